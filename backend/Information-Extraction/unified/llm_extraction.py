@@ -5,11 +5,14 @@ from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 from pdf2image import convert_from_bytes
 from PIL import Image
-import aiohttp
 import json
 from pathlib import Path
 import os
-from urllib.parse import urlparse
+import sys
+
+# 复用 backend 的出站模型网关（共用连接池和调用统计）
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from model_gateway import get_gateway, chat_completions_url, openai_base_url
 
 # ============ 配置部分 ============
 # MODEL_URL = "https://api.openai.com/v1"
@@ -77,17 +80,11 @@ class PDFMultimodalExtractor:
         self.api_type = self._detect_api_type()
         print(f"✓ 检测到API类型: {self.api_type}")
         
-        # 如果使用OpenAI SDK，初始化客户端
         if self.api_type == "openai_sdk":
-            from openai import AsyncOpenAI
-            if "/chat/completions" in model_url:
-                base_url = model_url.replace("/chat/completions", "")
-            else:
-                base_url = model_url
-            self.openai_client = AsyncOpenAI(api_key=api_key, base_url=base_url)
-            print(f"  使用OpenAI SDK (base_url: {base_url})")
+            print(f"  使用OpenAI SDK (base_url: {openai_base_url(model_url)})")
+        elif self.api_type == "qwen":
+            print(f"  使用HTTP客户端 (url: {chat_completions_url(model_url)})")
         else:
-            self.openai_client = None
             print(f"  使用HTTP客户端 (url: {model_url})")
         
         self.total_prompt_tokens = 0
@@ -121,29 +118,6 @@ class PDFMultimodalExtractor:
         # 默认使用Claude格式
         return "claude"
 
-    def _get_request_url(self) -> str:
-        """返回实际要POST的完整URL"""
-        url = self.model_url
-        lower = url.lower()
-
-        # 已包含完整端点，直接返回
-        if any(x in lower for x in ["/chat/completions", "/v1/completions", "completions"]):
-            return url
-
-        # DashScope兼容模式URL
-        if "dashscope" in lower and "compatible-mode" in lower:
-            if not url.endswith("/chat/completions"):
-                return url.rstrip('/') + '/chat/completions'
-            return url
-
-        # 类似 https://host/.../v1 格式，补上 chat/completions
-        parsed = urlparse(url)
-        path = parsed.path or ""
-        if path.rstrip('/') == '/v1':
-            return url.rstrip('/') + '/chat/completions'
-
-        return url
-        
     def pdf_to_images(self, pdf_path: str) -> List[Image.Image]:
         """将PDF转换为图片列表"""
         with open(pdf_path, 'rb') as f:
@@ -163,257 +137,74 @@ class PDFMultimodalExtractor:
         buffer.seek(0)
         return base64.b64encode(buffer.read()).decode('utf-8')
     
-    async def call_multimodal_api_openai_sdk(
+    async def call_multimodal_api_gateway(
         self,
         image_base64_list: List[str],
         page_nums: List[int],
         total_pages: int
     ) -> Dict[str, Any]:
-        """使用OpenAI官方SDK调用API（适用于GPT系列）"""
-        import time
-        start_time = time.time()
-        
+        """通过出站模型网关调用多模态API（openai_sdk / qwen / claude 由网关统一处理）"""
         page_range = f"{page_nums[0]}-{page_nums[-1]}" if len(page_nums) > 1 else str(page_nums[0])
         
         prompt = self._get_extraction_prompt(page_range, total_pages, page_nums)
         
-        # 构建消息内容 - OpenAI格式
-        content_items = [{"type": "text", "text": prompt}]
-        
-        for img_base64 in image_base64_list:
-            content_items.append({
+        # 构建消息内容 - OpenAI格式（Claude 由网关转换，图片放在文字之前）
+        image_items = [
+            {
                 "type": "image_url",
                 "image_url": {
                     "url": f"data:image/jpeg;base64,{img_base64}"
                 }
-            })
+            }
+            for img_base64 in image_base64_list
+        ]
+        text_item = {"type": "text", "text": prompt}
+        if self.api_type == "claude":
+            content_items = image_items + [text_item]
+        else:
+            content_items = [text_item] + image_items
         
         messages = [
             {
-                "role": "system", 
+                "role": "system",
                 "content": "你是一个专业的PDF文档信息提取助手。你必须严格按照用户要求的JSON格式返回结果，不要添加任何解释性文字或markdown代码块标记。直接返回可解析的JSON对象。"
             },
             {"role": "user", "content": content_items}
         ]
         
         try:
-            response = await self.openai_client.chat.completions.create(
+            response = await get_gateway().chat(
+                provider=self.api_type,
+                model_url=self.model_url,
+                api_key=self.api_key,
                 model=self.model_name,
                 messages=messages,
                 max_tokens=4096,
                 temperature=0.1,
                 response_format={"type": "json_object"}
             )
-            
-            # 提取Token使用信息
-            if response.usage:
-                prompt_tokens = response.usage.prompt_tokens
-                completion_tokens = response.usage.completion_tokens
-                total_tokens = response.usage.total_tokens
-                
-                self.total_prompt_tokens += prompt_tokens
-                self.total_completion_tokens += completion_tokens
-                self.total_tokens += total_tokens
-                
-                print(f"  第{page_range}页 Token: 输入={prompt_tokens}, 输出={completion_tokens}, 总计={total_tokens}")
-            
-            content = response.choices[0].message.content
-            
-            api_time = time.time() - start_time
-            print(f"  第{page_range}页 耗时: {api_time:.2f}秒")
-            
-            return self._parse_response_content(content, page_nums)
-            
-        except Exception as e:
-            print(f"❌ OpenAI SDK调用失败: {type(e).__name__}: {e}")
-            raise
-    
-    async def call_multimodal_api_qwen(
-        self,
-        image_base64_list: List[str],
-        page_nums: List[int],
-        total_pages: int
-    ) -> Dict[str, Any]:
-        """调用通义千问API（DashScope兼容模式）"""
-        import time
-        start_time = time.time()
-        
-        page_range = f"{page_nums[0]}-{page_nums[-1]}" if len(page_nums) > 1 else str(page_nums[0])
-        
-        prompt = self._get_extraction_prompt(page_range, total_pages, page_nums)
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
-        # 构建消息内容 - 通义千问格式
-        content_items = [{"type": "text", "text": prompt}]
-        
-        # 关键修复：通义千问使用 image_url 类型，而不是 image 类型
-        for img_base64 in image_base64_list:
-            content_items.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{img_base64}"
-                }
-            })
-        
-        payload = {
-            "model": self.model_name,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "你是一个专业的PDF文档信息提取助手。你必须严格按照用户要求的JSON格式返回结果，不要添加任何解释性文字或markdown代码块标记。"
-                },
-                {"role": "user", "content": content_items}
-            ],
-            "max_tokens": 4096,
-            "temperature": 0.1
-        }
-        
-        payload_size = len(json.dumps(payload))
-        print(f"  请求体大小: {payload_size / 1024 / 1024:.2f} MB")
-
-        request_url = self._get_request_url()
-        print(f"  请求URL: {request_url}")
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    request_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=300)
-                ) as response:
-                    response_text = await response.text()
-
-                    if response.status != 200:
-                        display_text = response_text[:1000]
-                        print(f"❌ API错误: {response.status}")
-                        print(f"错误详情: {display_text}")
-                        raise Exception(f"API调用失败: {response.status} - {display_text}")
-
-                    result = await response.json()
-
-                    # 提取Token使用信息
-                    if 'usage' in result:
-                        usage = result['usage']
-                        prompt_tokens = usage.get('prompt_tokens', 0)
-                        completion_tokens = usage.get('completion_tokens', 0)
-                        total_tokens = usage.get('total_tokens', 0)
-
-                        self.total_prompt_tokens += prompt_tokens
-                        self.total_completion_tokens += completion_tokens
-                        self.total_tokens += total_tokens
-
-                        print(f"  第{page_range}页 Token: 输入={prompt_tokens}, 输出={completion_tokens}, 总计={total_tokens}")
-
-                    # 提取响应内容
-                    content = result['choices'][0]['message']['content']
-
-                    api_time = time.time() - start_time
-                    print(f"  第{page_range}页 耗时: {api_time:.2f}秒")
-
-                    return self._parse_response_content(content, page_nums)
-                    
         except asyncio.TimeoutError:
             print(f"❌ 请求超时（页面 {page_range}）")
             raise
         except Exception as e:
-            print(f"❌ 通义千问API调用异常: {type(e).__name__}: {e}")
+            print(f"❌ {self.api_type} API调用异常: {type(e).__name__}: {e}")
             raise
-    
-    async def call_multimodal_api_claude(
-        self,
-        image_base64_list: List[str],
-        page_nums: List[int],
-        total_pages: int
-    ) -> Dict[str, Any]:
-        """调用Claude API"""
-        import time
-        start_time = time.time()
         
-        page_range = f"{page_nums[0]}-{page_nums[-1]}" if len(page_nums) > 1 else str(page_nums[0])
-        
-        prompt = self._get_extraction_prompt(page_range, total_pages, page_nums)
-        
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-key": self.api_key,
-            "anthropic-version": "2023-06-01"
-        }
-        
-        # 构建消息内容 - Claude格式
-        claude_content = []
-        for img_base64 in image_base64_list:
-            claude_content.append({
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/jpeg",
-                    "data": img_base64
-                }
-            })
-        claude_content.append({"type": "text", "text": prompt})
-        
-        payload = {
-            "model": self.model_name,
-            "max_tokens": 4096,
-            "temperature": 0.1,
-            "system": "你是一个专业的PDF文档信息提取助手。你必须严格按照用户要求的JSON格式返回结果。",
-            "messages": [{"role": "user", "content": claude_content}]
-        }
+        # 提取Token使用信息
+        if response.token_usage:
+            prompt_tokens = response.token_usage["prompt_tokens"]
+            completion_tokens = response.token_usage["completion_tokens"]
+            total_tokens = response.token_usage["total_tokens"]
+            
+            self.total_prompt_tokens += prompt_tokens
+            self.total_completion_tokens += completion_tokens
+            self.total_tokens += total_tokens
+            
+            print(f"  第{page_range}页 Token: 输入={prompt_tokens}, 输出={completion_tokens}, 总计={total_tokens}")
         
-        payload_size = len(json.dumps(payload))
-        print(f"  请求体大小: {payload_size / 1024 / 1024:.2f} MB")
-        print(f"  请求URL: {self.model_url}")
+        print(f"  第{page_range}页 耗时: {response.latency_ms / 1000:.2f}秒")
         
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.model_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=300)
-                ) as response:
-                    response_text = await response.text()
-
-                    if response.status != 200:
-                        display_text = response_text[:1000]
-                        print(f"❌ API错误: {response.status}")
-                        print(f"错误详情: {display_text}")
-                        raise Exception(f"API调用失败: {response.status} - {display_text}")
-
-                    result = await response.json()
-
-                    # 提取Token使用信息
-                    if 'usage' in result:
-                        usage = result['usage']
-                        prompt_tokens = usage.get('input_tokens', 0)
-                        completion_tokens = usage.get('output_tokens', 0)
-                        total_tokens = prompt_tokens + completion_tokens
-
-                        self.total_prompt_tokens += prompt_tokens
-                        self.total_completion_tokens += completion_tokens
-                        self.total_tokens += total_tokens
-
-                        print(f"  第{page_range}页 Token: 输入={prompt_tokens}, 输出={completion_tokens}, 总计={total_tokens}")
-
-                    # 提取响应内容
-                    content = result['content'][0]['text']
-
-                    api_time = time.time() - start_time
-                    print(f"  第{page_range}页 耗时: {api_time:.2f}秒")
-
-                    return self._parse_response_content(content, page_nums)
-                    
-        except asyncio.TimeoutError:
-            print(f"❌ 请求超时（页面 {page_range}）")
-            raise
-        except Exception as e:
-            print(f"❌ Claude API调用异常: {type(e).__name__}: {e}")
-            raise
+        return self._parse_response_content(response.content, page_nums)
     
     def _get_extraction_prompt(self, page_range: str, total_pages: int, page_nums: List[int]) -> str:
         """生成提取指令的prompt"""
@@ -650,21 +441,12 @@ class PDFMultimodalExtractor:
         page_nums: List[int],
         total_pages: int
     ) -> Dict[str, Any]:
-        """调用多模态API的统一入口 - 根据API类型路由"""
-        if self.api_type == "openai_sdk":
-            return await self.call_multimodal_api_openai_sdk(
-                image_base64_list, page_nums, total_pages
-            )
-        elif self.api_type == "qwen":
-            return await self.call_multimodal_api_qwen(
-                image_base64_list, page_nums, total_pages
-            )
-        elif self.api_type == "claude":
-            return await self.call_multimodal_api_claude(
-                image_base64_list, page_nums, total_pages
-            )
-        else:
+        """调用多模态API的统一入口"""
+        if self.api_type not in ("openai_sdk", "qwen", "claude"):
             raise ValueError(f"不支持的API类型: {self.api_type}")
+        return await self.call_multimodal_api_gateway(
+            image_base64_list, page_nums, total_pages
+        )
     
     async def extract_from_pdf(self, pdf_path: str, original_filename: Optional[str] = None) -> ExtractionResult:
         """从PDF文件中提取完整信息"""
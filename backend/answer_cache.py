@@ -0,0 +1,133 @@
+"""
+智能问答语义缓存
+新问题的向量与已缓存问题的余弦相似度达到阈值、且语料版本未变时直接复用回答，跳过检索和 LLM 调用：
+
+    - 条目按作用域区分：top_k、过滤条件和问题中的数字都相同才可复用
+      （“3个卧室的户型”与“4个卧室的户型”向量非常接近，答案却不同）
+    - 语料版本（入库、覆盖、删除时变化）与缓存中的不同时，旧条目全部失效
+    - 进程内 LRU，最多 max_entries 条；超过 ttl 秒的条目视为过期
+
+使用示例（.env）：
+ANSWER_CACHE_ENABLED=true
+ANSWER_CACHE_THRESHOLD=0.95
+"""
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 阿拉伯数字和中文数字（问题中的数量、面积等条件）
+_NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?|[零一二两三四五六七八九十百千]+")
+
+
+def question_scope(question: str, top_k: int, filters: Optional[Dict[str, Any]] = None) -> str:
+    """缓存作用域：top_k、过滤条件和问题中的数字"""
+    return json.dumps(
+        {"top_k": top_k, "filters": filters or {}, "numbers": _NUMBER_PATTERN.findall(question)},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+
+
+def _normalize(embedding: Sequence[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class SemanticAnswerCache:
+    """
+    问题向量 -> 回答 的进程内 LRU 缓存
+
+    问题向量归一化后存放在预分配的矩阵中（每个条目占一行），查询时对同作用域的条目做一次矩阵乘法
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, threshold: Optional[float] = None, ttl: Optional[float] = None):
+        """
+        Args:
+            max_entries: 最多缓存的回答数（默认读取 ANSWER_CACHE_SIZE）
+            threshold: 复用回答所需的最小余弦相似度（默认读取 ANSWER_CACHE_THRESHOLD）
+            ttl: 条目有效期（秒，0 表示不过期；默认读取 ANSWER_CACHE_TTL）
+        """
+        self.max_entries = max_entries or int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+        self.threshold = threshold if threshold is not None else float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+        self._entries: "OrderedDict[int, Tuple[str, float, Any]]" = OrderedDict()  # 行号 -> (作用域, 写入时间, 回答)
+        self._free: List[int] = list(range(self.max_entries - 1, -1, -1))
+        self._vectors: Optional[np.ndarray] = None
+        self._version: Hashable = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _check_version(self, version: Hashable):
+        """语料版本变化：清空全部条目（调用方负责加锁）"""
+        if version != self._version:
+            self._free.extend(self._entries)
+            self._entries.clear()
+            self._version = version
+
+    def _remove(self, slot: int):
+        del self._entries[slot]
+        self._free.append(slot)
+
+    def lookup(self, embedding: Sequence[float], version: Hashable, scope: str) -> Optional[Tuple[Any, float]]:
+        """查找相似问题的回答，返回 (回答, 相似度)；未命中返回 None"""
+        query = _normalize(embedding)
+        with self._lock:
+            self._check_version(version)
+            now = time.time()
+            slots = []
+            for slot, (entry_scope, created, _) in list(self._entries.items()):
+                if self.ttl > 0 and now - created > self.ttl:
+                    self._remove(slot)
+                elif entry_scope == scope:
+                    slots.append(slot)
+
+            if slots and self._vectors.shape[1] == query.shape[0]:
+                similarities = self._vectors[slots] @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    slot = slots[best]
+                    self._entries.move_to_end(slot)
+                    self.hits += 1
+                    return self._entries[slot][2], float(similarities[best])
+            self.misses += 1
+            return None
+
+    def put(self, embedding: Sequence[float], version: Hashable, scope: str, value: Any):
+        """写入回答；version 须为生成回答前取得的语料版本，期间语料已变化时不写入"""
+        vector = _normalize(embedding)
+        with self._lock:
+            if self._version is None:
+                self._version = version
+            if version != self._version:
+                return
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                # 首次写入（或 Embedding 维度变化）时按维度分配
+                self._free.extend(self._entries)
+                self._entries.clear()
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            if not self._free:
+                self._remove(next(iter(self._entries)))
+            slot = self._free.pop()
+            self._vectors[slot] = vector
+            self._entries[slot] = (scope, time.time(), value)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "threshold": self.threshold,
+        }
@@ -0,0 +1,140 @@
+"""
+本地 Embedding 推理后端基准测试：sentence_transformers（fp32，现有路径）vs torch（动态填充）vs torch_int8
+
+对同一批长短不一的中文文本块报告：
+    docs/s        批量向量化吞吐（入库路径）
+    查询延迟      单条查询向量化的 p50 / p99（检索路径）
+    兼容性        与 sentence_transformers fp32 向量的余弦相似度（最小值 / 平均值）
+
+使用示例：
+python bench_embeddings.py                                     # 使用 EMBEDDING_MODEL（默认 paraphrase-multilingual-MiniLM-L12-v2）
+python bench_embeddings.py --threads 4 --docs 2000
+python bench_embeddings.py --synthetic                         # 离线：随机初始化的同结构模型（12 层、384 维），只看速度
+"""
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from cpu_embeddings import CPUEmbeddings, EMBEDDING_BACKENDS
+
+WORDS = [
+    "卧室", "客厅", "餐厅", "厨房", "卫生间", "阳台", "书房", "走廊", "面积", "平方米", "朝南", "户型",
+    "图纸", "零件", "材料", "外径", "厚度", "螺栓孔", "公差", "倒角", "技术要求", "表面处理", "图号", "比例",
+]
+
+
+def synthetic_texts(n: int, seed: int, min_words: int = 3, max_words: int = 120) -> list:
+    """长度不一的中文文本（短查询到 CHUNK_SIZE 量级的文本块）"""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+        texts.append("，".join(words) + f" {rng.randint(1, 999)}")
+    return texts
+
+
+def build_synthetic_model(directory: str) -> str:
+    """随机初始化一个与 paraphrase-multilingual-MiniLM-L12-v2 同结构的模型（词表只含基准文本用到的字）"""
+    from transformers import BertConfig, BertModel, BertTokenizer
+    from sentence_transformers import SentenceTransformer, models
+
+    chars = sorted({c for word in WORDS for c in word} | set("0123456789，"))
+    vocab_file = os.path.join(directory, "vocab.txt")
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + chars))
+    config = BertConfig(
+        vocab_size=len(chars) + 5, hidden_size=384, num_hidden_layers=12, num_attention_heads=12,
+        intermediate_size=1536, max_position_embeddings=512
+    )
+    BertModel(config).save_pretrained(directory)
+    BertTokenizer(vocab_file).save_pretrained(directory)
+
+    transformer = models.Transformer(directory, max_seq_length=128)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension(), "mean")
+    model_dir = os.path.join(directory, "sentence_model")
+    SentenceTransformer(modules=[transformer, pooling]).save(model_dir)
+    return model_dir
+
+
+class SentenceTransformersBaseline:
+    """现有路径：HuggingFaceEmbeddings 内部的 SentenceTransformer.encode(normalize_embeddings=True)"""
+
+    def __init__(self, model_name: str, batch_size: int):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts):
+        return self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 Embedding 推理后端基准测试")
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"))
+    parser.add_argument("--synthetic", action="store_true", help="使用随机初始化的同结构模型（离线环境）")
+    parser.add_argument("--docs", type=int, default=512, help="批量向量化的文本数")
+    parser.add_argument("--queries", type=int, default=100, help="单条查询次数")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=0, help="torch 线程数（0 为默认）")
+    parser.add_argument("--backends", default=",".join(EMBEDDING_BACKENDS))
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    import torch
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    work_dir = tempfile.mkdtemp(prefix="bench_embeddings_") if args.synthetic else None
+    model_name = build_synthetic_model(work_dir) if args.synthetic else args.model
+    docs = synthetic_texts(args.docs, args.seed)
+    queries = synthetic_texts(args.queries, args.seed + 1, min_words=2, max_words=8)
+
+    rows, reference = [], None
+    try:
+        for backend in args.backends.split(","):
+            if backend == "sentence_transformers":
+                embeddings = SentenceTransformersBaseline(model_name, args.batch_size)
+            else:
+                embeddings = CPUEmbeddings(model_name, backend=backend, batch_size=args.batch_size)
+            embeddings.embed_documents(docs[:args.batch_size])  # 预热
+
+            start = time.perf_counter()
+            vectors = np.asarray(embeddings.embed_documents(docs), dtype=np.float32)
+            docs_per_sec = len(docs) / (time.perf_counter() - start)
+
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                embeddings.embed_query(query)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            if reference is None:
+                reference = vectors
+            cosine = np.sum(reference * vectors, axis=1)
+            rows.append((
+                getattr(embeddings, "backend", backend), docs_per_sec,
+                np.percentile(timings, 50), np.percentile(timings, 99), cosine.min(), cosine.mean()
+            ))
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n模型 {'（随机初始化，同结构）' if args.synthetic else model_name}，{len(docs)} 个文本块，"
+          f"{len(queries)} 次查询，torch 线程数 {torch.get_num_threads()}")
+    print(f"{'后端':<22}{'docs/s':>10}{'查询p50(ms)':>13}{'查询p99(ms)':>13}{'最小余弦':>10}{'平均余弦':>10}")
+    for backend, docs_per_sec, p50, p99, min_cos, mean_cos in rows:
+        print(f"{backend:<22}{docs_per_sec:>10.1f}{p50:>13.2f}{p99:>13.2f}{min_cos:>10.5f}{mean_cos:>10.5f}")
+    print("（余弦相似度相对第一个后端计算）")
+
+
+if __name__ == "__main__":
+    main()
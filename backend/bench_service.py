@@ -0,0 +1,468 @@
+"""
+端到端压测：/search、/upload、/ask、/question 在固定并发下的延迟、吞吐和内存
+
+每个接口、每个并发级别报告：
+    p50 / p95 / p99 / 平均延迟（毫秒）、吞吐（请求/秒）、错误率
+    峰值 RSS（MB）：压测期间服务进程（含 uvicorn worker 子进程）常驻内存的最大值，需 --spawn 或 --pid
+
+结果写成 JSON（按 endpoint + concurrency 对齐），compare 子命令比较两次结果，超过阈值的退化返回非零退出码。
+
+--spawn 在临时目录中启动 fake_model_server（离线模拟 VLM / LLM / Embedding）和 RAG 服务，不调用真实提供方；
+压测前先上传 --seed-docs 个文档（/question 的 documentId 从中选取）。
+
+使用示例：
+python bench_service.py run --spawn --concurrency 1,8,32 --requests 200 --output bench_results.json
+python bench_service.py run --spawn --endpoints search,ask --vision-latency-ms 500 --chat-latency-ms 200
+python bench_service.py run --url http://127.0.0.1:8000 --pid 12345 --endpoints search
+python bench_service.py compare baseline.json bench_results.json --max-regression 0.15
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+ENDPOINTS = ("search", "upload", "ask", "question")
+
+QUERIES = [
+    "三室两厅的户型", "带飘窗的主卧", "客厅朝南的平面图", "厨房和餐厅相邻", "总面积超过 100 平方米",
+    "有几个卧室", "卫生间的位置", "阳台面积多大", "开放式厨房", "南北通透的户型",
+]
+QUESTIONS = ["这个户型有几个卧室？", "客厅的面积是多少？", "有没有独立的阳台？", "主卧在什么位置？"]
+
+
+# ============ 进程内存 ============
+
+def _child_pids(pid: int) -> List[int]:
+    children = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children += [int(c) for c in f.read().split()]
+    except OSError:
+        pass
+    return children
+
+
+def process_tree_rss_mb(pid: int) -> Optional[float]:
+    """进程及其所有子进程的 RSS 之和（MB，读取 /proc；进程不存在或非 Linux 时为 None）"""
+    total_kb, pending, found = 0, [pid], False
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        found = True
+                        break
+        except OSError:
+            continue
+        pending += _child_pids(current)
+    return round(total_kb / 1024, 1) if found else None
+
+
+class RSSSampler:
+    """后台按固定间隔采样 RSS，记录峰值"""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            self._sample()
+            await asyncio.sleep(self.interval)
+
+    def _sample(self):
+        rss = process_tree_rss_mb(self.pid)
+        if rss is not None:
+            self.peak = rss if self.peak is None else max(self.peak, rss)
+
+    def __enter__(self):
+        if self.pid:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        if self._task is not None:
+            self._task.cancel()
+            self._sample()
+
+
+# ============ 请求负载 ============
+
+def make_floor_plan_png(seed: int, size=(800, 600)) -> bytes:
+    """随机平面图样式的 PNG（每次内容不同，避免命中上传去重）"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(5, 9)):
+        x0, y0 = rng.randint(0, size[0] - 200), rng.randint(0, size[1] - 150)
+        draw.rectangle([x0, y0, x0 + rng.randint(80, 200), y0 + rng.randint(60, 150)], outline="black", width=3)
+    draw.text((10, 10), f"PLAN-{seed}", fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class Workload:
+    """各接口的请求构造（/question 需要已上传文档的 fileId）"""
+
+    def __init__(self, client, seed: int, search_strategy: str, upload_wait: bool):
+        self.client = client
+        self.rng = random.Random(seed)
+        self.search_strategy = search_strategy
+        self.upload_wait = upload_wait
+        self.document_ids: List[str] = []
+        self._upload_seq = seed * 1_000_000
+
+    async def upload(self, wait: Optional[bool] = None):
+        self._upload_seq += 1
+        files = {"file": (f"bench_{self._upload_seq}.png", make_floor_plan_png(self._upload_seq), "image/png")}
+        params = {"wait": str(self.upload_wait if wait is None else wait).lower(), "image_type": "floor_plan"}
+        return await self.client.post("/upload", files=files, params=params)
+
+    async def search(self):
+        payload = {"query": self.rng.choice(QUERIES), "topK": 5, "strategy": self.search_strategy}
+        return await self.client.post("/search", json=payload)
+
+    async def ask(self):
+        return await self.client.post("/ask", json={"question": self.rng.choice(QUESTIONS + QUERIES), "top_k": 3})
+
+    async def question(self):
+        payload = {"documentId": self.rng.choice(self.document_ids), "question": self.rng.choice(QUESTIONS)}
+        return await self.client.post("/question", json=payload)
+
+    async def seed_documents(self, count: int):
+        """压测前上传文档（等待入库完成），记录 fileId"""
+        for _ in range(count):
+            response = await self.upload(wait=True)
+            body = response.json() if response.status_code == 200 else {}
+            if body.get("fileId"):
+                self.document_ids.append(body["fileId"])
+            else:
+                print(f"⚠️ 预置文档上传失败: {response.status_code} {response.text[:200]}")
+
+
+# ============ 压测 ============
+
+def summarize(endpoint: str, concurrency: int, latencies: List[float], errors: int, elapsed: float,
+              peak_rss_mb: Optional[float]) -> Dict[str, Any]:
+    total = len(latencies) + errors
+    stat = lambda fn: round(float(fn(latencies)), 1) if latencies else None  # 全部失败时为 None
+    return {
+        "endpoint": f"/{endpoint}",
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": stat(lambda v: np.percentile(v, 50)),
+            "p95": stat(lambda v: np.percentile(v, 95)),
+            "p99": stat(lambda v: np.percentile(v, 99)),
+            "mean": stat(np.mean),
+            "max": stat(np.max),
+        },
+        "peak_rss_mb": peak_rss_mb,
+    }
+
+
+async def run_level(workload: Workload, endpoint: str, concurrency: int, requests: int, pid: Optional[int]):
+    """concurrency 个并发客户端共完成 requests 个请求（非 2xx 计为错误，不计入延迟）"""
+    call = getattr(workload, endpoint)
+    remaining = [requests]
+    latencies: List[float] = []
+    errors = [0]
+
+    async def client_loop():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                response = await call()
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append((time.perf_counter() - start) * 1000)
+            else:
+                errors[0] += 1
+
+    with RSSSampler(pid) as sampler:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return summarize(endpoint, concurrency, latencies, errors[0], elapsed, sampler.peak)
+
+
+async def run_benchmark(base_url: str, args, pid: Optional[int]) -> List[Dict[str, Any]]:
+    import httpx
+
+    levels = [int(c) for c in args.concurrency.split(",")]
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        workload = Workload(client, args.seed, args.search_strategy, args.upload_wait)
+        endpoints = args.endpoints.split(",")
+        if args.seed_docs or "question" in endpoints:
+            await workload.seed_documents(max(args.seed_docs, 1 if "question" in endpoints else 0))
+            print(f"✓ 预置文档 {len(workload.document_ids)} 个")
+        if "question" in endpoints and not workload.document_ids:
+            raise SystemExit("没有可用的 documentId，无法压测 /question")
+
+        results = []
+        for endpoint in endpoints:
+            if endpoint not in ENDPOINTS:
+                raise SystemExit(f"未知接口: {endpoint}（可选 {', '.join(ENDPOINTS)}）")
+            for _ in range(args.warmup):
+                await getattr(workload, endpoint)()
+            for concurrency in levels:
+                result = await run_level(workload, endpoint, concurrency, args.requests, pid)
+                results.append(result)
+                print_result(result)
+        return results
+
+
+def print_result(r: Dict[str, Any]):
+    fmt = lambda v, spec: format(v, spec) if v is not None else "-"
+    lat = r["latency_ms"]
+    print(f"{r['endpoint']:<10}{r['concurrency']:>6}{r['requests']:>8}{r['error_rate'] * 100:>8.1f}%"
+          f"{fmt(lat['p50'], '.1f'):>10}{fmt(lat['p95'], '.1f'):>10}{fmt(lat['p99'], '.1f'):>10}"
+          f"{r['throughput_rps']:>10.2f}{fmt(r['peak_rss_mb'], '.0f'):>10}")
+
+
+# ============ 启动被测服务 ============
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_http(url: str, process: subprocess.Popen, timeout: float):
+    import httpx
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"进程已退出（返回码 {process.returncode}）: {url}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"等待超时: {url}")
+
+
+def spawn_stack(args, work_dir: str, processes: List[subprocess.Popen]) -> Tuple[str, str]:
+    """在 work_dir 中启动模拟模型服务和 RAG 服务（数据目录相互隔离），返回 (服务地址, 模拟模型地址)"""
+    backend_dir = Path(__file__).resolve().parent
+    fake_port, port = _free_port(), _free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}/v1"
+
+    fake_args = [
+        "--port", str(fake_port), "--seed", str(args.seed),
+        "--chat-latency-ms", str(args.chat_latency_ms), "--vision-latency-ms", str(args.vision_latency_ms),
+        "--embedding-latency-ms", str(args.embedding_latency_ms), "--token-latency-ms", str(args.token_latency_ms),
+        "--completion-tokens", str(args.completion_tokens), "--error-rate", str(args.error_rate),
+    ]
+    log = open(args.service_log, "w") if args.service_log else subprocess.DEVNULL
+    fake = subprocess.Popen(
+        [sys.executable, str(backend_dir / "fake_model_server.py")] + fake_args,
+        cwd=work_dir, stdout=log, stderr=subprocess.STDOUT
+    )
+    processes.append(fake)
+    _wait_http(f"{fake_url}/models", fake, 30)
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [str(backend_dir), os.environ.get("PYTHONPATH")])),
+        VLM_MODEL_URL=fake_url, VLM_API_KEY="fake", VLM_MODEL_NAME="fake-vlm",
+        EMBEDDING_TYPE="qwen", DASHSCOPE_API_KEY="fake", DASHSCOPE_BASE_URL=fake_url,
+        LOG_CONSOLE="false",
+    )
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    service = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main_service:app", "--host", "127.0.0.1", "--port", str(port),
+         "--no-access-log", "--log-level", "warning"],
+        cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    processes.append(service)
+    _wait_http(f"http://127.0.0.1:{port}/ready", service, args.startup_timeout)
+    return f"http://127.0.0.1:{port}", fake_url
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).resolve().parent, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    processes: List[subprocess.Popen] = []
+    work_dir = tempfile.mkdtemp(prefix="bench_service_") if args.spawn else None
+    fake_stats = None
+    try:
+        if args.spawn:
+            base_url, fake_url = spawn_stack(args, work_dir, processes)
+            pid = processes[-1].pid
+        else:
+            base_url, fake_url, pid = args.url, None, args.pid
+
+        print(f"\n压测 {base_url}（并发 {args.concurrency}，每级 {args.requests} 个请求）")
+        print(f"{'接口':<8}{'并发':>6}{'请求数':>6}{'错误率':>7}{'p50(ms)':>10}{'p95(ms)':>10}"
+              f"{'p99(ms)':>10}{'吞吐/s':>8}{'峰值RSS':>8}")
+        results = asyncio.run(run_benchmark(base_url, args, pid))
+
+        if fake_url:
+            import httpx
+            fake_stats = httpx.get(fake_url.rsplit("/v1", 1)[0] + "/stats", timeout=5).json()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "target": "spawn" if args.spawn else args.url,
+            "args": {k: v for k, v in vars(args).items() if k != "func"},
+            "fake_model": fake_stats,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✓ 结果已写入 {args.output}")
+
+
+# ============ 回归比较 ============
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any], max_regression: float) -> List[Dict[str, Any]]:
+    """
+    按 (endpoint, concurrency) 对齐两次结果，计算 p50 / p95 / p99 与吞吐的相对变化
+
+    延迟增加或吞吐下降超过 max_regression（比例）记为退化；错误率上升同样记为退化
+    """
+    base = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    rows = []
+    for r in current["results"]:
+        b = base.get((r["endpoint"], r["concurrency"]))
+        if b is None:
+            continue
+        changes = {
+            key: _relative(b["latency_ms"][key], r["latency_ms"][key]) for key in ("p50", "p95", "p99")
+        }
+        changes["throughput_rps"] = _relative(b["throughput_rps"], r["throughput_rps"])
+        regressed = [key for key in ("p50", "p95", "p99") if changes[key] is not None and changes[key] > max_regression]
+        if changes["throughput_rps"] is not None and -changes["throughput_rps"] > max_regression:
+            regressed.append("throughput_rps")
+        if r["error_rate"] > b["error_rate"]:
+            regressed.append("error_rate")
+        rows.append({"endpoint": r["endpoint"], "concurrency": r["concurrency"], "changes": changes, "regressed": regressed})
+    return rows
+
+
+def _relative(before: Optional[float], after: Optional[float]) -> Optional[float]:
+    if before is None or after is None or not before:
+        return None
+    return (after - before) / before
+
+
+def compare(args):
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+
+    rows = compare_reports(baseline, current, args.max_regression)
+    fmt = lambda v: f"{v * 100:+.1f}%" if v is not None else "-"
+    print(f"{'接口':<8}{'并发':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'吞吐':>10}  退化")
+    for row in rows:
+        c = row["changes"]
+        print(f"{row['endpoint']:<10}{row['concurrency']:>6}{fmt(c['p50']):>10}{fmt(c['p95']):>10}"
+              f"{fmt(c['p99']):>10}{fmt(c['throughput_rps']):>10}  {', '.join(row['regressed']) or '-'}")
+    if any(row["regressed"] for row in rows):
+        raise SystemExit(1)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="端到端压测")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    bench = sub.add_parser("run", help="压测并输出 JSON")
+    target = bench.add_mutually_exclusive_group(required=True)
+    target.add_argument("--spawn", action="store_true", help="启动模拟模型服务和 RAG 服务（临时目录，离线）")
+    target.add_argument("--url", help="已运行的服务地址")
+    bench.add_argument("--pid", type=int, default=None, help="--url 时采样该进程（及子进程）的 RSS")
+    bench.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    bench.add_argument("--concurrency", default="1,8,32", help="并发级别，逗号分隔")
+    bench.add_argument("--requests", type=int, default=100, help="每个并发级别的请求数")
+    bench.add_argument("--warmup", type=int, default=3, help="每个接口压测前的预热请求数")
+    bench.add_argument("--seed-docs", type=int, default=5, help="压测前上传的文档数")
+    bench.add_argument("--search-strategy", default="hybrid")
+    bench.add_argument("--upload-wait", action=argparse.BooleanOptionalAction, default=True,
+                       help="/upload 等待入库完成再返回（计入解析和索引耗时）")
+    bench.add_argument("--timeout", type=float, default=300.0, help="单个请求超时（秒）")
+    bench.add_argument("--seed", type=int, default=7)
+    bench.add_argument("--output", default="bench_results.json")
+    # --spawn：模拟模型服务的延迟与错误
+    bench.add_argument("--chat-latency-ms", type=float, default=300.0)
+    bench.add_argument("--vision-latency-ms", type=float, default=1500.0)
+    bench.add_argument("--embedding-latency-ms", type=float, default=20.0)
+    bench.add_argument("--token-latency-ms", type=float, default=5.0)
+    bench.add_argument("--completion-tokens", type=int, default=200)
+    bench.add_argument("--error-rate", type=float, default=0.0)
+    bench.add_argument("--startup-timeout", type=float, default=300.0)
+    bench.add_argument("--service-log", default=None, help="--spawn 时服务与模拟模型服务的输出写入该文件（默认丢弃）")
+    bench.add_argument("--env", action="append", default=[], help="--spawn 时传给服务的环境变量，如 VECTOR_BACKEND=numpy")
+    bench.set_defaults(func=run)
+
+    diff = sub.add_parser("compare", help="比较两次压测结果")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    diff.add_argument("--max-regression", type=float, default=0.15, help="允许的相对退化比例")
+    diff.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
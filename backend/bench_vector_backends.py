@@ -0,0 +1,131 @@
+"""
+向量库后端基准测试：Chroma vs NumPy 内存映射索引
+
+用随机向量构造同一份语料分别写入两种后端，比较：
+    冷启动     新进程中打开索引并完成第一次查询的耗时
+    查询延迟   无过滤 / 带元数据过滤（image_type + total_area 范围）的 p50 / p99
+
+使用示例：
+python bench_vector_backends.py --chunks 20000 --dim 384
+python bench_vector_backends.py --chunks 200000 --dim 1024 --dtype float16 --queries 500
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+from vector_backends import ChromaBackend
+from numpy_vector_store import NumpyVectorStore
+
+IMAGE_TYPES = ["cad", "floor_plan", "architecture", "technical_doc"]
+FILTER = {"$and": [{"image_type": {"$eq": "floor_plan"}}, {"total_area": {"$gte": 80.0}}]}
+
+
+def open_backend(kind: str, directory: str, dtype: str = "float32", hnsw_min_rows: int = 10000):
+    if kind == "chroma":
+        return ChromaBackend(directory)
+    return NumpyVectorStore(os.path.join(directory, "numpy_index"), dtype=dtype, hnsw_min_rows=hnsw_min_rows)
+
+
+def random_vectors(rng: np.random.Generator, n: int, dim: int) -> np.ndarray:
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def build(kind: str, directory: str, args) -> float:
+    rng = np.random.default_rng(args.seed)
+    backend = open_backend(kind, directory, args.dtype, args.hnsw_min_rows)
+    start = time.perf_counter()
+    for offset in range(0, args.chunks, args.batch):
+        n = min(args.batch, args.chunks - offset)
+        ids = [f"file{(offset + i) // 20}_chunk_{(offset + i) % 20}" for i in range(n)]
+        metadatas = [
+            {
+                "file_id": f"file{(offset + i) // 20}",
+                "chunk_id": (offset + i) % 20,
+                "image_type": IMAGE_TYPES[(offset + i) // 20 % len(IMAGE_TYPES)],
+                "total_area": float((offset + i) // 20 % 150)
+            }
+            for i in range(n)
+        ]
+        documents = [f"文本块 {offset + i}" for i in range(n)]
+        backend.upsert(ids, random_vectors(rng, n, args.dim).tolist(), documents, metadatas)
+    return time.perf_counter() - start
+
+
+def cold_start(kind: str, directory: str, dim: int, dtype: str, hnsw_min_rows: int) -> float:
+    """在新进程中测量：打开索引 + 第一次查询"""
+    code = (
+        "import sys, time, json; start = time.perf_counter();"
+        "from bench_vector_backends import open_backend;"
+        f"backend = open_backend({kind!r}, {directory!r}, {dtype!r}, {hnsw_min_rows!r});"
+        f"backend.query([[0.1] * {dim}], 10);"
+        "print(json.dumps(time.perf_counter() - start))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def latencies(backend, queries: np.ndarray, k: int, where=None) -> np.ndarray:
+    backend.query([queries[0].tolist()], k, where)  # 预热
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        backend.query([query.tolist()], k, where)
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.array(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chroma vs NumPy 向量库后端基准测试")
+    parser.add_argument("--chunks", type=int, default=20000, help="文本块数量")
+    parser.add_argument("--dim", type=int, default=384, help="向量维度")
+    parser.add_argument("--queries", type=int, default=200, help="每种场景的查询次数")
+    parser.add_argument("--k", type=int, default=10, help="每次查询返回的结果数")
+    parser.add_argument("--batch", type=int, default=5000, help="写入批大小")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"], help="NumPy 索引的存储精度")
+    parser.add_argument("--hnsw-min-rows", type=int, default=10000,
+                        help="NumPy 索引中使用 HNSW 的段行数下限（设为很大的值则全部精确检索）")
+    parser.add_argument("--backends", default="chroma,numpy", help="参与比较的后端，逗号分隔")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    queries = random_vectors(np.random.default_rng(args.seed + 1), args.queries, args.dim)
+    work_dir = tempfile.mkdtemp(prefix="bench_vectors_")
+    rows = []
+    try:
+        for kind in args.backends.split(","):
+            directory = os.path.join(work_dir, kind)
+            print(f"▶ {kind}: 写入 {args.chunks} 个文本块（维度 {args.dim}）...")
+            build_time = build(kind, directory, args)
+            cold = cold_start(kind, directory, args.dim, args.dtype, args.hnsw_min_rows)
+            backend = open_backend(kind, directory, args.dtype, args.hnsw_min_rows)
+            plain = latencies(backend, queries, args.k)
+            filtered = latencies(backend, queries, args.k, FILTER)
+            rows.append((
+                kind, build_time, cold * 1000,
+                np.percentile(plain, 50), np.percentile(plain, 99),
+                np.percentile(filtered, 50), np.percentile(filtered, 99)
+            ))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n文本块 {args.chunks}，维度 {args.dim}，k={args.k}，每场景 {args.queries} 次查询（耗时单位 ms，写入为秒）")
+    print(f"{'后端':<8}{'写入(s)':>10}{'冷启动':>10}{'p50':>9}{'p99':>9}{'过滤p50':>10}{'过滤p99':>10}")
+    for kind, build_time, cold, p50, p99, fp50, fp99 in rows:
+        print(f"{kind:<8}{build_time:>10.1f}{cold:>10.1f}{p50:>9.2f}{p99:>9.2f}{fp50:>10.2f}{fp99:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+LLM 上下文构建：MMR 选块 + 去除重叠 + 按 token 预算装箱
+
+检索返回的文本块直接拼接时，相邻块之间的重叠部分（文本分割的 CHUNK_OVERLAP）会重复出现，
+相似的块也会挤占上下文。这里按以下步骤构建上下文：
+
+    1. MMR（最大边际相关）排序：每次选与问题最相关、同时与已选块最不相似的块（向量化计算）
+    2. 去除重叠：与已选的同一文件的块比较，删去首尾重叠的文本；被已选内容（任意文件）包含的块直接跳过
+    3. 按 token 预算装箱：放不下的块跳过，剩余预算足够时截断后放入最后一块
+
+结果按文件（首次入选的顺序）和块号排列，同一文件的相邻块拼接后与原文一致。
+
+使用示例（.env）：
+CONTEXT_TOKEN_BUDGET=1500
+CONTEXT_MMR_LAMBDA=0.7
+"""
+import os
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# 截断最后一块时至少保留的 token 数（更少时不放入）
+MIN_PARTIAL_TOKENS = 50
+
+
+def _char_costs(text: str) -> np.ndarray:
+    """每个字符的 token 估计：ASCII 约 4 个字符一个 token，其余（中文等）每字一个"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    return np.where(codes < 128, 0.25, 1.0)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数（中文约每字一个，英文约每 4 个字符一个）"""
+    if not text:
+        return 0
+    return int(np.ceil(_char_costs(text).sum()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截断到不超过 max_tokens 的最长前缀"""
+    if max_tokens <= 0:
+        return ""
+    cumulative = np.cumsum(_char_costs(text))
+    return text[:int(np.searchsorted(cumulative, max_tokens, side="right"))]
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def mmr_order(
+    query_vector: Sequence[float],
+    vectors: Sequence[Sequence[float]],
+    lambda_mult: float = 0.7,
+    limit: Optional[int] = None
+) -> List[int]:
+    """
+    最大边际相关排序
+
+    每一步选 lambda * 与问题的余弦相似度 - (1 - lambda) * 与已选块的最大余弦相似度 最大的块；
+    相似度矩阵一次算出，之后每步只更新各候选与已选集合的最大相似度（一次向量运算）。
+
+    Returns:
+        候选下标，按入选顺序排列（最多 limit 个）
+    """
+    candidates = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+    if candidates.ndim != 2 or len(candidates) == 0:
+        return []
+    query = _normalize_rows(np.asarray(query_vector, dtype=np.float32))
+
+    relevance = candidates @ query
+    pairwise = candidates @ candidates.T
+    max_similarity = np.full(len(candidates), -np.inf, dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+
+    order: List[int] = []
+    limit = len(candidates) if limit is None else min(limit, len(candidates))
+    while len(order) < limit:
+        redundancy = np.where(np.isinf(max_similarity), 0.0, max_similarity)
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        order.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, pairwise[best])
+    return order
+
+
+def overlap_length(left: str, right: str, min_overlap: int) -> int:
+    """left 的结尾与 right 的开头重合的最长长度（短于 min_overlap 视为不重合，返回 0）"""
+    for length in range(min(len(left), len(right)), max(min_overlap, 1) - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def remove_overlap(text: str, selected: Sequence[str], min_overlap: int) -> str:
+    """
+    删去 text 与已选文本首尾重叠的部分（已选块在前时删开头，在后时删结尾）
+
+    text 整体已包含在某个已选文本中时返回空字符串
+    """
+    for previous in selected:
+        if text.strip() in previous:
+            return ""
+        head = overlap_length(previous, text, min_overlap)
+        if head:
+            text = text[head:]
+        tail = overlap_length(text, previous, min_overlap)
+        if tail:
+            text = text[:len(text) - tail]
+    return text
+
+
+@dataclass
+class ContextChunk:
+    """装入上下文的一个检索结果"""
+    result: Dict[str, Any]
+    text: str        # 去除重叠、截断后的文本
+    tokens: int
+    truncated: bool = False
+
+
+class ContextPacker:
+    """按 MMR 顺序选块、去除重叠，装入不超过 token 预算的上下文"""
+
+    def __init__(
+        self,
+        token_budget: Optional[int] = None,
+        lambda_mult: Optional[float] = None,
+        min_overlap: Optional[int] = None
+    ):
+        """
+        Args:
+            token_budget: 上下文（含每块的标题行）的 token 上限（默认读取 CONTEXT_TOKEN_BUDGET）
+            lambda_mult: MMR 中相关性的权重，1 为只看相关性（默认读取 CONTEXT_MMR_LAMBDA）
+            min_overlap: 视为重叠的最短字符数（默认读取 CONTEXT_MIN_OVERLAP）
+        """
+        self.token_budget = token_budget or int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+        self.lambda_mult = lambda_mult if lambda_mult is not None else float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+        self.min_overlap = min_overlap or int(os.getenv("CONTEXT_MIN_OVERLAP", "20"))
+
+    def pack(
+        self,
+        query_vector: Optional[Sequence[float]],
+        results: List[Dict[str, Any]],
+        vectors: Optional[Sequence[Sequence[float]]] = None,
+        header: Optional[Callable[[Dict[str, Any]], str]] = None,
+        max_chunks: Optional[int] = None
+    ) -> List[ContextChunk]:
+        """
+        Args:
+            query_vector: 问题向量（与 vectors 均为空时按检索顺序装箱）
+            results: 检索结果（按相关性降序）
+            vectors: 各结果的文本块向量，与 results 一一对应
+            header: 每块的标题行（计入预算）
+            max_chunks: 最多装入的块数
+
+        Returns:
+            装入的块，按文件和块号排列
+        """
+        if query_vector is not None and vectors is not None and len(vectors) == len(results):
+            order = mmr_order(query_vector, vectors, self.lambda_mult)
+        else:
+            order = list(range(len(results)))
+        header = header or (lambda result: "")
+
+        packed: List[ContextChunk] = []
+        selected: List[str] = []
+        selected_by_file: Dict[Any, List[str]] = {}
+        remaining = self.token_budget
+        for index in order:
+            result = results[index]
+            file_id = result.get("metadata", {}).get("file_id")
+            if any(result["content"].strip() in previous for previous in selected):
+                continue  # 其他文件中的相同内容
+            text = remove_overlap(result["content"], selected_by_file.get(file_id, []), self.min_overlap)
+            if len(text.strip()) < self.min_overlap and text.strip() != result["content"].strip():
+                continue  # 内容已在上下文中
+
+            cost = estimate_tokens(header(result)) + estimate_tokens(text)
+            truncated = False
+            if cost > remaining:
+                # 最相关的一块总要放入；其余块剩余预算不足 MIN_PARTIAL_TOKENS 时跳过
+                text_budget = remaining - estimate_tokens(header(result))
+                if packed and text_budget < MIN_PARTIAL_TOKENS:
+                    continue
+                text = truncate_to_tokens(text, max(text_budget, MIN_PARTIAL_TOKENS))
+                cost = estimate_tokens(header(result)) + estimate_tokens(text)
+                truncated = True
+
+            packed.append(ContextChunk(result=result, text=text, tokens=cost, truncated=truncated))
+            selected.append(result["content"])
+            selected_by_file.setdefault(file_id, []).append(result["content"])
+            remaining -= cost
+            if remaining < MIN_PARTIAL_TOKENS or (max_chunks and len(packed) >= max_chunks):
+                break
+
+        first_seen = {}
+        for chunk in packed:
+            first_seen.setdefault(chunk.result.get("metadata", {}).get("file_id"), len(first_seen))
+        packed.sort(key=lambda chunk: (
+            first_seen[chunk.result.get("metadata", {}).get("file_id")],
+            chunk.result.get("metadata", {}).get("chunk_id") or 0
+        ))
+        return packed
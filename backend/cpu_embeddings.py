@@ -0,0 +1,168 @@
+"""
+CPU 优化的本地 Embedding 推理
+替代 HuggingFaceEmbeddings（sentence-transformers fp32）的推理路径，模型权重、分词器、池化方式与原模型一致：
+
+    torch        fp32，按 token 长度排序分批、每批只填充到批内最长（动态填充），inference_mode 推理
+    torch_int8   在 torch 的基础上把 Linear 层动态量化为 int8（torch.ao.quantization.quantize_dynamic）
+
+加载 torch_int8 时用一组探针文本比较量化前后的向量，最小余弦相似度低于 min_cosine 时退回 fp32，
+保证写入的向量与已有集合（fp32 模型生成）兼容。
+线程数固定为 EMBEDDING_THREADS；EMBEDDING_CPU_AFFINITY（如 0-3,6）把推理线程绑定到指定核心。
+
+使用示例（.env）：
+EMBEDDING_TYPE=huggingface
+EMBEDDING_BACKEND=torch_int8
+"""
+import os
+import logging
+import threading
+import warnings
+from typing import List, Optional, Set
+
+import numpy as np
+
+logger = logging.getLogger("RAG_Service")
+
+EMBEDDING_BACKENDS = ("sentence_transformers", "torch", "torch_int8")
+
+# 量化兼容性检查使用的探针文本（覆盖短查询和较长的文本块）
+PROBE_TEXTS = [
+    "三室两厅的户型图",
+    "法兰盘图纸的外径是多少",
+    "GB-T1804-m 未注公差",
+    "主卧室面积 15.6 平方米，朝南，带独立卫生间和衣帽间，客厅与餐厅相连，总建筑面积约 120 平方米。",
+    "零件材料 Q235，表面镀锌处理，螺栓孔 4×Φ18 均布，技术要求：未注倒角 C1，去毛刺锐边。",
+    "floor plan with two bedrooms and a balcony",
+]
+
+
+def parse_cpu_list(spec: str) -> Set[int]:
+    """解析核心列表，如 "0-3,6" -> {0, 1, 2, 3, 6}"""
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, stop = part.split("-", 1)
+            cpus.update(range(int(start), int(stop) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+class CPUEmbeddings:
+    """
+    sentence-transformers 模型的 CPU 推理封装（embed_documents / embed_query，输出 L2 归一化向量）
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        backend: str = "torch_int8",
+        batch_size: Optional[int] = None,
+        num_threads: Optional[int] = None,
+        cpu_affinity: Optional[str] = None,
+        min_cosine: Optional[float] = None
+    ):
+        """
+        Args:
+            model_name: sentence-transformers 模型名或本地目录
+            backend: torch / torch_int8
+            batch_size: 每批文本条数（默认读取 EMBEDDING_CPU_BATCH_SIZE）
+            num_threads: torch 推理线程数（默认读取 EMBEDDING_THREADS，未设置时不修改）
+            cpu_affinity: 推理线程绑定的核心列表（默认读取 EMBEDDING_CPU_AFFINITY）
+            min_cosine: 量化后探针向量与 fp32 的最小余弦相似度（默认读取 EMBEDDING_INT8_MIN_COSINE）
+        """
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if backend not in ("torch", "torch_int8"):
+            raise ValueError(f"不支持的 CPU 推理后端: {backend}（可选 torch、torch_int8）")
+
+        self.model_name = model_name
+        self.batch_size = batch_size or int(os.getenv("EMBEDDING_CPU_BATCH_SIZE", "32"))
+        num_threads = num_threads or int(os.getenv("EMBEDDING_THREADS", "0"))
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        cpu_affinity = cpu_affinity if cpu_affinity is not None else os.getenv("EMBEDDING_CPU_AFFINITY", "")
+        self.cpu_affinity = parse_cpu_list(cpu_affinity) if cpu_affinity and hasattr(os, "sched_setaffinity") else None
+        self._pinned_threads: Set[int] = set()
+
+        self.model = SentenceTransformer(model_name, device="cpu").eval()
+        transformer = self.model[0]
+        self.tokenizer = transformer.tokenizer
+        self.max_length = transformer.max_seq_length
+
+        self.backend = backend
+        self.probe_min_cosine: Optional[float] = None
+        if backend == "torch_int8":
+            min_cosine = min_cosine if min_cosine is not None else float(os.getenv("EMBEDDING_INT8_MIN_COSINE", "0.99"))
+            self._quantize(min_cosine)
+
+        logger.info(
+            f"✓ 初始化 CPU Embedding: {model_name}（后端: {self.backend}，批大小: {self.batch_size}，"
+            f"线程数: {torch.get_num_threads()}）"
+        )
+        if self.probe_min_cosine is not None:
+            logger.info(f"  int8 与 fp32 探针向量最小余弦相似度: {self.probe_min_cosine:.5f}")
+
+    def _quantize(self, min_cosine: float):
+        """Linear 层动态量化为 int8；探针向量偏离 fp32 过多时保留 fp32"""
+        import torch
+
+        transformer = self.model[0]
+        original = transformer.auto_model
+        reference = self._encode(PROBE_TEXTS)
+
+        with warnings.catch_warnings():
+            # torch.ao.quantization 的弃用提示
+            warnings.simplefilter("ignore")
+            transformer.auto_model = torch.ao.quantization.quantize_dynamic(original, {torch.nn.Linear}, dtype=torch.qint8)
+            quantized = self._encode(PROBE_TEXTS)
+
+        self.probe_min_cosine = float(np.min(np.sum(reference * quantized, axis=1)))
+        if self.probe_min_cosine < min_cosine:
+            logger.warning(
+                f"⚠️ int8 量化后向量与 fp32 偏差过大（最小余弦 {self.probe_min_cosine:.4f} < {min_cosine}），改用 fp32"
+            )
+            transformer.auto_model = original
+            self.backend = "torch"
+
+    def _pin_current_thread(self):
+        """把当前推理线程（及其随后创建的 OpenMP 线程）绑定到指定核心"""
+        ident = threading.get_ident()
+        if self.cpu_affinity and ident not in self._pinned_threads:
+            os.sched_setaffinity(0, self.cpu_affinity)
+            self._pinned_threads.add(ident)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """按 token 长度排序后分批推理（每批填充到批内最长），按输入顺序返回归一化向量"""
+        import torch
+
+        if not texts:
+            return np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        self._pin_current_thread()
+
+        encoded = self.tokenizer(list(texts), truncation=True, max_length=self.max_length)
+        keys = list(encoded.keys())
+        order = np.argsort([len(ids) for ids in encoded["input_ids"]], kind="stable")
+
+        vectors = np.empty((len(texts), self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        with torch.inference_mode():
+            for start in range(0, len(texts), self.batch_size):
+                rows = order[start:start + self.batch_size]
+                features = self.tokenizer.pad(
+                    {key: [encoded[key][i] for i in rows] for key in keys},
+                    return_tensors="pt"
+                )
+                embeddings = self.model(dict(features))["sentence_embedding"]
+                embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+                vectors[rows] = embeddings.float().numpy()
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
@@ -0,0 +1,113 @@
+"""
+CPU 密集型任务
+供 render 进程池调用的顶层函数：参数和返回值都必须可 pickle，模块本身保持轻量导入
+"""
+import io
+import asyncio
+from typing import List, Dict, Any, Optional
+
+
+def render_thumbnail_variants(
+    source_path: str,
+    output_dir: str,
+    file_id: str,
+    sizes: Dict[str, int],
+    quality: int = 85
+) -> Dict[str, Dict[str, Any]]:
+    """
+    生成多尺寸缩略图（PDF 取首页，图片直接缩放），保存为 JPEG
+
+    Returns:
+        {尺寸名: {path, mime, etag, width, height, size}}，etag 为文件内容的 SHA-256
+    """
+    import hashlib
+    from pathlib import Path
+    from PIL import Image
+
+    if source_path.lower().endswith(".pdf"):
+        import fitz
+
+        doc = fitz.open(source_path)
+        try:
+            # 按最大尺寸确定渲染倍率，避免大尺寸缩略图被放大模糊
+            page = doc[0]
+            zoom = max(2.0, max(sizes.values()) / max(page.rect.width, page.rect.height))
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            base = Image.open(io.BytesIO(pix.tobytes("png")))
+        finally:
+            doc.close()
+    else:
+        base = Image.open(source_path)
+        base.load()
+
+    # 透明背景铺白后再转 RGB（JPEG 不支持透明通道）
+    if base.mode in ("RGBA", "LA", "P"):
+        base = base.convert("RGBA")
+        background = Image.new("RGB", base.size, (255, 255, 255))
+        background.paste(base, mask=base.split()[-1])
+        base = background
+    elif base.mode != "RGB":
+        base = base.convert("RGB")
+
+    variants = {}
+    for name, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        img = base.copy()
+        img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=quality, optimize=True)
+        data = buffer.getvalue()
+
+        path = Path(output_dir) / f"{file_id}_{name}.jpg"
+        tmp_path = path.with_suffix(".jpg.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+        variants[name] = {
+            "path": str(path),
+            "mime": "image/jpeg",
+            "etag": hashlib.sha256(data).hexdigest(),
+            "width": img.width,
+            "height": img.height,
+            "size": len(data)
+        }
+    return variants
+
+
+def find_pdf_image_pages(pdf_path: str, max_text_length: int = 100) -> List[int]:
+    """找出图片页（有图片且文本少于 max_text_length 字符），返回从 0 开始的页码"""
+    import fitz
+
+    doc = fitz.open(pdf_path)
+    try:
+        image_pages = []
+        for page_num in range(len(doc)):
+            page = doc[page_num]
+            if page.get_images(full=True) and len(page.get_text().strip()) < max_text_length:
+                image_pages.append(page_num)
+        return image_pages
+    finally:
+        doc.close()
+
+
+def render_pdf_page(pdf_path: str, page_num: int, zoom: float = 2.0) -> bytes:
+    """将 PDF 单页渲染为 PNG 字节"""
+    import fitz
+
+    doc = fitz.open(pdf_path)
+    try:
+        pix = doc[page_num].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+        return pix.tobytes("png")
+    finally:
+        doc.close()
+
+
+def extract_pdf_fast(file_path: str, original_filename: Optional[str] = None) -> Dict[str, Any]:
+    """
+    快速模式提取 PDF
+
+    PDFExtractionService.extract_fast 内部会 os.chdir，只能在独立进程中运行，
+    不能放进线程池（会改变整个服务进程的工作目录）。
+    """
+    from unified.unified_pdf_extraction_service import PDFExtractionService
+
+    return asyncio.run(PDFExtractionService().extract_fast(file_path, original_filename=original_filename))
@@ -25,7 +25,8 @@ def upload_file(file_path: str, image_type: str = None):
         if image_type:
             data['image_type'] = image_type
 
-        response = requests.post(url, files=files, data=data)
+        # wait=true：等待后台入库任务完成，返回检测类型和分块数
+        response = requests.post(url, files=files, data=data, params={'wait': 'true'})
 
     return response.json()
 
@@ -0,0 +1,146 @@
+"""
+分阶段执行器
+把 async 处理函数中的阻塞调用（向量库、Embedding、PDF 渲染、图片编码、文件读写）
+投递到按阶段划分的有界线程池/进程池，避免阻塞事件循环
+
+检索路径（query_embedding / search）与入库路径（index_embedding / index_write / render）
+使用互相独立的池，上传任务再多也不会占用检索的线程。
+"""
+import os
+import asyncio
+import threading
+import functools
+import multiprocessing
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Dict
+
+
+# 阶段名 -> (池类型, 并发数环境变量, 默认并发数)
+STAGES = {
+    "query_embedding": ("thread", "QUERY_EMBEDDING_WORKERS", 2),  # 检索：查询向量化
+    "search": ("thread", "SEARCH_WORKERS", 4),                    # 检索：Chroma 查询 / BM25
+    "index_embedding": ("thread", "INDEX_EMBEDDING_WORKERS", 1),  # 入库：文本块向量化
+    "index_write": ("thread", "INDEX_WRITE_WORKERS", 1),          # 入库：Chroma / 词法索引写入
+    "io": ("thread", "IO_WORKERS", 4),                            # 文件读写
+    "render": ("process", "RENDER_PROCESSES", max(1, (os.cpu_count() or 2) // 2)),  # PDF 渲染、图片编码
+}
+
+
+def _process_start_method() -> str:
+    """
+    进程池启动方式
+
+    默认使用 forkserver（不支持时为 spawn）：进程池在服务运行中按需创建，此时本进程已有日志写入线程、
+    执行器线程和事件循环，fork 出的子进程可能继承被其他线程持有的锁（日志队列、stdout、内存分配器）。
+    子进程只导入 cpu_tasks（轻量），主模块以 __mp_main__ 重新导入时不会初始化服务。
+    """
+    method = os.getenv("RENDER_MP_START_METHOD")
+    if method:
+        return method
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class StageExecutor(Executor):
+    """
+    带队列深度统计的执行器
+
+    包装一个线程池或进程池，记录已提交、执行中、排队中、已完成、失败的任务数。
+    本身实现了 Executor 接口，可直接传给 loop.run_in_executor。
+    """
+
+    def __init__(self, name: str, kind: str, max_workers: int):
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+
+        if kind == "process":
+            context = multiprocessing.get_context(_process_start_method())
+            if context.get_start_method() == "forkserver":
+                context.set_forkserver_preload(["cpu_tasks"])
+            # 子进程在首次提交时按需启动（不在这里阻塞等待）
+            self._pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        with self._lock:
+            self._in_flight += 1
+            self._submitted += 1
+
+        future = self._pool.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            self._in_flight -= 1
+            if future.cancelled() or future.exception() is not None:
+                self._failed += 1
+            else:
+                self._completed += 1
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        self._pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def stats(self) -> Dict[str, Any]:
+        """队列深度统计（执行中最多 max_workers 个，其余为排队）"""
+        with self._lock:
+            in_flight = self._in_flight
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "active": min(in_flight, self.max_workers),
+                "queued": max(0, in_flight - self.max_workers),
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed
+            }
+
+
+_executors: Dict[str, StageExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(stage: str) -> StageExecutor:
+    """获取（按需创建）指定阶段的执行器"""
+    if stage not in STAGES:
+        raise ValueError(f"未知的执行阶段: {stage}，支持: {list(STAGES.keys())}")
+
+    executor = _executors.get(stage)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(stage)
+            if executor is None:
+                kind, env_name, default_workers = STAGES[stage]
+                max_workers = int(os.getenv(env_name, str(default_workers)))
+                executor = StageExecutor(stage, kind, max_workers)
+                _executors[stage] = executor
+    return executor
+
+
+async def run_in_stage(stage: str, fn: Callable, *args, **kwargs) -> Any:
+    """在指定阶段的执行器中运行阻塞函数（进程池阶段要求 fn 及参数可 pickle）"""
+    loop = asyncio.get_running_loop()
+    if kwargs:
+        fn = functools.partial(fn, *args, **kwargs)
+        args = ()
+    return await loop.run_in_executor(get_executor(stage), fn, *args)
+
+
+def executor_stats() -> Dict[str, Dict[str, Any]]:
+    """所有已创建执行器的队列深度统计"""
+    return {name: executor.stats() for name, executor in _executors.items()}
+
+
+def shutdown_executors(wait: bool = True):
+    """关闭所有执行器"""
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=wait, cancel_futures=True)
+        _executors.clear()
@@ -0,0 +1,326 @@
+"""
+结构化事实库
+把入库时 VLM 提取的 extracted_info 拆成带类型、带索引的 SQLite 表（文档、房间、尺寸、构件、图层、属性），
+精确问题和聚合问题（"哪些户型卧室超过3个且面积大于120平"）直接用索引查询回答，热路径上没有向量化和 JSON 解析
+"""
+import re
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from metadata_filters import normalize_filters
+
+logger = logging.getLogger("RAG_Service")
+
+# 文档表中可用于过滤的列
+DOCUMENT_COLUMNS = {
+    "file_id", "file_name", "file_type", "image_type",
+    "total_area", "total_length", "total_width", "room_count", "bedroom_count"
+}
+
+# 房间名称 -> 类别（按顺序匹配；与 bedroom_count 元数据一致，名称含"卧"即为卧室）
+ROOM_CATEGORIES = [
+    ("bedroom", ("卧",)),
+    ("bathroom", ("卫", "浴", "洗手间")),
+    ("kitchen", ("厨",)),
+    ("living_room", ("客厅", "起居")),
+    ("dining_room", ("餐厅",)),
+    ("balcony", ("阳台",)),
+    ("study", ("书房",)),
+    ("storage", ("储", "衣帽")),
+    ("entrance", ("玄关",)),
+]
+
+_SQL_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    file_id TEXT PRIMARY KEY,
+    file_name TEXT,
+    name_stem TEXT,
+    file_type TEXT,
+    image_type TEXT,
+    total_area REAL,
+    total_length REAL,
+    total_width REAL,
+    room_count INTEGER,
+    bedroom_count INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_image_type ON documents(image_type);
+CREATE INDEX IF NOT EXISTS idx_documents_bedroom_area ON documents(bedroom_count, total_area);
+CREATE INDEX IF NOT EXISTS idx_documents_total_area ON documents(total_area);
+
+CREATE TABLE IF NOT EXISTS rooms (
+    file_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    name TEXT,
+    category TEXT,
+    position TEXT,
+    length REAL,
+    width REAL,
+    area REAL,
+    PRIMARY KEY (file_id, idx)
+);
+CREATE INDEX IF NOT EXISTS idx_rooms_category_area ON rooms(category, area);
+
+CREATE TABLE IF NOT EXISTS dimensions (
+    file_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL,
+    unit TEXT,
+    raw TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_dimensions_file ON dimensions(file_id);
+CREATE INDEX IF NOT EXISTS idx_dimensions_name_value ON dimensions(name, value);
+
+CREATE TABLE IF NOT EXISTS components (
+    file_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    room TEXT,
+    count INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_components_file ON components(file_id);
+CREATE INDEX IF NOT EXISTS idx_components_name ON components(name);
+
+CREATE TABLE IF NOT EXISTS layers (
+    file_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (file_id, idx)
+);
+CREATE INDEX IF NOT EXISTS idx_layers_name ON layers(name);
+
+CREATE TABLE IF NOT EXISTS attributes (
+    file_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (file_id, key)
+);
+CREATE INDEX IF NOT EXISTS idx_attributes_key_value ON attributes(key, value);
+"""
+
+_CHILD_TABLES = ("rooms", "dimensions", "components", "layers", "attributes")
+
+
+def room_category(name: str) -> str:
+    """房间名称归类"""
+    for category, keywords in ROOM_CATEGORIES:
+        if any(kw in name for kw in keywords):
+            return category
+    return "other"
+
+
+def _to_float(value: Any) -> Optional[float]:
+    """数值或带单位的字符串（"120mm"、"Φ50"）-> 浮点数"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = _NUMBER_RE.search(value.replace(",", ""))
+        if match:
+            return float(match.group())
+    return None
+
+
+class FactsStore:
+    """
+    基于 SQLite 的结构化事实库
+
+    - upsert_document() 在入库的 index 阶段调用（运行在 index_write 执行器中）
+    - query_documents() / count_documents() 使用与 metadata_filters 相同的过滤条件写法
+    """
+
+    def __init__(self, db_path: str = "./chroma_db/facts.sqlite3"):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    # ---------- 写入 ----------
+
+    def upsert_document(
+        self,
+        file_id: str,
+        file_name: str,
+        file_type: Optional[str],
+        image_type: Optional[str],
+        extracted_info: Optional[Dict[str, Any]]
+    ):
+        """写入（覆盖）一个文件的全部事实"""
+        info = extracted_info or {}
+        rooms = [r for r in info.get("rooms") or [] if isinstance(r, dict)]
+        total_dims = info.get("total_dimensions") if isinstance(info.get("total_dimensions"), dict) else {}
+
+        room_rows = []
+        for idx, room in enumerate(rooms):
+            name = str(room.get("name", ""))
+            dims = room.get("dimensions") if isinstance(room.get("dimensions"), dict) else {}
+            room_rows.append((
+                file_id, idx, name, room_category(name), room.get("position"),
+                _to_float(dims.get("length")), _to_float(dims.get("width")), _to_float(dims.get("area"))
+            ))
+
+        dimension_rows = []
+        for key in ("length", "width", "total_area"):
+            if key in total_dims:
+                dimension_rows.append((file_id, "total_dimensions", key, _to_float(total_dims[key]), total_dims.get("unit"), str(total_dims[key])))
+        for source in ("main_dimensions", "key_parameters"):
+            values = info.get(source)
+            if isinstance(values, dict):
+                for name, raw in values.items():
+                    dimension_rows.append((file_id, source, str(name), _to_float(raw), None, str(raw)))
+
+        component_rows = []
+        for kind, key in (("component", "main_components"), ("feature", "key_features")):
+            for name in info.get(key) or []:
+                component_rows.append((file_id, kind, str(name), None, None))
+        for room in rooms:
+            for name in room.get("furniture") or []:
+                component_rows.append((file_id, "furniture", str(name), room.get("name"), None))
+        for symbol in info.get("symbols") or []:
+            if isinstance(symbol, dict) and symbol.get("type"):
+                count = _to_float(symbol.get("count"))
+                component_rows.append((file_id, "symbol", str(symbol["type"]), None, int(count) if count is not None else None))
+
+        layer_rows = [(file_id, idx, str(name)) for idx, name in enumerate(info.get("layers") or [])]
+
+        # 顶层标量（图纸编号、比例、材料、文档类型、版本等）
+        attribute_rows = [
+            (file_id, key, str(value)) for key, value in info.items()
+            if isinstance(value, (str, int, float)) and not isinstance(value, bool)
+        ]
+
+        # 与元数据一致：提取结果中有 rooms 字段时才有房间数/卧室数
+        has_rooms = "rooms" in info
+        document_row = (
+            file_id, file_name, Path(file_name).stem if file_name else None, file_type, image_type,
+            _to_float(total_dims.get("total_area")), _to_float(total_dims.get("length")), _to_float(total_dims.get("width")),
+            len(rooms) if has_rooms else None,
+            sum(1 for row in room_rows if row[3] == "bedroom") if has_rooms else None,
+            time.time()
+        )
+
+        with self._lock:
+            with self._conn:
+                for table in _CHILD_TABLES:
+                    self._conn.execute(f"DELETE FROM {table} WHERE file_id = ?", (file_id,))
+                self._conn.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", document_row)
+                self._conn.executemany("INSERT INTO rooms VALUES (?, ?, ?, ?, ?, ?, ?, ?)", room_rows)
+                self._conn.executemany("INSERT INTO dimensions VALUES (?, ?, ?, ?, ?, ?)", dimension_rows)
+                self._conn.executemany("INSERT INTO components VALUES (?, ?, ?, ?, ?)", component_rows)
+                self._conn.executemany("INSERT INTO layers VALUES (?, ?, ?)", layer_rows)
+                self._conn.executemany("INSERT OR REPLACE INTO attributes VALUES (?, ?, ?)", attribute_rows)
+
+    def delete(self, file_id: str):
+        with self._lock:
+            with self._conn:
+                for table in _CHILD_TABLES + ("documents",):
+                    self._conn.execute(f"DELETE FROM {table} WHERE file_id = ?", (file_id,))
+
+    # ---------- 查询 ----------
+
+    @staticmethod
+    def supports(filters: Optional[Dict[str, Any]]) -> bool:
+        """过滤条件是否都能在文档表上执行"""
+        return all(field in DOCUMENT_COLUMNS for field, _, _ in normalize_filters(filters))
+
+    @staticmethod
+    def _where(filters: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        for field, op, value in normalize_filters(filters):
+            if field not in DOCUMENT_COLUMNS:
+                raise ValueError(f"事实库不支持的过滤字段: {field}")
+            if op in ("$in", "$nin"):
+                values = list(value)
+                if not values:
+                    clauses.append("0" if op == "$in" else "1")
+                    continue
+                placeholders = ", ".join("?" for _ in values)
+                clauses.append(f"{field} {'IN' if op == '$in' else 'NOT IN'} ({placeholders})")
+                params.extend(values)
+            elif op == "$contains":
+                clauses.append(f"instr({field}, ?) > 0")
+                params.append(str(value))
+            elif op in _SQL_OPERATORS:
+                clauses.append(f"{field} {_SQL_OPERATORS[op]} ?")
+                params.append(value)
+            else:
+                raise ValueError(f"不支持的过滤运算符: {op}")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query_documents(
+        self,
+        filters: Optional[Dict[str, Any]] = None,
+        limit: int = 50,
+        order_by: str = "total_area DESC"
+    ) -> List[Dict[str, Any]]:
+        """按过滤条件查询文档（每个文档一行）"""
+        where, params = self._where(filters)
+        column, _, direction = order_by.partition(" ")
+        if column not in DOCUMENT_COLUMNS or direction.upper() not in ("", "ASC", "DESC"):
+            raise ValueError(f"不支持的排序: {order_by}")
+        sql = f"SELECT * FROM documents{where} ORDER BY {column} IS NULL, {order_by} LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit]).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_documents(self, filters: Optional[Dict[str, Any]] = None) -> int:
+        where, params = self._where(filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM documents{where}", params).fetchone()[0]
+
+    def find_documents_in_text(self, text: str, limit: int = 3) -> List[Dict[str, Any]]:
+        """文件名（不含扩展名）出现在文本中的文档，名称越长越优先"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM documents WHERE length(name_stem) >= 2 AND instr(?, name_stem) > 0 "
+                "ORDER BY length(name_stem) DESC LIMIT ?",
+                (text, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_document(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """一个文件的全部事实：文档行 + rooms / dimensions / components / layers / attributes"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM documents WHERE file_id = ?", (file_id,)).fetchone()
+            if row is None:
+                return None
+            doc = dict(row)
+            doc["rooms"] = [dict(r) for r in self._conn.execute(
+                "SELECT name, category, position, length, width, area FROM rooms WHERE file_id = ? ORDER BY idx", (file_id,)
+            )]
+            doc["dimensions"] = [dict(r) for r in self._conn.execute(
+                "SELECT source, name, value, unit, raw FROM dimensions WHERE file_id = ?", (file_id,)
+            )]
+            doc["components"] = [dict(r) for r in self._conn.execute(
+                "SELECT kind, name, room, count FROM components WHERE file_id = ?", (file_id,)
+            )]
+            doc["layers"] = [r[0] for r in self._conn.execute(
+                "SELECT name FROM layers WHERE file_id = ? ORDER BY idx", (file_id,)
+            )]
+            doc["attributes"] = {r[0]: r[1] for r in self._conn.execute(
+                "SELECT key, value FROM attributes WHERE file_id = ?", (file_id,)
+            )}
+        return doc
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,287 @@
+"""
+离线的 OpenAI 兼容模型服务（压测用）
+代替真实的 VLM / LLM / Embedding 提供方，延迟、输出 token 数、错误率可配置：
+
+    POST /v1/chat/completions   对话（含图片的请求按 VLM 处理），支持 stream=true（SSE）
+                                - 请求 response_format=json_object：返回与 VLM 提示词输出格式一致的 JSON（平面图房间、尺寸等）
+                                - 含图片且 max_tokens <= 50：图片类型识别，返回 --image-type
+                                - 其余：返回 completion_tokens 个 token 的中文文本
+    POST /v1/embeddings         按字符二元组哈希生成的确定性向量（相同文本向量相同，相近文本余弦相似度高）
+    GET  /v1/models
+    GET  /stats                 各类调用的次数、注入的错误数、token 数
+
+延迟模型：基础延迟（对话 / 图片 / 向量化分别配置）+ 每个输出 token 的延迟，再按 jitter 比例随机抖动；
+流式响应在基础延迟后发出首个片段，之后每个 token 间隔 token_latency_ms。
+
+使用示例：
+python fake_model_server.py --port 9100 --chat-latency-ms 800 --vision-latency-ms 2500 --error-rate 0.01
+
+# 服务指向该地址（见 bench_service.py --spawn）
+VLM_MODEL_URL=http://127.0.0.1:9100/v1
+EMBEDDING_TYPE=qwen
+DASHSCOPE_BASE_URL=http://127.0.0.1:9100/v1
+"""
+import json
+import time
+import uuid
+import zlib
+import base64
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass, asdict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER_TEXT = "根据检索到的图纸内容，该户型为三室两厅一卫，客厅朝南，主卧带飘窗，厨房与餐厅相邻，整体动线合理。"
+ROOM_NAMES = ["客厅", "餐厅", "主卧", "次卧", "书房", "厨房", "卫生间", "阳台", "玄关"]
+
+
+@dataclass
+class FakeModelConfig:
+    """模拟模型的延迟、输出长度与错误注入"""
+    chat_latency_ms: float = 300.0       # 纯文本对话的基础延迟（首个 token 前）
+    vision_latency_ms: float = 1500.0    # 含图片对话的基础延迟
+    embedding_latency_ms: float = 20.0   # 每次向量化请求的延迟
+    token_latency_ms: float = 5.0        # 每个输出 token 的延迟
+    jitter: float = 0.1                  # 延迟随机抖动比例（±）
+    completion_tokens: int = 200         # 文本回答的 token 数（不超过请求的 max_tokens）
+    error_rate: float = 0.0              # 返回错误的概率
+    error_status: int = 500              # 注入错误的状态码（如 429、500、503）
+    dimensions: int = 1024               # 请求未指定 dimensions 时的向量维度
+    image_type: str = "floor_plan"       # 图片类型识别的返回值
+    seed: Optional[int] = None
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数（中文约每字一个，英文约每 4 个字符一个）"""
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return max(1, (len(text) - ascii_chars) + ascii_chars // 4)
+
+
+def hashed_embedding(text: str, dimensions: int) -> np.ndarray:
+    """字符二元组哈希到固定维度并 L2 归一化（确定性，不依赖模型）"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    padded = f" {text} "
+    for i in range(len(padded) - 1):
+        h = zlib.crc32(padded[i:i + 2].encode("utf-8"))
+        vector[h % dimensions] += 1.0 if (h >> 31) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def _message_parts(messages: List[Dict[str, Any]]):
+    """提取消息中的文本和图片数量"""
+    texts, images = [], 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    texts.append(part.get("text", ""))
+                elif part.get("type") in ("image_url", "image"):
+                    images += 1
+    return "\n".join(texts), images
+
+
+class FakeModelServer:
+    """按配置生成响应并统计调用"""
+
+    def __init__(self, config: FakeModelConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, kind: str, **values: int):
+        entry = self.stats.setdefault(kind, {"requests": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        entry["requests"] += 1
+        for key, value in values.items():
+            entry[key] += value
+
+    def _delay(self, ms: float) -> float:
+        jitter = self.config.jitter
+        return max(0.0, ms * (1 + self.rng.uniform(-jitter, jitter))) / 1000
+
+    def _should_fail(self) -> bool:
+        return self.config.error_rate > 0 and self.rng.random() < self.config.error_rate
+
+    def _error(self, kind: str) -> JSONResponse:
+        self._count(kind, errors=1)
+        return JSONResponse(
+            {"error": {"message": "injected error", "type": "fake_model_error", "code": self.config.error_status}},
+            status_code=self.config.error_status
+        )
+
+    def _vision_json(self, prompt: str) -> str:
+        """与 VLM 提示词输出格式一致的 JSON（平面图：房间、尺寸、符号）"""
+        rooms = []
+        for name in self.rng.sample(ROOM_NAMES, k=self.rng.randint(4, len(ROOM_NAMES))):
+            length, width = round(self.rng.uniform(2.0, 6.0), 2), round(self.rng.uniform(1.5, 4.5), 2)
+            rooms.append({
+                "name": name,
+                "position": self.rng.choice(["左上", "右上", "中央", "左下", "右下"]),
+                "dimensions": {"length": length, "width": width, "area": round(length * width, 2), "unit": "m"},
+                "furniture": self.rng.sample(["沙发", "茶几", "床", "衣柜", "餐桌", "书桌"], k=2),
+            })
+        total_area = round(sum(r["dimensions"]["area"] for r in rooms) * 1.15, 1)
+        return json.dumps({
+            "answer": f"该平面图共有 {len(rooms)} 个房间，总面积约 {total_area} 平方米。",
+            "extracted_info": {
+                "total_dimensions": {"length": 15.0, "width": round(total_area / 15.0, 2), "unit": "m", "total_area": total_area},
+                "rooms": rooms,
+                "symbols": [{"type": "door", "count": len(rooms)}, {"type": "window", "count": len(rooms) - 1}],
+                "design_notes": ["动线流畅", "南北通透"],
+            }
+        }, ensure_ascii=False)
+
+    def _completion(self, body: Dict[str, Any]):
+        """(回答内容, 输入 token 数, 输出 token 数, 基础延迟毫秒)"""
+        text, images = _message_parts(body.get("messages", []))
+        prompt_tokens = estimate_tokens(text) + 258 * images
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        base_ms = self.config.vision_latency_ms if images else self.config.chat_latency_ms
+
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            content = self._vision_json(text)
+        elif images and max_tokens is not None and max_tokens <= 50:
+            content = self.config.image_type
+        else:
+            n = self.config.completion_tokens if max_tokens is None else min(self.config.completion_tokens, max_tokens)
+            content = (ANSWER_TEXT * (n // len(ANSWER_TEXT) + 1))[:n]
+        return content, prompt_tokens, estimate_tokens(content), base_ms
+
+    async def chat(self, body: Dict[str, Any]):
+        kind = "vision" if _message_parts(body.get("messages", []))[1] else "chat"
+        if self._should_fail():
+            await asyncio.sleep(self._delay(self.config.chat_latency_ms / 10))
+            return self._error(kind)
+
+        content, prompt_tokens, completion_tokens, base_ms = self._completion(body)
+        self._count(kind, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = body.get("model", "fake-model")
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            return StreamingResponse(
+                self._stream(completion_id, model, content, base_ms, usage if include_usage else None),
+                media_type="text/event-stream"
+            )
+
+        await asyncio.sleep(self._delay(base_ms + self.config.token_latency_ms * completion_tokens))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    async def _stream(self, completion_id: str, model: str, content: str, base_ms: float, usage) -> AsyncIterator[bytes]:
+        def chunk(delta: Dict[str, Any], finish_reason=None, **extra) -> bytes:
+            payload = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        await asyncio.sleep(self._delay(base_ms))
+        yield chunk({"role": "assistant", "content": ""})
+        for i in range(0, len(content), 2):
+            await asyncio.sleep(self._delay(self.config.token_latency_ms))
+            yield chunk({"content": content[i:i + 2]})
+        yield chunk({}, "stop")
+        if usage is not None:
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                       "model": model, "choices": [], "usage": usage}
+            yield f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+        yield b"data: [DONE]\n\n"
+
+    async def embeddings(self, body: Dict[str, Any]):
+        if self._should_fail():
+            return self._error("embedding")
+
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        dimensions = int(body.get("dimensions") or self.config.dimensions)
+        prompt_tokens = sum(estimate_tokens(str(text)) for text in texts)
+        self._count("embedding", prompt_tokens=prompt_tokens)
+        await asyncio.sleep(self._delay(self.config.embedding_latency_ms))
+
+        data = []
+        for i, text in enumerate(texts):
+            vector = hashed_embedding(str(text), dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        }
+
+
+def create_app(config: Optional[FakeModelConfig] = None) -> FastAPI:
+    server = FakeModelServer(config or FakeModelConfig())
+    app = FastAPI(title="Fake OpenAI-compatible model server")
+    app.state.server = server
+
+    @app.post("/v1/chat/completions")
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        return await server.chat(await request.json())
+
+    @app.post("/v1/embeddings")
+    @app.post("/embeddings")
+    async def embeddings(request: Request):
+        return await server.embeddings(await request.json())
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "fake-model", "object": "model", "owned_by": "fake"}]}
+
+    @app.get("/stats")
+    async def stats():
+        return {"config": asdict(server.config), "calls": server.stats}
+
+    return app
+
+
+def main():
+    defaults = FakeModelConfig()
+    parser = argparse.ArgumentParser(description="离线的 OpenAI 兼容模型服务（压测用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--chat-latency-ms", type=float, default=defaults.chat_latency_ms)
+    parser.add_argument("--vision-latency-ms", type=float, default=defaults.vision_latency_ms)
+    parser.add_argument("--embedding-latency-ms", type=float, default=defaults.embedding_latency_ms)
+    parser.add_argument("--token-latency-ms", type=float, default=defaults.token_latency_ms)
+    parser.add_argument("--jitter", type=float, default=defaults.jitter)
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--dimensions", type=int, default=defaults.dimensions)
+    parser.add_argument("--image-type", default=defaults.image_type)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = FakeModelConfig(**{k: v for k, v in vars(args).items() if k not in ("host", "port")})
+    print(f"✓ 模拟模型服务: http://{args.host}:{args.port}/v1")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+文件索引与缓存响应
+维护 fileId -> (原文件路径, MIME, ETag, 缩略图变体) 的持久化索引，缩略图/预览/下载请求直接查表，
+不再逐个探测扩展名；响应带强 ETag 和 Cache-Control，客户端缓存命中时返回 304；
+下载支持 Range / If-Range 断点续传
+"""
+import os
+import json
+import hashlib
+import time
+import logging
+import threading
+from pathlib import Path
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import quote
+
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from executors import run_in_stage
+
+logger = logging.getLogger("RAG_Service")
+
+# 缩略图尺寸：list（结果列表）、card（结果卡片）、detail（预览）
+THUMBNAIL_SIZES = {
+    "list": 160,
+    "card": 400,
+    "detail": 1200,
+}
+
+MIME_TYPES = {
+    ".pdf": "application/pdf",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".dwg": "image/vnd.dwg",
+    ".dxf": "image/vnd.dxf",
+}
+
+
+class FileIndex:
+    """
+    fileId -> 文件记录
+
+    记录保存在一个 JSON 文件中：
+    {fileId: {path, mime, etag, size, fileName, updatedAt, variants: {尺寸名: {path, mime, etag, width, height, size}}}}
+    """
+
+    def __init__(self, index_path: str = "./uploads/file_index.json"):
+        self.index_path = Path(index_path)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _load(self):
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self._records = json.load(f)
+        except Exception as e:
+            logger.warning(f"  ⚠️ 无法加载文件索引 {self.index_path}: {e}")
+
+    def _save(self):
+        # 先写临时文件再替换，避免进程中断留下半个文件
+        tmp_path = self.index_path.with_suffix(self.index_path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._records, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, file_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._records.get(file_id)
+            if not record:
+                return None
+            record = dict(record)
+            record["variants"] = dict(record.get("variants", {}))
+            return record
+
+    def put_original(
+        self,
+        file_id: str,
+        path: str,
+        etag: str,
+        size: int,
+        file_name: Optional[str] = None
+    ):
+        """登记原文件（内容变化时旧的缩略图变体一并作废）"""
+        with self._lock:
+            previous = self._records.get(file_id, {})
+            variants = previous.get("variants", {}) if previous.get("etag") == etag else {}
+            self._records[file_id] = {
+                "path": path,
+                "mime": MIME_TYPES.get(Path(path).suffix.lower(), "application/octet-stream"),
+                "etag": etag,
+                "size": size,
+                "fileName": file_name or previous.get("fileName"),
+                "updatedAt": time.time(),
+                "variants": variants
+            }
+            self._save()
+
+    def put_variants(self, file_id: str, variants: Dict[str, Dict[str, Any]]):
+        """登记缩略图变体"""
+        with self._lock:
+            record = self._records.get(file_id)
+            if record is None:
+                return
+            record.setdefault("variants", {}).update(variants)
+            record["updatedAt"] = time.time()
+            self._save()
+
+
+def hash_file(path: Path, chunk_size: int = 1024 * 1024) -> Tuple[str, int]:
+    """分块计算文件 SHA-256，返回 (哈希, 字节数)"""
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher.hexdigest(), size
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match 比较（忽略 W/ 前缀，支持逗号分隔列表和 *）"""
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def cached_file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    etag: str,
+    max_age: int
+) -> Response:
+    """
+    带强 ETag 和 Cache-Control 的文件响应，If-None-Match 命中时返回 304
+
+    Args:
+        etag: 文件内容哈希（不带引号）
+        max_age: Cache-Control 的 max-age（秒）；同一 fileId 可能被强制重新处理，因此不标记 immutable
+    """
+    headers = {
+        "ETag": f'"{etag}"',
+        "Cache-Control": f"public, max-age={max_age}"
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+class RangeNotSatisfiable(Exception):
+    """Range 超出文件范围（416）"""
+
+
+def parse_range(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段 Range 请求头
+
+    Returns:
+        (start, end)，end 包含在内；语法不合法或多段 Range 时返回 None（按完整文件响应）
+
+    Raises:
+        RangeNotSatisfiable: 起始位置超出文件大小
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, sep, end_text = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start_text == "":
+            # 后缀形式：bytes=-N 表示最后 N 个字节
+            suffix = int(end_text)
+            if suffix <= 0 or file_size == 0:
+                raise RangeNotSatisfiable()
+            return max(0, file_size - suffix), file_size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else file_size - 1
+    except ValueError:
+        return None
+    if start >= file_size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, file_size - 1)
+
+
+def _if_range_matches(if_range: str, etag: str, mtime: float) -> bool:
+    """If-Range 校验：实体标签用强比较，日期需与 Last-Modified 完全一致"""
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    try:
+        return int(parsedate_to_datetime(if_range).timestamp()) == int(mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+def content_disposition(file_name: str) -> str:
+    """attachment 头，非 ASCII 文件名使用 RFC 5987 编码"""
+    fallback = file_name.encode("ascii", "replace").decode("ascii").replace('"', "_")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(file_name)}"
+
+
+class RangeFileResponse(Response):
+    """
+    支持 Range / If-Range 的文件下载响应
+
+    - 单段 Range 返回 206，多段 Range 按完整文件返回 200，越界返回 416
+    - If-Range 与当前 ETag / Last-Modified 不一致时忽略 Range，返回完整文件
+    - If-None-Match 命中时返回 304
+    - 按大块在 io 执行器中读取，客户端断开后立即停止
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(
+        self,
+        request: Request,
+        path: str,
+        stat_result: os.stat_result,
+        media_type: str,
+        etag: str,
+        file_name: str
+    ):
+        self.path = path
+        file_size = stat_result.st_size
+        headers = {
+            "Accept-Ranges": "bytes",
+            "ETag": f'"{etag}"',
+            "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "Cache-Control": "no-cache",
+            "Content-Disposition": content_disposition(file_name)
+        }
+
+        self.start, self.count = 0, file_size
+        status_code = 200
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if_none_match = request.headers.get("if-none-match")
+
+        if if_none_match and _etag_matches(if_none_match, headers["ETag"]):
+            status_code, self.count = 304, 0
+        elif range_header and (not if_range or _if_range_matches(if_range, headers["ETag"], stat_result.st_mtime)):
+            try:
+                byte_range = parse_range(range_header, file_size)
+            except RangeNotSatisfiable:
+                status_code, self.count = 416, 0
+                headers["Content-Range"] = f"bytes */{file_size}"
+            else:
+                if byte_range is not None:
+                    start, end = byte_range
+                    status_code = 206
+                    self.start, self.count = start, end - start + 1
+                    headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+
+        if status_code != 304:
+            headers["Content-Length"] = str(self.count)
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type if self.count else None)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers
+        })
+        if scope["method"].upper() == "HEAD" or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        file = await run_in_stage("io", open, self.path, "rb")
+        try:
+            await run_in_stage("io", file.seek, self.start)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await run_in_stage("io", file.read, min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # 文件在下载过程中被截断：结束响应，客户端按 Content-Length 判断不完整后续传
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await run_in_stage("io", file.close)
@@ -9,16 +9,19 @@
 """
 
 import io
+import sys
 import base64
 import asyncio
+from concurrent.futures import Executor
 from typing import List, Dict, Any, Optional, Union
 from dataclasses import dataclass
 from pathlib import Path
 from PIL import Image
-import aiohttp
 import json
-import requests
-from urllib.parse import urlparse
+
+# 出站模型调用统一走 backend/model_gateway.py 的共享连接池
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from model_gateway import get_gateway, detect_provider, openai_base_url
 
 
 # ============ 配置部分 ============
@@ -37,6 +40,7 @@ class AnalysisResult:
     raw_response: str  # 原始响应
     token_usage: Dict[str, int]  # Token使用统计
     time_cost: float  # 耗时
+    cached: bool = False  # 是否来自响应缓存
 
 
 class ImageType:
@@ -47,6 +51,33 @@ class ImageType:
     TECHNICAL_DOC = "technical_doc"  # 工业技术档案/工艺文件
 
 
+def encode_image_to_base64(image_source: Union[str, Path, bytes, Image.Image], max_size: int = 2000) -> str:
+    """
+    将图片压缩并转换为JPEG base64字符串
+
+    模块级函数，可以直接投递到进程池执行（传入路径或图片字节时在子进程中解码）
+    """
+    if isinstance(image_source, Image.Image):
+        image = image_source
+    elif isinstance(image_source, bytes):
+        image = Image.open(io.BytesIO(image_source))
+    else:
+        image = Image.open(image_source)
+
+    # 压缩大图片
+    if image.width > max_size or image.height > max_size:
+        image = image.copy()  # 避免修改原图
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        print(f"  图片已压缩到: {image.size}")
+
+    buffer = io.BytesIO()
+    if image.mode == 'RGBA':
+        image = image.convert('RGB')
+    image.save(buffer, format='JPEG', quality=85)
+    buffer.seek(0)
+    return base64.b64encode(buffer.read()).decode('utf-8')
+
+
 class SimpleVLMAnalyzer:
     """简化版VLM图像分析器"""
 
@@ -246,44 +277,31 @@ class SimpleVLMAnalyzer:
         self,
         model_url: str = DEFAULT_MODEL_URL,
         api_key: str = DEFAULT_API_KEY,
-        model_name: str = DEFAULT_MODEL_NAME
+        model_name: str = DEFAULT_MODEL_NAME,
+        encode_executor: Optional[Executor] = None,
+        response_cache: Optional[Any] = None
     ):
-        """初始化分析器"""
+        """
+        初始化分析器
+
+        Args:
+            encode_executor: 图片压缩/编码使用的执行器（如进程池），默认使用事件循环的线程池
+            response_cache: VLM 响应缓存（如 vlm_cache.VLMResponseCache），命中时不调用 VLM
+        """
         self.model_url = model_url
         self.api_key = api_key
         self.model_name = model_name
+        self.encode_executor = encode_executor
+        self.response_cache = response_cache
 
-        # 检测API类型
-        self.api_type = self._detect_api_type()
+        # 检测API类型（连接由模型网关统一管理，不再每次调用新建）
+        self.api_type = detect_provider(self.model_url)
         print(f"✓ 初始化VLM分析器: {self.api_type} - {self.model_name}")
 
-        # 如果使用OpenAI SDK，初始化客户端
-        if self.api_type == "openai_sdk":
-            from openai import AsyncOpenAI
-            base_url = model_url.replace("/chat/completions", "") if "/chat/completions" in model_url else model_url
-            self.openai_client = AsyncOpenAI(api_key=api_key, base_url=base_url)
-        else:
-            self.openai_client = None
-
-    def _detect_api_type(self) -> str:
-        """检测API类型"""
-        url_lower = self.model_url.lower()
-
-        if "dashscope" in url_lower or "aliyun" in url_lower:
-            return "qwen"
-        elif "anthropic" in url_lower or "claude" in url_lower:
-            return "claude"
-        elif "openai.com" in url_lower or "gpt" in self.model_name.lower():
-            return "openai_sdk"
-        else:
-            return "openai_sdk"  # 默认使用OpenAI格式
-
-    def _get_request_url(self) -> str:
-        """获取完整的请求URL"""
-        url = self.model_url
-        if "/chat/completions" not in url and url.endswith("/v1"):
-            return url + "/chat/completions"
-        return url
+    @property
+    def openai_client(self):
+        """网关中当前事件循环共用的 AsyncOpenAI 客户端"""
+        return get_gateway().openai_client(openai_base_url(self.model_url), self.api_key)
 
     def load_image(self, image_source: Union[str, Path, Image.Image]) -> Image.Image:
         """
@@ -304,6 +322,8 @@ class SimpleVLMAnalyzer:
 
         # 如果是URL
         if image_source.startswith(('http://', 'https://')):
+            import requests
+
             print(f"⬇ 正在从URL下载图片: {image_source}")
             response = requests.get(image_source, timeout=30)
             response.raise_for_status()
@@ -323,32 +343,34 @@ class SimpleVLMAnalyzer:
 
     def image_to_base64(self, image: Image.Image, max_size: int = 2000) -> str:
         """将PIL Image转换为base64字符串"""
-        # 压缩大图片
-        if image.width > max_size or image.height > max_size:
-            image = image.copy()  # 避免修改原图
-            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-            print(f"  图片已压缩到: {image.size}")
-
-        buffer = io.BytesIO()
-        if image.mode == 'RGBA':
-            image = image.convert('RGB')
-        image.save(buffer, format='JPEG', quality=85)
-        buffer.seek(0)
-        return base64.b64encode(buffer.read()).decode('utf-8')
+        return encode_image_to_base64(image, max_size)
+
+    async def image_to_base64_async(
+        self,
+        image_source: Union[str, Path, bytes, Image.Image],
+        max_size: int = 2000
+    ) -> str:
+        """在 encode_executor 中压缩并编码图片，不阻塞事件循环"""
+        if isinstance(image_source, Path):
+            image_source = str(image_source)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.encode_executor, encode_image_to_base64, image_source, max_size)
 
     async def analyze_image(
         self,
-        image_source: Union[str, Path, Image.Image],
+        image_source: Union[str, Path, bytes, Image.Image],
         question: str,
-        image_type: str = ImageType.CAD
+        image_type: str = ImageType.CAD,
+        max_size: int = 2000
     ) -> AnalysisResult:
         """
         分析图像并回答问题
 
         Args:
-            image_source: 图片来源（本地路径、URL或PIL Image对象）
+            image_source: 图片来源（本地路径、URL、图片字节或PIL Image对象）
             question: 用户问题
             image_type: 图像类型 (cad / architecture / technical_doc)
+            max_size: 发送给 VLM 前的图片压缩尺寸
 
         Returns:
             AnalysisResult对象
@@ -362,12 +384,17 @@ class SimpleVLMAnalyzer:
         print(f"   问题: {question}")
         print("="*60)
 
-        # 1. 加载图片
-        image = self.load_image(image_source)
+        loop = asyncio.get_running_loop()
+
+        # 1. 加载图片（URL 下载为阻塞 IO，放到线程池；图片字节直接交给编码器解码）
+        if isinstance(image_source, bytes):
+            image = image_source
+        else:
+            image = await loop.run_in_executor(None, self.load_image, image_source)
 
         # 2. 转换为base64
         print("🔄 正在将图片转换为base64...")
-        image_base64 = self.image_to_base64(image)
+        image_base64 = await self.image_to_base64_async(image, max_size)
         print(f"✓ 转换完成: {len(image_base64) / 1024:.1f} KB")
 
         # 3. 构建提示词
@@ -376,16 +403,42 @@ class SimpleVLMAnalyzer:
 
         prompt = self.PROMPTS[image_type].format(question=question)
 
-        # 4. 调用VLM API
+        # 4. 查询响应缓存（相同图片、提示词、类型、模型和尺寸直接复用解析结果）
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.make_key(image_base64, prompt, image_type, self.model_name, max_size)
+            cached = await loop.run_in_executor(None, self.response_cache.get, cache_key)
+            if cached is not None:
+                print("♻️ 命中VLM响应缓存，跳过模型调用")
+                return AnalysisResult(
+                    image_type=image_type,
+                    question=question,
+                    answer=cached.get('answer', ''),
+                    extracted_info=cached.get('extracted_info', {}),
+                    raw_response=cached.get('raw_response', ''),
+                    token_usage=cached.get('token_usage', {}),
+                    time_cost=time.time() - start_time,
+                    cached=True
+                )
+
+        # 5. 调用VLM API
         print(f"🚀 正在调用VLM模型: {self.model_name}")
         response_data = await self._call_vlm_api(image_base64, prompt)
 
-        # 5. 解析响应
+        # 6. 解析响应
         answer = response_data.get('answer', '')
         extracted_info = response_data.get('extracted_info', {})
         raw_response = response_data.get('raw_response', '')
         token_usage = response_data.get('token_usage', {})
 
+        if cache_key is not None and answer:
+            await loop.run_in_executor(None, self.response_cache.put, cache_key, {
+                'answer': answer,
+                'extracted_info': extracted_info,
+                'raw_response': raw_response,
+                'token_usage': token_usage
+            })
+
         time_cost = time.time() - start_time
 
         print("\n" + "="*60)
@@ -405,18 +458,7 @@ class SimpleVLMAnalyzer:
         )
 
     async def _call_vlm_api(self, image_base64: str, prompt: str) -> Dict[str, Any]:
-        """调用VLM API（根据API类型自动选择调用方式）"""
-        if self.api_type == "openai_sdk":
-            return await self._call_openai_api(image_base64, prompt)
-        elif self.api_type == "qwen":
-            return await self._call_qwen_api(image_base64, prompt)
-        elif self.api_type == "claude":
-            return await self._call_claude_api(image_base64, prompt)
-        else:
-            raise ValueError(f"不支持的API类型: {self.api_type}")
-
-    async def _call_openai_api(self, image_base64: str, prompt: str) -> Dict[str, Any]:
-        """调用OpenAI格式的API"""
+        """调用VLM API（经模型网关，按API类型自动选择调用方式）"""
         messages = [
             {
                 "role": "system",
@@ -440,186 +482,36 @@ class SimpleVLMAnalyzer:
         ]
 
         try:
-            response = await self.openai_client.chat.completions.create(
+            result = await get_gateway().chat(
+                provider=self.api_type,
+                model_url=self.model_url,
+                api_key=self.api_key,
                 model=self.model_name,
                 messages=messages,
                 max_tokens=4096,
                 temperature=0.1,
                 response_format={"type": "json_object"}
             )
-
-            content = response.choices[0].message.content
-
-            # Token统计
-            token_usage = {}
-            if response.usage:
-                token_usage = {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                }
-                print(f"  Token使用: 输入={token_usage['prompt_tokens']}, "
-                      f"输出={token_usage['completion_tokens']}, "
-                      f"总计={token_usage['total_tokens']}")
-
-            # 解析JSON响应
-            parsed = self._parse_json_response(content)
-
-            return {
-                'answer': parsed.get('answer', ''),
-                'extracted_info': parsed.get('extracted_info', {}),
-                'raw_response': content,
-                'token_usage': token_usage
-            }
-
         except Exception as e:
-            print(f"❌ API调用失败: {e}")
+            print(f"❌ API调用失败（{self.api_type}）: {e}")
             raise
 
-    async def _call_qwen_api(self, image_base64: str, prompt: str) -> Dict[str, Any]:
-        """调用通义千问API"""
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-
-        payload = {
-            "model": self.model_name,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "你是一位专业的工业图纸和技术文档分析专家。"
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": prompt
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 4096,
-            "temperature": 0.1
-        }
-
-        request_url = self._get_request_url()
+        token_usage = result.token_usage
+        if token_usage:
+            print(f"  Token使用: 输入={token_usage['prompt_tokens']}, "
+                  f"输出={token_usage['completion_tokens']}, "
+                  f"总计={token_usage['total_tokens']}")
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    request_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=300)
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        raise Exception(f"API错误 {response.status}: {error_text[:500]}")
-
-                    result = await response.json()
-                    content = result['choices'][0]['message']['content']
-
-                    # Token统计
-                    token_usage = {}
-                    if 'usage' in result:
-                        usage = result['usage']
-                        token_usage = {
-                            "prompt_tokens": usage.get('prompt_tokens', 0),
-                            "completion_tokens": usage.get('completion_tokens', 0),
-                            "total_tokens": usage.get('total_tokens', 0)
-                        }
+        # 解析JSON响应
+        parsed = self._parse_json_response(result.content)
 
-                    parsed = self._parse_json_response(content)
-
-                    return {
-                        'answer': parsed.get('answer', ''),
-                        'extracted_info': parsed.get('extracted_info', {}),
-                        'raw_response': content,
-                        'token_usage': token_usage
-                    }
-        except Exception as e:
-            print(f"❌ 通义千问API调用失败: {e}")
-            raise
-
-    async def _call_claude_api(self, image_base64: str, prompt: str) -> Dict[str, Any]:
-        """调用Claude API"""
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-key": self.api_key,
-            "anthropic-version": "2023-06-01"
+        return {
+            'answer': parsed.get('answer', ''),
+            'extracted_info': parsed.get('extracted_info', {}),
+            'raw_response': result.content,
+            'token_usage': token_usage
         }
 
-        payload = {
-            "model": self.model_name,
-            "max_tokens": 4096,
-            "temperature": 0.1,
-            "system": "你是一位专业的工业图纸和技术文档分析专家。",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": image_base64
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": prompt
-                        }
-                    ]
-                }
-            ]
-        }
-
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.model_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=300)
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        raise Exception(f"API错误 {response.status}: {error_text[:500]}")
-
-                    result = await response.json()
-                    content = result['content'][0]['text']
-
-                    # Token统计
-                    token_usage = {}
-                    if 'usage' in result:
-                        usage = result['usage']
-                        token_usage = {
-                            "prompt_tokens": usage.get('input_tokens', 0),
-                            "completion_tokens": usage.get('output_tokens', 0),
-                            "total_tokens": usage.get('input_tokens', 0) + usage.get('output_tokens', 0)
-                        }
-
-                    parsed = self._parse_json_response(content)
-
-                    return {
-                        'answer': parsed.get('answer', ''),
-                        'extracted_info': parsed.get('extracted_info', {}),
-                        'raw_response': content,
-                        'token_usage': token_usage
-                    }
-        except Exception as e:
-            print(f"❌ Claude API调用失败: {e}")
-            raise
-
     def _parse_json_response(self, content: str) -> Dict[str, Any]:
         """解析JSON响应"""
         try:
@@ -0,0 +1,408 @@
+"""
+异步入库任务队列
+/upload 保存文件后立即返回任务 ID，由后台 worker 逐阶段执行解析、分析、索引，
+每个阶段完成后落盘检查点，服务重启后从最后完成的阶段继续；
+已结束的任务保留 INGEST_JOB_RETENTION 秒后连同检查点文件一起清理
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple
+
+logger = logging.getLogger("RAG_Service")
+
+
+class JobStatus:
+    """任务状态"""
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+# 各阶段默认并发上限（可用 INGEST_<STAGE>_CONCURRENCY 覆盖）
+DEFAULT_STAGE_CONCURRENCY = {
+    "extract": 2,
+    "thumbnail": 4,
+    "image_analysis": 2,
+    "detect": 4,
+    "analyze": 4,
+    "index": 1,
+}
+
+# 阶段函数：(job, state, progress) -> 需要合并进 state 的输出
+StageFunc = Callable[["IngestionJob", Dict[str, Any], Callable[[float], None]], Awaitable[Dict[str, Any]]]
+
+
+@dataclass
+class StageRecord:
+    """单个阶段的执行记录"""
+    name: str
+    status: str = JobStatus.QUEUED
+    progress: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> Optional[int]:
+        if self.started_at is None:
+            return None
+        end = self.finished_at or time.time()
+        return round((end - self.started_at) * 1000)
+
+
+@dataclass
+class IngestionJob:
+    """入库任务"""
+    job_id: str
+    file_id: str
+    file_name: str
+    file_path: str
+    file_extension: str
+    image_type: Optional[str] = None
+    status: str = JobStatus.QUEUED
+    stages: List[StageRecord] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+
+    @property
+    def current_stage(self) -> Optional[str]:
+        for stage in self.stages:
+            if stage.status != JobStatus.COMPLETED:
+                return stage.name
+        return None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.COMPLETED, JobStatus.FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """对外展示的任务状态"""
+        return {
+            "jobId": self.job_id,
+            "fileId": self.file_id,
+            "fileName": self.file_name,
+            "status": self.status,
+            "currentStage": self.current_stage,
+            "progress": round(sum(s.progress for s in self.stages) / len(self.stages), 4) if self.stages else 0.0,
+            "stages": [
+                {
+                    "name": s.name,
+                    "status": s.status,
+                    "progress": round(s.progress, 4),
+                    "durationMs": s.duration_ms,
+                    "error": s.error
+                }
+                for s in self.stages
+            ],
+            "createdAt": datetime.fromtimestamp(self.created_at).isoformat(),
+            "updatedAt": datetime.fromtimestamp(self.updated_at).isoformat(),
+            "error": self.error,
+            "result": self.result
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "IngestionJob":
+        record = dict(record)
+        record["stages"] = [StageRecord(**s) for s in record.get("stages", [])]
+        return cls(**record)
+
+
+class JobStore:
+    """
+    任务持久化
+
+    jobs/{job_id}.json 保存任务状态，jobs/{job_id}.state.json 保存阶段检查点（各阶段的输出）
+    """
+
+    def __init__(self, jobs_dir: str = "./jobs"):
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+
+    def _write_json(self, path: Path, data: Dict[str, Any]):
+        # 先写临时文件再替换，避免进程中断留下半个文件
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def save_job(self, job: IngestionJob):
+        self._write_json(self.jobs_dir / f"{job.job_id}.json", asdict(job))
+
+    def save_state(self, job_id: str, state: Dict[str, Any]):
+        self._write_json(self.jobs_dir / f"{job_id}.state.json", state)
+
+    def load_state(self, job_id: str) -> Dict[str, Any]:
+        path = self.jobs_dir / f"{job_id}.state.json"
+        if not path.exists():
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def delete_job(self, job_id: str):
+        """删除任务记录和检查点"""
+        for path in (self.jobs_dir / f"{job_id}.json", self.jobs_dir / f"{job_id}.state.json"):
+            path.unlink(missing_ok=True)
+
+    def load_jobs(self) -> List[IngestionJob]:
+        jobs = []
+        for path in sorted(self.jobs_dir.glob("*.json")):
+            if path.name.endswith(".state.json"):
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    jobs.append(IngestionJob.from_record(json.load(f)))
+            except Exception as e:
+                logger.warning(f"  ⚠️ 无法加载任务记录 {path.name}: {e}")
+        return jobs
+
+
+class IngestionJobManager:
+    """
+    入库任务管理器
+
+    - worker 协程从队列中取任务，逐阶段执行
+    - 每个阶段有独立的并发上限（信号量），大文件的慢阶段不会占满所有 worker
+    - 订阅者通过 subscribe() 获取进度事件（用于 SSE）
+    - 已结束（完成/失败）的任务超过保留时长后从内存和磁盘移除（启动、创建任务、任务结束时清理）
+    """
+
+    def __init__(
+        self,
+        stage_planner: Callable[[IngestionJob], List[Tuple[str, StageFunc]]],
+        store: Optional[JobStore] = None,
+        workers: Optional[int] = None,
+        retention: Optional[float] = None,
+        on_finished: Optional[Callable[[IngestionJob], None]] = None
+    ):
+        """
+        Args:
+            stage_planner: 根据任务返回有序的 [(阶段名, 阶段函数)]
+            store: 任务持久化
+            workers: worker 协程数量
+            retention: 已结束任务的保留秒数，0 表示不清理（默认读取 INGEST_JOB_RETENTION）
+            on_finished: 任务结束（完成或失败）时的回调，用于把结果记录到任务记录之外（任务记录会被清理）
+        """
+        self.stage_planner = stage_planner
+        self.store = store or JobStore(os.getenv("JOBS_DIR", "./jobs"))
+        self.workers = workers or int(os.getenv("INGEST_WORKERS", "4"))
+        self.retention = retention if retention is not None else float(os.getenv("INGEST_JOB_RETENTION", "86400"))
+        self.on_finished = on_finished
+
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._done_events: Dict[str, asyncio.Event] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+    def _semaphore(self, stage: str) -> asyncio.Semaphore:
+        if stage not in self._semaphores:
+            default = DEFAULT_STAGE_CONCURRENCY.get(stage, 2)
+            limit = int(os.getenv(f"INGEST_{stage.upper()}_CONCURRENCY", str(default)))
+            self._semaphores[stage] = asyncio.Semaphore(limit)
+        return self._semaphores[stage]
+
+    async def start(self):
+        """启动 worker，并恢复重启前未完成的任务"""
+        self._queue = asyncio.Queue()
+
+        resumed = 0
+        for job in self.store.load_jobs():
+            self._jobs[job.job_id] = job
+            self._done_events[job.job_id] = asyncio.Event()
+            if job.finished:
+                self._done_events[job.job_id].set()
+            else:
+                job.status = JobStatus.QUEUED
+                self._queue.put_nowait(job.job_id)
+                resumed += 1
+        self._evict_finished()
+
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self.workers)
+        ]
+        logger.info(f"✓ 入库任务队列已启动: {self.workers} 个 worker，恢复 {resumed} 个未完成任务")
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(
+        self,
+        file_id: str,
+        file_name: str,
+        file_path: str,
+        file_extension: str,
+        image_type: Optional[str] = None
+    ) -> IngestionJob:
+        """创建任务、落盘并加入队列"""
+        job = IngestionJob(
+            job_id=str(uuid.uuid4()),
+            file_id=file_id,
+            file_name=file_name,
+            file_path=file_path,
+            file_extension=file_extension,
+            image_type=image_type
+        )
+        job.stages = [StageRecord(name) for name, _ in self.stage_planner(job)]
+
+        self._evict_finished()
+        self._jobs[job.job_id] = job
+        self._done_events[job.job_id] = asyncio.Event()
+        self.store.save_job(job)
+        self._queue.put_nowait(job.job_id)
+
+        logger.info(f"📋 入库任务已创建: {job.job_id} ({file_name})")
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self._jobs.get(job_id)
+
+    def active_job(self, file_id: str) -> Optional[IngestionJob]:
+        """该文件排队中或运行中的任务（没有时返回 None）"""
+        for job in self._jobs.values():
+            if job.file_id == file_id and job.status in (JobStatus.QUEUED, JobStatus.RUNNING):
+                return job
+        return None
+
+    async def wait(self, job_id: str) -> IngestionJob:
+        """等待任务结束"""
+        job = self._jobs[job_id]
+        await self._done_events[job_id].wait()
+        return job
+
+    async def subscribe(self, job_id: str):
+        """
+        订阅任务进度，先推送当前状态，之后每次变化推送一次，任务结束后停止
+
+        Yields:
+            任务状态字典；超过 15 秒无变化时产出 None（用于发送心跳）
+        """
+        job = self._jobs[job_id]
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(queue)
+        try:
+            snapshot = job.to_dict()
+            yield snapshot
+            while snapshot["status"] not in (JobStatus.COMPLETED, JobStatus.FAILED):
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield snapshot
+        finally:
+            self._subscribers[job_id].remove(queue)
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
+
+    def _evict_finished(self):
+        """移除结束超过保留时长、且没有订阅者的任务，并删除其检查点文件"""
+        if self.retention <= 0:
+            return
+        deadline = time.time() - self.retention
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.updated_at < deadline and job_id not in self._subscribers
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+            self._done_events.pop(job_id, None)
+            self.store.delete_job(job_id)
+        if expired:
+            logger.info(f"🧹 清理 {len(expired)} 个已过保留期的入库任务")
+
+    def _publish(self, job: IngestionJob, persist: bool = False):
+        job.updated_at = time.time()
+        if persist:
+            self.store.save_job(job)
+        snapshot = job.to_dict()
+        for queue in self._subscribers.get(job.job_id, []):
+            queue.put_nowait(snapshot)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(self._jobs[job_id])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ 入库任务 worker-{worker_id} 异常: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job: IngestionJob):
+        job.status = JobStatus.RUNNING
+        self._publish(job, persist=True)
+
+        state = self.store.load_state(job.job_id)
+        records = {s.name: s for s in job.stages}
+
+        try:
+            for index, (name, stage_func) in enumerate(self.stage_planner(job)):
+                record = records.get(name)
+                if record is None:
+                    # 升级前创建的任务缺少新增阶段：补上记录
+                    record = records[name] = StageRecord(name)
+                    job.stages.insert(index, record)
+                if record.status == JobStatus.COMPLETED:
+                    continue  # 重启恢复：已完成的阶段直接跳过
+
+                def progress(value: float, record=record):
+                    record.progress = max(0.0, min(1.0, value))
+                    self._publish(job)
+
+                async with self._semaphore(name):
+                    record.status = JobStatus.RUNNING
+                    record.progress = 0.0
+                    record.started_at = time.time()
+                    record.finished_at = None
+                    record.error = None
+                    self._publish(job, persist=True)
+
+                    try:
+                        outputs = await stage_func(job, state, progress)
+                    except Exception as e:
+                        record.status = JobStatus.FAILED
+                        record.error = str(e)
+                        record.finished_at = time.time()
+                        raise
+
+                state.update(outputs or {})
+                self.store.save_state(job.job_id, state)
+
+                record.status = JobStatus.COMPLETED
+                record.progress = 1.0
+                record.finished_at = time.time()
+                self._publish(job, persist=True)
+                logger.info(f"  ✓ 任务 {job.job_id[:8]} 阶段 {name} 完成 ({record.duration_ms}ms)")
+
+            job.result = state.get("result")
+            job.status = JobStatus.COMPLETED
+
+        except Exception as e:
+            logger.error(f"❌ 入库任务失败 {job.job_id}: {e}")
+            job.status = JobStatus.FAILED
+            job.error = str(e)
+
+        self._publish(job, persist=True)
+        if self.on_finished is not None:
+            try:
+                self.on_finished(job)
+            except Exception as e:
+                logger.error(f"❌ 入库任务结束回调失败 {job.job_id}: {e}")
+        self._done_events[job.job_id].set()
+        self._evict_finished()
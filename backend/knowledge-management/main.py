@@ -2,6 +2,7 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from api.routes import router
 from database.sql_db import init_db
+from utils import close_http_client
 import uvicorn
 
 app = FastAPI(
@@ -28,6 +29,11 @@ async def startup_event():
     init_db()
     print("✅ 数据库初始化完成")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时释放 Embedding HTTP 连接池"""
+    await close_http_client()
+
 @app.get("/")
 async def root():
     return {
@@ -1,8 +1,28 @@
 import httpx
-from typing import List
+from typing import List, Optional
 from config import settings
 import uuid
 
+# 进程内共用的 Embedding HTTP 客户端（保持长连接，避免每次调用重新建立 TCP/TLS 连接）
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共用的 HTTP 客户端，首次调用时创建"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=60.0,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60.0)
+        )
+    return _http_client
+
+async def close_http_client():
+    """关闭共用的 HTTP 客户端（应用关闭时调用）"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 async def generate_embedding(text: str) -> List[float]:
     """
     调用在线embedding API生成向量
@@ -26,23 +46,24 @@ async def generate_embedding(text: str) -> List[float]:
         "input": text
     }
     
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            response = await client.post(
-                settings.EMBEDDING_API_URL,
-                headers=headers,
-                json=payload
-            )
-            response.raise_for_status()
-            
-            result = response.json()
-            embedding = result["data"][0]["embedding"]
-            return embedding
-            
-        except httpx.HTTPError as e:
-            raise Exception(f"Embedding API调用失败: {str(e)}")
-        except (KeyError, IndexError) as e:
-            raise Exception(f"Embedding API响应格式错误: {str(e)}")
+    client = get_http_client()
+    try:
+        response = await client.post(
+            settings.EMBEDDING_API_URL,
+            headers=headers,
+            json=payload,
+            timeout=30.0
+        )
+        response.raise_for_status()
+        
+        result = response.json()
+        embedding = result["data"][0]["embedding"]
+        return embedding
+        
+    except httpx.HTTPError as e:
+        raise Exception(f"Embedding API调用失败: {str(e)}")
+    except (KeyError, IndexError) as e:
+        raise Exception(f"Embedding API响应格式错误: {str(e)}")
 
 async def generate_embeddings_batch(texts: List[str]) -> List[List[float]]:
     """
@@ -67,23 +88,24 @@ async def generate_embeddings_batch(texts: List[str]) -> List[List[float]]:
         "input": texts
     }
     
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            response = await client.post(
-                settings.EMBEDDING_API_URL,
-                headers=headers,
-                json=payload
-            )
-            response.raise_for_status()
-            
-            result = response.json()
-            embeddings = [item["embedding"] for item in result["data"]]
-            return embeddings
-            
-        except httpx.HTTPError as e:
-            raise Exception(f"Embedding API调用失败: {str(e)}")
-        except (KeyError, IndexError) as e:
-            raise Exception(f"Embedding API响应格式错误: {str(e)}")
+    client = get_http_client()
+    try:
+        response = await client.post(
+            settings.EMBEDDING_API_URL,
+            headers=headers,
+            json=payload,
+            timeout=60.0
+        )
+        response.raise_for_status()
+        
+        result = response.json()
+        embeddings = [item["embedding"] for item in result["data"]]
+        return embeddings
+        
+    except httpx.HTTPError as e:
+        raise Exception(f"Embedding API调用失败: {str(e)}")
+    except (KeyError, IndexError) as e:
+        raise Exception(f"Embedding API响应格式错误: {str(e)}")
 
 def generate_file_id() -> str:
     """生成文件唯一ID"""
@@ -0,0 +1,363 @@
+"""
+BM25 词法索引
+与向量库写入同一批文本块，用于零件号、图号等精确词的召回，
+并提供倒数排名融合（RRF）把词法排序和向量排序合并为混合检索结果
+"""
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+
+# ASCII 字母数字串（零件号/图号常见的 - _ . / 连接符保留在整体词中）
+_ASCII_RUN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_ASCII_PART = re.compile(r"[a-z0-9]+")
+# 中日韩统一表意文字
+_CJK_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+
+
+def tokenize(text: str, use_jieba: bool = False) -> List[str]:
+    """
+    中文友好的分词
+
+    - 中文片段：字符二元组（单字片段保留单字），可选 jieba 搜索模式分词
+    - 英文/数字片段：保留完整串（如 GB-T1804-m），同时拆出各组成部分
+    """
+    if not text:
+        return []
+
+    text = text.lower()
+    tokens = []
+
+    for match in _ASCII_RUN.finditer(text):
+        run = match.group(0)
+        tokens.append(run)
+        parts = _ASCII_PART.findall(run)
+        if len(parts) > 1:
+            tokens.extend(parts)
+
+    for match in _CJK_RUN.finditer(text):
+        run = match.group(0)
+        if use_jieba:
+            import jieba
+            tokens.extend(t for t in jieba.cut_for_search(run) if t.strip())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+
+    return tokens
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[str]],
+    k: int = 60
+) -> List[Tuple[str, float]]:
+    """
+    倒数排名融合：score(d) = Σ 1 / (k + rank_i(d))
+
+    Args:
+        rankings: 多个按相关度降序排列的 id 列表
+        k: 平滑常数（原论文取 60）
+
+    Returns:
+        [(id, score)]，按融合分数降序
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] += 1.0 / (k + rank)
+
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+
+def truncate_to_groups(
+    items: List[Any],
+    n_groups: int,
+    group_of: Callable[[Any], Any]
+) -> List[Any]:
+    """
+    按分组截断有序结果：保留排在第 n_groups + 1 个新分组出现之前的全部条目
+
+    用于文档级 top-k（按 file_id 分组），返回的条目恰好覆盖排名最靠前的 n_groups 个分组（不足时全部返回）。
+    """
+    seen = set()
+    for i, item in enumerate(items):
+        group = group_of(item)
+        if group not in seen:
+            if len(seen) >= n_groups:
+                return items[:i]
+            seen.add(group)
+    return list(items)
+
+
+def count_groups(items: List[Any], group_of: Callable[[Any], Any]) -> int:
+    """有序结果中不同分组的个数"""
+    return len({group_of(item) for item in items})
+
+
+class LexicalIndex:
+    """
+    增量、持久化的 BM25 倒排索引
+
+    持久化格式为追加写的 JSONL（每行一个文本块），启动时重放重建倒排表；
+    同一 id 重复写入时以最后一次为准，删除追加 {"id", "deleted": true} 记录。
+    被覆盖或删除的记录超过存活文本块数的 compact_ratio 倍（且不少于 min_compact_records 条）时，
+    只写存活文本块到临时文件再替换原文件（压缩）。
+    只读模式（多进程部署的检索 worker）不写入，检索前读入写入进程新追加的行，文件被压缩替换后整体重建。
+    """
+
+    # 过期记录少于该条数时不压缩（小索引重放很快，不值得重写）
+    min_compact_records = 1000
+
+    def __init__(
+        self,
+        persist_path: str,
+        k1: float = 1.5,
+        b: float = 0.75,
+        use_jieba: Optional[bool] = None,
+        read_only: bool = False,
+        compact_ratio: Optional[float] = None
+    ):
+        self.persist_path = Path(persist_path)
+        self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+        self.k1 = k1
+        self.b = b
+        self.read_only = read_only
+        self.compact_ratio = compact_ratio if compact_ratio is not None else float(os.getenv("LEXICAL_COMPACT_RATIO", "0.5"))
+
+        if use_jieba is None:
+            use_jieba = os.getenv("LEXICAL_TOKENIZER", "bigram").lower() == "jieba"
+        self.use_jieba = use_jieba
+
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # term -> {doc_id: tf}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._docs: Dict[str, Dict[str, Any]] = {}  # doc_id -> {content, metadata}
+        self._total_len = 0
+        self._offset = 0  # 已读入的 JSONL 字节数
+        self._records = 0  # JSONL 中的记录数（含被覆盖和删除的）
+        self._inode: Optional[int] = None  # 已读入的文件，压缩替换后变化
+        self._generation = 0  # 文件被压缩替换的次数（本进程观察到的）
+
+        self._load()
+        if not read_only:
+            with self._lock:
+                self._maybe_compact()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    @property
+    def offset(self) -> int:
+        """已读入（或写入）的 JSONL 字节数，每次写入后增长"""
+        return self._offset
+
+    @property
+    def generation(self) -> int:
+        """文件被压缩替换的次数，与 offset 一起标识索引内容（压缩后 offset 会变小）"""
+        return self._generation
+
+    def _reset(self):
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_len.clear()
+        self._docs.clear()
+        self._total_len = 0
+        self._offset = 0
+        self._records = 0
+
+    def _load(self):
+        """从 JSONL 重放索引（文件已被压缩替换时从头重建）"""
+        if not self.persist_path.exists():
+            return
+
+        with open(self.persist_path, "rb") as f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self._inode:
+                if self._inode is not None:
+                    self._reset()
+                    self._generation += 1
+                self._inode = inode
+            f.seek(self._offset)
+            data = f.read()
+        # 只读入完整的行：写入进程可能正在追加最后一行
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        for line in data[:end].decode("utf-8").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 进程中断可能留下半行，跳过即可
+                continue
+            self._records += 1
+            if record.get("deleted"):
+                self._unindex(record["id"])
+            else:
+                self._index(record["id"], record["content"], record.get("metadata", {}))
+
+    def refresh(self) -> bool:
+        """只读模式：读入写入进程新追加的行（文件被压缩替换或截断时整体重建），返回是否有更新"""
+        if not self.read_only:
+            return False
+        try:
+            stat = os.stat(self.persist_path)
+        except FileNotFoundError:
+            return False
+        if stat.st_ino == self._inode and stat.st_size == self._offset:
+            return False
+
+        with self._lock:
+            if stat.st_ino == self._inode and stat.st_size < self._offset:
+                self._reset()
+                self._generation += 1
+            self._load()
+        return True
+
+    def _maybe_compact(self):
+        """过期记录过多时只保留存活文本块重写文件（调用方负责加锁）"""
+        live = len(self._docs)
+        dead = self._records - live
+        if dead < max(self.min_compact_records, live * self.compact_ratio):
+            return
+
+        tmp_path = self.persist_path.with_suffix(self.persist_path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for doc_id, doc in self._docs.items():
+                f.write(json.dumps(
+                    {"id": doc_id, "content": doc["content"], "metadata": doc["metadata"]},
+                    ensure_ascii=False
+                ) + "\n")
+            offset = f.tell()
+        os.replace(tmp_path, self.persist_path)
+
+        self._offset = offset
+        self._records = live
+        self._inode = os.stat(self.persist_path).st_ino
+        self._generation += 1
+
+    def _index(self, doc_id: str, content: str, metadata: Dict[str, Any]):
+        """写入内存倒排表（调用方负责加锁）"""
+        if doc_id in self._docs:
+            self._unindex(doc_id)
+
+        terms = Counter(tokenize(content, self.use_jieba))
+        for term, tf in terms.items():
+            self._postings[term][doc_id] = tf
+
+        length = sum(terms.values())
+        self._doc_terms[doc_id] = terms
+        self._doc_len[doc_id] = length
+        self._docs[doc_id] = {"content": content, "metadata": metadata}
+        self._total_len += length
+
+    def _unindex(self, doc_id: str):
+        for term in self._doc_terms.pop(doc_id, {}):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_len -= self._doc_len.pop(doc_id, 0)
+        self._docs.pop(doc_id, None)
+
+    def add_documents(
+        self,
+        ids: List[str],
+        contents: List[str],
+        metadatas: List[Dict[str, Any]]
+    ):
+        """增量添加文本块，并追加写入磁盘"""
+        if self.read_only:
+            raise PermissionError(f"词法索引以只读模式打开: {self.persist_path}")
+        with self._lock:
+            with open(self.persist_path, "a", encoding="utf-8") as f:
+                for doc_id, content, metadata in zip(ids, contents, metadatas):
+                    self._index(doc_id, content, metadata)
+                    f.write(json.dumps(
+                        {"id": doc_id, "content": content, "metadata": metadata},
+                        ensure_ascii=False
+                    ) + "\n")
+                self._offset = f.tell()
+            self._records += len(ids)
+            self._maybe_compact()
+
+    def delete_documents(self, ids: List[str]):
+        """删除文本块，并追加删除记录到磁盘"""
+        if self.read_only:
+            raise PermissionError(f"词法索引以只读模式打开: {self.persist_path}")
+        with self._lock:
+            ids = [doc_id for doc_id in ids if doc_id in self._docs]
+            if not ids:
+                return
+            with open(self.persist_path, "a", encoding="utf-8") as f:
+                for doc_id in ids:
+                    self._unindex(doc_id)
+                    f.write(json.dumps({"id": doc_id, "deleted": True}, ensure_ascii=False) + "\n")
+                self._offset = f.tell()
+            self._records += len(ids)
+            self._maybe_compact()
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        predicate: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        group_key: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        BM25 检索
+
+        Args:
+            predicate: 元数据过滤函数，在截断前应用（过滤后仍返回 top_k 个）
+            group_key: 按该元数据字段分组截断（如 file_id），top_k 表示分组数而非文本块数
+
+        Returns:
+            [{"id", "content", "metadata", "score"}]，按分数降序
+        """
+        query_terms = set(tokenize(query, self.use_jieba))
+        if not query_terms:
+            return []
+        self.refresh()
+
+        with self._lock:
+            n_docs = len(self._docs)
+            if n_docs == 0:
+                return []
+            avg_len = self._total_len / n_docs
+
+            scores = defaultdict(float)
+            for term in query_terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+            if predicate is not None:
+                ranked = [item for item in ranked if predicate(self._docs[item[0]]["metadata"])]
+            if group_key is None:
+                top = ranked[:top_k]
+            else:
+                top = truncate_to_groups(ranked, top_k, lambda item: self._docs[item[0]]["metadata"].get(group_key))
+            return [
+                {
+                    "id": doc_id,
+                    "content": self._docs[doc_id]["content"],
+                    "metadata": self._docs[doc_id]["metadata"],
+                    "score": score
+                }
+                for doc_id, score in top
+            ]
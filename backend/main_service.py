@@ -8,9 +8,11 @@ import uuid
 import asyncio
 import logging
 import json
+import re
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Union, AsyncIterator
 from pathlib import Path
+from urllib.parse import quote
 import tempfile
 import shutil
 import time
@@ -20,21 +22,17 @@ from dotenv import load_dotenv
 load_dotenv()  # 加载 .env 文件
 
 # ============ 配置日志系统 ============
-# 简单的日志配置，直接输出到控制台
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(message)s',
-    stream=sys.stdout
-)
+# 日志写入队列，由后台线程批量输出到控制台和 logs/（JSON Lines，见 simple_logger）
+from simple_logger import setup_logging, log_request, log_stats, RequestLogMiddleware
+setup_logging()
 
 # 创建应用日志记录器
 logger = logging.getLogger("RAG_Service")
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Form, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from starlette.middleware.base import BaseHTTPMiddleware
 import uvicorn
 
 # 添加项目路径
@@ -44,17 +42,49 @@ sys.path.insert(0, str(backend_path / "Information-Extraction"))
 sys.path.insert(0, str(backend_path / "image_analysis"))
 
 # 导入现有模块
-from simple_vlm_analyzer import SimpleVLMAnalyzer, ImageType
-from unified.unified_pdf_extraction_service import PDFExtractionService
-from qwen_embeddings import QwenEmbeddings
-from simple_logger import log_request
+# 模型、向量库、PDF 解析、LangChain 等重量级依赖在用到它们的构造函数/方法中导入，
+# 导入本模块只加载 Web 框架和轻量模块，uvicorn 可以立即监听端口（见 startup.py）
+from simple_vlm_analyzer import ImageType
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, truncate_to_groups, count_groups
+from metadata_filters import build_where, match_conditions, match_filters
+from facts_store import FactsStore
+from executors import get_executor, run_in_stage, executor_stats, shutdown_executors
+import cpu_tasks
+from ingestion_jobs import IngestionJobManager, IngestionJob, JobStatus
+from upload_dedup import UploadHashIndex
+from file_index import (
+    FileIndex, THUMBNAIL_SIZES, MIME_TYPES, RangeFileResponse,
+    cached_file_response, content_disposition, hash_file
+)
+from upload_stream import StreamedUpload, UploadTooLarge, InvalidUpload, receive_upload
+from vlm_cache import VLMResponseCache
+from answer_cache import SemanticAnswerCache, question_scope
+from context_packing import ContextPacker, ContextChunk
+from model_gateway import get_gateway, openai_base_url
+from startup import StartupState, ReadinessMiddleware
+from serve_workers import service_role, WriterRedirectMiddleware
+from tracing import span, TracingMiddleware, render_metrics
+
+
+# 问题中的中文数字（"三个卧室"、"十二个房间"、"一百二十平米"）
+CHINESE_DIGITS = {"零": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+CHINESE_UNITS = {"十": 10, "百": 100}
+CHINESE_NUMERAL_PATTERN = re.compile(r"[零一二两三四五六七八九十百]+")
+
+
+def chinese_numeral_to_int(numeral: str) -> int:
+    """整段中文数字 -> 整数：十 → 10，十二 → 12，二十 → 20，二十三 → 23，一百零五 → 105"""
+    total, digit = 0, 0
+    for char in numeral:
+        if char in CHINESE_UNITS:
+            total += (digit or 1) * CHINESE_UNITS[char]
+            digit = 0
+        else:
+            digit = CHINESE_DIGITS[char]
+    return total + digit
 
-# LangChain imports
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain.docstore.document import Document
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+# 聚合问题关键词（问的是"哪些文件"而不是某个文件的属性）
+AGGREGATE_KEYWORDS = ["哪些", "哪几", "几张", "多少张", "几套", "多少套", "几份", "多少份", "所有"]
 
 
 # ============ 数据模型 ============
@@ -106,6 +136,20 @@ class SearchResponse(BaseModel):
     queryTime: float
     model: str
     strategy: str
+    rerankTime: Optional[float] = None  # 重排耗时（毫秒，仅 two-stage 策略）
+
+
+class SearchBatchRequest(BaseModel):
+    """批量搜索请求"""
+    queries: List[SearchRequest]
+
+
+class SearchBatchResponse(BaseModel):
+    """批量搜索响应（results 与 queries 顺序一致，耗时单位为毫秒）"""
+    results: List[SearchResponse]
+    totalTime: float
+    embeddingTime: float  # 批量查询向量化耗时
+    vectorSearchTime: float  # 批量向量检索耗时
 
 
 class UploadResponse(BaseModel):
@@ -115,6 +159,32 @@ class UploadResponse(BaseModel):
     fileName: str
     message: Optional[str] = None
     detectedImageType: Optional[str] = None  # 检测到的图片类型
+    jobId: Optional[str] = None  # 入库任务ID（用于查询处理进度）
+    duplicate: bool = False  # 内容与已上传文件相同，复用了已有 fileId
+
+
+class JobStageStatus(BaseModel):
+    """入库任务阶段状态"""
+    name: str
+    status: str
+    progress: float
+    durationMs: Optional[int] = None
+    error: Optional[str] = None
+
+
+class JobStatusResponse(BaseModel):
+    """入库任务状态"""
+    jobId: str
+    fileId: str
+    fileName: str
+    status: str  # queued, running, completed, failed
+    currentStage: Optional[str] = None
+    progress: float
+    stages: List[JobStageStatus]
+    createdAt: str
+    updatedAt: str
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
 
 
 class FollowUpQuestionRequest(BaseModel):
@@ -144,6 +214,7 @@ class IntelligentQAResponse(BaseModel):
     sources: List[Dict[str, Any]]
     confidence: float
     query_type: str  # exact_query, filter_query, general_query
+    cache: Optional[Dict[str, Any]] = None  # 语义缓存：本次是否命中、相似度、累计命中/未命中次数（未启用时为空）
 
 
 # ============ 向量数据库管理器 ============
@@ -151,40 +222,37 @@ class IntelligentQAResponse(BaseModel):
 class VectorStoreManager:
     """向量数据库管理器 - 使用 ChromaDB"""
 
-    def __init__(self, persist_directory: str = "./chroma_db"):
-        """初始化向量数据库"""
+    def __init__(self, persist_directory: str = "./chroma_db", read_only: bool = False):
+        """
+        初始化向量数据库
+
+        Args:
+            read_only: 只读跟随写入进程的索引（多进程部署的检索 worker，见 serve_workers），不回填、不写入
+        """
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from model_server import ModelServerClient, RemoteEmbeddings, create_local_embeddings
+        from vector_backends import create_vector_backend
+
         self.persist_directory = persist_directory
         os.makedirs(persist_directory, exist_ok=True)
 
         # 根据配置选择 Embedding 模型
         logger.info("初始化 Embedding 模型...")
         embedding_type = os.getenv("EMBEDDING_TYPE", "huggingface").lower()
+        self.embedding_type = embedding_type
 
-        if embedding_type == "qwen":
-            # 使用通义千问 Embedding
-            logger.info("  使用通义千问 text-embedding-v4")
-            self.embeddings = QwenEmbeddings(
-                api_key=os.getenv("DASHSCOPE_API_KEY"),
-                base_url=os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
-                model=os.getenv("EMBEDDING_MODEL", "text-embedding-v4"),
-                dimensions=int(os.getenv("EMBEDDING_DIMENSIONS", "1024"))
-            )
+        # 配置了共享模型进程时经 Unix socket 调用，本进程不加载模型
+        self.model_server_socket = os.getenv("MODEL_SERVER_SOCKET")
+        if self.model_server_socket:
+            logger.info(f"  使用共享模型进程: {self.model_server_socket}")
+            self.embeddings = RemoteEmbeddings(ModelServerClient(self.model_server_socket))
         else:
-            # 使用 HuggingFace Embedding（默认，离线可用）
-            print("  使用 HuggingFace Embedding")
-            model_name = os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name=model_name,
-                model_kwargs={'device': 'cpu'},
-                encode_kwargs={'normalize_embeddings': True}
-            )
+            self.embeddings = create_local_embeddings(embedding_type)
 
-        # 初始化 Chroma
-        self.vector_store = Chroma(
-            persist_directory=persist_directory,
-            embedding_function=self.embeddings,
-            collection_name="multimodal_rag"
-        )
+        # 初始化向量库后端（VECTOR_BACKEND=chroma / numpy，见 vector_backends）
+        self.read_only = read_only
+        self._corpus_writes = 0  # 本进程写入（入库、覆盖、删除）次数
+        self.vector_store = create_vector_backend(persist_directory, self.embeddings, read_only=read_only)
 
         # 文本分割器
         chunk_size = int(os.getenv("CHUNK_SIZE", "300"))
@@ -196,9 +264,43 @@ class VectorStoreManager:
             separators=["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""]
         )
 
+        # BM25 词法索引（与向量库写入同一批文本块，用于混合检索）
+        self.lexical_index = LexicalIndex(os.path.join(persist_directory, "lexical_index.jsonl"), read_only=read_only)
+        if len(self.lexical_index) == 0 and not read_only:
+            self._backfill_lexical_index()
+        self.rrf_k = int(os.getenv("HYBRID_RRF_K", "60"))
+
+        # 有无法下推的过滤条件时，每轮扩大候选数的倍数
+        self.filter_widen_factor = int(os.getenv("FILTER_WIDEN_FACTOR", "4"))
+        # 逐轮扩大检索的候选数上限（限制文档级 top-k 与剩余条件过滤的最坏延迟）
+        self.grouped_max_candidates = int(os.getenv("GROUPED_SEARCH_MAX_CANDIDATES", "2000"))
+
         logger.info(f"✓ 向量数据库初始化完成")
         logger.info(f"  Embedding类型: {embedding_type}")
+        logger.info(f"  向量库后端: {self.vector_store.name}")
         logger.info(f"  分块大小: {chunk_size}, 重叠: {chunk_overlap}")
+        logger.info(f"  词法索引: {len(self.lexical_index)} 个文本块")
+
+    def _backfill_lexical_index(self):
+        """词法索引为空时，从已有的向量库回填"""
+        try:
+            existing = self.vector_store.get()
+        except Exception as e:
+            logger.warning(f"  ⚠️ 读取向量库失败，跳过词法索引回填: {e}")
+            return
+
+        if existing and existing.get("ids"):
+            self.lexical_index.add_documents(
+                existing["ids"],
+                existing["documents"],
+                existing["metadatas"]
+            )
+            logger.info(f"  已从向量库回填词法索引: {len(existing['ids'])} 个文本块")
+
+    @staticmethod
+    def _chunk_key(metadata: Dict[str, Any]) -> str:
+        """文本块在向量库/词法索引中的统一 id"""
+        return f"{metadata.get('file_id', 'unknown')}_chunk_{metadata.get('chunk_id', 0)}"
 
     async def add_document(
         self,
@@ -209,16 +311,16 @@ class VectorStoreManager:
         metadata: Dict[str, Any]
     ) -> int:
         """添加文档到向量库"""
-        print(f"\n📥 添加文档到向量库: {file_name}")
+        logger.info(f"📥 添加文档到向量库: {file_name}")
 
         # 分割文本
-        chunks = self.text_splitter.split_text(content)
+        with span("chunking"):
+            chunks = self.text_splitter.split_text(content)
         logger.info(f"  分割为 {len(chunks)} 个文本块")
 
-        # 创建 Document 对象
-        documents = []
-        for i, chunk in enumerate(chunks):
-            doc_metadata = {
+        # 每个文本块的元数据
+        metadatas = [
+            {
                 "file_id": file_id,
                 "file_name": file_name,
                 "file_type": file_type,
@@ -227,67 +329,245 @@ class VectorStoreManager:
                 "upload_date": datetime.now().isoformat(),
                 **metadata
             }
+            for i in range(len(chunks))
+        ]
+
+        # 添加到向量库（向量化与写入分别在入库阶段的执行器中运行）
+        ids = [f"{file_id}_chunk_{i}" for i in range(len(chunks))]
+        with span("index_embedding"):
+            vectors = await run_in_stage("index_embedding", self.embeddings.embed_documents, chunks)
+        with span("index_write"):
+            await run_in_stage("index_write", self._write_chunks, file_id, ids, chunks, vectors, metadatas)
+
+        logger.info(f"✓ 文档已添加到向量库，共 {len(chunks)} 个块")
+        return len(chunks)
+
+    def _write_chunks(
+        self,
+        file_id: str,
+        ids: List[str],
+        chunks: List[str],
+        vectors: List[List[float]],
+        metadatas: List[Dict[str, Any]]
+    ):
+        """写入向量库与词法索引（同步，运行在 index_write 执行器中）"""
+        # 重新入库（force）的文本块可能比上次少：先删除不会被覆盖的旧块，其余的由 upsert 覆盖
+        self.delete_file_chunks(file_id, keep=ids)
+        self.vector_store.upsert(ids, vectors, chunks, metadatas)
+        self.lexical_index.add_documents(ids, chunks, metadatas)
+        self.bump_corpus_version()
+
+    def delete_file_chunks(self, file_id: str, keep: List[str] = ()) -> List[str]:
+        """删除文件在向量库和词法索引中的文本块（keep 中的 id 保留），返回被删除的 id"""
+        keep = set(keep)
+        stale = [chunk_id for chunk_id in self.vector_store.get(where={"file_id": file_id})["ids"] if chunk_id not in keep]
+        if not stale:
+            return []
+        deleted = self.vector_store.delete(where={"file_id": file_id}, ids=stale)
+        self.lexical_index.delete_documents(stale)
+        self.bump_corpus_version()
+        logger.info(f"  已删除文件 {file_id} 的 {len(deleted)} 个旧文本块")
+        return deleted
+
+    def bump_corpus_version(self):
+        """语料变化（入库、覆盖、删除）后调用，使语义缓存中的回答失效"""
+        self._corpus_writes += 1
+
+    def corpus_version(self) -> tuple:
+        """
+        语料版本：本进程写入次数 + 词法索引的压缩次数和已读入的字节数
+
+        词法索引与向量库写入同一批文本块，只读跟随时（检索 worker）其偏移随写入进程的新写入增长，
+        压缩后偏移变小、压缩次数加一
+        """
+        if self.read_only:
+            self.lexical_index.refresh()
+        return (self._corpus_writes, self.lexical_index.generation, self.lexical_index.offset)
+
+    @classmethod
+    def _format_hit(cls, content: str, metadata: Dict[str, Any], distance: float) -> Dict[str, Any]:
+        """向量库命中 -> 检索结果字典"""
+        # ChromaDB 使用 L2 (欧几里得距离) 或余弦距离
+        # L2 距离范围可能很大，余弦距离范围是 [0, 2]
+        #
+        # 方案1：使用倒数归一化（适用于各种距离度量）
+        # similarity = 1 / (1 + distance)
+        #
+        # 方案2：余弦距离转相似度
+        # similarity = 1 - (distance / 2)
+        #
+        # 我们使用方案1，因为它对任何距离都有效
+        similarity = 1.0 / (1.0 + distance)  # 距离越小，相似度越高
+        metadata = metadata or {}
+        return {
+            "id": cls._chunk_key(metadata),
+            "content": content,
+            "metadata": metadata,
+            "similarity": float(similarity),
+            "distance": float(distance)  # 保留原始距离用于调试
+        }
+
+    async def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """批量查询向量化：一次 embed_documents 调用（与逐条 embed_query 结果一致）"""
+        if not queries:
+            return []
+        with span("query_embedding"):
+            return await run_in_stage("query_embedding", self.embeddings.embed_documents, list(queries))
+
+    async def chunk_vectors(self, results: List[Dict[str, Any]]) -> List[List[float]]:
+        """检索结果对应的文本块向量（从向量库读取，取不到的块重新向量化）"""
+        if not results:
+            return []
+        ids = [r["id"] for r in results]
+        stored = await run_in_stage("search", self.vector_store.get_embeddings, ids)
+        vectors = [stored.get(chunk_id) for chunk_id in ids]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = await self.embed_queries([results[i]["content"] for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        return vectors
+
+    def _query_many(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int,
+        where_filter: Optional[Dict[str, Any]]
+    ) -> List[List[Dict[str, Any]]]:
+        """一次多向量查询（同步，运行在 search 执行器中），按查询顺序返回结果"""
+        return [
+            [self._format_hit(document, metadata, distance) for _, document, metadata, distance in hits]
+            for hits in self.vector_store.query(query_embeddings, n_results, where_filter)
+        ]
+
+    async def _vector_query(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int,
+        where_filter: Optional[Dict[str, Any]]
+    ) -> List[List[Dict[str, Any]]]:
+        """在 search 执行器中执行一次多向量查询（计入 vector_search 阶段耗时）"""
+        with span("vector_search"):
+            return await run_in_stage("search", self._query_many, query_embeddings, n_results, where_filter)
+
+    async def search_many(
+        self,
+        query_embeddings: List[List[float]],
+        top_ks: List[int],
+        filters_list: List[Optional[Dict[str, Any]]],
+        distinct_files: Optional[List[Optional[int]]] = None,
+        truncate_groups: Optional[List[bool]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        批量向量检索，按输入顺序返回每个查询的结果
+
+        where 子句相同且没有剩余条件的查询合并为一次多向量查询（取组内最大 top_k 后按各自 top_k 截断）；
+        带剩余条件的查询仍走逐轮扩大候选的单查询路径，并发执行。
+        distinct_files[i] 指定时按文件截断；多向量查询凑不够文件的查询单独继续扩大候选。
+        truncate_groups[i] 为 False 时返回前 top_ks[i] 个候选（不够 distinct_files[i] 个文件时继续扩大），不按文件截断。
+        """
+        distinct_files = distinct_files or [None] * len(query_embeddings)
+        truncate_groups = truncate_groups or [True] * len(query_embeddings)
+        results: List[Optional[List[Dict[str, Any]]]] = [None] * len(query_embeddings)
+        groups: Dict[str, Dict[str, Any]] = {}
+        single = []
+        for i, filters in enumerate(filters_list):
+            where_filter, residual = build_where(filters)
+            if residual:
+                single.append(i)
+                continue
+            group_key = json.dumps(where_filter, sort_keys=True, ensure_ascii=False)
+            groups.setdefault(group_key, {"where": where_filter, "indexes": []})["indexes"].append(i)
+
+        def file_of(hit: Dict[str, Any]) -> str:
+            return hit["metadata"].get("file_id", "unknown")
+
+        async def run_group(group: Dict[str, Any]):
+            indexes = group["indexes"]
+            n_results = max(top_ks[i] for i in indexes)
+            hits = await self._vector_query([query_embeddings[i] for i in indexes], n_results, group["where"])
+            widen = []
+            for i, query_hits in zip(indexes, hits):
+                n_files = distinct_files[i]
+                if not n_files:
+                    results[i] = query_hits[:top_ks[i]]
+                elif not truncate_groups[i]:
+                    pool = query_hits[:top_ks[i]]
+                    if count_groups(pool, file_of) >= n_files:
+                        results[i] = pool
+                    elif len(query_hits) < n_results:
+                        results[i] = query_hits  # 候选已全部取出
+                    else:
+                        widen.append(i)
+                elif count_groups(query_hits, file_of) >= n_files or len(query_hits) < n_results:
+                    results[i] = truncate_to_groups(query_hits, n_files, file_of)
+                else:
+                    widen.append(i)
+
+            async def widen_one(i: int):
+                results[i] = await self._widening_search(
+                    query_embeddings[i], top_ks[i], group["where"], [], distinct_files[i],
+                    fetch_k=n_results * self.filter_widen_factor, truncate_groups=truncate_groups[i]
+                )
 
-            documents.append(Document(
-                page_content=chunk,
-                metadata=doc_metadata
-            ))
+            await asyncio.gather(*(widen_one(i) for i in widen))
 
-        # 添加到向量库
-        ids = [f"{file_id}_chunk_{i}" for i in range(len(documents))]
-        self.vector_store.add_documents(documents, ids=ids)
+        async def run_single(i: int):
+            results[i] = await self.search(
+                query="", top_k=top_ks[i], filters=filters_list[i],
+                query_embedding=query_embeddings[i], distinct_files=distinct_files[i],
+                truncate_groups=truncate_groups[i]
+            )
 
-        logger.info(f"✓ 文档已添加到向量库，共 {len(documents)} 个块")
-        return len(documents)
+        await asyncio.gather(
+            *(run_group(group) for group in groups.values()),
+            *(run_single(i) for i in single)
+        )
+        logger.info(f"✓ 批量向量检索: {len(query_embeddings)} 个查询，{len(groups)} 次多向量查询 + {len(single)} 次单查询")
+        return results
 
     async def search(
         self,
         query: str,
         top_k: int = 10,
-        file_type_filter: Optional[str] = None
+        file_type_filter: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        query_embedding: Optional[List[float]] = None,
+        distinct_files: Optional[int] = None,
+        truncate_groups: bool = True
     ) -> List[Dict[str, Any]]:
-        """向量检索"""
-        print(f"\n🔍 执行向量检索: {query[:50]}...")
+        """
+        向量检索
+
+        Args:
+            filters: 元数据过滤条件（见 metadata_filters），能下推的条件翻译为 where 子句下推到向量库；
+                     其余条件在 Python 中判断，候选数按 filter_widen_factor 逐轮扩大，直到凑满 top_k 或集合耗尽
+            query_embedding: 已计算好的查询向量（批量检索时传入，跳过向量化）
+            distinct_files: 文档级 top-k：候选数从 top_k 起逐轮扩大，直到命中 distinct_files 个不同文件
+                            （或候选耗尽 / 达到 grouped_max_candidates），返回这些文件的全部命中文本块
+            truncate_groups: 为 False 时 distinct_files 只决定是否扩大候选，返回全部候选不按文件截断
+                             （两阶段检索先重排整个候选池，再按文件截断）
+        """
+        log_request(f"🔍 执行向量检索: {query[:50]}...")
 
         # 构建过滤器
-        where_filter = {}
+        filters = dict(filters or {})
         if file_type_filter:
-            where_filter["file_type"] = file_type_filter
-
-        # 执行检索
-        if where_filter:
-            results = self.vector_store.similarity_search_with_score(
-                query,
-                k=top_k,
-                filter=where_filter
+            filters["file_type"] = file_type_filter
+        where_filter, residual = build_where(filters)
+        if filters:
+            logger.info(f"  过滤条件: where={where_filter}, 剩余条件={residual}")
+
+        # 执行检索（查询向量化与向量库查询分别在检索阶段的执行器中运行）
+        if query_embedding is None:
+            with span("query_embedding"):
+                query_embedding = await run_in_stage("query_embedding", self.embeddings.embed_query, query)
+        if residual or distinct_files:
+            formatted_results = await self._widening_search(
+                query_embedding, top_k, where_filter, residual, distinct_files, truncate_groups=truncate_groups
             )
         else:
-            results = self.vector_store.similarity_search_with_score(
-                query,
-                k=top_k
-            )
-
-        # 格式化结果
-        formatted_results = []
-        for doc, score in results:
-            # ChromaDB 使用 L2 (欧几里得距离) 或余弦距离
-            # L2 距离范围可能很大，余弦距离范围是 [0, 2]
-            #
-            # 方案1：使用倒数归一化（适用于各种距离度量）
-            # similarity = 1 / (1 + distance)
-            #
-            # 方案2：余弦距离转相似度
-            # similarity = 1 - (distance / 2)
-            #
-            # 我们使用方案1，因为它对任何距离都有效
-            similarity = 1.0 / (1.0 + score)  # 距离越小，相似度越高
-
-            formatted_results.append({
-                "content": doc.page_content,
-                "metadata": doc.metadata,
-                "similarity": float(similarity),
-                "distance": float(score)  # 保留原始距离用于调试
-            })
+            formatted_results = (await self._vector_query([query_embedding], top_k, where_filter))[0]
 
         logger.info(f"✓ 找到 {len(formatted_results)} 个相关结果")
 
@@ -298,6 +578,129 @@ class VectorStoreManager:
 
         return formatted_results
 
+    async def _widening_search(
+        self,
+        query_embedding: List[float],
+        top_k: int,
+        where_filter: Optional[Dict[str, Any]],
+        residual: List[tuple],
+        distinct_files: Optional[int] = None,
+        fetch_k: Optional[int] = None,
+        truncate_groups: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        逐轮扩大候选数的检索，返回满足剩余条件的检索结果
+
+        - 只有剩余条件时：凑满 top_k 个命中后截断
+        - 指定 distinct_files 时：凑满 distinct_files 个不同文件后按文件截断（见 truncate_to_groups）；
+          truncate_groups=False 时不截断，返回全部候选
+        每轮候选数乘以 filter_widen_factor，上限为集合大小与 grouped_max_candidates。
+        """
+        collection_size = await run_in_stage("search", self.vector_store.count)
+        max_k = min(collection_size, max(self.grouped_max_candidates, top_k))
+        if fetch_k is None:
+            fetch_k = top_k * self.filter_widen_factor if residual else top_k
+        fetch_k = min(fetch_k, max_k)
+
+        def file_of(hit: Dict[str, Any]) -> str:
+            return hit["metadata"].get("file_id", "unknown")
+
+        def enough(matched: List[Dict[str, Any]]) -> bool:
+            if distinct_files:
+                return count_groups(matched, file_of) >= distinct_files
+            return len(matched) >= top_k
+
+        rounds = 0
+        while True:
+            rounds += 1
+            candidates = (await self._vector_query([query_embedding], max(fetch_k, 1), where_filter))[0]
+            matched = [hit for hit in candidates if match_conditions(hit["metadata"], residual)]
+            # 凑够结果，或下推条件下的候选已全部取出，或达到候选上限
+            if enough(matched) or len(candidates) < fetch_k or fetch_k >= max_k:
+                break
+            fetch_k = min(fetch_k * self.filter_widen_factor, max_k)
+
+        if distinct_files:
+            if truncate_groups:
+                matched = truncate_to_groups(matched, distinct_files, file_of)
+            logger.info(f"  文档级检索: {rounds} 轮，候选 {len(candidates)} → "
+                        f"{count_groups(matched, file_of)} 个文件 / {len(matched)} 个文本块")
+            return matched
+
+        logger.info(f"  剩余条件过滤: {rounds} 轮，候选 {len(candidates)} → 命中 {len(matched)}")
+        return matched[:top_k]
+
+    async def hybrid_search(
+        self,
+        query: str,
+        top_k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        vector_results: Optional[List[Dict[str, Any]]] = None,
+        distinct_files: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        混合检索：BM25 词法检索与向量检索并发执行，再用 RRF 融合排序
+
+        融合后的 similarity 为归一化的 RRF 分数（两路都排第一时为 1.0），
+        原始向量相似度和 BM25 分数保留在 vector_similarity / lexical_score 中。
+        vector_results 为批量检索已取得的向量结果，传入时只执行词法检索。
+        distinct_files 指定时两路都按文件分组召回，融合结果覆盖排名最靠前的 distinct_files 个文件。
+        """
+        log_request(f"🔀 执行混合检索: {query[:50]}...")
+
+        # 词法检索在内存中打分，过滤条件直接在截断前应用
+        predicate = (lambda metadata: match_filters(metadata, filters)) if filters else None
+        group_key = "file_id" if distinct_files else None
+
+        async def lexical_search():
+            with span("lexical_search"):
+                return await run_in_stage(
+                    "search", self.lexical_index.search, query, distinct_files or top_k, predicate, group_key
+                )
+
+        if vector_results is None:
+            vector_results, lexical_results = await asyncio.gather(
+                self.search(query=query, top_k=top_k, filters=filters, distinct_files=distinct_files),
+                lexical_search()
+            )
+        else:
+            lexical_results = await lexical_search()
+
+        candidates = {}
+        for result in lexical_results:
+            candidates[result["id"]] = {
+                "id": result["id"],
+                "content": result["content"],
+                "metadata": result["metadata"],
+                "vector_similarity": None,
+                "lexical_score": float(result["score"])
+            }
+        for result in vector_results:
+            entry = candidates.setdefault(result["id"], {**result, "lexical_score": None})
+            entry["vector_similarity"] = result["similarity"]
+            entry["distance"] = result["distance"]
+
+        fused = reciprocal_rank_fusion(
+            [[r["id"] for r in vector_results], [r["id"] for r in lexical_results]],
+            k=self.rrf_k
+        )
+        max_score = 2.0 / (self.rrf_k + 1)
+
+        if distinct_files:
+            fused = truncate_to_groups(fused, distinct_files, lambda item: candidates[item[0]]["metadata"].get("file_id"))
+        else:
+            fused = fused[:top_k]
+
+        formatted_results = []
+        for chunk_key, score in fused:
+            entry = candidates[chunk_key]
+            entry["similarity"] = score / max_score
+            formatted_results.append(entry)
+
+        logger.info(f"✓ 混合检索完成: 向量 {len(vector_results)} + 词法 {len(lexical_results)} → 融合 {len(formatted_results)}")
+
+        return formatted_results
+
 
 # ============ 主服务类 ============
 
@@ -305,22 +708,45 @@ class MultimodalRAGService:
     """多模态 RAG 主服务"""
 
     def __init__(self):
-        """初始化服务"""
+        """
+        初始化服务（加载模型和向量库，耗时较长：服务启动时在预热任务中调用，见 warmup_service）
+
+        SERVICE_ROLE=search（多进程部署的检索 worker）只初始化检索和问答需要的组件：
+        不创建 render 进程池、PDF 解析、VLM 分析器和入库任务队列，索引只读打开
+        """
+        from simple_vlm_analyzer import SimpleVLMAnalyzer
+        from unified.unified_pdf_extraction_service import PDFExtractionService
+
+        self.role = service_role()
+        self.ingests = self.role != "search"
+
+        # render 进程池（forkserver 启动，子进程不继承本进程的模型内存和线程）
+        if self.ingests:
+            get_executor("render")
+
         # 初始化各个组件
-        self.pdf_service = PDFExtractionService()
-        self.vector_manager = VectorStoreManager()
+        if self.ingests:
+            with startup_state.phase("pdf_service"):
+                self.pdf_service = PDFExtractionService()
+        with startup_state.phase("vector_store"):
+            self.vector_manager = VectorStoreManager(read_only=not self.ingests)
 
         # VLM 配置（从环境变量读取）
         self.vlm_model_url = os.getenv("VLM_MODEL_URL", None)
         self.vlm_api_key = os.getenv("VLM_API_KEY", None)
         self.vlm_model_name = os.getenv("VLM_MODEL_NAME", "gpt-4o")
 
-        # 初始化 VLM 分析器
+        # VLM 响应缓存（重新入库时相同图片不再调用 VLM）
+        self.vlm_cache = VLMResponseCache.from_env()
+
+        # 初始化 VLM 分析器（图片压缩/编码投递到 render 进程池）
         self.vlm_analyzer = SimpleVLMAnalyzer(
             model_url=self.vlm_model_url,
             api_key=self.vlm_api_key,
-            model_name=self.vlm_model_name
-        )
+            model_name=self.vlm_model_name,
+            encode_executor=get_executor("render"),
+            response_cache=self.vlm_cache
+        ) if self.ingests else None
 
         # 文件存储目录
         self.upload_dir = Path("./uploads")
@@ -330,8 +756,84 @@ class MultimodalRAGService:
         self.preview_dir = Path("./previews")
         self.preview_dir.mkdir(exist_ok=True)
 
-        print("✓ 服务初始化完成")
-        print("="*60 + "\n")
+        # 单个上传文件大小上限
+        self.upload_max_bytes = int(float(os.getenv("UPLOAD_MAX_MB", "500")) * 1024 * 1024)
+
+        # 上传内容哈希索引（重复上传直接复用已有 fileId）
+        self.upload_hash_index = UploadHashIndex(
+            os.getenv("UPLOAD_HASH_INDEX", str(self.upload_dir / "hash_index.json"))
+        )
+
+        # fileId -> 原文件/缩略图索引（缩略图、预览请求直接查表）
+        self.file_index = FileIndex(
+            os.getenv("FILE_INDEX_PATH", str(self.upload_dir / "file_index.json"))
+        )
+        self.thumbnail_max_age = int(os.getenv("THUMBNAIL_CACHE_MAX_AGE", "86400"))
+        # 按 fileId 加锁生成缩略图；最后一个等待者退出时删除条目，字典大小只与正在生成的文件数有关
+        self._thumbnail_locks: Dict[str, asyncio.Lock] = {}
+        self._thumbnail_waiters: Dict[str, int] = {}
+
+        # 下载交给 nginx 发送时的 internal location 前缀（如 /protected-uploads/）
+        self.download_accel_prefix = os.getenv("DOWNLOAD_ACCEL_REDIRECT_PREFIX", "")
+
+        # 结构化事实库（精确/聚合问题直接查询，不走向量检索）
+        with startup_state.phase("facts_store"):
+            self.facts_store = FactsStore(
+                os.getenv("FACTS_DB_PATH", os.path.join(self.vector_manager.persist_directory, "facts.sqlite3"))
+            )
+            if len(self.facts_store) == 0 and self.ingests:
+                self._backfill_facts_store()
+
+        # PDF 图片页并发分析数
+        self.pdf_page_concurrency = int(os.getenv("PDF_PAGE_CONCURRENCY", "4"))
+
+        # 入库任务队列（worker 在应用启动时运行；检索 worker 不入库）
+        self.job_manager = IngestionJobManager(
+            self._plan_ingestion_stages, on_finished=self._on_ingestion_finished
+        ) if self.ingests else None
+
+        # 重排模型（two-stage 策略首次使用时加载）
+        self.rerank_candidates = int(os.getenv("RERANK_CANDIDATES", "50"))
+        # 批量搜索单次请求的查询数上限
+        self.search_batch_max = int(os.getenv("SEARCH_BATCH_MAX", "256"))
+        self._reranker = None
+        self._reranker_lock = asyncio.Lock()
+
+        # 智能问答语义缓存（相似问题 + 语料未变时复用回答，跳过检索和 LLM）
+        self.answer_cache = (
+            SemanticAnswerCache() if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true" else None
+        )
+
+        # LLM 上下文：从 CONTEXT_CANDIDATES 个候选块中按 MMR 选块、去除重叠，装入 CONTEXT_TOKEN_BUDGET
+        self.context_packer = ContextPacker()
+        self.context_candidates = int(os.getenv("CONTEXT_CANDIDATES", "10"))
+
+        logger.info(f"✓ 服务初始化完成（角色: {self.role}）")
+
+    def _backfill_facts_store(self):
+        """事实库为空时，从向量库已有文件的元数据回填"""
+        try:
+            existing = self.vector_manager.vector_store.get(where={"chunk_id": 0})
+        except Exception as e:
+            logger.warning(f"  ⚠️ 读取向量库失败，跳过事实库回填: {e}")
+            return
+
+        for metadata in existing.get("metadatas") or []:
+            extracted_info = {}
+            if "extracted_info_json" in metadata:
+                try:
+                    extracted_info = json.loads(metadata["extracted_info_json"])
+                except ValueError:
+                    pass
+            self.facts_store.upsert_document(
+                metadata.get("file_id"),
+                metadata.get("file_name", ""),
+                metadata.get("file_type"),
+                metadata.get("image_type"),
+                extracted_info
+            )
+        if existing.get("metadatas"):
+            logger.info(f"  已从向量库回填事实库: {len(existing['metadatas'])} 个文件")
 
     def _format_extracted_info_to_natural_language(self, info: Dict[str, Any]) -> str:
         """将结构化信息转换为自然语言"""
@@ -397,14 +899,14 @@ class MultimodalRAGService:
 
     async def _detect_image_type(
         self,
-        image_path: Path,
+        image_source: Union[Path, bytes],
         user_specified_type: Optional[str] = None
     ) -> str:
         """
         智能检测图片类型
 
         Args:
-            image_path: 图片路径
+            image_source: 图片路径，或内存中的图片字节（如 PDF 页面渲染结果）
             user_specified_type: 用户指定的类型（如果有）
 
         Returns:
@@ -418,7 +920,7 @@ class MultimodalRAGService:
         logger.info(f"🔍 智能检测图片类型...")
 
         # 基于文件扩展名的初步判断
-        file_ext = image_path.suffix.lower()
+        file_ext = image_source.suffix.lower() if isinstance(image_source, Path) else ""
         if file_ext in ['.dwg', '.dxf']:
             logger.info(f"  根据扩展名判断为: CAD")
             return ImageType.CAD
@@ -440,10 +942,17 @@ class MultimodalRAGService:
 
 **请直接返回类型名称（小写），不要有其他内容。**"""
 
-            # 使用较小的 token 限制快速判断
-            from PIL import Image
-            image = Image.open(image_path)
-            image_base64 = self.vlm_analyzer.image_to_base64(image, max_size=1000)
+            # 使用较小的 token 限制快速判断（图片在 render 进程池中加载和编码）
+            image_base64 = await self.vlm_analyzer.image_to_base64_async(image_source, max_size=1000)
+
+            # 查询响应缓存
+            cache_key = None
+            if self.vlm_cache is not None:
+                cache_key = self.vlm_cache.make_key(image_base64, detection_prompt, "detect", self.vlm_model_name, 1000)
+                cached = await run_in_stage("io", self.vlm_cache.get, cache_key)
+                if cached is not None:
+                    logger.info(f"  ✓ 智能识别结果（缓存）: {cached['answer']}")
+                    return cached['answer']
 
             # 调用 VLM API
             messages = [
@@ -464,19 +973,29 @@ class MultimodalRAGService:
                 }
             ]
 
-            response = await self.vlm_analyzer.openai_client.chat.completions.create(
-                model=self.vlm_model_name,
-                messages=messages,
-                max_tokens=50,
-                temperature=0.0
-            )
+            with span("vlm_detect"):
+                response = await get_gateway().chat(
+                    provider=self.vlm_analyzer.api_type,
+                    model_url=self.vlm_model_url,
+                    api_key=self.vlm_api_key,
+                    model=self.vlm_model_name,
+                    messages=messages,
+                    max_tokens=50,
+                    temperature=0.0
+                )
 
-            detected_type = response.choices[0].message.content.strip().lower()
+            detected_type = response.content.strip().lower()
 
             # 验证返回的类型
             valid_types = [ImageType.CAD, ImageType.FLOOR_PLAN, ImageType.ARCHITECTURE, ImageType.TECHNICAL_DOC]
             if detected_type in valid_types:
                 logger.info(f"  ✓ 智能识别结果: {detected_type}")
+                if cache_key is not None:
+                    await run_in_stage("io", self.vlm_cache.put, cache_key, {
+                        "answer": detected_type,
+                        "extracted_info": {},
+                        "token_usage": response.token_usage
+                    })
                 return detected_type
             else:
                 logger.warning(f"  ⚠️ 无法识别类型: {detected_type}，使用默认类型: architecture")
@@ -486,47 +1005,87 @@ class MultimodalRAGService:
             logger.warning(f"  ⚠️ 智能识别失败: {e}，使用默认类型: architecture")
             return ImageType.ARCHITECTURE
 
-    def _generate_pdf_thumbnail(self, pdf_path: Path, file_id: str) -> Path:
-        """生成PDF首页缩略图"""
-        import fitz
-        from PIL import Image
-        import io
-
+    async def _generate_thumbnails(self, source_path: Path, file_id: str) -> Optional[Dict[str, Any]]:
+        """生成多尺寸缩略图（在 render 进程池中渲染）并登记到文件索引"""
         try:
-            # 打开PDF
-            doc = fitz.open(str(pdf_path))
+            variants = await run_in_stage(
+                "render",
+                cpu_tasks.render_thumbnail_variants,
+                str(source_path),
+                str(self.preview_dir),
+                file_id,
+                THUMBNAIL_SIZES
+            )
+            self.file_index.put_variants(file_id, variants)
 
-            # 获取第一页
-            page = doc[0]
+            logger.info(f"✓ 缩略图已生成: {file_id} ({', '.join(variants)})")
+            return variants
 
-            # 渲染为图像（提高分辨率以获得更清晰的缩略图）
-            mat = fitz.Matrix(2.0, 2.0)  # 2倍缩放
-            pix = page.get_pixmap(matrix=mat)
+        except Exception as e:
+            logger.error(f"生成缩略图失败: {e}")
+            return None
 
-            # 转换为PIL Image
-            img_data = pix.tobytes("png")
-            img = Image.open(io.BytesIO(img_data))
+    async def _locate_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """
+        查询文件索引；索引中没有的旧文件探测一次扩展名并补登记
+        """
+        record = self.file_index.get(file_id)
+        if record and Path(record["path"]).exists():
+            return record
+
+        for ext in MIME_TYPES:
+            file_path = self.upload_dir / f"{file_id}{ext}"
+            if await run_in_stage("io", file_path.exists):
+                content_hash, size = await run_in_stage("io", hash_file, file_path)
+                self.file_index.put_original(file_id, str(file_path), content_hash, size)
+                return self.file_index.get(file_id)
+        return None
+
+    async def get_thumbnail_variant(self, file_id: str, variant: str) -> Optional[Dict[str, Any]]:
+        """
+        获取缩略图变体，正常情况下入库时已生成；旧文件首次请求时生成一次
 
-            # 创建缩略图（保持宽高比）
-            img.thumbnail((400, 400), Image.Resampling.LANCZOS)
+        Returns:
+            变体记录 {path, mime, etag, ...}；文件不存在时返回 None
 
-            # 保存缩略图
-            thumbnail_path = self.preview_dir / f"{file_id}_thumb.png"
-            img.save(thumbnail_path, "PNG", optimize=True)
+        Raises:
+            HTTPException: 文件类型不支持缩略图(501)或生成失败(500)
+        """
+        record = await self._locate_file(file_id)
+        if record is None:
+            return None
 
-            doc.close()
+        entry = record["variants"].get(variant)
+        if entry and Path(entry["path"]).exists():
+            return entry
 
-            logger.info(f"✓ PDF缩略图已生成: {thumbnail_path}")
-            return thumbnail_path
+        if Path(record["path"]).suffix.lower() not in ('.pdf', '.png', '.jpg', '.jpeg'):
+            raise HTTPException(status_code=501, detail="该文件类型暂不支持缩略图")
 
-        except Exception as e:
-            logger.error(f"生成PDF缩略图失败: {e}")
-            return None
+        # 同一文件的并发请求只生成一次
+        lock = self._thumbnail_locks.setdefault(file_id, asyncio.Lock())
+        self._thumbnail_waiters[file_id] = self._thumbnail_waiters.get(file_id, 0) + 1
+        try:
+            async with lock:
+                entry = self.file_index.get(file_id)["variants"].get(variant)
+                if not (entry and Path(entry["path"]).exists()):
+                    variants = await self._generate_thumbnails(Path(record["path"]), file_id)
+                    entry = (variants or {}).get(variant)
+        finally:
+            self._thumbnail_waiters[file_id] -= 1
+            if not self._thumbnail_waiters[file_id]:
+                del self._thumbnail_waiters[file_id]
+                del self._thumbnail_locks[file_id]
+
+        if entry is None:
+            raise HTTPException(status_code=500, detail="缩略图生成失败")
+        return entry
 
     async def _analyze_pdf_images(
         self,
         pdf_path: Path,
-        extraction_result: Dict[str, Any]
+        extraction_result: Dict[str, Any],
+        progress_callback: Optional[Callable[[float], None]] = None
     ) -> str:
         """
         分析PDF中的图片页面，使用VLM提取信息
@@ -534,72 +1093,60 @@ class MultimodalRAGService:
         Args:
             pdf_path: PDF文件路径
             extraction_result: PDF提取结果
+            progress_callback: 进度回调（已完成页数 / 图片页总数）
 
         Returns:
             图片分析的文本内容
         """
-        import fitz
-        from PIL import Image
-        import io
-
         logger.info("🖼️ 开始分析PDF中的图片页面...")
 
-        image_analysis_results = []
-
         try:
-            doc = fitz.open(str(pdf_path))
-
-            # 遍历每一页
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-
-                # 获取页面图片
-                image_list = page.get_images(full=True)
-
-                # 如果这一页有图片，或者这一页主要是图片（文本很少）
-                text_length = len(page.get_text().strip())
-
-                # 判断是否为图片页：有图片且文本少于100字符
-                if image_list and text_length < 100:
-                    logger.info(f"  发现图片页: 第 {page_num + 1} 页")
-
-                    # 渲染整页为图片
-                    mat = fitz.Matrix(2.0, 2.0)  # 2倍缩放
-                    pix = page.get_pixmap(matrix=mat)
-
-                    # 转换为PIL Image
-                    img_data = pix.tobytes("png")
-                    image = Image.open(io.BytesIO(img_data))
-
-                    # 智能检测图片类型
-                    # 先保存临时文件用于检测
-                    temp_path = self.upload_dir / f"temp_page_{page_num}.png"
-                    image.save(temp_path, "PNG")
-
-                    detected_type = await self._detect_image_type(temp_path)
-
-                    # 使用 VLM 分析
-                    analysis_result = await self.vlm_analyzer.analyze_image(
-                        image,
-                        question=f"这是PDF文档第{page_num + 1}页的内容，请详细描述这张图的所有信息。",
-                        image_type=detected_type
-                    )
-
-                    # 删除临时文件
-                    if temp_path.exists():
-                        temp_path.unlink()
-
-                    # 保存分析结果
-                    image_analysis_results.append({
-                        'page': page_num + 1,
-                        'type': detected_type,
-                        'analysis': analysis_result.answer,
-                        'structured_info': analysis_result.extracted_info
-                    })
-
-                    logger.info(f"  ✓ 第 {page_num + 1} 页分析完成 (类型: {detected_type})")
+            # 判断是否为图片页：有图片且文本少于100字符（在 render 进程池中扫描）
+            image_pages = await run_in_stage("render", cpu_tasks.find_pdf_image_pages, str(pdf_path), 100)
+            if image_pages:
+                logger.info(f"  发现图片页: {', '.join(str(p + 1) for p in image_pages)}")
+
+            # 每页独立流水线：渲染 → 类型检测 → VLM 分析，多页并发，
+            # 信号量同时限制 VLM 并发数和内存中的页面图片数量
+            semaphore = asyncio.Semaphore(self.pdf_page_concurrency)
+            completed_pages = 0
+
+            async def analyze_page(page_num: int) -> Optional[Dict[str, Any]]:
+                nonlocal completed_pages
+                async with semaphore:
+                    try:
+                        # 渲染整页为图片（2倍缩放），PNG 字节直接在内存中传递
+                        img_data = await run_in_stage("render", cpu_tasks.render_pdf_page, str(pdf_path), page_num, 2.0)
+
+                        # 智能检测图片类型
+                        detected_type = await self._detect_image_type(img_data)
+
+                        # 使用 VLM 分析
+                        with span("vlm"):
+                            analysis_result = await self.vlm_analyzer.analyze_image(
+                                img_data,
+                                question=f"这是PDF文档第{page_num + 1}页的内容，请详细描述这张图的所有信息。",
+                                image_type=detected_type
+                            )
+                    except Exception as e:
+                        logger.warning(f"  ⚠️ 第 {page_num + 1} 页分析失败: {e}")
+                        return None
+                    finally:
+                        completed_pages += 1
+                        if progress_callback:
+                            progress_callback(completed_pages / len(image_pages))
+
+                logger.info(f"  ✓ 第 {page_num + 1} 页分析完成 (类型: {detected_type})")
+                return {
+                    'page': page_num + 1,
+                    'type': detected_type,
+                    'analysis': analysis_result.answer,
+                    'structured_info': analysis_result.extracted_info
+                }
 
-            doc.close()
+            # gather 按输入顺序返回，结果天然按页码排列
+            page_results = await asyncio.gather(*(analyze_page(p) for p in image_pages))
+            image_analysis_results = [r for r in page_results if r is not None]
 
             # 格式化图片分析结果
             if image_analysis_results:
@@ -618,34 +1165,177 @@ class MultimodalRAGService:
                 return ""
 
         except Exception as e:
-            logger.error(f"❌ PDF图片分析失败: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error(f"❌ PDF图片分析失败: {e}", exc_info=True)
             return ""
 
+    async def _get_reranker(self):
+        """懒加载交叉编码器（模型加载放到线程中，不阻塞事件循环）"""
+        if self._reranker is None:
+            async with self._reranker_lock:
+                if self._reranker is None:
+                    from reranker import CrossEncoderReranker
+                    client = getattr(self.vector_manager.embeddings, "client", None)
+                    if self.vector_manager.model_server_socket and client is not None:
+                        # 多进程部署：重排模型也在共享模型进程中，本进程只保留分数缓存
+                        self._reranker = CrossEncoderReranker(predictor=client.rerank)
+                    else:
+                        self._reranker = await asyncio.to_thread(CrossEncoderReranker)
+        return self._reranker
+
+    def _vector_top_k(self, request: SearchRequest) -> int:
+        """
+        向量检索的初始召回数
+
+        召回按文件分组（distinct_files=topK），候选不足 topK 个文件时由向量库逐轮扩大，
+        不需要固定倍数的过量召回；两阶段检索召回 rerank_candidates 个候选，重排后再按文件截断
+        """
+        if request.strategy == RetrievalStrategy.TWO_STAGE:
+            return max(self.rerank_candidates, request.topK)
+        return request.topK
+
+    async def _retrieve_chunks(
+        self,
+        request: SearchRequest,
+        vector_hits: Optional[List[Dict[str, Any]]] = None
+    ) -> tuple[List[Dict[str, Any]], Optional[float]]:
+        """
+        按检索策略取回文本块
+
+        Args:
+            vector_hits: 批量检索已取得的向量结果（已按 topK 个文件分组召回；两阶段检索为未截断的候选池），
+                         为 None 时自行检索
+
+        Returns:
+            (文本块结果, 重排耗时秒数或 None)
+        """
+        rerank_time = None
+        top_k = self._vector_top_k(request)
+
+        if request.strategy == RetrievalStrategy.TWO_STAGE:
+            # 第一阶段：ANN 宽召回整个候选池（至少覆盖 topK 个文件，不按文件截断）；
+            # 第二阶段：交叉编码器精排后再按文件截断，向量排名靠后的文件可以被重排提上来
+            candidates = vector_hits
+            if candidates is None:
+                candidates = await self.vector_manager.search(
+                    query=request.query,
+                    top_k=top_k,
+                    filters=request.filters,
+                    distinct_files=request.topK,
+                    truncate_groups=False
+                )
+            rerank_start = time.time()
+            reranker = await self._get_reranker()
+            with span("rerank"):
+                reranked = await reranker.rerank(request.query, candidates)
+            vector_results = truncate_to_groups(
+                reranked, request.topK, lambda hit: hit["metadata"].get("file_id", "unknown")
+            )
+            rerank_time = time.time() - rerank_start
+            logger.info(f"  重排耗时: {rerank_time:.3f}秒 (候选 {len(candidates)} 个)")
+        elif request.strategy == RetrievalStrategy.HYBRID:
+            vector_results = await self.vector_manager.hybrid_search(
+                query=request.query,
+                top_k=top_k,
+                filters=request.filters,
+                vector_results=vector_hits,
+                distinct_files=request.topK
+            )
+        elif vector_hits is not None:
+            vector_results = vector_hits
+        else:
+            vector_results = await self.vector_manager.search(
+                query=request.query,
+                top_k=top_k,
+                filters=request.filters,
+                distinct_files=request.topK
+            )
+
+        return vector_results, rerank_time
+
     async def handle_search(
         self,
         request: SearchRequest
     ) -> SearchResponse:
         """处理搜索请求"""
-        import time
         start_time = time.time()
 
-        logger.info(f"\n{'='*60}")
-        logger.info(f"🔍 处理搜索请求")
-        logger.info(f"  查询: {request.query}")
-        logger.info(f"  模型: {request.model}")
-        logger.info(f"  策略: {request.strategy}")
-        logger.info(f"  TopK: {request.topK}")
-        logger.info(f"  最小相似度: {request.minSimilarity}")
-        logger.info(f"{'='*60}")
-
-        # 执行向量检索 - 检索更多chunk以便聚合
-        vector_results = await self.vector_manager.search(
-            query=request.query,
-            top_k=request.topK * 3  # 检索3倍数量，用于聚合后筛选
+        log_request("🔍 处理搜索请求", min_similarity=request.minSimilarity)
+
+        vector_results, rerank_time = await self._retrieve_chunks(request)
+        with span("aggregation"):
+            search_results = self._aggregate_search_results(request, vector_results)
+
+        query_time = time.time() - start_time
+
+        log_request(f"✓ 搜索完成，返回 {len(search_results)} 个文档", seconds=round(query_time, 2))
+
+        return SearchResponse(
+            results=search_results,
+            totalCount=len(search_results),
+            queryTime=round(query_time * 1000),  # 转换为毫秒
+            model=request.model,
+            strategy=request.strategy,
+            rerankTime=round(rerank_time * 1000) if rerank_time is not None else None
+        )
+
+    async def handle_search_batch(self, batch: SearchBatchRequest) -> SearchBatchResponse:
+        """
+        批量搜索：所有查询一次批量向量化，向量检索合并为多向量查询，
+        之后各查询的词法融合/重排/按文件聚合并发执行；结果按输入顺序返回。
+
+        每个查询的 queryTime = 共享阶段（向量化 + 向量检索）耗时 + 该查询自身后处理耗时
+        """
+        start_time = time.time()
+        requests = batch.queries
+        logger.info(f"\n🔍 处理批量搜索请求: {len(requests)} 个查询")
+
+        embeddings = await self.vector_manager.embed_queries([r.query for r in requests])
+        embedding_time = time.time() - start_time
+
+        search_start = time.time()
+        vector_hits = await self.vector_manager.search_many(
+            embeddings,
+            [self._vector_top_k(r) for r in requests],
+            [r.filters for r in requests],
+            [r.topK for r in requests],
+            [r.strategy != RetrievalStrategy.TWO_STAGE for r in requests]
+        )
+        vector_search_time = time.time() - search_start
+        shared_time = time.time() - start_time
+
+        async def finish(request: SearchRequest, hits: List[Dict[str, Any]]) -> SearchResponse:
+            own_start = time.time()
+            vector_results, rerank_time = await self._retrieve_chunks(request, vector_hits=hits)
+            with span("aggregation"):
+                search_results = self._aggregate_search_results(request, vector_results)
+            return SearchResponse(
+                results=search_results,
+                totalCount=len(search_results),
+                queryTime=round((shared_time + time.time() - own_start) * 1000),
+                model=request.model,
+                strategy=request.strategy,
+                rerankTime=round(rerank_time * 1000) if rerank_time is not None else None
+            )
+
+        responses = await asyncio.gather(*(finish(r, hits) for r, hits in zip(requests, vector_hits)))
+        total_time = time.time() - start_time
+
+        logger.info(f"✓ 批量搜索完成: {len(responses)} 个查询，"
+                    f"向量化 {embedding_time:.3f}秒，向量检索 {vector_search_time:.3f}秒，总计 {total_time:.2f}秒")
+
+        return SearchBatchResponse(
+            results=list(responses),
+            totalTime=round(total_time * 1000),
+            embeddingTime=round(embedding_time * 1000),
+            vectorSearchTime=round(vector_search_time * 1000)
         )
 
+    def _aggregate_search_results(
+        self,
+        request: SearchRequest,
+        vector_results: List[Dict[str, Any]]
+    ) -> List[SearchResult]:
+        """文本块结果按文件聚合、过滤、截断为 topK，并格式化为前端需要的格式"""
         # 【新增】按文件聚合结果
         file_results = {}  # {file_id: {metadata, chunks, max_similarity}}
 
@@ -762,227 +1452,399 @@ class MultimodalRAGService:
 
             search_results.append(search_result)
 
-        query_time = time.time() - start_time
-
-        print(f"\n✓ 搜索完成")
-        logger.info(f"  返回 {len(search_results)} 个文档")
-        logger.info(f"  耗时: {query_time:.2f}秒")
+        return search_results
 
-        return SearchResponse(
-            results=search_results,
-            totalCount=len(search_results),
-            queryTime=round(query_time * 1000),  # 转换为毫秒
-            model=request.model,
-            strategy=request.strategy
-        )
+    async def receive_upload(self, request: Request) -> StreamedUpload:
+        """把上传请求体流式写入临时文件（同时计算内容哈希和大小）"""
+        temp_path = self.upload_dir / f".{uuid.uuid4()}.part"
+        return await receive_upload(request, temp_path, self.upload_max_bytes)
 
     async def handle_upload(
         self,
-        file: UploadFile,
-        image_type: Optional[str] = None
+        upload: StreamedUpload,
+        image_type: Optional[str] = None,
+        wait: bool = False,
+        force: bool = False
     ) -> UploadResponse:
         """
-        处理文件上传
+        处理文件上传：保存文件并创建入库任务，立即返回任务ID
+
+        内容与已上传文件相同时直接返回已有 fileId，不再重复解析和索引
 
         Args:
-            file: 上传的文件
+            upload: 已流式写入临时文件的上传（见 receive_upload）
             image_type: 用户指定的图片类型（可选）
                        支持: cad, floor_plan, architecture, technical_doc
+            wait: 是否等待入库任务完成后再返回（兼容同步调用方）
+            force: 内容重复时仍重新处理（沿用已有 fileId，覆盖原有文本块）
         """
-        logger.info(f"\n{'='*60}")
-        logger.info(f"📤 处理文件上传: {file.filename}")
-        if image_type:
-            logger.info(f"   用户指定类型: {image_type}")
-        logger.info(f"{'='*60}")
-
-        try:
-            # 生成文件ID
-            file_id = str(uuid.uuid4())
-            file_extension = Path(file.filename).suffix.lower()
-
-            # 保存上传的文件
-            file_path = self.upload_dir / f"{file_id}{file_extension}"
-            content = await file.read()
-            with open(file_path, 'wb') as f:
-                f.write(content)
-
-            logger.info(f"✓ 文件已保存: {file_path}")
-
-            detected_image_type = None  # 记录检测到的图片类型
-
-            # 根据文件类型处理
-            if file_extension == '.pdf':
-                # PDF 文件：使用快速模式提取
-                extraction_result = await self.pdf_service.extract_fast(
-                    str(file_path),
-                    original_filename=file.filename
-                )
-
-                content_text = extraction_result["markdown"]
-                file_type = "PDF"
-
-                # 提取页面信息
-                page_count = extraction_result["metadata"]["total_pages"]
-
-                # 生成PDF首页缩略图
-                self._generate_pdf_thumbnail(file_path, file_id)
+        log_request(f"📤 处理文件上传: {upload.filename}", image_type=image_type)
 
-                # 【新增】分析PDF中的图片页面
-                pdf_image_analysis = await self._analyze_pdf_images(file_path, extraction_result)
-                if pdf_image_analysis:
-                    content_text += "\n\n" + pdf_image_analysis
-                    logger.info("✓ PDF图片页面已整合到内容中")
+        temp_path = upload.temp_path
+        content_hash = upload.content_hash
+        file_size = upload.size
 
-            elif file_extension in ['.png', '.jpg', '.jpeg', '.dwg', '.dxf']:
-                # 【新增】智能检测图片类型
-                detected_image_type = await self._detect_image_type(file_path, image_type)
-
-                # 根据检测的类型生成合适的问题
-                question_map = {
-                    ImageType.CAD: "请详细描述这张CAD图纸的内容，包括所有可见的技术信息、尺寸标注、零部件结构等。",
-                    ImageType.FLOOR_PLAN: "请详细描述这张平面布置图，包括房间布局、尺寸、家具摆放、动线等信息。",
-                    ImageType.ARCHITECTURE: "请详细描述这张架构图/流程图，包括所有组件、模块、关系和流程。",
-                    ImageType.TECHNICAL_DOC: "请详细描述这份技术文档，包括所有可见的参数、表格数据、工艺信息等。"
-                }
-
-                question = question_map.get(detected_image_type, "请详细描述这张图的所有内容。")
+        try:
+            file_extension = Path(upload.filename).suffix.lower()
 
-                # 图像/CAD 文件：使用 VLM 分析
-                analysis_result = await self.vlm_analyzer.analyze_image(
-                    str(file_path),
-                    question=question,
-                    image_type=detected_image_type
-                )
+            if file_extension not in ['.pdf', '.png', '.jpg', '.jpeg', '.dwg', '.dxf']:
+                raise HTTPException(status_code=400, detail=f"不支持的文件类型: {file_extension}")
 
-                # 【优化】将结构化信息转换为自然语言
-                natural_language_info = self._format_extracted_info_to_natural_language(
-                    analysis_result.extracted_info
+            # 从查询哈希索引到登记新任务之间没有 await，并发的相同上传不会重复处理
+            existing = self.upload_hash_index.get(content_hash)
+            existing_job = self.job_manager.get(existing["jobId"]) if existing and existing.get("jobId") else None
+            # 任务记录可能已过保留期被清理，此时以哈希索引中的失败标记为准
+            failed = existing_job.status == JobStatus.FAILED if existing_job else bool(existing and existing.get("failed"))
+            if existing and not force and not failed:
+                await run_in_stage("io", temp_path.unlink, True)
+                logger.info(f"♻️ 内容重复，复用已有文件: {existing['fileId']} ({existing['fileName']})")
+                return await self._duplicate_upload_response(upload.filename, existing, existing_job, wait)
+
+            # 强制重新处理或上次处理失败时沿用原 fileId，入库时覆盖原有文本块
+            file_id = existing["fileId"] if existing else str(uuid.uuid4())
+
+            # 同一文件的入库任务仍在排队或运行时不重新处理：两条流水线会并发写入相同的文本块 id
+            active_job = self.job_manager.active_job(file_id) if existing else None
+            if active_job is not None:
+                await run_in_stage("io", temp_path.unlink, True)
+                logger.warning(f"⚠️ 文件 {file_id} 的入库任务 {active_job.job_id} 尚未完成，拒绝重新处理")
+                return UploadResponse(
+                    success=False,
+                    fileId=file_id,
+                    fileName=upload.filename,
+                    message=f"该文件正在处理中（任务 {active_job.job_id}），请等待完成后再重新处理",
+                    jobId=active_job.job_id
                 )
-                content_text = f"{analysis_result.answer}\n\n{natural_language_info}"
 
-                # 【新增】根据检测类型设置文件类型
-                file_type_map = {
-                    ImageType.CAD: "CAD图纸",
-                    ImageType.FLOOR_PLAN: "平面布置图",
-                    ImageType.ARCHITECTURE: "架构图",
-                    ImageType.TECHNICAL_DOC: "技术文档"
-                }
-                file_type = file_type_map.get(detected_image_type, "图片")
-                page_count = 1
+            # 保存上传的文件
+            file_path = self.upload_dir / f"{file_id}{file_extension}"
+            os.replace(temp_path, file_path)
 
-            else:
-                raise HTTPException(status_code=400, detail=f"不支持的文件类型: {file_extension}")
+            self.file_index.put_original(file_id, str(file_path), content_hash, file_size, upload.filename)
 
-            # 添加到向量库
-            metadata = {
-                "file_path": str(file_path),
-                "file_extension": file_extension,
-                "page_count": page_count,
-                "version": "v1.0"
-            }
+            logger.info(f"✓ 文件已保存: {file_path} ({file_size} 字节, sha256={content_hash[:12]})")
 
-            # 如果有检测到的图片类型，添加到元数据
-            if detected_image_type:
-                metadata["image_type"] = detected_image_type
-
-            # 【新增】如果有分析结果，存储结构化信息到元数据
-            if 'analysis_result' in locals():
-                # ⚠️ ChromaDB 不支持嵌套字典，需要序列化
-                # 将复杂的 extracted_info 转为 JSON 字符串
-                metadata["extracted_info_json"] = json.dumps(analysis_result.extracted_info, ensure_ascii=False)
-
-                # 【新增】提取关键字段到元数据顶层（便于过滤）
-                extracted_info = analysis_result.extracted_info
-                if "rooms" in extracted_info:
-                    metadata["room_count"] = len(extracted_info["rooms"])
-                    # 统计卧室数量
-                    bedrooms = [r for r in extracted_info["rooms"] if "卧" in r.get("name", "")]
-                    metadata["bedroom_count"] = len(bedrooms)
-
-                if "total_dimensions" in extracted_info:
-                    total_dims = extracted_info["total_dimensions"]
-                    metadata["total_area"] = float(total_dims.get("total_area", 0))
-                    metadata["total_length"] = float(total_dims.get("length", 0))
-                    metadata["total_width"] = float(total_dims.get("width", 0))
-
-            chunk_count = await self.vector_manager.add_document(
+            # 创建入库任务
+            job = self.job_manager.submit(
                 file_id=file_id,
-                file_name=file.filename,
-                file_type=file_type,
-                content=content_text,
-                metadata=metadata
+                file_name=upload.filename,
+                file_path=str(file_path),
+                file_extension=file_extension,
+                image_type=image_type
             )
+            self.upload_hash_index.put(content_hash, file_id, upload.filename, file_extension, job.job_id, file_size)
+
+            if not wait:
+                return UploadResponse(
+                    success=True,
+                    fileId=file_id,
+                    fileName=upload.filename,
+                    message="文件已保存，已加入处理队列",
+                    jobId=job.job_id
+                )
 
-            print(f"\n✓ 文件上传并索引完成")
-            logger.info(f"  文件ID: {file_id}")
-            logger.info(f"  文件类型: {file_type}")
-            if detected_image_type:
-                logger.info(f"  检测类型: {detected_image_type}")
-            logger.info(f"  分块数: {chunk_count}")
+            job = await self.job_manager.wait(job.job_id)
+            if job.status != JobStatus.COMPLETED:
+                raise RuntimeError(job.error or "入库任务失败")
 
             return UploadResponse(
                 success=True,
                 fileId=file_id,
-                fileName=file.filename,
-                message=f"文件上传成功，已分割为 {chunk_count} 个文本块并建立索引",
-                detectedImageType=detected_image_type
+                fileName=upload.filename,
+                message=f"文件上传成功，已分割为 {job.result['chunk_count']} 个文本块并建立索引",
+                detectedImageType=job.result.get("detected_image_type"),
+                jobId=job.job_id
             )
 
         except Exception as e:
-            logger.error(f"❌ 文件上传失败: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error(f"❌ 文件上传失败: {e}", exc_info=True)
+            temp_path.unlink(missing_ok=True)
 
             return UploadResponse(
                 success=False,
                 fileId="",
-                fileName=file.filename,
+                fileName=upload.filename,
                 message=f"文件上传失败: {str(e)}"
             )
 
-    async def handle_follow_up_question(
+    async def _duplicate_upload_response(
         self,
-        request: FollowUpQuestionRequest
-    ) -> FollowUpQuestionResponse:
-        """处理追问"""
-
-        # 检索相关文档片段
-        results = await self.vector_manager.search(
-            query=request.question,
-            top_k=3
+        file_name: str,
+        existing: Dict[str, Any],
+        existing_job: Optional[IngestionJob],
+        wait: bool
+    ) -> UploadResponse:
+        """重复上传：返回已有文件的 fileId 与入库任务"""
+        if existing_job and wait:
+            existing_job = await self.job_manager.wait(existing_job.job_id)
+            if existing_job.status != JobStatus.COMPLETED:
+                raise RuntimeError(existing_job.error or "入库任务失败")
+
+        if existing_job and existing_job.status == JobStatus.COMPLETED and existing_job.result:
+            message = f"文件内容已存在，复用已有索引（{existing_job.result['chunk_count']} 个文本块）"
+        elif existing_job and not existing_job.finished:
+            message = "文件内容已存在，正在处理中"
+        else:
+            message = "文件内容已存在，复用已有索引"
+
+        return UploadResponse(
+            success=True,
+            fileId=existing["fileId"],
+            fileName=file_name,
+            message=message,
+            detectedImageType=(existing_job.result or {}).get("detected_image_type") if existing_job else None,
+            jobId=existing.get("jobId"),
+            duplicate=True
         )
 
-        # 过滤出指定文档的结果
-        doc_results = [r for r in results if r["metadata"].get("file_id") == request.documentId]
+    def _on_ingestion_finished(self, job: IngestionJob):
+        """入库任务失败时标记哈希索引记录，之后的重复上传会重新处理"""
+        if job.status == JobStatus.FAILED:
+            self.upload_hash_index.mark_failed(job.job_id)
+
+    def _plan_ingestion_stages(self, job: IngestionJob) -> List[tuple]:
+        """根据文件类型返回入库任务的有序阶段"""
+        if job.file_extension == '.pdf':
+            return [
+                ("extract", self._stage_extract_pdf),
+                ("thumbnail", self._stage_thumbnail),
+                ("image_analysis", self._stage_analyze_pdf_images),
+                ("index", self._stage_index),
+            ]
+        # 缩略图在索引前生成，文件出现在检索结果中时缩略图已就绪
+        thumbnail_stages = [("thumbnail", self._stage_thumbnail)] if job.file_extension in ('.png', '.jpg', '.jpeg') else []
+        return thumbnail_stages + [
+            ("detect", self._stage_detect_image_type),
+            ("analyze", self._stage_analyze_image),
+            ("index", self._stage_index),
+        ]
 
-        if not doc_results:
-            # 如果没有找到指定文档，使用所有结果
-            doc_results = results
+    async def _stage_extract_pdf(self, job: IngestionJob, state: Dict[str, Any], progress) -> Dict[str, Any]:
+        """PDF 文件：使用快速模式提取（在 render 进程池中运行）"""
+        with span("pdf_extraction"):
+            extraction_result = await run_in_stage(
+                "render",
+                cpu_tasks.extract_pdf_fast,
+                job.file_path,
+                job.file_name
+            )
+        return {
+            "content_text": extraction_result["markdown"],
+            "file_type": "PDF",
+            "page_count": extraction_result["metadata"]["total_pages"]
+        }
+
+    async def _stage_thumbnail(self, job: IngestionJob, state: Dict[str, Any], progress) -> Dict[str, Any]:
+        """生成多尺寸缩略图（失败不影响入库，请求时会再尝试生成）"""
+        await self._generate_thumbnails(Path(job.file_path), job.file_id)
+        return {}
+
+    async def _stage_analyze_pdf_images(self, job: IngestionJob, state: Dict[str, Any], progress) -> Dict[str, Any]:
+        """分析PDF中的图片页面"""
+        pdf_image_analysis = await self._analyze_pdf_images(
+            Path(job.file_path),
+            {},
+            progress_callback=progress
+        )
+        if pdf_image_analysis:
+            logger.info("✓ PDF图片页面已整合到内容中")
+            return {"content_text": state["content_text"] + "\n\n" + pdf_image_analysis}
+        return {}
+
+    async def _stage_detect_image_type(self, job: IngestionJob, state: Dict[str, Any], progress) -> Dict[str, Any]:
+        """智能检测图片类型"""
+        detected_image_type = await self._detect_image_type(Path(job.file_path), job.image_type)
+        return {"detected_image_type": detected_image_type}
+
+    async def _stage_analyze_image(self, job: IngestionJob, state: Dict[str, Any], progress) -> Dict[str, Any]:
+        """图像/CAD 文件：使用 VLM 分析"""
+        detected_image_type = state["detected_image_type"]
+
+        # 根据检测的类型生成合适的问题
+        question_map = {
+            ImageType.CAD: "请详细描述这张CAD图纸的内容，包括所有可见的技术信息、尺寸标注、零部件结构等。",
+            ImageType.FLOOR_PLAN: "请详细描述这张平面布置图，包括房间布局、尺寸、家具摆放、动线等信息。",
+            ImageType.ARCHITECTURE: "请详细描述这张架构图/流程图，包括所有组件、模块、关系和流程。",
+            ImageType.TECHNICAL_DOC: "请详细描述这份技术文档，包括所有可见的参数、表格数据、工艺信息等。"
+        }
+
+        question = question_map.get(detected_image_type, "请详细描述这张图的所有内容。")
+
+        with span("vlm"):
+            analysis_result = await self.vlm_analyzer.analyze_image(
+                job.file_path,
+                question=question,
+                image_type=detected_image_type
+            )
 
-        # 构建上下文
-        context = "\n\n".join([r["content"] for r in doc_results[:3]])
+        # 【优化】将结构化信息转换为自然语言
+        natural_language_info = self._format_extracted_info_to_natural_language(
+            analysis_result.extracted_info
+        )
 
-        # 使用 LLM 生成回答
-        try:
-            from langchain_openai import ChatOpenAI
+        # 【新增】根据检测类型设置文件类型
+        file_type_map = {
+            ImageType.CAD: "CAD图纸",
+            ImageType.FLOOR_PLAN: "平面布置图",
+            ImageType.ARCHITECTURE: "架构图",
+            ImageType.TECHNICAL_DOC: "技术文档"
+        }
+
+        return {
+            "content_text": f"{analysis_result.answer}\n\n{natural_language_info}",
+            "file_type": file_type_map.get(detected_image_type, "图片"),
+            "page_count": 1,
+            "extracted_info": analysis_result.extracted_info
+        }
+
+    async def _stage_index(self, job: IngestionJob, state: Dict[str, Any], progress) -> Dict[str, Any]:
+        """添加到向量库"""
+        metadata = {
+            "file_path": job.file_path,
+            "file_extension": job.file_extension,
+            "page_count": state["page_count"],
+            "version": "v1.0"
+        }
+
+        # 如果有检测到的图片类型，添加到元数据
+        detected_image_type = state.get("detected_image_type")
+        if detected_image_type:
+            metadata["image_type"] = detected_image_type
+
+        # 【新增】如果有分析结果，存储结构化信息到元数据
+        if "extracted_info" in state:
+            # ⚠️ ChromaDB 不支持嵌套字典，需要序列化
+            # 将复杂的 extracted_info 转为 JSON 字符串
+            extracted_info = state["extracted_info"]
+            metadata["extracted_info_json"] = json.dumps(extracted_info, ensure_ascii=False)
+
+            # 【新增】提取关键字段到元数据顶层（便于过滤）
+            if "rooms" in extracted_info:
+                metadata["room_count"] = len(extracted_info["rooms"])
+                # 统计卧室数量
+                bedrooms = [r for r in extracted_info["rooms"] if "卧" in r.get("name", "")]
+                metadata["bedroom_count"] = len(bedrooms)
 
-            llm = ChatOpenAI(
-                model_name=self.vlm_model_name,
-                api_key=self.vlm_api_key,
-                base_url=self.vlm_model_url,
-                temperature=0.3
+            if "total_dimensions" in extracted_info:
+                total_dims = extracted_info["total_dimensions"]
+                metadata["total_area"] = float(total_dims.get("total_area", 0))
+                metadata["total_length"] = float(total_dims.get("length", 0))
+                metadata["total_width"] = float(total_dims.get("width", 0))
+
+        chunk_count = await self.vector_manager.add_document(
+            file_id=job.file_id,
+            file_name=job.file_name,
+            file_type=state["file_type"],
+            content=state["content_text"],
+            metadata=metadata
+        )
+        with span("index_write"):
+            await run_in_stage(
+                "index_write",
+                self.facts_store.upsert_document,
+                job.file_id,
+                job.file_name,
+                state["file_type"],
+                detected_image_type,
+                state.get("extracted_info")
             )
+        self.vector_manager.bump_corpus_version()
+
+        logger.info(f"✓ 文件上传并索引完成")
+        logger.info(f"  文件ID: {job.file_id}")
+        logger.info(f"  文件类型: {state['file_type']}")
+        if detected_image_type:
+            logger.info(f"  检测类型: {detected_image_type}")
+        logger.info(f"  分块数: {chunk_count}")
+
+        return {
+            "result": {
+                "file_id": job.file_id,
+                "chunk_count": chunk_count,
+                "detected_image_type": detected_image_type
+            }
+        }
 
-            prompt = f"""基于以下文档内容回答问题：
+    def _create_llm(self, streaming: bool = False) -> "ChatOpenAI":
+        """创建问答使用的 LLM 客户端（底层连接由模型网关复用，不会每次请求重新握手）"""
+        from langchain_openai import ChatOpenAI
 
-文档内容：
-{context}
+        gateway = get_gateway()
+        base_url = openai_base_url(self.vlm_model_url)
+        return ChatOpenAI(
+            model_name=self.vlm_model_name,
+            api_key=self.vlm_api_key,
+            base_url=base_url,
+            temperature=0.3,
+            streaming=streaming,
+            client=gateway.sync_openai_client(base_url, self.vlm_api_key).chat.completions,
+            async_client=gateway.chat_completions(base_url, self.vlm_api_key)
+        )
 
-问题：{request.question}
+    async def _stream_llm_answer(self, prompt: str, token_usage: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        流式生成回答，逐个产出模型输出的文本片段
 
-请给出准确、详细的回答，并指出回答依据的内容来自哪些部分。"""
+        流式响应不返回用量统计：输出 token 数按片段数计（每个片段约为一个 token），输入 token 数未知
+        """
+        llm = self._create_llm(streaming=True)
+        token_usage.update({"prompt_tokens": None, "completion_tokens": 0, "estimated": True})
 
-            response = await llm.ainvoke(prompt)
+        with span("llm"):
+            async for chunk in llm.astream(prompt):
+                if chunk.content:
+                    token_usage["completion_tokens"] += 1
+                    yield chunk.content
+
+    async def _prepare_follow_up(self, request: FollowUpQuestionRequest) -> tuple[List[Dict[str, Any]], str]:
+        """检索追问相关的文档片段并构建提示词"""
+
+        # 检索指定文档的候选片段（file_id 条件下推到向量库）
+        question_embedding = (await self.vector_manager.embed_queries([request.question]))[0]
+        candidates = await self.vector_manager.search(
+            query=request.question,
+            top_k=self.context_candidates,
+            filters={"file_id": request.documentId},
+            query_embedding=question_embedding
+        )
+
+        if not candidates:
+            # 如果没有找到指定文档，使用所有结果
+            candidates = await self.vector_manager.search(
+                query=request.question,
+                top_k=self.context_candidates,
+                query_embedding=question_embedding
+            )
+
+        # 构建上下文：MMR 选块、去除相邻块的重叠，按 token 预算装箱（引用编号对应片段顺序）
+        packed = await self._pack_context(question_embedding, candidates, lambda result: "")
+        doc_results = [chunk.result for chunk in packed]
+        context = "\n\n".join(chunk.text for chunk in packed)
+
+        prompt = f"""基于以下文档内容回答问题：
+
+文档内容：
+{context}
+
+问题：{request.question}
+
+请给出准确、详细的回答，并指出回答依据的内容来自哪些部分。"""
+
+        return doc_results, prompt
+
+    async def handle_follow_up_question(
+        self,
+        request: FollowUpQuestionRequest
+    ) -> FollowUpQuestionResponse:
+        """处理追问"""
+
+        doc_results, prompt = await self._prepare_follow_up(request)
+
+        # 使用 LLM 生成回答
+        try:
+            llm = self._create_llm()
+            with span("llm"):
+                response = await llm.ainvoke(prompt)
             answer = response.content
 
             # 提取引用
@@ -1004,6 +1866,54 @@ class MultimodalRAGService:
                 confidence=0.0
             )
 
+    async def stream_follow_up_question(
+        self,
+        request: FollowUpQuestionRequest
+    ) -> AsyncIterator[tuple[str, Dict[str, Any]]]:
+        """
+        流式追问：先返回引用的文档片段，再逐段返回回答，最后返回置信度和 token 用量
+
+        Yields:
+            (事件名, 数据)，事件名为 sources / token / error / done
+        """
+        doc_results, prompt = await self._prepare_follow_up(request)
+        citations = [i + 1 for i in range(len(doc_results))]
+
+        yield "sources", {
+            "citations": citations,
+            "sources": self._format_sources(doc_results)
+        }
+
+        token_usage: Dict[str, Any] = {}
+        try:
+            async for text in self._stream_llm_answer(prompt, token_usage):
+                yield "token", {"text": text}
+            confidence = 0.85
+        except Exception as e:
+            logger.error(f"❌ 回答生成失败: {e}")
+            if token_usage.get("completion_tokens"):
+                yield "error", {"message": str(e)}
+            else:
+                yield "token", {"text": "抱歉，无法生成回答。"}
+                citations = []
+            confidence = 0.0
+
+        logger.info(f"✓ 回答生成完成（流式）")
+        yield "done", {
+            "citations": citations,
+            "confidence": confidence,
+            "token_usage": token_usage or None
+        }
+
+    def _format_sources(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """检索结果 -> 问答来源信息"""
+        return [{
+            "file_id": r["metadata"].get("file_id"),
+            "file_name": r["metadata"].get("file_name"),
+            "file_type": r["metadata"].get("file_type"),
+            "similarity": r["similarity"]
+        } for r in results]
+
     def _extract_structured_data(self, metadata: Dict[str, Any]) -> List[Dict[str, str]]:
         """从元数据提取结构化数据"""
         structured_data = []
@@ -1040,38 +1950,137 @@ class MultimodalRAGService:
         2. 过滤查询：先过滤再检索（如："找3个卧室的户型"）
         3. 一般查询：向量检索 + LLM生成答案
         """
-        logger.info(f"\n{'='*60}")
-        logger.info(f"🤖 智能问答")
-        logger.info(f"  问题: {request.question}")
-        logger.info(f"{'='*60}")
+        log_request("🤖 智能问答", question=request.question)
+
+        # 0. 语义缓存：相似问题的回答（语料版本在检索前取得，生成期间语料变化时不写入缓存）
+        question_embedding = None
+        if self.answer_cache is not None:
+            corpus_version = await run_in_stage("search", self.vector_manager.corpus_version)
+            scope = question_scope(request.question, request.top_k, request.filters)
+            question_embedding = (await self.vector_manager.embed_queries([request.question]))[0]
+            cached = self.answer_cache.lookup(question_embedding, corpus_version, scope)
+            if cached is not None:
+                response, similarity = cached
+                log_request("✓ 命中语义缓存", similarity=round(similarity, 4))
+                return response.model_copy(update={"cache": self._answer_cache_info(True, similarity)})
 
         # 1. 分类问题类型
         query_type = self._classify_question(request.question)
         logger.info(f"  问题类型: {query_type}")
 
-        # 2. 根据问题类型处理
+        # 2. 根据问题类型处理（已计算的问题向量直接用于检索）
         if query_type == "exact_query":
             # 精确查询：从元数据直接提取
-            answer, sources, confidence = await self._handle_exact_query(request.question, request.top_k)
+            answer, sources, confidence = await self._handle_exact_query(
+                request.question, request.top_k, request.filters, query_embedding=question_embedding
+            )
 
         elif query_type == "filter_query":
             # 过滤查询：智能过滤 + 检索
-            answer, sources, confidence = await self._handle_filter_query(request.question, request.top_k)
+            answer, sources, confidence = await self._handle_filter_query(
+                request.question, request.top_k, request.filters, query_embedding=question_embedding
+            )
 
         else:
             # 一般查询：向量检索 + LLM
-            answer, sources, confidence = await self._handle_general_query(request.question, request.top_k)
+            answer, sources, confidence = await self._handle_general_query(
+                request.question, request.top_k, request.filters, query_embedding=question_embedding
+            )
 
         logger.info(f"✓ 答案已生成")
         logger.info(f"  置信度: {confidence:.2f}")
         logger.info(f"  来源数: {len(sources)}")
 
-        return IntelligentQAResponse(
+        response = IntelligentQAResponse(
             answer=answer,
             sources=sources,
             confidence=confidence,
             query_type=query_type
         )
+        if self.answer_cache is None:
+            return response
+
+        # 未检索到内容、LLM 调用失败退回原文时不缓存
+        if confidence > 0 and not answer.startswith(self.FALLBACK_ANSWER_PREFIX):
+            self.answer_cache.put(question_embedding, corpus_version, scope, response)
+        return response.model_copy(update={"cache": self._answer_cache_info(False)})
+
+    def _answer_cache_info(self, hit: bool, similarity: Optional[float] = None) -> Dict[str, Any]:
+        """响应中的语义缓存信息"""
+        stats = self.answer_cache.stats()
+        return {
+            "hit": hit,
+            "similarity": round(similarity, 4) if similarity is not None else None,
+            "hits": stats["hits"],
+            "misses": stats["misses"],
+        }
+
+    async def stream_intelligent_qa(
+        self,
+        request: IntelligentQARequest
+    ) -> AsyncIterator[tuple[str, Dict[str, Any]]]:
+        """
+        流式智能问答：检索完成后立即返回来源，一般查询的答案随 LLM 生成逐段返回，
+        精确查询和过滤查询不调用 LLM，答案作为单个片段返回
+
+        Yields:
+            (事件名, 数据)，事件名为 sources / token / error / done
+        """
+        log_request("🤖 智能问答（流式）", question=request.question)
+
+        query_type = self._classify_question(request.question)
+        logger.info(f"  问题类型: {query_type}")
+
+        if query_type != "general_query":
+            if query_type == "exact_query":
+                answer, sources, confidence = await self._handle_exact_query(request.question, request.top_k, request.filters)
+            else:
+                answer, sources, confidence = await self._handle_filter_query(request.question, request.top_k, request.filters)
+
+            yield "sources", {"query_type": query_type, "sources": sources}
+            yield "token", {"text": answer}
+            yield "done", {"query_type": query_type, "confidence": confidence, "token_usage": None}
+            return
+
+        # 一般查询：向量检索 + LLM 流式生成
+        question_embedding = (await self.vector_manager.embed_queries([request.question]))[0]
+        candidates = await self.vector_manager.search(
+            query=request.question,
+            top_k=max(request.top_k, self.context_candidates),
+            filters=request.filters,
+            query_embedding=question_embedding
+        )
+        packed = await self._pack_general_context(question_embedding, candidates, request.top_k)
+        vector_results = [chunk.result for chunk in packed]
+        yield "sources", {"query_type": query_type, "sources": self._format_sources(vector_results)}
+
+        if not vector_results:
+            yield "token", {"text": "抱歉，没有找到相关信息。"}
+            yield "done", {"query_type": query_type, "confidence": 0.0, "token_usage": None}
+            return
+
+        token_usage: Dict[str, Any] = {}
+        if self.vlm_api_key:
+            prompt = self._build_general_prompt(request.question, packed)
+            try:
+                async for text in self._stream_llm_answer(prompt, token_usage):
+                    yield "token", {"text": text}
+                yield "token", {"text": self._format_source_list(vector_results)}
+            except Exception as e:
+                logger.error(f"LLM生成答案失败: {e}")
+                if token_usage.get("completion_tokens"):
+                    yield "error", {"message": str(e)}
+                else:
+                    yield "token", {"text": self._fallback_answer(vector_results)}
+        else:
+            # 没有配置LLM，返回最相关的内容
+            yield "token", {"text": self._fallback_answer(vector_results)}
+
+        confidence = candidates[0]["similarity"]
+        logger.info(f"✓ 答案已生成（流式）")
+        logger.info(f"  置信度: {confidence:.2f}")
+
+        yield "done", {"query_type": query_type, "confidence": confidence, "token_usage": token_usage or None}
 
     def _classify_question(self, question: str) -> str:
         """分类问题类型"""
@@ -1092,46 +2101,92 @@ class MultimodalRAGService:
     async def _handle_exact_query(
         self,
         question: str,
-        top_k: int
+        top_k: int,
+        filters: Optional[Dict[str, Any]] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> tuple[str, List[Dict[str, Any]], float]:
-        """处理精确查询 - 从元数据直接提取答案"""
+        """
+        处理精确查询 - 从结构化事实库直接回答
 
-        # 向量检索找到最相关的文档
-        vector_results = await self.vector_manager.search(
-            query=question,
-            top_k=top_k
-        )
+        - 聚合问题（带数值条件，或"哪些/几张"）：事实库索引查询
+        - 单文件问题：按 file_id 过滤条件或问题中的文件名定位文件，定位不到时才用向量检索找最相关文件
+        """
+        conditions = self._parse_filter_conditions(question)
+        fact_filters = {**(filters or {}), **conditions}
+        is_aggregate = any(key != "image_type" for key in conditions) or any(kw in question for kw in AGGREGATE_KEYWORDS)
+        if is_aggregate and self.facts_store.supports(fact_filters):
+            return await self._answer_aggregate_from_facts(question, fact_filters, top_k)
+
+        # 定位单个文件
+        doc, similarity, fallback_content = None, 1.0, None
+        file_id = (filters or {}).get("file_id")
+        if isinstance(file_id, str):
+            doc = await run_in_stage("search", self.facts_store.get_document, file_id)
+        else:
+            named = await run_in_stage("search", self.facts_store.find_documents_in_text, question, 1)
+            if named:
+                doc = await run_in_stage("search", self.facts_store.get_document, named[0]["file_id"])
+
+        if doc is None:
+            # 向量检索找到最相关的文档
+            vector_results = await self.vector_manager.search(
+                query=question,
+                top_k=top_k,
+                filters=filters,
+                query_embedding=query_embedding
+            )
+            if not vector_results:
+                return "抱歉，没有找到相关信息。", [], 0.0
+            top_result = vector_results[0]
+            similarity = top_result["similarity"]
+            fallback_content = top_result["content"]
+            metadata = top_result["metadata"]
+            doc = await run_in_stage("search", self.facts_store.get_document, metadata.get("file_id")) or {
+                "file_id": metadata.get("file_id"),
+                "file_name": metadata.get("file_name"),
+                "file_type": metadata.get("file_type"),
+                "rooms": [],
+                "dimensions": []
+            }
 
-        if not vector_results:
-            return "抱歉，没有找到相关信息。", [], 0.0
+        answer_parts = self._answer_from_facts(question, doc)
 
-        top_result = vector_results[0]
-        metadata = top_result["metadata"]
+        # 默认回答
+        if not answer_parts:
+            answer_parts.append("根据文档内容：")
+            answer_parts.append((fallback_content or "未找到相关的结构化信息。")[:300])
 
-        # 从 JSON 字符串解析 extracted_info
-        extracted_info = {}
-        if "extracted_info_json" in metadata:
-            try:
-                extracted_info = json.loads(metadata["extracted_info_json"])
-            except:
-                pass
+        # 添加来源
+        answer_parts.append(f"\n📄 来源：{doc.get('file_name') or '未知文件'}")
+
+        answer = "\n".join(answer_parts)
 
-        # 根据问题提取答案
+        # 构建来源信息
+        sources = [{
+            "file_id": doc.get("file_id"),
+            "file_name": doc.get("file_name"),
+            "file_type": doc.get("file_type"),
+            "similarity": similarity
+        }]
+
+        return answer, sources, similarity
+
+    def _answer_from_facts(self, question: str, doc: Dict[str, Any]) -> List[str]:
+        """根据单个文件的事实回答卧室/面积/尺寸问题"""
         answer_parts = []
 
         # 处理卧室相关问题
         if "卧室" in question or "房间" in question:
-            if "rooms" in extracted_info:
-                rooms = extracted_info["rooms"]
-                bedrooms = [r for r in rooms if "卧" in r.get("name", "")]
+            if doc.get("room_count") is not None:
+                bedrooms = [r for r in doc["rooms"] if r["category"] == "bedroom"]
 
                 if bedrooms:
-                    answer_parts.append(f"这张{metadata.get('file_type', '图纸')}有{len(bedrooms)}个卧室：")
+                    answer_parts.append(f"这张{doc.get('file_type') or '图纸'}有{len(bedrooms)}个卧室：")
                     for i, room in enumerate(bedrooms, 1):
                         room_text = f"{i}. {room['name']}"
-                        if "dimensions" in room and "area" in room["dimensions"]:
-                            room_text += f" - {room['dimensions']['area']}平方米"
-                        if "position" in room:
+                        if room["area"] is not None:
+                            room_text += f" - {room['area']}平方米"
+                        if room["position"]:
                             room_text += f"（{room['position']}）"
                         answer_parts.append(room_text)
                 else:
@@ -1139,78 +2194,96 @@ class MultimodalRAGService:
 
         # 处理面积相关问题
         elif "面积" in question or "多大" in question:
-            if "total_area" in metadata:
-                total_area = metadata["total_area"]
-                answer_parts.append(f"总面积为 {total_area} 平方米")
-            elif "total_dimensions" in extracted_info:
-                total_area = extracted_info["total_dimensions"].get("total_area")
-                answer_parts.append(f"总面积为 {total_area} 平方米")
+            if doc.get("total_area") is not None:
+                answer_parts.append(f"总面积为 {doc['total_area']} 平方米")
             else:
                 answer_parts.append("未找到面积信息。")
 
         # 处理尺寸相关问题
         elif "尺寸" in question or "长度" in question or "宽度" in question:
-            if "total_dimensions" in extracted_info:
-                dims = extracted_info["total_dimensions"]
+            if doc.get("total_length") is not None or doc.get("total_width") is not None:
                 answer_parts.append(
-                    f"建筑尺寸：长 {dims.get('length')} 米，宽 {dims.get('width')} 米，"
-                    f"总面积 {dims.get('total_area')} 平方米"
+                    f"建筑尺寸：长 {doc.get('total_length')} 米，宽 {doc.get('total_width')} 米，"
+                    f"总面积 {doc.get('total_area')} 平方米"
                 )
+            elif doc["dimensions"]:
+                answer_parts.append("尺寸参数：")
+                for dim in doc["dimensions"]:
+                    answer_parts.append(f"- {dim['name']}：{dim['raw']}")
             else:
                 answer_parts.append("未找到尺寸信息。")
 
-        # 默认回答
-        if not answer_parts:
-            answer_parts.append("根据文档内容：")
-            answer_parts.append(top_result["content"][:300])
+        return answer_parts
 
-        # 添加来源
-        answer_parts.append(f"\n📄 来源：{metadata.get('file_name', '未知文件')}")
-
-        answer = "\n".join(answer_parts)
+    async def _answer_aggregate_from_facts(
+        self,
+        question: str,
+        filters: Dict[str, Any],
+        top_k: int
+    ) -> tuple[str, List[Dict[str, Any]], float]:
+        """聚合问题：在事实库上按条件查询文件列表和总数"""
+        limit = max(top_k, 10)
+        docs, total = await asyncio.gather(
+            run_in_stage("search", self.facts_store.query_documents, filters, limit),
+            run_in_stage("search", self.facts_store.count_documents, filters)
+        )
+        logger.info(f"  事实库查询: {filters} → {total} 个文件")
+
+        if not docs:
+            return "没有找到符合条件的结果。", [], 0.0
+
+        answer_parts = [f"共有 {total} 个符合条件的文件：\n"]
+        for i, doc in enumerate(docs, 1):
+            answer_parts.append(f"\n{i}. {doc['file_name']}")
+            if doc["total_area"] is not None:
+                answer_parts.append(f"   - 总面积：{doc['total_area']}平方米")
+            if doc["bedroom_count"] is not None:
+                answer_parts.append(f"   - 卧室数：{doc['bedroom_count']}个")
+            if doc["room_count"] is not None:
+                answer_parts.append(f"   - 房间数：{doc['room_count']}个")
+        if total > len(docs):
+            answer_parts.append(f"\n（仅列出前 {len(docs)} 个）")
 
-        # 构建来源信息
         sources = [{
-            "file_id": metadata.get("file_id"),
-            "file_name": metadata.get("file_name"),
-            "file_type": metadata.get("file_type"),
-            "similarity": top_result["similarity"]
-        }]
-
-        confidence = top_result["similarity"]
+            "file_id": doc["file_id"],
+            "file_name": doc["file_name"],
+            "file_type": doc["file_type"],
+            "similarity": 1.0
+        } for doc in docs]
 
-        return answer, sources, confidence
+        # 结构化条件精确匹配，置信度为 1
+        return "\n".join(answer_parts), sources, 1.0
 
     async def _handle_filter_query(
         self,
         question: str,
-        top_k: int
+        top_k: int,
+        extra_filters: Optional[Dict[str, Any]] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> tuple[str, List[Dict[str, Any]], float]:
-        """处理过滤查询 - 智能过滤 + 检索"""
+        """
+        处理过滤查询 - 智能过滤 + 检索
+
+        问题中解析出的条件都能在事实库上执行时直接查事实库（不做向量检索）；
+        否则把条件下推到向量库检索
+        """
 
         # 解析过滤条件
-        filters = self._parse_filter_conditions(question)
-        logger.info(f"  解析的过滤条件: {filters}")
+        conditions = self._parse_filter_conditions(question)
+        logger.info(f"  解析的过滤条件: {conditions}")
 
-        # TODO: 实现带过滤的检索（需要 ChromaDB 支持元数据过滤）
-        # 暂时使用普通检索后过滤
-        vector_results = await self.vector_manager.search(
+        # 用户传入的条件与问题中解析出的条件合并
+        filters = {**(extra_filters or {}), **conditions}
+        if conditions and self.facts_store.supports(filters):
+            return await self._answer_aggregate_from_facts(question, filters, top_k)
+
+        filtered_results = await self.vector_manager.search(
             query=question,
-            top_k=top_k * 3  # 检索更多结果用于过滤
+            top_k=top_k,
+            filters=filters,
+            query_embedding=query_embedding
         )
 
-        # 应用过滤条件
-        filtered_results = []
-        for result in vector_results:
-            metadata = result["metadata"]
-
-            # 检查是否符合过滤条件
-            if self._match_filters(metadata, filters):
-                filtered_results.append(result)
-
-            if len(filtered_results) >= top_k:
-                break
-
         if not filtered_results:
             return f"没有找到符合条件的结果。", [], 0.0
 
@@ -1219,15 +2292,6 @@ class MultimodalRAGService:
 
         for i, result in enumerate(filtered_results, 1):
             metadata = result["metadata"]
-
-            # 解析 extracted_info
-            extracted_info = {}
-            if "extracted_info_json" in metadata:
-                try:
-                    extracted_info = json.loads(metadata["extracted_info_json"])
-                except:
-                    pass
-
             answer_parts.append(f"\n{i}. {metadata.get('file_name')}")
 
             # 显示关键信息
@@ -1255,30 +2319,53 @@ class MultimodalRAGService:
         return answer, sources, confidence
 
     def _parse_filter_conditions(self, question: str) -> Dict[str, Any]:
-        """解析过滤条件"""
-        filters = {}
-
-        # 解析数字条件
-        import re
-
-        # 卧室数量
-        bedroom_match = re.search(r'(\d+)\s*个?\s*卧室', question)
-        if bedroom_match:
-            filters["bedroom_count"] = int(bedroom_match.group(1))
-
-        # 房间数量
-        room_match = re.search(r'(\d+)\s*个?\s*房间', question)
-        if room_match:
-            filters["room_count"] = int(room_match.group(1))
-
-        # 面积范围
-        area_match = re.search(r'(\d+)\s*[以上大于].*?平', question)
-        if area_match:
-            filters["total_area_gte"] = int(area_match.group(1))
+        """
+        解析过滤条件
 
-        area_match2 = re.search(r'[小少于].*?(\d+)\s*平', question)
-        if area_match2:
-            filters["total_area_lte"] = int(area_match2.group(1))
+        键名使用 metadata_filters 的写法（bedroom_count / bedroom_count_gt / total_area_gte 等），
+        既能下推到向量库，也能直接在事实库上查询
+        """
+        filters = {}
+        question = CHINESE_NUMERAL_PATTERN.sub(lambda m: str(chinese_numeral_to_int(m.group())), question)
+
+        # 卧室/房间数量：N个以上卧室、超过N个卧室、卧室超过N个、N个卧室
+        for field, noun in (("bedroom_count", "卧室"), ("room_count", "房间")):
+            count = r"(\d+)\s*个?"
+            patterns = [
+                (rf"{count}\s*(?:及以上|以上)\s*(?:的)?\s*{noun}", "_gte"),
+                (rf"(?:至少|不少于)\s*{count}\s*{noun}", "_gte"),
+                (rf"(?:超过|多于|大于)\s*{count}\s*{noun}", "_gt"),
+                (rf"(?:少于|小于)\s*{count}\s*{noun}", "_lt"),
+                (rf"{noun}\s*(?:数量?)?\s*(?:超过|多于|大于)\s*{count}", "_gt"),
+                (rf"{noun}\s*(?:数量?)?\s*(?:至少|不少于)\s*{count}", "_gte"),
+                (rf"{noun}\s*(?:数量?)?\s*(?:少于|小于)\s*{count}", "_lt"),
+                (rf"{count}\s*{noun}", ""),
+            ]
+            for pattern, suffix in patterns:
+                match = re.search(pattern, question)
+                if match:
+                    filters[field + suffix] = int(match.group(1))
+                    break
+
+        # 面积范围：大于120平、120平以上、小于200平、200平以下（上下界各取第一个匹配）
+        area = r"(\d+(?:\.\d+)?)\s*(?:平方米|平米|平|㎡|m2)"
+        for patterns in (
+            [
+                (rf"(?:不小于|不少于|至少|>=|≥)\s*{area}", "total_area_gte"),
+                (rf"(?:大于|超过|多于|高于|>|＞)\s*{area}", "total_area_gt"),
+                (rf"{area}\s*(?:及以上|以上)", "total_area_gte"),
+            ],
+            [
+                (rf"(?:不大于|不超过|至多|<=|≤)\s*{area}", "total_area_lte"),
+                (rf"(?:小于|少于|低于|<|＜)\s*{area}", "total_area_lt"),
+                (rf"{area}\s*(?:及以下|以下|以内)", "total_area_lte"),
+            ],
+        ):
+            for pattern, key in patterns:
+                match = re.search(pattern, question)
+                if match:
+                    filters[key] = float(match.group(1))
+                    break
 
         # 图纸类型
         if "平面图" in question or "户型" in question:
@@ -1286,170 +2373,133 @@ class MultimodalRAGService:
 
         return filters
 
-    def _match_filters(self, metadata: Dict[str, Any], filters: Dict[str, Any]) -> bool:
-        """检查元数据是否匹配过滤条件"""
-        for key, value in filters.items():
-            if key == "bedroom_count":
-                if metadata.get("bedroom_count", 0) != value:
-                    return False
-
-            elif key == "room_count":
-                if metadata.get("room_count", 0) != value:
-                    return False
-
-            elif key == "total_area_gte":
-                if metadata.get("total_area", 0) < value:
-                    return False
-
-            elif key == "total_area_lte":
-                if metadata.get("total_area", float('inf')) > value:
-                    return False
-
-            elif key == "image_type":
-                if metadata.get("image_type") != value:
-                    return False
-
-        return True
-
     async def _handle_general_query(
         self,
         question: str,
-        top_k: int
+        top_k: int,
+        filters: Optional[Dict[str, Any]] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> tuple[str, List[Dict[str, Any]], float]:
         """处理一般查询 - 向量检索 + LLM"""
 
-        # 向量检索
-        vector_results = await self.vector_manager.search(
+        # 向量检索：从全部候选中选出至多 top_k 个块构建 LLM 上下文，来源即这些块
+        if query_embedding is None:
+            query_embedding = (await self.vector_manager.embed_queries([question]))[0]
+        candidates = await self.vector_manager.search(
             query=question,
-            top_k=top_k
+            top_k=max(top_k, self.context_candidates),
+            filters=filters,
+            query_embedding=query_embedding
         )
+        packed = await self._pack_general_context(query_embedding, candidates, top_k)
+        vector_results = [chunk.result for chunk in packed]
 
         if not vector_results:
             return "抱歉，没有找到相关信息。", [], 0.0
 
-        # 构建上下文
-        context_parts = []
-        for i, result in enumerate(vector_results, 1):
-            metadata = result["metadata"]
-            context_parts.append(f"[文档{i}] {metadata.get('file_name')}:")
-            context_parts.append(result["content"][:500])
-            context_parts.append("")
-
-        context = "\n".join(context_parts)
-
         # 使用 LLM 生成答案（如果配置了）
         if self.vlm_api_key:
             try:
-                from langchain_openai import ChatOpenAI
-
-                llm = ChatOpenAI(
-                    model_name=self.vlm_model_name,
-                    api_key=self.vlm_api_key,
-                    base_url=self.vlm_model_url,
-                    temperature=0.3
-                )
-
-                prompt = f"""基于以下文档内容回答问题。
-
-文档内容：
-{context}
+                llm = self._create_llm()
+                prompt = self._build_general_prompt(question, packed)
 
-问题：{question}
-
-请给出准确、详细的回答。"""
-
-                response = await llm.ainvoke(prompt)
+                with span("llm"):
+                    response = await llm.ainvoke(prompt)
                 answer = response.content
 
                 # 添加来源
-                sources_text = "\n\n📄 参考来源：\n"
-                for i, result in enumerate(vector_results, 1):
-                    sources_text += f"{i}. {result['metadata'].get('file_name')}\n"
-
-                answer += sources_text
+                answer += self._format_source_list(vector_results)
 
             except Exception as e:
                 logger.error(f"LLM生成答案失败: {e}")
-                answer = f"根据检索到的内容：\n\n{vector_results[0]['content'][:500]}\n\n来源：{vector_results[0]['metadata'].get('file_name')}"
+                answer = self._fallback_answer(vector_results)
         else:
             # 没有配置LLM，返回最相关的内容
-            answer = f"根据检索到的内容：\n\n{vector_results[0]['content'][:500]}\n\n来源：{vector_results[0]['metadata'].get('file_name')}"
+            answer = self._fallback_answer(vector_results)
 
         # 构建来源信息
-        sources = [{
-            "file_id": r["metadata"].get("file_id"),
-            "file_name": r["metadata"].get("file_name"),
-            "file_type": r["metadata"].get("file_type"),
-            "similarity": r["similarity"]
-        } for r in vector_results]
+        sources = self._format_sources(vector_results)
 
-        confidence = vector_results[0]["similarity"]
+        confidence = candidates[0]["similarity"]
 
         return answer, sources, confidence
 
+    async def _pack_context(
+        self,
+        question_embedding: List[float],
+        candidates: List[Dict[str, Any]],
+        header: Callable[[Dict[str, Any]], str],
+        max_chunks: Optional[int] = None
+    ) -> List[ContextChunk]:
+        """候选块 -> 装入上下文的块（MMR 选块、去除重叠、按 token 预算装箱，最多 max_chunks 块）"""
+        if not candidates:
+            return []
+        try:
+            vectors = await self.vector_manager.chunk_vectors(candidates)
+        except Exception as e:
+            # 取不到块向量时按检索顺序装箱
+            logger.warning(f"⚠️ 读取文本块向量失败，按检索顺序构建上下文: {e}")
+            vectors = None
+        packed = self.context_packer.pack(question_embedding, candidates, vectors, header, max_chunks)
+        log_request(
+            "📦 LLM 上下文", candidates=len(candidates), chunks=len(packed),
+            tokens=sum(chunk.tokens for chunk in packed), budget=self.context_packer.token_budget
+        )
+        return packed
 
-# ============ 请求日志中间件 ============
-
-class RequestLoggerMiddleware(BaseHTTPMiddleware):
-    """记录所有API请求的中间件"""
+    @staticmethod
+    def _context_header(index: int, result: Dict[str, Any]) -> str:
+        """一般查询上下文中每块的标题行（编号与参考来源列表一致）"""
+        return f"[文档{index}] {result['metadata'].get('file_name')}:"
 
-    async def dispatch(self, request: Request, call_next):
-        # 记录请求信息
-        request_id = str(uuid.uuid4())[:8]
-        start_time = time.time()
+    async def _pack_general_context(
+        self,
+        question_embedding: List[float],
+        candidates: List[Dict[str, Any]],
+        top_k: int
+    ) -> List[ContextChunk]:
+        """
+        一般查询：从候选中选出至多 top_k 个块
 
-        # 获取客户端信息
-        client_host = request.client.host if request.client else "unknown"
+        装箱时编号尚未确定，标题行按最大编号 top_k 计入预算（编号位数最多，估计值不小于实际标题）
+        """
+        return await self._pack_context(
+            question_embedding, candidates, lambda result: self._context_header(top_k, result), top_k
+        )
 
-        # 记录请求开始
-        logger.info(f"")
-        logger.info(f"{'='*80}")
-        logger.info(f"[{request_id}] 📥 收到请求")
-        logger.info(f"[{request_id}]   方法: {request.method}")
-        logger.info(f"[{request_id}]   路径: {request.url.path}")
-        logger.info(f"[{request_id}]   客户端: {client_host}")
-        logger.info(f"[{request_id}]   User-Agent: {request.headers.get('user-agent', 'N/A')}")
+    def _build_general_prompt(self, question: str, packed: List[ContextChunk]) -> str:
+        """一般查询：用装箱后的文本块构建上下文和提示词（[文档i] 与来源列表的第 i 项对应）"""
+        context_parts = []
+        for i, chunk in enumerate(packed, 1):
+            context_parts.append(self._context_header(i, chunk.result))
+            context_parts.append(chunk.text)
+            context_parts.append("")
 
-        # 如果是 POST 请求，记录 Content-Type
-        if request.method == "POST":
-            content_type = request.headers.get('content-type', 'N/A')
-            logger.info(f"[{request_id}]   Content-Type: {content_type}")
+        context = "\n".join(context_parts)
 
-        logger.info(f"{'='*80}")
+        return f"""基于以下文档内容回答问题。
 
-        # 处理请求
-        try:
-            response = await call_next(request)
+文档内容：
+{context}
 
-            # 计算耗时
-            process_time = time.time() - start_time
+问题：{question}
 
-            # 记录响应
-            logger.info(f"")
-            logger.info(f"{'='*80}")
-            logger.info(f"[{request_id}] 📤 返回响应")
-            logger.info(f"[{request_id}]   状态码: {response.status_code}")
-            logger.info(f"[{request_id}]   耗时: {process_time:.3f}秒")
-            logger.info(f"{'='*80}")
-            logger.info(f"")
+请给出准确、详细的回答。"""
 
-            # 添加响应头
-            response.headers["X-Request-ID"] = request_id
-            response.headers["X-Process-Time"] = f"{process_time:.3f}"
+    def _format_source_list(self, vector_results: List[Dict[str, Any]]) -> str:
+        """附加在答案末尾的参考来源列表"""
+        sources_text = "\n\n📄 参考来源：\n"
+        for i, result in enumerate(vector_results, 1):
+            sources_text += f"{i}. {result['metadata'].get('file_name')}\n"
+        return sources_text
 
-            return response
+    # 无法调用 LLM 时的回答前缀（语义缓存据此跳过退回原文的回答）
+    FALLBACK_ANSWER_PREFIX = "根据检索到的内容："
 
-        except Exception as e:
-            # 记录错误
-            process_time = time.time() - start_time
-            logger.error(f"")
-            logger.error(f"{'='*80}")
-            logger.error(f"[{request_id}] ❌ 请求处理失败")
-            logger.error(f"[{request_id}]   错误: {str(e)}")
-            logger.error(f"[{request_id}]   耗时: {process_time:.3f}秒")
-            logger.error(f"{'='*80}")
-            logger.error(f"", exc_info=True)
-            raise
+    def _fallback_answer(self, vector_results: List[Dict[str, Any]]) -> str:
+        """无法调用 LLM 时直接返回最相关的内容"""
+        best = max(vector_results, key=lambda r: r["similarity"])
+        return f"{self.FALLBACK_ANSWER_PREFIX}\n\n{best['content'][:500]}\n\n来源：{best['metadata'].get('file_name')}"
 
 
 # ============ FastAPI 应用 ============
@@ -1460,8 +2510,21 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# 添加请求日志中间件
-app.add_middleware(RequestLoggerMiddleware)
+# 服务状态：业务接口在预热完成前返回 503（中间件先加的在内层，503 响应也会经过日志和 CORS）
+startup_state = StartupState()
+app.add_middleware(
+    ReadinessMiddleware,
+    state=startup_state,
+    exempt_paths=["/", "/health", "/ready", "/metrics", "/docs", "/redoc", "/openapi.json"]
+)
+
+# 进程角色（standalone / writer / search，见 serve_workers）：检索 worker 把写入类接口重定向到写入进程
+SERVICE_ROLE = service_role()
+if SERVICE_ROLE == "search":
+    app.add_middleware(WriterRedirectMiddleware, writer_url=os.getenv("WRITER_URL"))
+
+# 请求日志中间件（request_id、访问日志、详细日志采样）
+app.add_middleware(RequestLogMiddleware, skip_paths=["/metrics"])
 
 # CORS 配置
 app.add_middleware(
@@ -1470,10 +2533,46 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
-# 初始化服务
-service = MultimodalRAGService()
+# 分阶段耗时追踪（最外层：Server-Timing 的 total 覆盖整个中间件链，/metrics 抓取本身不计入请求直方图）
+app.add_middleware(TracingMiddleware, skip_paths=["/metrics"])
+
+# 服务实例在应用启动后的预热任务中创建；导入本模块（测试、render 子进程以 __mp_main__ 重新导入）不会加载模型
+service: Optional[MultimodalRAGService] = None
+
+
+async def warmup_service():
+    """
+    预热：创建服务（模型、向量库、VLM 客户端）并启动入库任务队列，完成后标记就绪
+
+    构造函数在线程中运行，预热期间事件循环照常响应 /health、/ready
+    """
+    global service
+    try:
+        if SERVICE_ROLE != "search":
+            with startup_state.phase("render_pool"):
+                # render 进程池（子进程在首次提交任务时由 forkserver 启动）
+                get_executor("render")
+        with startup_state.phase("service"):
+            instance = await asyncio.to_thread(MultimodalRAGService)
+        if instance.job_manager is not None:
+            with startup_state.phase("job_manager"):
+                await instance.job_manager.start()
+        if instance.vector_manager.embedding_type != "qwen" or instance.vector_manager.model_server_socket:
+            # 本地 Embedding 模型第一次推理较慢，预热时先跑一次（使用共享模型进程时同时等待其就绪）
+            with startup_state.phase("embedding_warmup"):
+                await instance.vector_manager.embed_queries(["预热"])
+        with startup_state.phase("qa_imports"):
+            await asyncio.to_thread(__import__, "langchain_openai")
+
+        service = instance
+        startup_state.mark_ready()
+        logger.info(f"✓ 服务就绪，预热耗时 {startup_state.snapshot()['warmupTime']} ms: {startup_state.phases}")
+    except Exception as e:
+        startup_state.mark_failed(e)
+        logger.error(f"❌ 服务预热失败: {e}", exc_info=True)
 
 
 @app.get("/")
@@ -1486,100 +2585,257 @@ async def root():
     }
 
 
+@app.on_event("startup")
+async def startup():
+    """后台预热服务（加载模型、启动入库任务队列并恢复重启前未完成的任务），不阻塞端口监听"""
+    app.state.warmup_task = asyncio.create_task(warmup_service())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """停止入库任务，关闭分阶段执行器和模型连接池"""
+    if service is not None and service.job_manager is not None:
+        await service.job_manager.stop()
+    shutdown_executors(wait=False)
+    await get_gateway().aclose()
+
+
 @app.get("/health")
 async def health_check():
-    """健康检查"""
+    """健康检查（存活探针：进程能响应即为 healthy，预热进度见 startup / /ready）"""
     return {
         "status": "healthy",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now().isoformat(),
+        "role": SERVICE_ROLE,
+        "pid": os.getpid(),
+        "startup": startup_state.snapshot(),
+        "executors": executor_stats(),  # 各阶段执行器的队列深度
+        "vlm_cache": service.vlm_cache.stats() if service and service.vlm_cache else None,  # VLM 响应缓存命中统计
+        "model_calls": get_gateway().stats()  # 出站模型调用的耗时与 token 用量
     }
 
 
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查（就绪探针）：模型和向量库加载完成前返回 503，预热失败时返回 503 和错误信息"""
+    return JSONResponse(
+        startup_state.snapshot(),
+        status_code=200 if startup_state.ready else 503
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标：各阶段与 HTTP 请求耗时直方图、执行器队列深度、语义缓存、日志队列、就绪状态（本进程内累计）"""
+    lines = [
+        "# HELP rag_ready 服务是否已就绪",
+        "# TYPE rag_ready gauge",
+        f"rag_ready {int(startup_state.ready)}",
+        "# HELP rag_executor_active 各阶段执行器执行中的任务数",
+        "# TYPE rag_executor_active gauge",
+    ]
+    stats = executor_stats()
+    lines += [f'rag_executor_active{{stage="{name}"}} {s["active"]}' for name, s in stats.items()]
+    lines += ["# HELP rag_executor_queued 各阶段执行器排队中的任务数", "# TYPE rag_executor_queued gauge"]
+    lines += [f'rag_executor_queued{{stage="{name}"}} {s["queued"]}' for name, s in stats.items()]
+    if service is not None and service.answer_cache is not None:
+        cache = service.answer_cache.stats()
+        lines += [
+            "# HELP rag_answer_cache_hits_total 智能问答语义缓存命中次数",
+            "# TYPE rag_answer_cache_hits_total counter",
+            f"rag_answer_cache_hits_total {cache['hits']}",
+            "# HELP rag_answer_cache_misses_total 智能问答语义缓存未命中次数",
+            "# TYPE rag_answer_cache_misses_total counter",
+            f"rag_answer_cache_misses_total {cache['misses']}",
+        ]
+    logs = log_stats()
+    lines += [
+        "# HELP rag_log_queued 日志队列中等待写入的记录数",
+        "# TYPE rag_log_queued gauge",
+        f"rag_log_queued {logs['queued']}",
+        "# HELP rag_log_dropped_total 日志队列满或写入失败而丢弃的记录数",
+        "# TYPE rag_log_dropped_total counter",
+        f"rag_log_dropped_total {logs['dropped']}",
+    ]
+    return Response(render_metrics(lines), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/search", response_model=SearchResponse)
 async def search(request: SearchRequest):
     """搜索接口"""
     try:
-        log_request(f"\n{'='*80}")
-        log_request(f"🔍 API收到搜索请求")
-        log_request(f"  查询: {request.query}")
-        log_request(f"  模型: {request.model}")
-        log_request(f"  策略: {request.strategy}")
-        log_request(f"  TopK: {request.topK}")
-        print(f"{'='*80}\n")
-        sys.stdout.flush()
+        log_request(
+            "🔍 API收到搜索请求",
+            query=request.query, model=request.model, strategy=request.strategy, top_k=request.topK
+        )
 
         result = await service.handle_search(request)
 
-        log_request(f"\n{'='*80}")
-        log_request(f"✓ API搜索完成，返回 {result.totalCount} 个结果")
-        print(f"{'='*80}\n")
-        sys.stdout.flush()
+        log_request(f"✓ API搜索完成，返回 {result.totalCount} 个结果", query_ms=result.queryTime)
+
+        return result
+    except Exception as e:
+        logger.error(f"❌ 搜索失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/search/batch", response_model=SearchBatchResponse)
+async def search_batch(request: SearchBatchRequest):
+    """批量搜索接口：一次请求提交多个查询，结果按提交顺序返回"""
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="queries 不能为空")
+    if len(request.queries) > service.search_batch_max:
+        raise HTTPException(
+            status_code=413,
+            detail=f"单次批量搜索最多 {service.search_batch_max} 个查询，收到 {len(request.queries)} 个"
+        )
+
+    try:
+        log_request(f"🔍 API收到批量搜索请求: {len(request.queries)} 个查询")
+
+        result = await service.handle_search_batch(request)
+
+        log_request(f"✓ API批量搜索完成，耗时 {result.totalTime}ms")
 
         return result
     except Exception as e:
-        print(f"\n❌ 搜索失败: {e}\n")
-        sys.stdout.flush()
-        logger.error(f"❌ 搜索失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"❌ 批量搜索失败: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/upload", response_model=UploadResponse)
+# 上传请求体由 receive_upload 流式解析，这里单独声明 OpenAPI 中的表单结构
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}}
+                }
+            }
+        }
+    }
+}
+
+
+@app.post("/upload", response_model=UploadResponse, openapi_extra=UPLOAD_OPENAPI)
 async def upload(
-    file: UploadFile = File(...),
-    image_type: Optional[str] = None
+    request: Request,
+    image_type: Optional[str] = None,
+    wait: bool = False,
+    force: bool = False
 ):
     """
     文件上传接口
 
+    文件保存后立即返回 jobId，解析和索引在后台进行，
+    进度通过 /jobs/{job_id} 或 /jobs/{job_id}/events 查询。
+    请求体（multipart 的 file 字段）按块流式写盘，超过 UPLOAD_MAX_MB 时返回 413。
+
     Args:
-        file: 上传的文件
+        request: multipart/form-data 请求，文件字段名为 file
         image_type: 可选的图片类型指定
                    支持: cad, floor_plan, architecture, technical_doc
+        wait: 为 true 时等待入库完成再返回
+        force: 为 true 时即使内容与已上传文件相同也重新处理
     """
     try:
-        log_request(f"\n{'='*80}")
-        log_request(f"📤 API收到文件上传请求")
-        log_request(f"  文件名: {file.filename}")
-        log_request(f"  Content-Type: {file.content_type}")
-        if image_type:
-            log_request(f"  指定类型: {image_type}")
-        print(f"{'='*80}\n")
-        sys.stdout.flush()
-
-        result = await service.handle_upload(file, image_type)
-
-        log_request(f"\n{'='*80}")
-        print(f"{'✓' if result.success else '❌'} 文件上传{'成功' if result.success else '失败'}")
-        log_request(f"  消息: {result.message}")
-        if result.detectedImageType:
-            log_request(f"  检测类型: {result.detectedImageType}")
-        print(f"{'='*80}\n")
-        sys.stdout.flush()
+        try:
+            file = await service.receive_upload(request)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except InvalidUpload as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        log_request(
+            "📤 API收到文件上传请求",
+            file_name=file.filename, content_type=file.content_type,
+            size_mb=round(file.size / 1024 / 1024, 2), image_type=image_type
+        )
+
+        result = await service.handle_upload(file, image_type, wait, force)
+
+        log_request(
+            f"{'✓' if result.success else '❌'} 文件上传{'成功' if result.success else '失败'}",
+            message=result.message, detected_image_type=result.detectedImageType
+        )
 
         return result
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"\n❌ 上传失败: {e}\n")
-        sys.stdout.flush()
-        logger.error(f"❌ 上传失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"❌ 上传失败: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """查询入库任务状态（各阶段进度与耗时）"""
+    job = service.job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """入库任务进度流（SSE），任务结束后自动关闭"""
+    if not service.job_manager.get(job_id):
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+
+    async def event_stream():
+        async for snapshot in service.job_manager.subscribe(job_id):
+            if snapshot is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: progress\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.post("/question", response_model=FollowUpQuestionResponse)
 async def follow_up_question(request: FollowUpQuestionRequest):
     """追问接口"""
     try:
         return await service.handle_follow_up_question(request)
     except Exception as e:
-        logger.error(f"❌ 追问失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"❌ 追问失败: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def sse_event_stream(events: AsyncIterator[tuple]) -> StreamingResponse:
+    """把 (事件名, 数据) 异步序列包装为 SSE 响应；生成过程中出错时发送 error 事件后结束"""
+    async def event_stream():
+        try:
+            async for event, data in events:
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logger.error(f"❌ 流式响应失败: {e}")
+            yield f"event: error\ndata: {json.dumps({'message': str(e)}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/question/stream")
+async def follow_up_question_stream(request: FollowUpQuestionRequest):
+    """
+    追问接口（流式，SSE）
+
+    事件顺序：sources（引用片段）→ token（回答片段，多次）→ done（置信度、token 用量）
+    """
+    return sse_event_stream(service.stream_follow_up_question(request))
+
+
 @app.post("/ask", response_model=IntelligentQAResponse)
 async def intelligent_qa(request: IntelligentQARequest):
     """
@@ -1591,67 +2847,58 @@ async def intelligent_qa(request: IntelligentQARequest):
     3. 一般查询：向量检索 + LLM生成答案
     """
     try:
-        log_request(f"\n{'='*80}")
-        log_request(f"🤖 API收到智能问答请求")
-        log_request(f"  问题: {request.question}")
-        log_request(f"  TopK: {request.top_k}")
-        print(f"{'='*80}\n")
-        sys.stdout.flush()
+        log_request("🤖 API收到智能问答请求", question=request.question, top_k=request.top_k)
 
         result = await service.handle_intelligent_qa(request)
 
-        log_request(f"\n{'='*80}")
-        log_request(f"✓ 答案已生成")
-        log_request(f"  问题类型: {result.query_type}")
-        log_request(f"  置信度: {result.confidence:.2f}")
-        log_request(f"  来源数: {len(result.sources)}")
-        print(f"{'='*80}\n")
-        sys.stdout.flush()
+        log_request(
+            "✓ 答案已生成",
+            query_type=result.query_type, confidence=round(result.confidence, 2), sources=len(result.sources)
+        )
 
         return result
     except Exception as e:
-        print(f"\n❌ 智能问答失败: {e}\n")
-        sys.stdout.flush()
-        logger.error(f"❌ 智能问答失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"❌ 智能问答失败: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/ask/stream")
+async def intelligent_qa_stream(request: IntelligentQARequest):
+    """
+    智能问答接口（流式，SSE）
+
+    检索完成后立即推送 sources 事件，随后逐段推送 token 事件（LLM 生成的回答），
+    最后推送 done 事件（query_type、confidence、token_usage）
+    """
+    log_request("🤖 API收到流式智能问答请求", question=request.question, top_k=request.top_k)
+
+    return sse_event_stream(service.stream_intelligent_qa(request))
+
+
 @app.get("/preview/{file_id}")
-async def get_preview(file_id: str):
-    """获取文档预览"""
-    # 预览和缩略图暂时一样，返回原图
-    return await get_thumbnail(file_id)
+async def get_preview(file_id: str, request: Request):
+    """获取文档预览（detail 尺寸缩略图）"""
+    return await get_thumbnail(file_id, request, size="detail")
 
 
 @app.get("/thumbnail/{file_id}")
-async def get_thumbnail(file_id: str):
-    """获取文档缩略图"""
-    try:
-        # 查找文件
-        for ext in ['.png', '.jpg', '.jpeg', '.pdf', '.dwg', '.dxf']:
-            file_path = service.upload_dir / f"{file_id}{ext}"
-            if file_path.exists():
-                # 对于图片，直接返回原图
-                if ext in ['.png', '.jpg', '.jpeg']:
-                    return FileResponse(file_path, media_type=f"image/{ext[1:]}")
-                # 对于PDF，返回缩略图
-                elif ext == '.pdf':
-                    thumbnail_path = service.preview_dir / f"{file_id}_thumb.png"
-                    if thumbnail_path.exists():
-                        return FileResponse(thumbnail_path, media_type="image/png")
-                    else:
-                        # 如果缩略图不存在，尝试生成
-                        thumb_path = service._generate_pdf_thumbnail(file_path, file_id)
-                        if thumb_path and thumb_path.exists():
-                            return FileResponse(thumb_path, media_type="image/png")
-                        else:
-                            raise HTTPException(status_code=500, detail="PDF缩略图生成失败")
-                else:
-                    raise HTTPException(status_code=501, detail="该文件类型暂不支持缩略图")
+async def get_thumbnail(
+    file_id: str,
+    request: Request,
+    size: str = Query("card", description="缩略图尺寸: list / card / detail")
+):
+    """
+    获取文档缩略图
 
-        raise HTTPException(status_code=404, detail=f"文件不存在: {file_id}")
+    缩略图在入库时预先生成，响应带 ETag 和 Cache-Control，客户端缓存未变化时返回 304
+    """
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"不支持的缩略图尺寸: {size}")
+    try:
+        entry = await service.get_thumbnail_variant(file_id, size)
+        if entry is None:
+            raise HTTPException(status_code=404, detail=f"文件不存在: {file_id}")
+        return cached_file_response(request, entry["path"], entry["mime"], entry["etag"], service.thumbnail_max_age)
     except HTTPException:
         raise
     except Exception as e:
@@ -1659,11 +2906,36 @@ async def get_thumbnail(file_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/download/{document_id}")
-async def download_document(document_id: str):
-    """下载文档"""
-    # TODO: 实现文档下载
-    raise HTTPException(status_code=501, detail="下载功能暂未实现")
+@app.api_route("/download/{document_id}", methods=["GET", "HEAD"])
+async def download_document(document_id: str, request: Request):
+    """
+    下载原文件（document_id 即 fileId）
+
+    支持 Range / If-Range 断点续传；配置 DOWNLOAD_ACCEL_REDIRECT_PREFIX 时交给 nginx 以 sendfile 零拷贝发送
+    """
+    try:
+        record = await service._locate_file(document_id)
+        if record is None:
+            raise HTTPException(status_code=404, detail=f"文件不存在: {document_id}")
+
+        file_path = Path(record["path"])
+        file_name = record.get("fileName") or file_path.name
+
+        if service.download_accel_prefix:
+            # nginx internal location 负责 Range 和 sendfile
+            return Response(headers={
+                "X-Accel-Redirect": service.download_accel_prefix.rstrip("/") + "/" + quote(file_path.name),
+                "Content-Type": record["mime"],
+                "Content-Disposition": content_disposition(file_name)
+            })
+
+        stat_result = await run_in_stage("io", os.stat, file_path)
+        return RangeFileResponse(request, str(file_path), stat_result, record["mime"], record["etag"], file_name)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"下载文件失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 # ============ 启动服务 ============
@@ -1684,5 +2956,5 @@ if __name__ == "__main__":
         port=8000,
         log_level="info",
         log_config=log_config,
-        access_log=True
+        access_log=False  # 访问日志由 RequestLogMiddleware 记录
     )
@@ -0,0 +1,129 @@
+"""
+元数据过滤条件
+把过滤条件字典翻译为 Chroma 原生 where 子句（下推到向量库），无法下推的条件在 Python 中逐条判断
+
+过滤条件写法（SearchRequest.filters / IntelligentQARequest.filters / 问题解析出的条件）：
+    {"image_type": "floor_plan"}                 等于
+    {"image_type": ["cad", "floor_plan"]}        属于（$in）
+    {"total_area_gte": 100, "total_area_lte": 200}   范围（_gte / _lte / _gt / _lt / _ne / _in / _nin 后缀）
+    {"total_area": {"$gte": 100}}                直接使用 Chroma 运算符
+    {"file_name_contains": "户型"}               子串匹配（不能下推，在 Python 中判断）
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+# 后缀 -> Chroma 运算符
+SUFFIX_OPERATORS = {
+    "_gte": "$gte",
+    "_lte": "$lte",
+    "_gt": "$gt",
+    "_lt": "$lt",
+    "_ne": "$ne",
+    "_nin": "$nin",
+    "_in": "$in",
+}
+
+# Chroma 元数据 where 支持的运算符
+PUSHDOWN_OPERATORS = {"$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin"}
+
+# 只能在 Python 中判断的后缀
+RESIDUAL_SUFFIXES = {"_contains": "$contains"}
+
+_SCALAR_TYPES = (str, int, float, bool)
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> List[Tuple[str, str, Any]]:
+    """过滤条件字典 -> [(字段, 运算符, 值)]"""
+    conditions = []
+    for key, value in (filters or {}).items():
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            for op, operand in value.items():
+                conditions.append((key, op, operand))
+            continue
+
+        for suffix, op in {**RESIDUAL_SUFFIXES, **SUFFIX_OPERATORS}.items():
+            if key.endswith(suffix) and len(key) > len(suffix):
+                conditions.append((key[:-len(suffix)], op, value))
+                break
+        else:
+            op = "$in" if isinstance(value, (list, tuple, set)) else "$eq"
+            conditions.append((key, op, list(value) if op == "$in" else value))
+    return conditions
+
+
+def _pushable(op: str, value: Any) -> bool:
+    if op not in PUSHDOWN_OPERATORS:
+        return False
+    if op in ("$in", "$nin"):
+        return isinstance(value, list) and len(value) > 0 and all(isinstance(v, _SCALAR_TYPES) for v in value)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, _SCALAR_TYPES)
+
+
+def build_where(
+    filters: Optional[Dict[str, Any]]
+) -> Tuple[Optional[Dict[str, Any]], List[Tuple[str, str, Any]]]:
+    """
+    拆分过滤条件
+
+    Returns:
+        (Chroma where 子句或 None, 需要在 Python 中判断的剩余条件)
+    """
+    clauses, residual = [], []
+    for field, op, value in normalize_filters(filters):
+        if _pushable(op, value):
+            clauses.append({field: {op: value}})
+        else:
+            residual.append((field, op, value))
+
+    if not clauses:
+        return None, residual
+    if len(clauses) == 1:
+        return clauses[0], residual
+    return {"$and": clauses}, residual
+
+
+def _compare(actual: Any, op: str, expected: Any) -> bool:
+    if op == "$eq":
+        return actual == expected
+    if op == "$ne":
+        return actual != expected
+    if op == "$in":
+        return actual in expected
+    if op == "$nin":
+        return actual not in expected
+    if op == "$contains":
+        return actual is not None and str(expected) in str(actual)
+    if actual is None:
+        return False
+    try:
+        if op == "$gt":
+            return actual > expected
+        if op == "$gte":
+            return actual >= expected
+        if op == "$lt":
+            return actual < expected
+        if op == "$lte":
+            return actual <= expected
+    except TypeError:
+        return False
+    raise ValueError(f"不支持的过滤运算符: {op}")
+
+
+def match_conditions(metadata: Dict[str, Any], conditions: List[Tuple[str, str, Any]]) -> bool:
+    """元数据是否满足全部条件（字段缺失时与 Chroma 一致：只有 $ne / $nin 视为满足）"""
+    for field, op, value in conditions:
+        if field not in metadata:
+            if op in ("$ne", "$nin"):
+                continue
+            return False
+        if not _compare(metadata[field], op, value):
+            return False
+    return True
+
+
+def match_filters(metadata: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+    """元数据是否满足过滤条件字典"""
+    return match_conditions(metadata, normalize_filters(filters))
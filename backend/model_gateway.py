@@ -0,0 +1,426 @@
+"""
+出站模型调用网关
+所有 VLM / LLM / Embedding 调用共用长连接池（按事件循环区分），统一 openai_sdk / qwen / claude 三种调用方式，
+并按提供方、模型记录调用次数、耗时和 token 用量
+
+aiohttp / httpx / openai 在首次建连时才导入，导入本模块不拖慢服务启动
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import weakref
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger("RAG_Service")
+
+
+@dataclass
+class ChatResult:
+    """一次对话调用的结果"""
+    content: str
+    token_usage: Dict[str, int]
+    latency_ms: int
+    provider: str
+
+
+def detect_provider(model_url: str) -> str:
+    """根据地址判断调用方式：qwen / claude / openai_sdk"""
+    url_lower = model_url.lower()
+    if "dashscope" in url_lower or "aliyun" in url_lower:
+        return "qwen"
+    if "anthropic" in url_lower or "claude" in url_lower:
+        return "claude"
+    return "openai_sdk"
+
+
+def openai_base_url(model_url: str) -> str:
+    """OpenAI SDK 使用的 base_url（去掉 /chat/completions）"""
+    return model_url.replace("/chat/completions", "") if "/chat/completions" in model_url else model_url
+
+
+def chat_completions_url(model_url: str) -> str:
+    """OpenAI 兼容接口实际 POST 的完整地址"""
+    if "completions" in model_url.lower():
+        return model_url
+    path = urlparse(model_url).path or ""
+    if path.rstrip("/") == "/v1" or "compatible-mode" in model_url.lower():
+        return model_url.rstrip("/") + "/chat/completions"
+    return model_url
+
+
+def _normalize_usage(usage: Any, provider: str) -> Dict[str, int]:
+    """统一为 prompt_tokens / completion_tokens / total_tokens"""
+    if not usage:
+        return {}
+    if not isinstance(usage, dict):
+        usage = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0),
+            "completion_tokens": getattr(usage, "completion_tokens", 0),
+            "total_tokens": getattr(usage, "total_tokens", 0)
+        }
+    if provider == "claude":
+        prompt_tokens = usage.get("input_tokens", 0)
+        completion_tokens = usage.get("output_tokens", 0)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    return {
+        "prompt_tokens": usage.get("prompt_tokens", 0) or 0,
+        "completion_tokens": usage.get("completion_tokens", 0) or 0,
+        "total_tokens": usage.get("total_tokens", 0) or 0
+    }
+
+
+def _to_claude_messages(messages: List[Dict[str, Any]]) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """OpenAI 格式消息 -> Claude 格式（system 单独传，data URL 图片转为 base64 source）"""
+    system = None
+    converted = []
+    for message in messages:
+        if message["role"] == "system":
+            system = message["content"]
+            continue
+
+        content = message["content"]
+        if isinstance(content, list):
+            items = []
+            for item in content:
+                if item.get("type") == "image_url":
+                    url = item["image_url"]["url"]
+                    header, data = url.split(",", 1)
+                    media_type = header[len("data:"):].split(";")[0] or "image/jpeg"
+                    items.append({
+                        "type": "image",
+                        "source": {"type": "base64", "media_type": media_type, "data": data}
+                    })
+                else:
+                    items.append(item)
+            content = items
+        converted.append({"role": message["role"], "content": content})
+    return system, converted
+
+
+class _CallStats:
+    """单个 (提供方, 模型) 的调用统计"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_latency_ms = 0
+        self.max_latency_ms = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_latency_ms": round(self.total_latency_ms / self.calls) if self.calls else 0,
+            "max_latency_ms": self.max_latency_ms,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens
+        }
+
+
+class _InstrumentedCompletions:
+    """
+    包装 AsyncOpenAI 的 chat.completions，记录耗时和用量
+
+    可作为 ChatOpenAI 的 async_client 传入，让 LangChain 的调用也走网关连接池
+    """
+
+    def __init__(self, completions, gateway: "ModelGateway"):
+        self._completions = completions
+        self._gateway = gateway
+
+    async def create(self, **kwargs):
+        model = kwargs.get("model", "")
+        start = time.perf_counter()
+        try:
+            response = await self._completions.create(**kwargs)
+        except Exception:
+            self._gateway.record("openai_sdk", model, start, error=True)
+            raise
+
+        if kwargs.get("stream"):
+            return self._gateway._record_stream(response, model, start)
+
+        self._gateway.record("openai_sdk", model, start, _normalize_usage(response.usage, "openai_sdk"))
+        return response
+
+
+class ModelGateway:
+    """
+    出站模型调用网关
+
+    - 每个事件循环一套长连接池：aiohttp 会话（qwen / claude）和按 (base_url, api_key) 复用的 AsyncOpenAI
+    - 同步 OpenAI 客户端（Embedding 在线程池中调用）全局复用
+    - record() / stats() 提供按 (提供方, 模型) 的耗时和 token 统计
+    """
+
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        timeout: Optional[float] = None
+    ):
+        self.max_connections = max_connections or int(os.getenv("MODEL_MAX_CONNECTIONS", "64"))
+        self.max_keepalive = max_keepalive or int(os.getenv("MODEL_MAX_KEEPALIVE", "32"))
+        self.keepalive_expiry = keepalive_expiry or float(os.getenv("MODEL_KEEPALIVE_EXPIRY", "60"))
+        self.timeout = timeout or float(os.getenv("MODEL_TIMEOUT", "300"))
+
+        # 事件循环 -> {连接池键: 客户端}；循环结束后自动释放
+        self._loop_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Any, Any]]" = weakref.WeakKeyDictionary()
+        self._sync_clients: Dict[Tuple[str, str], Any] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], _CallStats] = {}
+
+    # ---------- 连接池 ----------
+
+    def _pools(self) -> Dict[Any, Any]:
+        loop = asyncio.get_running_loop()
+        pools = self._loop_pools.get(loop)
+        if pools is None:
+            pools = {}
+            self._loop_pools[loop] = pools
+        return pools
+
+    def _httpx_limits(self) -> "httpx.Limits":
+        import httpx
+
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry
+        )
+
+    def http_session(self) -> "aiohttp.ClientSession":
+        """当前事件循环共用的 aiohttp 会话"""
+        import aiohttp
+
+        pools = self._pools()
+        session = pools.get("aiohttp")
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_expiry)
+            session = aiohttp.ClientSession(connector=connector)
+            pools["aiohttp"] = session
+        return session
+
+    def openai_client(self, base_url: str, api_key: Optional[str]):
+        """当前事件循环共用的 AsyncOpenAI 客户端（按 base_url + api_key 复用）"""
+        import httpx
+        from openai import AsyncOpenAI
+
+        pools = self._pools()
+        key = ("openai", base_url, api_key)
+        client = pools.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=httpx.AsyncClient(
+                    limits=self._httpx_limits(),
+                    timeout=httpx.Timeout(self.timeout, connect=10.0)
+                )
+            )
+            pools[key] = client
+        return client
+
+    def chat_completions(self, base_url: str, api_key: Optional[str]) -> _InstrumentedCompletions:
+        """带统计的 chat.completions（供 ChatOpenAI 的 async_client 使用）"""
+        return _InstrumentedCompletions(self.openai_client(base_url, api_key).chat.completions, self)
+
+    def sync_openai_client(self, base_url: str, api_key: Optional[str]):
+        """全局共用的同步 OpenAI 客户端（线程安全，可在执行器线程中调用）"""
+        import httpx
+        from openai import OpenAI
+
+        key = (base_url, api_key)
+        client = self._sync_clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._sync_clients.get(key)
+                if client is None:
+                    client = OpenAI(
+                        api_key=api_key,
+                        base_url=base_url,
+                        http_client=httpx.Client(
+                            limits=self._httpx_limits(),
+                            timeout=httpx.Timeout(self.timeout, connect=10.0),
+                            follow_redirects=True
+                        )
+                    )
+                    self._sync_clients[key] = client
+        return client
+
+    async def aclose(self):
+        """关闭当前事件循环的连接池（应用关闭时调用）"""
+        loop = asyncio.get_running_loop()
+        pools = self._loop_pools.pop(loop, {})
+        for client in pools.values():
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"  ⚠️ 关闭模型连接池失败: {e}")
+
+    # ---------- 调用 ----------
+
+    async def chat(
+        self,
+        provider: str,
+        model_url: str,
+        api_key: Optional[str],
+        model: str,
+        messages: List[Dict[str, Any]],
+        max_tokens: int = 4096,
+        temperature: float = 0.1,
+        response_format: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None
+    ) -> ChatResult:
+        """
+        统一的对话调用
+
+        Args:
+            provider: openai_sdk / qwen / claude（见 detect_provider）
+            model_url: 模型地址（与各调用方原有配置一致）
+            messages: OpenAI 格式消息（claude 会自动转换）
+            response_format: 仅 openai_sdk 方式生效
+        """
+        start = time.perf_counter()
+        try:
+            if provider == "openai_sdk":
+                content, usage = await self._chat_openai_sdk(
+                    model_url, api_key, model, messages, max_tokens, temperature, response_format
+                )
+            elif provider == "qwen":
+                content, usage = await self._chat_openai_http(
+                    model_url, api_key, model, messages, max_tokens, temperature, timeout
+                )
+            elif provider == "claude":
+                content, usage = await self._chat_claude(
+                    model_url, api_key, model, messages, max_tokens, temperature, timeout
+                )
+            else:
+                raise ValueError(f"不支持的API类型: {provider}")
+        except Exception:
+            self.record(provider, model, start, error=True)
+            raise
+
+        token_usage = _normalize_usage(usage, provider)
+        latency_ms = self.record(provider, model, start, token_usage)
+        return ChatResult(content=content, token_usage=token_usage, latency_ms=latency_ms, provider=provider)
+
+    async def _chat_openai_sdk(self, model_url, api_key, model, messages, max_tokens, temperature, response_format):
+        params = {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+        if response_format:
+            params["response_format"] = response_format
+        response = await self.openai_client(openai_base_url(model_url), api_key).chat.completions.create(**params)
+        return response.choices[0].message.content, response.usage
+
+    async def _post_json(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: Optional[float]):
+        import aiohttp
+
+        async with self.http_session().post(
+            url,
+            headers=headers,
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=timeout or self.timeout)
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(f"API错误 {response.status}: {error_text[:500]}")
+            return await response.json()
+
+    async def _chat_openai_http(self, model_url, api_key, model, messages, max_tokens, temperature, timeout):
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+        payload = {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+        result = await self._post_json(chat_completions_url(model_url), headers, payload, timeout)
+        return result["choices"][0]["message"]["content"], result.get("usage")
+
+    async def _chat_claude(self, model_url, api_key, model, messages, max_tokens, temperature, timeout):
+        headers = {"Content-Type": "application/json", "x-api-key": api_key, "anthropic-version": "2023-06-01"}
+        system, claude_messages = _to_claude_messages(messages)
+        payload = {"model": model, "max_tokens": max_tokens, "temperature": temperature, "messages": claude_messages}
+        if system:
+            payload["system"] = system
+        result = await self._post_json(model_url, headers, payload, timeout)
+        return result["content"][0]["text"], result.get("usage")
+
+    def embed_sync(
+        self,
+        base_url: str,
+        api_key: Optional[str],
+        model: str,
+        texts: List[str],
+        **kwargs
+    ) -> List[List[float]]:
+        """同步 Embedding 调用（OpenAI 兼容接口），按输入顺序返回向量"""
+        start = time.perf_counter()
+        try:
+            response = self.sync_openai_client(base_url, api_key).embeddings.create(model=model, input=texts, **kwargs)
+        except Exception:
+            self.record("embedding", model, start, error=True)
+            raise
+        self.record("embedding", model, start, _normalize_usage(response.usage, "openai_sdk"))
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+    # ---------- 统计 ----------
+
+    def record(
+        self,
+        provider: str,
+        model: str,
+        start: float,
+        token_usage: Optional[Dict[str, int]] = None,
+        error: bool = False
+    ) -> int:
+        """记录一次调用，返回耗时（毫秒）"""
+        latency_ms = round((time.perf_counter() - start) * 1000)
+        with self._lock:
+            stats = self._stats.setdefault((provider, model), _CallStats())
+            stats.calls += 1
+            stats.total_latency_ms += latency_ms
+            stats.max_latency_ms = max(stats.max_latency_ms, latency_ms)
+            if error:
+                stats.errors += 1
+            if token_usage:
+                stats.prompt_tokens += token_usage.get("prompt_tokens") or 0
+                stats.completion_tokens += token_usage.get("completion_tokens") or 0
+        return latency_ms
+
+    async def _record_stream(self, stream, model: str, start: float):
+        """流式响应：转发数据块，结束时记录总耗时和输出片段数（约等于输出 token 数）"""
+        chunks = 0
+        try:
+            async for chunk in stream:
+                chunks += 1
+                yield chunk
+        except Exception:
+            self.record("openai_sdk", model, start, error=True)
+            raise
+        self.record("openai_sdk", model, start, {"completion_tokens": chunks})
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """按 "提供方/模型" 汇总的调用统计"""
+        with self._lock:
+            return {f"{provider}/{model}": s.to_dict() for (provider, model), s in self._stats.items()}
+
+
+_gateway: Optional[ModelGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> ModelGateway:
+    """进程内共用的网关实例"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = ModelGateway()
+    return _gateway
@@ -0,0 +1,357 @@
+"""
+共享模型推理进程
+多进程部署（见 serve_workers）时，写入进程和各检索 worker 不各自加载 Embedding / 重排模型，
+而是通过 Unix socket 调用同一个模型进程：模型内存只占一份，并发请求在进程内合并成批推理。
+
+协议：每个帧为 4 字节大端长度 + 内容
+    请求   JSON {"op": "embed", "texts": [...]} / {"op": "rerank", "pairs": [[query, text], ...]} / {"op": "ping"}
+    响应   JSON 头 {"ok": true, ...}；embed 的头为 {"ok": true, "shape": [n, dim]}，随后一帧 float32 向量
+           出错时为 {"ok": false, "error": "..."}
+
+使用示例：
+python model_server.py --socket /tmp/rag_models.sock
+"""
+import os
+import json
+import time
+import socket
+import struct
+import asyncio
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("RAG_Service")
+
+_LENGTH = struct.Struct("!I")
+DEFAULT_SOCKET = "/tmp/rag_models.sock"
+
+
+def create_local_embeddings(embedding_type: Optional[str] = None):
+    """
+    按 EMBEDDING_TYPE 在当前进程中创建 Embedding 模型（qwen 为远程 API，其余为本地 HuggingFace 模型）
+
+    本地模型的推理后端由 EMBEDDING_BACKEND 选择：sentence_transformers（默认）/ torch / torch_int8
+    """
+    embedding_type = (embedding_type or os.getenv("EMBEDDING_TYPE", "huggingface")).lower()
+
+    if embedding_type == "qwen":
+        # 使用通义千问 Embedding
+        from qwen_embeddings import QwenEmbeddings
+
+        logger.info("  使用通义千问 text-embedding-v4")
+        return QwenEmbeddings(
+            api_key=os.getenv("DASHSCOPE_API_KEY"),
+            base_url=os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
+            model=os.getenv("EMBEDDING_MODEL", "text-embedding-v4"),
+            dimensions=int(os.getenv("EMBEDDING_DIMENSIONS", "1024"))
+        )
+
+    model_name = os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+    backend = os.getenv("EMBEDDING_BACKEND", "sentence_transformers").lower()
+    if backend != "sentence_transformers":
+        # CPU 优化推理（动态填充 / int8 量化），向量与 sentence-transformers 兼容，见 cpu_embeddings
+        from cpu_embeddings import CPUEmbeddings
+
+        return CPUEmbeddings(model_name, backend=backend)
+
+    # 使用 HuggingFace Embedding（默认，离线可用）
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    logger.info(f"使用 HuggingFace Embedding: {model_name}")
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': True}
+    )
+
+
+# ============ 服务端 ============
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    header = await reader.readexactly(_LENGTH.size)
+    return await reader.readexactly(_LENGTH.unpack(header)[0])
+
+
+def _frame(payload: bytes) -> bytes:
+    return _LENGTH.pack(len(payload)) + payload
+
+
+class ModelServer:
+    """
+    模型推理服务
+
+    - embed：各连接的请求进入同一队列，推理线程空闲时把排队的请求合并为一批（至多 max_batch 条文本）
+    - rerank：交叉编码器在独立线程中推理，首次请求时加载
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        embeddings=None,
+        max_batch: Optional[int] = None,
+        batch_wait_ms: Optional[float] = None
+    ):
+        """
+        Args:
+            embeddings: Embedding 模型（实现 embed_documents），为 None 时按 EMBEDDING_TYPE 创建
+            max_batch: 合并推理的文本条数上限（默认读取 MODEL_SERVER_MAX_BATCH）
+            batch_wait_ms: 凑批的最长等待时间（默认读取 MODEL_SERVER_BATCH_WAIT_MS）
+        """
+        self.socket_path = socket_path
+        self.embeddings = embeddings if embeddings is not None else create_local_embeddings()
+        self.max_batch = max_batch or int(os.getenv("MODEL_SERVER_MAX_BATCH", "64"))
+        wait_ms = batch_wait_ms if batch_wait_ms is not None else float(os.getenv("MODEL_SERVER_BATCH_WAIT_MS", "2"))
+        self.batch_wait = wait_ms / 1000
+
+        self._embed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model_embed")
+        self._rerank_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model_rerank")
+        self._reranker = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.started_at = time.time()
+        self.stats = {"connections": 0, "requests": 0, "texts": 0, "batches": 0, "rerank_pairs": 0}
+
+    async def start(self):
+        """监听 Unix socket（已存在的旧 socket 文件先删除）"""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.create_task(self._embed_batches())
+        self._server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        logger.info(f"✓ 模型服务已监听: {self.socket_path}")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._batcher.cancel()
+        self._embed_executor.shutdown(wait=False)
+        self._rerank_executor.shutdown(wait=False)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """一个连接上的请求依次处理（客户端每个线程独占一条连接）"""
+        self.stats["connections"] += 1
+        try:
+            while True:
+                try:
+                    request = json.loads(await _read_frame(reader))
+                except asyncio.IncompleteReadError:
+                    break
+                self.stats["requests"] += 1
+                try:
+                    header, payload = await self._dispatch(request)
+                except Exception as e:
+                    logger.error(f"模型服务请求失败: {e}")
+                    header, payload = {"ok": False, "error": f"{type(e).__name__}: {e}"}, None
+                writer.write(_frame(json.dumps(header, ensure_ascii=False).encode("utf-8")))
+                if payload is not None:
+                    writer.write(_frame(payload))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[bytes]]:
+        op = request.get("op")
+        if op == "embed":
+            vectors = await self._embed(request["texts"])
+            return {"ok": True, "shape": list(vectors.shape)}, vectors.tobytes()
+        if op == "rerank":
+            scores = await self._rerank(request["pairs"])
+            return {"ok": True, "scores": scores}, None
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid(), "uptime": round(time.time() - self.started_at, 1), **self.stats}, None
+        raise ValueError(f"未知操作: {op}")
+
+    async def _embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, future))
+        return await future
+
+    async def _embed_batches(self):
+        """合并排队的 embed 请求：取出第一个请求后最多再等 batch_wait 凑批，整批一次推理再按请求拆分"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            n_texts = len(batch[0][0])
+            deadline = loop.time() + self.batch_wait
+            while n_texts < self.max_batch:
+                try:
+                    if self._queue.empty():
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                n_texts += len(item[0])
+
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                vectors = await loop.run_in_executor(self._embed_executor, self.embeddings.embed_documents, texts)
+                vectors = np.asarray(vectors, dtype=np.float32)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.stats["batches"] += 1
+            self.stats["texts"] += len(texts)
+            offset = 0
+            for request_texts, future in batch:
+                if not future.done():
+                    future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+    async def _rerank(self, pairs: List[List[str]]) -> List[float]:
+        loop = asyncio.get_running_loop()
+        if self._reranker is None:
+            from reranker import CrossEncoderReranker
+            self._reranker = await loop.run_in_executor(self._rerank_executor, CrossEncoderReranker)
+        self.stats["rerank_pairs"] += len(pairs)
+        scores = await loop.run_in_executor(self._rerank_executor, self._reranker.predict, pairs)
+        return [float(score) for score in scores]
+
+
+# ============ 客户端 ============
+
+class ModelServerError(RuntimeError):
+    """模型服务返回的错误"""
+
+
+class ModelServerClient:
+    """
+    模型服务客户端（同步，线程安全）
+
+    每次调用从连接池取一条空闲连接，用完放回；模型服务尚未启动时在 connect_timeout 内重试连接。
+    """
+
+    def __init__(self, socket_path: str, connect_timeout: Optional[float] = None, timeout: Optional[float] = None):
+        self.socket_path = socket_path
+        self.connect_timeout = connect_timeout if connect_timeout is not None else float(
+            os.getenv("MODEL_SERVER_CONNECT_TIMEOUT", "120")
+        )
+        self.timeout = timeout if timeout is not None else float(os.getenv("MODEL_TIMEOUT", "300"))
+        self._idle: List[socket.socket] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> socket.socket:
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                sock.settimeout(self.timeout)
+                return sock
+            except OSError:
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.2)
+
+    @staticmethod
+    def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            n = sock.recv_into(view[received:])
+            if n == 0:
+                raise ConnectionError("模型服务关闭了连接")
+            received += n
+        return bytes(buffer)
+
+    def _recv_frame(self, sock: socket.socket) -> bytes:
+        length = _LENGTH.unpack(self._recv_exactly(sock, _LENGTH.size))[0]
+        return self._recv_exactly(sock, length)
+
+    def call(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[bytes]]:
+        """发送一个请求，返回 (响应头, 向量数据或 None)"""
+        with self._lock:
+            sock = self._idle.pop() if self._idle else None
+        if sock is None:
+            sock = self._connect()
+
+        try:
+            sock.sendall(_frame(json.dumps(request, ensure_ascii=False).encode("utf-8")))
+            header = json.loads(self._recv_frame(sock))
+            payload = self._recv_frame(sock) if header.get("ok") and "shape" in header else None
+        except BaseException:
+            sock.close()
+            raise
+
+        with self._lock:
+            self._idle.append(sock)
+        if not header.get("ok"):
+            raise ModelServerError(header.get("error", "模型服务调用失败"))
+        return header, payload
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        header, payload = self.call({"op": "embed", "texts": list(texts)})
+        return np.frombuffer(payload, dtype=np.float32).reshape(header["shape"])
+
+    def rerank(self, pairs: List[List[str]]) -> List[float]:
+        return self.call({"op": "rerank", "pairs": [list(pair) for pair in pairs]})[0]["scores"]
+
+    def ping(self) -> Dict[str, Any]:
+        return self.call({"op": "ping"})[0]
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock in idle:
+            sock.close()
+
+
+class RemoteEmbeddings:
+    """Embedding 接口（embed_documents / embed_query）的模型服务实现"""
+
+    def __init__(self, client: ModelServerClient):
+        self.client = client
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.client.embed(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.client.embed([text])[0].tolist()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="共享模型推理进程（Embedding / 重排）")
+    parser.add_argument("--socket", default=os.getenv("MODEL_SERVER_SOCKET", DEFAULT_SOCKET), help="Unix socket 路径")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    server = ModelServer(args.socket)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
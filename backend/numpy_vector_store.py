@@ -0,0 +1,555 @@
+"""
+进程内向量索引（NumPy 内存映射）
+适用于单租户 20 万文本块以内的语料：进程内精确检索 / HNSW，没有序列化和 SQLite 开销
+
+存储布局（目录下）：
+    manifest.json                 段列表与向量维度/精度，写入新段后原子替换，是唯一的提交点
+    seg_000001.vectors.npy        向量矩阵（float32 或 float16），查询时以 mmap 只读打开
+    seg_000001.norms.npy          每行向量的平方范数（float32），用于计算 L2 距离
+    seg_000001.rows.jsonl         每行一个 {"id", "document", "metadata"}；删除记录为 {"id", "deleted": true}（向量全零）
+    seg_000001.hnsw.bin           行数达到 hnsw_min_rows 的段额外建 HNSW 图（需要 hnswlib，随 chromadb 安装）
+
+检索：小段以及过滤后剩余行数不足 hnsw_min_rows 的段做精确检索（矩阵乘法），大段走 HNSW（过滤条件作为 filter 回调）。
+写入只追加新段；同一 id 再次写入时以最后一次为准（旧行在内存中标记失效）。
+删除也追加一个段，其中是删除记录（墓碑）：重放时使更早写入的同 id 行失效；合并到最早的段时墓碑才被丢弃。
+段数按大小分层合并（相邻两段中前一段不超过后一段的 2 倍时合并），段数保持在 O(log N)。
+距离与 Chroma 默认的 l2 空间一致（平方欧氏距离），两种后端的相似度可以直接比较。
+
+只读模式（read_only=True，多进程部署的检索 worker 使用）：不写入，每次读取前检查 manifest 是否被写入进程替换，
+替换后重新打开段列表（已打开的段复用，只映射新段），写入进程发布的新段随即可见。
+"""
+import os
+import json
+import copy
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metadata_filters import match_conditions
+
+try:
+    import hnswlib
+except ImportError:  # 没有 hnswlib 时所有段都做精确检索
+    hnswlib = None
+
+MANIFEST = "manifest.json"
+SUPPORTED_DTYPES = ("float32", "float16")
+
+# float16 段按块转换为 float32 后再做矩阵乘法，避免整段拷贝
+_BLOCK_ROWS = 16384
+
+Hit = Tuple[str, str, Dict[str, Any], float]
+
+
+def where_to_conditions(where: Optional[Dict[str, Any]]) -> List[Tuple[str, str, Any]]:
+    """Chroma where 子句 -> [(字段, 运算符, 值)]（只支持 build_where 生成的 $and 扁平结构）"""
+    if not where:
+        return []
+    if "$and" in where:
+        conditions = []
+        for clause in where["$and"]:
+            conditions.extend(where_to_conditions(clause))
+        return conditions
+
+    conditions = []
+    for field, spec in where.items():
+        if isinstance(spec, dict):
+            conditions.extend((field, op, value) for op, value in spec.items())
+        else:
+            conditions.append((field, "$eq", spec))
+    return conditions
+
+
+class _Segment:
+    """一个只读段：内存映射的向量矩阵 + 行数据 + 存活标记"""
+
+    def __init__(
+        self,
+        name: str,
+        vectors: np.ndarray,
+        norms: np.ndarray,
+        rows: List[Dict[str, Any]],
+        hnsw=None
+    ):
+        self.name = name
+        self.vectors = vectors
+        self.norms = norms
+        self.hnsw = hnsw
+        self.ids = [row["id"] for row in rows]
+        self.documents = [row.get("document", "") for row in rows]
+        self.metadatas = [row.get("metadata") or {} for row in rows]
+        self.deleted = np.array([bool(row.get("deleted")) for row in rows], dtype=bool)  # 删除记录（墓碑）
+        self.alive = ~self.deleted
+        self._columns: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._columns_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def column(self, field: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        元数据列（首次过滤时按需构建，之后复用）
+
+        Returns:
+            (是否存在, 原始值 object 数组, 数值 float64 数组（非数值为 NaN）)
+        """
+        cached = self._columns.get(field)
+        if cached is not None:
+            return cached
+        with self._columns_lock:
+            if field not in self._columns:
+                present = np.fromiter((field in m for m in self.metadatas), dtype=bool, count=len(self))
+                values = np.empty(len(self), dtype=object)
+                values[:] = [m.get(field) for m in self.metadatas]
+                numbers = np.fromiter(
+                    (
+                        float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan
+                        for v in values
+                    ),
+                    dtype=np.float64,
+                    count=len(self)
+                )
+                self._columns[field] = (present, values, numbers)
+            return self._columns[field]
+
+    def mask(self, conditions: List[Tuple[str, str, Any]]) -> np.ndarray:
+        """满足全部条件的存活行（语义与 metadata_filters.match_conditions 一致）"""
+        mask = self.alive.copy()
+        for field, op, value in conditions:
+            if not mask.any():
+                break
+            present, values, numbers = self.column(field)
+            if op in ("$gt", "$gte", "$lt", "$lte") and isinstance(value, (int, float)) and not isinstance(value, bool):
+                with np.errstate(invalid="ignore"):
+                    if op == "$gt":
+                        matched = numbers > value
+                    elif op == "$gte":
+                        matched = numbers >= value
+                    elif op == "$lt":
+                        matched = numbers < value
+                    else:
+                        matched = numbers <= value
+            elif op in ("$eq", "$ne") and isinstance(value, (str, int, float, bool)):
+                matched = np.asarray(values == value, dtype=bool)
+                if op == "$ne":
+                    matched = ~matched
+                else:
+                    matched &= present
+            else:
+                candidates = np.flatnonzero(mask)
+                matched = np.zeros(len(self), dtype=bool)
+                for i in candidates:
+                    matched[i] = match_conditions(self.metadatas[i], [(field, op, value)])
+            mask &= matched
+        return mask
+
+    def search(
+        self,
+        queries: np.ndarray,
+        query_norms: np.ndarray,
+        n_results: int,
+        conditions: List[Tuple[str, str, Any]],
+        hnsw_min_rows: int = 0
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """段内检索，返回每个查询的 (行号, 距离)，按距离升序"""
+        mask = self.mask(conditions) if conditions else self.alive
+        rows = None if mask.all() else np.flatnonzero(mask)
+        n_rows = len(self) if rows is None else len(rows)
+        if n_rows == 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))] * len(queries)
+
+        if self.hnsw is not None and n_rows >= hnsw_min_rows:
+            try:
+                labels, distances = self.hnsw.knn_query(
+                    queries, k=min(n_results, n_rows), num_threads=1,
+                    filter=None if rows is None else (lambda label: bool(mask[label]))
+                )
+                return [(labels[j].astype(np.int64), distances[j]) for j in range(len(queries))]
+            except RuntimeError:
+                # 过滤后图上可达的点不足 k 个，退回精确检索
+                pass
+
+        return self._exact_search(queries, query_norms, n_results, rows)
+
+    def _exact_search(
+        self,
+        queries: np.ndarray,
+        query_norms: np.ndarray,
+        n_results: int,
+        rows: Optional[np.ndarray]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """对全部行（rows 为 None）或指定行做精确检索"""
+        n_rows = len(self) if rows is None else len(rows)
+
+        # 平方欧氏距离：|x|² + |q|² - 2 x·q
+        dots = np.empty((n_rows, len(queries)), dtype=np.float32)
+        for start in range(0, n_rows, _BLOCK_ROWS):
+            stop = min(start + _BLOCK_ROWS, n_rows)
+            block = self.vectors[start:stop] if rows is None else self.vectors[rows[start:stop]]
+            dots[start:stop] = block.astype(np.float32, copy=False) @ queries.T
+        norms = self.norms if rows is None else self.norms[rows]
+        distances = norms[:, None] + query_norms[None, :] - 2.0 * dots
+        np.maximum(distances, 0.0, out=distances)
+
+        k = min(n_results, n_rows)
+        results = []
+        for j in range(len(queries)):
+            column = distances[:, j]
+            top = np.argpartition(column, k - 1)[:k] if k < n_rows else np.arange(n_rows)
+            top = top[np.argsort(column[top], kind="stable")]
+            results.append((top if rows is None else rows[top], column[top]))
+        return results
+
+
+class NumpyVectorStore:
+    """
+    内存映射的 NumPy 向量索引
+
+    接口与 vector_backends.ChromaBackend 一致：count / upsert / query / get
+    """
+
+    name = "numpy"
+
+    def __init__(
+        self,
+        directory: str,
+        dtype: str = "float32",
+        hnsw_min_rows: int = 10000,
+        hnsw_ef: int = 100,
+        hnsw_m: int = 16,
+        hnsw_ef_construction: int = 100,
+        read_only: bool = False
+    ):
+        """
+        Args:
+            dtype: 新建索引的向量存储精度（已有索引以 manifest 为准）
+            hnsw_min_rows: 段行数（或过滤后行数）达到该值才使用 HNSW，否则精确检索；hnswlib 不可用时始终精确检索
+            hnsw_ef / hnsw_m / hnsw_ef_construction: HNSW 查询与构建参数
+            read_only: 只读跟随另一个进程写入的索引
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"不支持的向量精度: {dtype}（可选 {', '.join(SUPPORTED_DTYPES)}）")
+
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.read_only = read_only
+        self.dtype = dtype
+        self.hnsw_min_rows = hnsw_min_rows
+        self.hnsw_ef = hnsw_ef
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.dim: Optional[int] = None
+        self._next_segment = 1
+        self._segments: List[_Segment] = []
+        self._positions: Dict[str, Tuple[str, int]] = {}  # id -> (段名, 行号)
+        self._write_lock = threading.Lock()
+        self._opened: Dict[str, _Segment] = {}  # 段名 -> 打开的段（未经重放，只读模式重新加载时复用）
+        self._manifest_version: Optional[tuple] = None
+        self._load()
+
+    # ---------- 持久化 ----------
+
+    def _manifest_stat(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.directory / MANIFEST)
+        except FileNotFoundError:
+            return None
+        # manifest 每次以 os.replace 整体替换，inode 随之变化
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _load(self):
+        # 只读模式下写入进程可能在读 manifest 和打开段之间合并并删除旧段：重新读取 manifest
+        for attempt in range(3):
+            version = self._manifest_stat()
+            if version is None:
+                return
+            manifest = json.loads((self.directory / MANIFEST).read_text(encoding="utf-8"))
+            try:
+                segments = [
+                    self._opened[name] if name in self._opened else self._open_segment(name)
+                    for name in manifest.get("segments", [])
+                ]
+                break
+            except FileNotFoundError:
+                if not self.read_only or attempt == 2:
+                    raise
+
+        self.dim = manifest.get("dim")
+        self.dtype = manifest.get("dtype", self.dtype)
+        self._next_segment = manifest.get("next_segment", 1)
+        self._opened = {segment.name: segment for segment in segments}
+        self._manifest_version = version
+        self._publish(segments)
+
+    def refresh(self) -> bool:
+        """只读模式：manifest 变化时重新加载段列表，返回是否重新加载"""
+        if not self.read_only or self._manifest_stat() == self._manifest_version:
+            return False
+        with self._write_lock:
+            if self._manifest_stat() == self._manifest_version:
+                return False
+            self._load()
+        return True
+
+    def _open_segment(self, name: str) -> _Segment:
+        vectors = np.load(self.directory / f"{name}.vectors.npy", mmap_mode="r")
+        norms = np.load(self.directory / f"{name}.norms.npy")
+        with open(self.directory / f"{name}.rows.jsonl", "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+        hnsw = None
+        hnsw_path = self.directory / f"{name}.hnsw.bin"
+        if hnswlib is not None and hnsw_path.exists():
+            hnsw = hnswlib.Index(space="l2", dim=vectors.shape[1])
+            hnsw.load_index(str(hnsw_path), max_elements=len(rows))
+            hnsw.set_ef(self.hnsw_ef)
+        return _Segment(name, vectors, norms, rows, hnsw)
+
+    def _write_segment(self, vectors: np.ndarray, rows: List[Dict[str, Any]]) -> _Segment:
+        name = f"seg_{self._next_segment:06d}"
+        self._next_segment += 1
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype)
+        stored = vectors.astype(np.float32)
+        norms = np.einsum("ij,ij->i", stored, stored).astype(np.float32)
+
+        # 先写临时文件再改名；manifest 替换之前，新段对读者不可见
+        for suffix, writer in (
+            ("vectors.npy", lambda f: np.save(f, vectors)),
+            ("norms.npy", lambda f: np.save(f, norms)),
+            ("rows.jsonl", lambda f: f.write("".join(
+                json.dumps(row, ensure_ascii=False) + "\n" for row in rows
+            ).encode("utf-8")))
+        ):
+            path = self.directory / f"{name}.{suffix}"
+            tmp_path = path.with_name(path.name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                writer(f)
+            os.replace(tmp_path, path)
+
+        if hnswlib is not None and len(rows) >= self.hnsw_min_rows:
+            hnsw = hnswlib.Index(space="l2", dim=stored.shape[1])
+            hnsw.init_index(max_elements=len(rows), ef_construction=self.hnsw_ef_construction, M=self.hnsw_m)
+            hnsw.add_items(stored, np.arange(len(rows)))
+            path = self.directory / f"{name}.hnsw.bin"
+            tmp_path = path.with_name(path.name + ".tmp")
+            hnsw.save_index(str(tmp_path))
+            os.replace(tmp_path, path)
+        return self._open_segment(name)
+
+    def _write_manifest(self, segments: List[_Segment]):
+        manifest = {
+            "dim": self.dim,
+            "dtype": self.dtype,
+            "next_segment": self._next_segment,
+            "segments": [segment.name for segment in segments]
+        }
+        tmp_path = self.directory / (MANIFEST + ".tmp")
+        tmp_path.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.directory / MANIFEST)
+
+    @staticmethod
+    def _replay(segments: List[_Segment]) -> Tuple[List[_Segment], Dict[str, Tuple[str, int]]]:
+        """
+        按段顺序重放：后写入的同 id 行覆盖先写入的，删除记录使先写入的行失效
+        （被覆盖的段复制一份再改存活标记，不影响正在查询的读者）
+        """
+        positions: Dict[str, Tuple[str, int]] = {}
+        stale: Dict[str, List[int]] = {}
+        for segment in segments:
+            for row, chunk_id in enumerate(segment.ids):
+                if segment.deleted[row]:
+                    previous = positions.pop(chunk_id, None)
+                    if previous is not None:
+                        stale.setdefault(previous[0], []).append(previous[1])
+                    continue
+                if not segment.alive[row]:
+                    continue
+                previous = positions.get(chunk_id)
+                if previous is not None:
+                    stale.setdefault(previous[0], []).append(previous[1])
+                positions[chunk_id] = (segment.name, row)
+
+        replayed = []
+        for segment in segments:
+            rows = stale.get(segment.name)
+            if rows:
+                segment = copy.copy(segment)
+                segment.alive = segment.alive.copy()
+                segment.alive[rows] = False
+            replayed.append(segment)
+        return replayed, positions
+
+    def _publish(self, segments: List[_Segment]):
+        """整体替换段列表（读者持有旧列表不受影响）"""
+        self._segments, self._positions = self._replay(segments)
+
+    # ---------- 写入 ----------
+
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]]
+    ):
+        """追加一个新段（同一批内重复的 id 以最后一次为准），必要时合并小段"""
+        if self.read_only:
+            raise PermissionError(f"向量索引以只读模式打开: {self.directory}")
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError(f"向量形状 {vectors.shape} 与 {len(ids)} 个 id 不匹配")
+
+        with self._write_lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与索引维度 {self.dim} 不一致")
+
+            rows = [
+                {"id": chunk_id, "document": document, "metadata": metadata or {}}
+                for chunk_id, document, metadata in zip(ids, documents, metadatas)
+            ]
+            self._append_segment(vectors, rows)
+
+    def delete(self, where: Optional[Dict[str, Any]] = None, ids: Optional[List[str]] = None) -> List[str]:
+        """
+        删除满足条件（或指定 id）的存活行：追加一个删除记录段，返回被删除的 id
+
+        where 与 ids 同时给出时删除两者的交集
+        """
+        if self.read_only:
+            raise PermissionError(f"向量索引以只读模式打开: {self.directory}")
+        with self._write_lock:
+            matched = self.get(where)["ids"]
+            if ids is not None:
+                wanted = set(ids)
+                matched = [chunk_id for chunk_id in matched if chunk_id in wanted]
+            if matched:
+                self._append_segment(
+                    np.zeros((len(matched), self.dim), dtype=np.float32),
+                    [{"id": chunk_id, "deleted": True} for chunk_id in matched]
+                )
+        return matched
+
+    def _append_segment(self, vectors: np.ndarray, rows: List[Dict[str, Any]]):
+        """写入新段、合并、发布 manifest 并删除被合并的段文件（调用方持有写锁）"""
+        segments = self._segments + [self._write_segment(vectors, rows)]
+        segments, retired = self._merge_tail(segments)
+        self._write_manifest(segments)
+        self._publish(segments)
+
+        for name in retired:
+            for suffix in ("vectors.npy", "norms.npy", "rows.jsonl", "hnsw.bin"):
+                try:
+                    (self.directory / f"{name}.{suffix}").unlink()
+                except FileNotFoundError:
+                    pass
+
+    def _merge_tail(self, segments: List[_Segment]) -> Tuple[List[_Segment], List[str]]:
+        """
+        前一段不超过后一段的 2 倍时合并两段（只保留存活行；更早还有段时保留删除记录），
+        返回新段列表和待删除的段名
+        """
+        # 先重放一次，保证合并时只拷贝最新版本的行
+        segments, _ = self._replay(segments)
+        retired = []
+        while len(segments) >= 2 and segments[-2].alive.sum() <= 2 * segments[-1].alive.sum():
+            older, newer = segments[-2], segments[-1]
+            parts, rows = [], []
+            keep_deleted = len(segments) > 2
+            for segment in (older, newer):
+                keep = np.flatnonzero(segment.alive | (segment.deleted if keep_deleted else False))
+                parts.append(np.asarray(segment.vectors[keep]))
+                rows.extend(
+                    {"id": segment.ids[i], "deleted": True} if segment.deleted[i] else
+                    {"id": segment.ids[i], "document": segment.documents[i], "metadata": segment.metadatas[i]}
+                    for i in keep
+                )
+            merged = self._write_segment(np.concatenate(parts), rows)
+            segments = segments[:-2] + [merged]
+            retired.extend([older.name, newer.name])
+        return segments, retired
+
+    # ---------- 读取 ----------
+
+    def count(self) -> int:
+        self.refresh()
+        return len(self._positions)
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def query(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[List[Hit]]:
+        """
+        多向量检索
+
+        Returns:
+            每个查询一个列表：[(id, 文本, 元数据, 平方欧氏距离)]，按距离升序
+        """
+        self.refresh()
+        segments = self._segments
+        if not query_embeddings:
+            return []
+        if n_results <= 0 or not segments:
+            return [[] for _ in query_embeddings]
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        conditions = where_to_conditions(where)
+
+        per_query: List[List[Tuple[float, _Segment, int]]] = [[] for _ in query_embeddings]
+        for segment in segments:
+            hits = segment.search(queries, query_norms, n_results, conditions, self.hnsw_min_rows)
+            for j, (rows, distances) in enumerate(hits):
+                per_query[j].extend(zip(distances.tolist(), [segment] * len(rows), rows.tolist()))
+
+        results = []
+        for candidates in per_query:
+            candidates.sort(key=lambda c: c[0])
+            results.append([
+                (segment.ids[row], segment.documents[row], segment.metadatas[row], distance)
+                for distance, segment, row in candidates[:n_results]
+            ])
+        return results
+
+    def get(
+        self,
+        where: Optional[Dict[str, Any]] = None,
+        include_embeddings: bool = False
+    ) -> Dict[str, Any]:
+        """按条件取出全部存活行（不排序），格式与 Chroma get 一致"""
+        self.refresh()
+        conditions = where_to_conditions(where)
+        result: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": []}
+        if include_embeddings:
+            result["embeddings"] = []
+        for segment in self._segments:
+            for row in np.flatnonzero(segment.mask(conditions)):
+                result["ids"].append(segment.ids[row])
+                result["documents"].append(segment.documents[row])
+                result["metadatas"].append(segment.metadatas[row])
+                if include_embeddings:
+                    result["embeddings"].append(segment.vectors[row].astype(np.float32).tolist())
+        return result
+
+    def get_embeddings(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """按 id 取向量（float32；不存在的 id 不返回）"""
+        self.refresh()
+        positions = self._positions
+        segments = {segment.name: segment for segment in self._segments}
+        vectors = {}
+        for chunk_id in ids:
+            name, row = positions.get(chunk_id, (None, None))
+            # 只读跟随时段列表可能刚被替换：找不到的段跳过
+            if name in segments:
+                vectors[chunk_id] = np.asarray(segments[name].vectors[row], dtype=np.float32)
+        return vectors
@@ -3,11 +3,14 @@
 支持 LangChain 的 Embeddings 接口
 """
 import os
+import logging
 from typing import List
-import httpx
-from openai import OpenAI
 from langchain.embeddings.base import Embeddings
 
+from model_gateway import get_gateway
+
+logger = logging.getLogger("RAG_Service")
+
 
 class QwenEmbeddings(Embeddings):
     """通义千问 text-embedding-v4 模型封装"""
@@ -18,7 +21,8 @@ class QwenEmbeddings(Embeddings):
         base_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1",
         model: str = "text-embedding-v4",
         dimensions: int = 1024,
-        encoding_format: str = "float"
+        encoding_format: str = "float",
+        batch_size: int = None
     ):
         """
         初始化通义千问 Embedding
@@ -29,6 +33,7 @@ class QwenEmbeddings(Embeddings):
             model: 模型名称（text-embedding-v4 或 text-embedding-v3）
             dimensions: 向量维度（仅 v3 和 v4 支持，v4 最大 1024）
             encoding_format: 编码格式
+            batch_size: 每次请求的文本条数（默认读取 EMBEDDING_BATCH_SIZE，DashScope 上限 10）
         """
         self.api_key = api_key or os.getenv("DASHSCOPE_API_KEY")
         if not self.api_key:
@@ -38,23 +43,12 @@ class QwenEmbeddings(Embeddings):
         self.model = model
         self.dimensions = dimensions
         self.encoding_format = encoding_format
+        self.batch_size = max(1, batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", "10")))
 
-        # 初始化 OpenAI 客户端
-        # 创建自定义 HTTP 客户端，避免 proxies 参数问题
-        http_client = httpx.Client(
-            timeout=60.0,
-            follow_redirects=True
-        )
-
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url=self.base_url,
-            http_client=http_client
-        )
+        # 调用经模型网关：共用长连接池，并记录耗时和 token 用量
+        self.gateway = get_gateway()
 
-        print(f"✓ 初始化通义千问 Embedding")
-        print(f"  模型: {self.model}")
-        print(f"  维度: {self.dimensions}")
+        logger.info(f"✓ 初始化通义千问 Embedding（模型: {self.model}，维度: {self.dimensions}）")
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """
@@ -68,25 +62,42 @@ class QwenEmbeddings(Embeddings):
         """
         embeddings = []
 
-        # 批量处理（通义千问支持批量，但为了稳定性我们也可以单个处理）
-        for text in texts:
+        # 按批调用（DashScope 单次最多 batch_size 条），整批失败时逐条重试
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
             try:
-                response = self.client.embeddings.create(
-                    model=self.model,
-                    input=text,
-                    dimensions=self.dimensions,
-                    encoding_format=self.encoding_format
-                )
-                embedding = response.data[0].embedding
-                embeddings.append(embedding)
-
+                embeddings.extend(self._embed(batch))
+                continue
             except Exception as e:
-                print(f"⚠️ 向量化失败: {e}")
-                # 失败时返回零向量
-                embeddings.append([0.0] * self.dimensions)
+                if len(batch) == 1:
+                    logger.warning(f"⚠️ 向量化失败: {e}")
+                    embeddings.append([0.0] * self.dimensions)
+                    continue
+                logger.warning(f"⚠️ 批量向量化失败（{len(batch)} 条），改为逐条处理: {e}")
+
+            for text in batch:
+                try:
+                    embeddings.extend(self._embed([text]))
+                except Exception as e:
+                    logger.warning(f"⚠️ 向量化失败: {e}")
+                    # 失败时返回零向量
+                    embeddings.append([0.0] * self.dimensions)
 
         return embeddings
 
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.gateway.embed_sync(
+            self.base_url,
+            self.api_key,
+            self.model,
+            texts,
+            dimensions=self.dimensions,
+            encoding_format=self.encoding_format
+        )
+        if len(vectors) != len(texts):
+            raise ValueError(f"返回向量数 {len(vectors)} 与输入 {len(texts)} 不一致")
+        return vectors
+
     def embed_query(self, text: str) -> List[float]:
         """
         对查询文本进行向量化
@@ -98,16 +109,17 @@ class QwenEmbeddings(Embeddings):
             向量
         """
         try:
-            response = self.client.embeddings.create(
-                model=self.model,
-                input=text,
+            return self.gateway.embed_sync(
+                self.base_url,
+                self.api_key,
+                self.model,
+                [text],
                 dimensions=self.dimensions,
                 encoding_format=self.encoding_format
-            )
-            return response.data[0].embedding
+            )[0]
 
         except Exception as e:
-            print(f"⚠️ 查询向量化失败: {e}")
+            logger.warning(f"⚠️ 查询向量化失败: {e}")
             # 失败时返回零向量
             return [0.0] * self.dimensions
 
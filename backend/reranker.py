@@ -0,0 +1,138 @@
+"""
+交叉编码器重排
+two-stage 检索的第二阶段：对 ANN 召回的候选文本块做 (query, chunk) 精排
+"""
+import os
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+logger = logging.getLogger("RAG_Service")
+
+
+class CrossEncoderReranker:
+    """
+    本地 CPU 交叉编码器重排器
+
+    - 批量推理：一次 predict 处理所有未命中缓存的候选
+    - 有界线程池：限制同时进行的推理数量，避免 CPU 被重排请求占满
+    - LRU 缓存：按 (query, chunk_id) 缓存分数，重复查询无需再次推理
+    """
+
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        max_workers: Optional[int] = None,
+        cache_size: Optional[int] = None,
+        max_length: int = 512,
+        predictor: Optional[Callable[[List[List[str]]], List[float]]] = None
+    ):
+        """
+        Args:
+            predictor: 批量打分函数 [[query, text]] -> 分数；指定时不在本进程加载模型（如多进程部署时调用共享模型服务）
+        """
+        self.model_name = model_name or os.getenv("RERANK_MODEL", "BAAI/bge-reranker-base")
+        self.batch_size = batch_size or int(os.getenv("RERANK_BATCH_SIZE", "16"))
+        self.cache_size = cache_size or int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+        max_workers = max_workers or int(os.getenv("RERANK_WORKERS", "2"))
+
+        if predictor is None:
+            from sentence_transformers import CrossEncoder
+            self.model = CrossEncoder(self.model_name, max_length=max_length, device="cpu")
+        else:
+            self.model = None
+        self._predictor = predictor or self.predict
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rerank")
+
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        source = "本地" if predictor is None else "共享模型服务"
+        logger.info(f"✓ 重排模型已加载: {self.model_name}（{source}，batch={self.batch_size}, workers={max_workers}）")
+
+    def predict(self, pairs: List[List[str]]) -> List[float]:
+        """本地模型批量打分（不经过缓存）"""
+        return self.model.predict(
+            pairs,
+            batch_size=self.batch_size,
+            show_progress_bar=False
+        )
+
+    def score(self, query: str, candidates: List[Tuple[str, str]]) -> List[float]:
+        """
+        同步打分
+
+        Args:
+            query: 查询文本
+            candidates: [(chunk_id, 文本)]
+
+        Returns:
+            与 candidates 顺序一致的分数列表
+        """
+        scores: List[Optional[float]] = [None] * len(candidates)
+        pending = []
+
+        with self._cache_lock:
+            for i, (chunk_id, _) in enumerate(candidates):
+                key = (query, chunk_id)
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+                    self.cache_hits += 1
+                else:
+                    pending.append(i)
+                    self.cache_misses += 1
+
+        if pending:
+            pairs = [[query, candidates[i][1]] for i in pending]
+            predicted = self._predictor(pairs)
+
+            with self._cache_lock:
+                for i, value in zip(pending, predicted):
+                    value = float(value)
+                    scores[i] = value
+                    self._cache[(query, candidates[i][0])] = value
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return scores
+
+    async def rerank(
+        self,
+        query: str,
+        results: List[Dict[str, Any]],
+        top_k: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        对检索结果重排
+
+        重排分数写入 similarity（原向量相似度保留在 vector_similarity），
+        结果按重排分数降序返回。
+        """
+        if not results:
+            return []
+
+        loop = asyncio.get_running_loop()
+        scores = await loop.run_in_executor(
+            self._executor,
+            self.score,
+            query,
+            [(r["id"], r["content"]) for r in results]
+        )
+
+        reranked = []
+        for result, value in zip(results, scores):
+            reranked.append({
+                **result,
+                "vector_similarity": result.get("similarity"),
+                "similarity": value
+            })
+
+        reranked.sort(key=lambda r: r["similarity"], reverse=True)
+        return reranked[:top_k] if top_k else reranked
@@ -0,0 +1,149 @@
+"""
+多进程部署：一个模型进程 + 一个写入进程 + N 个检索 worker
+
+    模型进程     model_server.py，加载 Embedding / 重排模型，通过 Unix socket 为其余进程推理（模型内存只占一份）
+    写入进程     SERVICE_ROLE=writer，负责上传、入库任务、文件下载/预览，是向量索引、词法索引、事实库唯一的写入者
+    检索 worker  SERVICE_ROLE=search，uvicorn --workers N 共享同一端口；只读打开索引，写入进程发布新段后随即可见；
+                 上传、任务、文件类接口以 307 重定向到写入进程（生产环境建议由 nginx 按路径直接分流）
+
+向量库需要 VECTOR_BACKEND=numpy（Chroma 不支持多进程共享同一目录），未设置时自动使用；
+首次启动时写入进程会把已有 Chroma 数据导入 NumPy 索引。
+
+使用示例：
+python serve_workers.py --workers 4                       # 检索 :8000，写入 :8001
+python serve_workers.py --workers 8 --port 8000 --writer-port 8001 --socket /tmp/rag_models.sock
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import subprocess
+from typing import Iterable, List, Optional
+
+from starlette.responses import JSONResponse, RedirectResponse
+
+SERVICE_ROLES = ("standalone", "writer", "search")
+
+# 检索 worker 不处理、转给写入进程的路径前缀
+WRITER_PATH_PREFIXES = ("/upload", "/jobs", "/preview", "/thumbnail", "/download")
+
+
+def service_role() -> str:
+    """当前进程的角色（SERVICE_ROLE，默认 standalone：单进程承担全部职责）"""
+    role = os.getenv("SERVICE_ROLE", "standalone").lower()
+    if role not in SERVICE_ROLES:
+        raise ValueError(f"不支持的 SERVICE_ROLE: {role}（可选 {', '.join(SERVICE_ROLES)}）")
+    return role
+
+
+class WriterRedirectMiddleware:
+    """检索 worker 的中间件（纯 ASGI）：写入类接口以 307 重定向到写入进程（保留方法和请求体）"""
+
+    def __init__(self, app, writer_url: Optional[str], prefixes: Iterable[str] = WRITER_PATH_PREFIXES):
+        self.app = app
+        self.writer_url = writer_url.rstrip("/") if writer_url else None
+        self.prefixes = tuple(prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        if self.writer_url is None:
+            response = JSONResponse({"detail": "检索 worker 不处理该接口，且未配置 WRITER_URL"}, status_code=501)
+        else:
+            query = scope.get("query_string", b"").decode("latin-1")
+            location = self.writer_url + scope["path"] + (f"?{query}" if query else "")
+            response = RedirectResponse(location, status_code=307)
+        await response(scope, receive, send)
+
+
+# ============ 启动器 ============
+
+def _wait_for_socket(path: str, process: subprocess.Popen, timeout: float):
+    """等待模型进程监听 socket 并响应 ping"""
+    from model_server import ModelServerClient
+
+    client = ModelServerClient(path, connect_timeout=0)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"模型进程已退出（返回码 {process.returncode}）")
+        try:
+            client.ping()
+            client.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"模型进程 {timeout:.0f} 秒内未就绪: {path}")
+
+
+def launch(args, processes: List[subprocess.Popen]):
+    """依次启动模型进程、写入进程、检索 worker，启动的进程追加到 processes（失败时由调用方统一停止）"""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    vector_backend = os.getenv("VECTOR_BACKEND", "numpy").lower()
+    if vector_backend != "numpy":
+        raise SystemExit(f"多进程部署需要 VECTOR_BACKEND=numpy（当前为 {vector_backend}）")
+
+    env = dict(os.environ, VECTOR_BACKEND="numpy", MODEL_SERVER_SOCKET=args.socket)
+    # 访问日志由 RequestLogMiddleware 记录
+    uvicorn = [sys.executable, "-m", "uvicorn", "main_service:app", "--host", args.host, "--no-access-log"]
+
+    print(f"▶ 模型进程: {args.socket}")
+    model = subprocess.Popen([sys.executable, "model_server.py", "--socket", args.socket], cwd=backend_dir, env=env)
+    processes.append(model)
+    _wait_for_socket(args.socket, model, args.model_timeout)
+
+    print(f"▶ 写入进程: http://{args.host}:{args.writer_port}")
+    processes.append(subprocess.Popen(
+        uvicorn + ["--port", str(args.writer_port)],
+        cwd=backend_dir, env=dict(env, SERVICE_ROLE="writer")
+    ))
+
+    writer_url = args.writer_url or f"http://{'127.0.0.1' if args.host == '0.0.0.0' else args.host}:{args.writer_port}"
+    print(f"▶ 检索 worker x{args.workers}: http://{args.host}:{args.port}（写入类接口重定向到 {writer_url}）")
+    processes.append(subprocess.Popen(
+        uvicorn + ["--port", str(args.port), "--workers", str(args.workers)],
+        cwd=backend_dir, env=dict(env, SERVICE_ROLE="search", WRITER_URL=writer_url)
+    ))
+
+
+def main(argv: Optional[List[str]] = None):
+    from model_server import DEFAULT_SOCKET
+
+    parser = argparse.ArgumentParser(description="多进程部署：模型进程 + 写入进程 + N 个检索 worker")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="检索 worker 数（默认 CPU 核数）")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000, help="检索 worker 端口")
+    parser.add_argument("--writer-port", type=int, default=8001, help="写入进程端口")
+    parser.add_argument("--writer-url", default=None, help="检索 worker 重定向写入类接口的地址（默认写入进程本机地址）")
+    parser.add_argument("--socket", default=os.getenv("MODEL_SERVER_SOCKET", DEFAULT_SOCKET), help="模型进程 Unix socket")
+    parser.add_argument("--model-timeout", type=float, default=600, help="等待模型加载的超时（秒）")
+    args = parser.parse_args(argv)
+
+    def stop(*_):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    processes: List[subprocess.Popen] = []
+    try:
+        launch(args, processes)
+        # 任一进程退出则整体退出，交给外部进程管理器重启
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in reversed(processes):
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
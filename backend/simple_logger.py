@@ -1,35 +1,337 @@
 """
-简单的文件日志记录器
+结构化日志：队列 + 后台写入线程
+
+请求路径上只把记录（dict）放入队列，格式化、写控制台、写文件都在后台线程中按批完成：
+    setup_logging()              根日志记录器（含 RAG_Service）改为写入队列，启动后台写入线程
+    log_request(msg, **fields)   请求详情（原来的分隔线横幅），按 LOG_REQUEST_SAMPLE_RATE 逐请求采样
+                                 （未采样的请求同时略过 RAG_Service 的 INFO 详情，警告和错误不受影响）
+    RequestLogMiddleware         纯 ASGI 中间件：每个请求一条访问日志（request_id、方法、路由、状态码、耗时），
+                                 响应头带 X-Request-ID / X-Process-Time
+
+文件：LOG_DIR/api_YYYYMMDD.log，每行一个 JSON 记录；按天切换，超过 LOG_MAX_BYTES 时轮转为 .1 .2 …（保留 LOG_BACKUP_COUNT 个）。
+队列满（LOG_QUEUE_SIZE）时丢弃新记录并计数（/metrics 的 rag_log_dropped_total），不阻塞请求。
+
+使用示例：
+    log_request("🔍 API收到搜索请求", query=request.query, top_k=request.topK)
 """
+import os
 import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import threading
+import traceback
 from datetime import datetime
 from pathlib import Path
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, TextIO
+
+# 当前请求的日志上下文：{"request_id": ..., "sampled": bool}
+_request_context: ContextVar[Optional[Dict[str, Any]]] = ContextVar("rag_request_log", default=None)
+
+_STOP = object()
+
+
+class RotatingLogFile:
+    """按天命名的 JSON Lines 文件，超过 max_bytes 时轮转（多进程共用同一文件时，发现被其他进程轮转后重新打开）"""
+
+    def __init__(self, log_dir: Path, max_bytes: int, backup_count: int):
+        self.log_dir = Path(log_dir)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._path: Optional[Path] = None
+        self._file = None
+
+    def write(self, lines: List[str]):
+        path = self.log_dir / f"api_{datetime.now().strftime('%Y%m%d')}.log"
+        if path != self._path or self._rotated_elsewhere():
+            self._reopen(path)
+        self._file.write("".join(lines))
+        self._file.flush()
+        if self.max_bytes > 0 and self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotated_elsewhere(self) -> bool:
+        try:
+            return os.stat(self._path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except OSError:
+            return True
+
+    def _reopen(self, path: Path):
+        self.close()
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self._path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _rotate(self):
+        """api_YYYYMMDD.log -> .1 -> .2 …，超出 backup_count 的删除"""
+        self.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            source = self._path.with_name(f"{self._path.name}.{i}")
+            if source.exists():
+                source.replace(self._path.with_name(f"{self._path.name}.{i + 1}"))
+        if self.backup_count > 0:
+            self._path.replace(self._path.with_name(f"{self._path.name}.1"))
+        else:
+            self._path.unlink()
+        self._reopen(self._path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
 
-class SimpleLogger:
-    def __init__(self, log_file="logs/api_requests.log"):
-        self.log_dir = Path("logs")
-        self.log_dir.mkdir(exist_ok=True)
-        self.log_file = self.log_dir / f"api_{datetime.now().strftime('%Y%m%d')}.log"
-        
-    def log(self, message):
-        """同时输出到控制台和文件"""
-        timestamp = datetime.now().strftime('%H:%M:%S')
-        log_msg = f"[{timestamp}] {message}"
-        
-        # 输出到控制台
-        print(log_msg)
-        sys.stdout.flush()
-        
-        # 写入文件
+
+class LogPipeline:
+    """有界队列 + 后台写入线程：每次取出最多 batch_size 条记录，控制台和文件各一次写入"""
+
+    def __init__(
+        self,
+        log_dir: str = "logs",
+        console: Optional[TextIO] = sys.stdout,
+        queue_size: int = 10000,
+        batch_size: int = 256,
+        max_bytes: int = 100 * 1024 * 1024,
+        backup_count: int = 5
+    ):
+        self.console = console
+        self.batch_size = batch_size
+        self.file = RotatingLogFile(Path(log_dir), max_bytes, backup_count) if log_dir else None
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self.dropped = 0
+        self.written = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def emit(self, record: Dict[str, Any]) -> bool:
+        """放入队列；队列满时丢弃（不阻塞调用方）"""
         try:
-            with open(self.log_file, 'a', encoding='utf-8') as f:
-                f.write(log_msg + '\n')
-        except:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def stop(self, timeout: float = 5.0):
+        """写完队列中已有的记录后停止"""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
             pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self._queue.qsize(), "dropped": self.dropped, "written": self.written}
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP or _STOP in batch:
+                stopping = True
+                batch = [record for record in batch if record is not _STOP]
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            if self.console is not None:
+                self.console.write("".join(format_console(record) for record in batch))
+                self.console.flush()
+            if self.file is not None:
+                self.file.write([json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in batch])
+            self.written += len(batch)
+        except Exception:
+            # 日志写入失败不影响服务（磁盘满、控制台被关闭等）
+            self.dropped += len(batch)
+
+
+def format_console(record: Dict[str, Any]) -> str:
+    """控制台格式：[时:分:秒] 消息 key=value …（请求内的记录带 request_id）"""
+    extra = " ".join(
+        f"{key}={value}" for key, value in record.items()
+        if key not in ("ts", "level", "logger", "pid", "msg", "exc")
+    )
+    line = f"[{record['ts'][11:19]}] {record['msg']}" + (f"  {extra}" if extra else "")
+    if record.get("exc"):
+        line += "\n" + record["exc"].rstrip("\n")
+    return line + "\n"
+
+
+def make_record(level: str, message: str, logger_name: str = "", fields: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    record = {
+        "ts": datetime.now().isoformat(timespec="milliseconds"),
+        "level": level,
+        "logger": logger_name,
+        "pid": os.getpid(),
+        "msg": message,
+    }
+    context = _request_context.get()
+    if context is not None:
+        record["request_id"] = context["request_id"]
+    if fields:
+        record.update(fields)
+    return record
 
-# 全局logger实例
-api_logger = SimpleLogger()
 
-def log_request(message):
-    """记录API请求"""
-    api_logger.log(message)
+class QueueLogHandler(logging.Handler):
+    """
+    logging 处理器：把 LogRecord 转成记录放入队列（异常堆栈在调用线程格式化，traceback 对象不跨线程）
+
+    未采样的请求内，RAG_Service 的 INFO 及以下记录（检索、聚合等逐步详情）不写入；警告、错误和访问日志始终写入。
+    """
+
+    def __init__(self, pipeline: LogPipeline):
+        super().__init__()
+        self.pipeline = pipeline
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if record.levelno < logging.WARNING and record.name == "RAG_Service" and not request_sampled():
+                return
+            message = record.getMessage().strip("\n")
+            fields = getattr(record, "fields", None)
+            if not message and not fields and not record.exc_info:
+                return  # 原来用于排版的空行
+            entry = make_record(record.levelname, message, record.name, fields)
+            if record.exc_info:
+                entry["exc"] = "".join(traceback.format_exception(*record.exc_info))
+            self.pipeline.emit(entry)
+        except Exception:
+            self.handleError(record)
+
+
+_pipeline: Optional[LogPipeline] = None
+
+
+def setup_logging(level: int = logging.INFO) -> LogPipeline:
+    """
+    配置根日志记录器写入队列（重复调用返回同一个管道）
+
+    环境变量：LOG_DIR（空字符串表示不写文件）、LOG_CONSOLE、LOG_QUEUE_SIZE、LOG_BATCH_SIZE、LOG_MAX_BYTES、LOG_BACKUP_COUNT
+    """
+    global _pipeline
+    if _pipeline is not None:
+        return _pipeline
+
+    _pipeline = LogPipeline(
+        log_dir=os.getenv("LOG_DIR", "logs"),
+        console=sys.stdout if os.getenv("LOG_CONSOLE", "true").lower() == "true" else None,
+        queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+        batch_size=int(os.getenv("LOG_BATCH_SIZE", "256")),
+        max_bytes=int(os.getenv("LOG_MAX_BYTES", str(100 * 1024 * 1024))),
+        backup_count=int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    )
+    _pipeline.start()
+    atexit.register(_pipeline.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, QueueLogHandler):
+            root.removeHandler(handler)
+    root.addHandler(QueueLogHandler(_pipeline))
+    root.setLevel(level)
+    return _pipeline
+
+
+def log_stats() -> Dict[str, int]:
+    """队列长度、丢弃数、已写入数（未调用 setup_logging 时为 0）"""
+    return _pipeline.stats() if _pipeline is not None else {"queued": 0, "dropped": 0, "written": 0}
+
+
+def request_sampled() -> bool:
+    """当前请求是否记录详细日志（请求之外始终记录）"""
+    context = _request_context.get()
+    return context is None or context["sampled"]
+
+
+def log_request(message: str, /, **fields):
+    """记录请求详情（按请求采样；字段写入 JSON 记录，字段名可以是 message）"""
+    if not request_sampled():
+        return
+    if _pipeline is not None:
+        _pipeline.emit(make_record("INFO", message, "RAG_Service.request", fields))
+    else:
+        logging.getLogger("RAG_Service").info(message, extra={"fields": fields})
+
+
+class RequestLogMiddleware:
+    """
+    请求日志中间件（纯 ASGI）
+
+    为每个请求分配 request_id（沿用请求头 X-Request-ID），决定本请求是否采样详细日志，
+    响应结束后记录一条访问日志；异常记录堆栈后继续抛出。
+    """
+
+    def __init__(self, app, sample_rate: Optional[float] = None, skip_paths=()):
+        self.app = app
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("LOG_REQUEST_SAMPLE_RATE", "1.0"))
+        self.skip_paths = set(skip_paths)
+        self.logger = logging.getLogger("RAG_Service.access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:8]
+        token = _request_context.set({"request_id": request_id, "sampled": random.random() < self.sample_rate})
+        status = {"code": 500}
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                headers.append((b"x-process-time", f"{time.perf_counter() - start:.3f}".encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        except Exception as e:
+            self.logger.error(
+                f"❌ 请求处理失败: {e}", exc_info=True,
+                extra={"fields": self._fields(scope, 500, start)}
+            )
+            raise
+        else:
+            if scope["path"] not in self.skip_paths:
+                self.logger.info(
+                    f"{scope['method']} {scope['path']} {status['code']}",
+                    extra={"fields": self._fields(scope, status["code"], start)}
+                )
+        finally:
+            _request_context.reset(token)
+
+    @staticmethod
+    def _fields(scope, status: int, start: float) -> Dict[str, Any]:
+        client = scope.get("client")
+        return {
+            "route": getattr(scope.get("route"), "path", None) or "unmatched",
+            "status": status,
+            "ms": round((time.perf_counter() - start) * 1000, 1),
+            "client": client[0] if client else "unknown",
+        }
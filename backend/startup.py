@@ -0,0 +1,217 @@
+"""
+服务启动：就绪状态、就绪检查中间件与启动耗时分析
+
+main_service 导入时只加载 Web 框架和轻量模块，uvicorn 立即监听端口；
+模型、向量库、VLM 客户端在应用启动后的预热任务中加载，加载完成前业务接口返回 503（/health、/ready 等不受影响）。
+
+使用示例：
+python startup.py imports                 # 导入耗时报告（python -X importtime），列出 main_service 直接导入的模块
+python startup.py listen                  # 启动 uvicorn，测量到监听端口和 /ready 返回 200 的耗时
+python startup.py listen --ready-path /health   # 测量没有 /ready 的旧版本
+"""
+import os
+import re
+import sys
+import time
+import socket
+import argparse
+import subprocess
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from starlette.responses import JSONResponse
+
+
+class StartupState:
+    """服务启动状态：starting -> ready / failed，并记录各预热阶段耗时"""
+
+    def __init__(self):
+        self.status = "starting"
+        self.started_at = time.time()
+        self.ready_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.phases: Dict[str, int] = {}  # 阶段 -> 耗时（毫秒）
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    @contextmanager
+    def phase(self, name: str):
+        """记录一个预热阶段的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.perf_counter() - start) * 1000)
+
+    def mark_ready(self):
+        self.status = "ready"
+        self.ready_at = time.time()
+
+    def mark_failed(self, error: BaseException):
+        self.status = "failed"
+        self.error = f"{type(error).__name__}: {error}"
+
+    def snapshot(self) -> Dict[str, Any]:
+        end = self.ready_at or time.time()
+        return {
+            "status": self.status,
+            "startedAt": datetime.fromtimestamp(self.started_at).isoformat(),
+            "warmupTime": round((end - self.started_at) * 1000),
+            "phases": dict(self.phases),
+            "error": self.error
+        }
+
+
+class ReadinessMiddleware:
+    """
+    就绪检查中间件（纯 ASGI）：服务未就绪时业务请求直接返回 503 + Retry-After，
+    不进入路由（业务接口里的 except Exception 不会把它变成 500）
+    """
+
+    def __init__(self, app, state: StartupState, exempt_paths: Iterable[str] = ()):
+        self.app = app
+        self.state = state
+        self.exempt_paths = set(exempt_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.state.ready or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        starting = self.state.status == "starting"
+        response = JSONResponse(
+            {
+                "detail": "服务正在启动，请稍后重试" if starting else f"服务启动失败: {self.state.error}",
+                "startup": self.state.snapshot()
+            },
+            status_code=503,
+            headers={"Retry-After": "2"} if starting else None
+        )
+        await response(scope, receive, send)
+
+
+# ============ 启动耗时分析 ============
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_time_report(module: str = "main_service", top: int = 20) -> Dict[str, Any]:
+    """
+    在子进程中用 python -X importtime 导入 module，返回总耗时、
+    module 直接导入的模块（按累计耗时排序）以及自身耗时最高的模块
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, len(indent) // 2, int(self_us), int(cumulative_us)))
+
+    total = next((e for e in reversed(entries) if e[0] == module), None)
+    if total is None:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+
+    # -X importtime 按导入完成顺序输出，module 自身在最后，深度为 0；其直接导入的模块深度为 1
+    direct = [e for e in entries if e[1] == 1]
+    return {
+        "module": module,
+        "totalMs": round(total[3] / 1000, 1),
+        "selfMs": round(total[2] / 1000, 1),
+        "direct": [
+            {"module": name, "cumulativeMs": round(cumulative / 1000, 1)}
+            for name, _, _, cumulative in sorted(direct, key=lambda e: e[3], reverse=True)[:top]
+        ],
+        "slowestSelf": [
+            {"module": name, "selfMs": round(self_us / 1000, 1)}
+            for name, _, self_us, _ in sorted(entries, key=lambda e: e[2], reverse=True)[:top]
+        ]
+    }
+
+
+def measure_startup(
+    app: str = "main_service:app",
+    port: int = 8765,
+    ready_path: str = "/ready",
+    timeout: float = 300.0
+) -> Dict[str, Optional[float]]:
+    """启动 uvicorn 子进程，测量到端口可连接、到 ready_path 返回 200 的耗时（毫秒）"""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    listening_ms = ready_ms = None
+    try:
+        while time.perf_counter() - start < timeout and process.poll() is None:
+            if listening_ms is None:
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+                    listening_ms = (time.perf_counter() - start) * 1000
+                except OSError:
+                    time.sleep(0.01)
+                    continue
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{ready_path}", timeout=2) as response:
+                    if response.status == 200:
+                        ready_ms = (time.perf_counter() - start) * 1000
+                        break
+            except OSError:
+                pass
+            time.sleep(0.02)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    return {
+        "listeningMs": round(listening_ms) if listening_ms is not None else None,
+        "readyMs": round(ready_ms) if ready_ms is not None else None
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="服务启动耗时分析")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    imports = sub.add_parser("imports", help="导入耗时报告")
+    imports.add_argument("--module", default="main_service")
+    imports.add_argument("--top", type=int, default=15)
+
+    listen = sub.add_parser("listen", help="测量到监听端口 / 就绪的耗时")
+    listen.add_argument("--app", default="main_service:app")
+    listen.add_argument("--port", type=int, default=8765)
+    listen.add_argument("--ready-path", default="/ready")
+    listen.add_argument("--runs", type=int, default=3)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "imports":
+        report = import_time_report(args.module, args.top)
+        print(f"导入 {report['module']}: 共 {report['totalMs']} ms（模块自身执行 {report['selfMs']} ms）\n")
+        print("直接导入（累计耗时）:")
+        for item in report["direct"]:
+            print(f"  {item['cumulativeMs']:>9.1f} ms  {item['module']}")
+        print("\n自身耗时最高的模块:")
+        for item in report["slowestSelf"]:
+            print(f"  {item['selfMs']:>9.1f} ms  {item['module']}")
+        return
+
+    for run in range(1, args.runs + 1):
+        result = measure_startup(args.app, args.port, args.ready_path)
+        print(f"第 {run} 次: 监听端口 {result['listeningMs']} ms，就绪({args.ready_path}) {result['readyMs']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+测试智能问答语义缓存
+
+使用示例：
+python -m pytest test_answer_cache.py -q
+"""
+import numpy as np
+
+from answer_cache import SemanticAnswerCache, question_scope
+
+
+def _vec(*values):
+    return list(np.asarray(values, dtype=np.float32))
+
+
+def test_similar_question_hits_within_threshold():
+    cache = SemanticAnswerCache(max_entries=10, threshold=0.95, ttl=0)
+    scope = question_scope("主卧面积多少", 3)
+    assert cache.lookup(_vec(1, 0, 0), 1, scope) is None
+    cache.put(_vec(1, 0, 0), 1, scope, "15 平方米")
+
+    answer, similarity = cache.lookup(_vec(1, 0.1, 0), 1, scope)
+    assert answer == "15 平方米" and similarity > 0.99
+    assert cache.lookup(_vec(1, 1, 0), 1, scope) is None  # 余弦 0.71
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_corpus_version_change_invalidates():
+    cache = SemanticAnswerCache(max_entries=10, threshold=0.9, ttl=0)
+    scope = question_scope("主卧面积多少", 3)
+    cache.put(_vec(1, 0), (0, 100), scope, "旧回答")
+    assert cache.lookup(_vec(1, 0), (1, 250), scope) is None
+    assert len(cache) == 0
+
+    # 生成回答期间语料已变化：按旧版本写入的回答被丢弃
+    cache.put(_vec(1, 0), (0, 100), scope, "过期回答")
+    assert cache.lookup(_vec(1, 0), (1, 250), scope) is None
+
+
+def test_scope_separates_numbers_filters_and_top_k():
+    assert question_scope("找3个卧室的户型", 3) != question_scope("找4个卧室的户型", 3)
+    assert question_scope("三个卧室的户型", 3) != question_scope("四个卧室的户型", 3)
+    assert question_scope("主卧面积", 3) != question_scope("主卧面积", 5)
+    assert question_scope("主卧面积", 3, {"image_type": "cad"}) != question_scope("主卧面积", 3)
+    assert question_scope("主卧面积多少", 3) == question_scope("主卧的面积是多少", 3)
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    cache = SemanticAnswerCache(max_entries=2, threshold=0.99, ttl=60)
+    scope = question_scope("q", 3)
+    cache.put(_vec(1, 0, 0), 1, scope, "a")
+    cache.put(_vec(0, 1, 0), 1, scope, "b")
+    assert cache.lookup(_vec(1, 0, 0), 1, scope)[0] == "a"  # a 变为最近使用
+    cache.put(_vec(0, 0, 1), 1, scope, "c")                 # 淘汰 b
+    assert cache.lookup(_vec(0, 1, 0), 1, scope) is None
+    assert cache.lookup(_vec(0, 0, 1), 1, scope)[0] == "c"
+
+    now = __import__("time").time()
+    monkeypatch.setattr("answer_cache.time.time", lambda: now + 120)
+    assert cache.lookup(_vec(1, 0, 0), 1, scope) is None
+    assert len(cache) == 0
@@ -0,0 +1,71 @@
+"""
+测试 LLM 上下文构建（MMR 选块、去除重叠、token 预算）
+
+使用示例：
+python -m pytest test_context_packing.py -q
+"""
+import numpy as np
+
+from context_packing import ContextPacker, estimate_tokens, mmr_order, remove_overlap, truncate_to_tokens
+
+
+def _result(file_id, chunk_id, content):
+    return {"id": f"{file_id}_chunk_{chunk_id}", "content": content,
+            "metadata": {"file_id": file_id, "file_name": f"{file_id}.pdf", "chunk_id": chunk_id}}
+
+
+def test_mmr_prefers_diverse_chunks():
+    query = [1.0, 0.0, 0.0]
+    vectors = [[1.0, 0.05, 0.0], [1.0, 0.06, 0.0], [0.8, 0.0, 0.6]]  # 前两个几乎相同
+    assert mmr_order(query, vectors, lambda_mult=1.0) == [0, 1, 2]
+    assert mmr_order(query, vectors, lambda_mult=0.5) == [0, 2, 1]
+    assert mmr_order(query, vectors, lambda_mult=0.5, limit=2) == [0, 2]
+
+
+def test_overlap_between_adjacent_chunks_is_removed():
+    text = "".join(f"第{i}句描述户型中的一个房间，客厅朝南采光充足。" for i in range(12))
+    first, second = text[:120], text[80:200]  # 40 个字符重叠
+    assert remove_overlap(second, [first], 20) == text[120:200]
+    assert remove_overlap(first, [second], 20) == text[:80]
+    assert remove_overlap(text[90:110], [first], 20) == ""
+
+    packer = ContextPacker(token_budget=1000, lambda_mult=0.7, min_overlap=20)
+    results = [_result("a", 1, second), _result("a", 0, first), _result("b", 0, "另一份文档的说明文字，与户型无关的内容。")]
+    packed = packer.pack([1.0, 0.0], results, [[1.0, 0.1], [0.9, 0.2], [0.2, 1.0]])
+    assert [c.result["id"] for c in packed] == ["a_chunk_0", "a_chunk_1", "b_chunk_0"]
+    assert packed[0].text + packed[1].text == text[:200]
+
+    # 其他文件中完全相同的块不重复放入
+    packed = packer.pack(None, results + [_result("c", 0, first)])
+    assert [c.result["id"] for c in packed] == ["a_chunk_0", "a_chunk_1", "b_chunk_0"]
+
+
+def test_token_budget_truncates_last_chunk_and_skips_the_rest():
+    assert estimate_tokens("卧室abcd") == 3
+    assert estimate_tokens(truncate_to_tokens("卧" * 100, 30)) == 30
+
+    results = [_result(f"f{i}", 0, f"文档{i}" + "内容" * 100) for i in range(4)]
+    packer = ContextPacker(token_budget=300, lambda_mult=1.0, min_overlap=20)
+    packed = packer.pack(None, results, header=lambda result: "[文档] x:")
+    assert [c.result["id"] for c in packed] == ["f0_chunk_0", "f1_chunk_0"]
+    assert packed[1].truncated and not packed[0].truncated
+    assert sum(c.tokens for c in packed) <= 300
+
+    # 预算小于一块时最相关的块截断后仍放入
+    packed = ContextPacker(token_budget=10, min_overlap=20).pack(None, results)
+    assert len(packed) == 1 and packed[0].result["id"] == "f0_chunk_0"
+
+
+def test_max_chunks_and_header_budget():
+    results = [_result(f"f{i}", 0, f"文档{i}的内容" * 10) for i in range(6)]
+    header = lambda result: f"[文档{len(results)}] {result['metadata']['file_name']}:"
+    packed = ContextPacker(token_budget=2000, lambda_mult=1.0, min_overlap=20).pack(None, results, header=header, max_chunks=3)
+    assert [c.result["id"] for c in packed] == ["f0_chunk_0", "f1_chunk_0", "f2_chunk_0"]
+
+    packer = ContextPacker(token_budget=120, lambda_mult=1.0, min_overlap=20)
+    packed = packer.pack(None, results, header=header)
+    emitted = sum(
+        estimate_tokens(f"[文档{i}] {c.result['metadata']['file_name']}:") + estimate_tokens(c.text)
+        for i, c in enumerate(packed, 1)
+    )
+    assert emitted <= sum(c.tokens for c in packed) <= 120
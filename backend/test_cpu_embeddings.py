@@ -0,0 +1,66 @@
+"""
+测试 CPU 优化 Embedding（使用随机初始化的小模型，离线运行）
+
+使用示例：
+python -m pytest test_cpu_embeddings.py -q
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from transformers import BertConfig, BertModel, BertTokenizer
+from sentence_transformers import SentenceTransformer, models
+
+from cpu_embeddings import CPUEmbeddings, parse_cpu_list
+
+TEXTS = ["卧室", "客厅面积图号零件卧室客厅面积", "abc", "零件 图号 a1b2c3 卧室客厅", "面积"]
+
+
+@pytest.fixture(scope="module")
+def tiny_model_dir(tmp_path_factory):
+    model_dir = tmp_path_factory.mktemp("tiny_sentence_model")
+
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list("卧室客厅面积图号零件") + list("abcdefg0123456789")
+    vocab_file = model_dir / "vocab.txt"
+    vocab_file.write_text("\n".join(vocab), encoding="utf-8")
+    config = BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        max_position_embeddings=64
+    )
+    BertModel(config).save_pretrained(model_dir)
+    BertTokenizer(str(vocab_file)).save_pretrained(model_dir)
+
+    transformer = models.Transformer(str(model_dir), max_seq_length=32)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension(), "mean")
+    output_dir = model_dir / "sentence_model"
+    SentenceTransformer(modules=[transformer, pooling]).save(str(output_dir))
+    return str(output_dir)
+
+
+def test_matches_sentence_transformers_in_input_order(tiny_model_dir):
+    reference = SentenceTransformer(tiny_model_dir, device="cpu").encode(TEXTS, normalize_embeddings=True)
+
+    # 批大小 2：长度排序后分成多批，结果仍按输入顺序返回
+    fp32 = CPUEmbeddings(tiny_model_dir, backend="torch", batch_size=2)
+    assert np.allclose(fp32.embed_documents(TEXTS), reference, atol=1e-5)
+    assert np.allclose(fp32.embed_query(TEXTS[1]), reference[1], atol=1e-5)
+
+    int8 = CPUEmbeddings(tiny_model_dir, backend="torch_int8", batch_size=2, min_cosine=0.9)
+    if int8.backend == "torch_int8":
+        cosine = np.sum(np.asarray(int8.embed_documents(TEXTS)) * reference, axis=1)
+        assert cosine.min() >= 0.9
+
+
+def test_int8_falls_back_to_fp32_when_probe_vectors_drift(tiny_model_dir):
+    embeddings = CPUEmbeddings(tiny_model_dir, backend="torch_int8", min_cosine=1.01)
+    assert embeddings.backend == "torch"
+    assert embeddings.probe_min_cosine < 1.01
+
+
+def test_parse_cpu_list():
+    assert parse_cpu_list("0-3, 6") == {0, 1, 2, 3, 6}
@@ -0,0 +1,56 @@
+"""
+测试分阶段执行器
+
+使用示例：
+python -m pytest test_executors.py -q
+"""
+import asyncio
+import threading
+
+import pytest
+
+from executors import StageExecutor, get_executor, run_in_stage, executor_stats, shutdown_executors, _process_start_method
+
+
+def test_stats_report_active_and_queued():
+    executor = StageExecutor("test", "thread", max_workers=1)
+    release = threading.Event()
+
+    futures = [executor.submit(release.wait) for _ in range(3)]
+    stats = executor.stats()
+    assert stats["active"] == 1
+    assert stats["queued"] == 2
+    assert stats["submitted"] == 3
+
+    release.set()
+    for future in futures:
+        future.result()
+    stats = executor.stats()
+    assert stats["active"] == 0
+    assert stats["completed"] == 3
+    executor.shutdown()
+
+
+def test_run_in_stage_passes_kwargs_and_records_failures():
+    async def main():
+        assert await run_in_stage("io", sorted, [3, 1, 2], reverse=True) == [3, 2, 1]
+        with pytest.raises(ZeroDivisionError):
+            await run_in_stage("io", lambda: 1 / 0)
+
+    asyncio.run(main())
+    assert executor_stats()["io"]["failed"] == 1
+    shutdown_executors()
+
+
+def test_unknown_stage_is_rejected():
+    with pytest.raises(ValueError):
+        get_executor("gpu")
+
+
+def test_process_pool_does_not_fork_a_threaded_parent(monkeypatch):
+    monkeypatch.delenv("RENDER_MP_START_METHOD", raising=False)
+    assert _process_start_method() in ("forkserver", "spawn")
+
+    executor = StageExecutor("render", "process", max_workers=1)
+    assert executor.submit(abs, -3).result(timeout=60) == 3
+    executor.shutdown()
@@ -0,0 +1,50 @@
+"""
+测试结构化事实库
+
+使用示例：
+python -m pytest test_facts_store.py -q
+"""
+from facts_store import FactsStore
+
+
+def floor_plan(bedrooms, total_area):
+    rooms = [{"name": f"卧室{i + 1}", "dimensions": {"area": 12}} for i in range(bedrooms)]
+    rooms.append({"name": "客厅", "dimensions": {"length": 6, "width": 5, "area": 30}, "furniture": ["沙发", "茶几"]})
+    return {"total_dimensions": {"length": 12, "width": 10, "unit": "m", "total_area": total_area}, "rooms": rooms}
+
+
+def test_aggregate_query_uses_filter_syntax(tmp_path):
+    store = FactsStore(str(tmp_path / "facts.sqlite3"))
+    store.upsert_document("a", "A户型.png", "平面布置图", "floor_plan", floor_plan(2, 90))
+    store.upsert_document("b", "B户型.png", "平面布置图", "floor_plan", floor_plan(4, 130))
+    store.upsert_document("c", "C户型.png", "平面布置图", "floor_plan", floor_plan(4, 110))
+
+    filters = {"bedroom_count_gt": 3, "total_area_gt": 120, "image_type": "floor_plan"}
+    assert [d["file_id"] for d in store.query_documents(filters)] == ["b"]
+    assert store.count_documents({"bedroom_count": 4}) == 2
+    assert store.supports(filters)
+    assert not store.supports({"extracted_info_json": "x"})
+
+    # 重新入库覆盖旧事实
+    store.upsert_document("b", "B户型.png", "平面布置图", "floor_plan", floor_plan(3, 130))
+    assert store.count_documents(filters) == 0
+
+
+def test_document_facts_are_split_into_typed_rows(tmp_path):
+    store = FactsStore(str(tmp_path / "facts.sqlite3"))
+    store.upsert_document("cad1", "法兰盘图纸.png", "CAD图纸", "cad", {
+        "drawing_number": "FL-001",
+        "material": "Q235",
+        "main_dimensions": {"外径": "Φ200mm", "厚度": "20"},
+        "key_features": ["螺栓孔"],
+        "layers": ["轮廓", "标注"]
+    })
+
+    doc = store.get_document("cad1")
+    assert doc["attributes"] == {"drawing_number": "FL-001", "material": "Q235"}
+    assert {d["name"]: d["value"] for d in doc["dimensions"]} == {"外径": 200.0, "厚度": 20.0}
+    assert doc["components"][0]["name"] == "螺栓孔"
+    assert doc["layers"] == ["轮廓", "标注"]
+    assert doc["room_count"] is None
+
+    assert [d["file_id"] for d in store.find_documents_in_text("法兰盘图纸的外径是多少")] == ["cad1"]
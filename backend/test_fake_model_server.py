@@ -0,0 +1,77 @@
+"""
+测试离线的 OpenAI 兼容模型服务（通过 openai SDK 调用，确认与真实接口兼容）
+
+使用示例：
+python -m pytest test_fake_model_server.py -q
+"""
+import json
+
+import numpy as np
+import openai
+import pytest
+from fastapi.testclient import TestClient
+
+from fake_model_server import FakeModelConfig, create_app
+
+FAST = dict(chat_latency_ms=0, vision_latency_ms=0, embedding_latency_ms=0, token_latency_ms=0, seed=1)
+IMAGE = {"type": "image_url", "image_url": {"url": "data:image/png;base64,iVBORw0KGgo="}}
+
+
+def _client(**config) -> openai.OpenAI:
+    app = create_app(FakeModelConfig(**{**FAST, **config}))
+    return openai.OpenAI(base_url="http://testserver/v1", api_key="fake", http_client=TestClient(app), max_retries=0)
+
+
+def test_chat_text_respects_max_tokens_and_reports_usage():
+    client = _client(completion_tokens=40)
+    response = client.chat.completions.create(
+        model="fake-llm", messages=[{"role": "user", "content": "有几个卧室？"}], max_tokens=10
+    )
+    assert len(response.choices[0].message.content) == 10
+    assert response.usage.completion_tokens == 10 and response.usage.prompt_tokens > 0
+
+
+def test_vision_json_and_type_detection():
+    client = _client(image_type="cad")
+    analysis = client.chat.completions.create(
+        model="fake-vlm", response_format={"type": "json_object"},
+        messages=[{"role": "user", "content": [IMAGE, {"type": "text", "text": "分析平面图"}]}]
+    )
+    info = json.loads(analysis.choices[0].message.content)["extracted_info"]
+    assert info["rooms"] and info["total_dimensions"]["total_area"] > 0
+
+    detection = client.chat.completions.create(
+        model="fake-vlm", max_tokens=50, messages=[{"role": "user", "content": [IMAGE, {"type": "text", "text": "类型？"}]}]
+    )
+    assert detection.choices[0].message.content == "cad"
+
+
+def test_streaming_chat_with_usage():
+    client = _client(completion_tokens=9)
+    stream = client.chat.completions.create(
+        model="fake-llm", stream=True, stream_options={"include_usage": True},
+        messages=[{"role": "user", "content": "介绍一下户型"}]
+    )
+    chunks = list(stream)
+    text = "".join(c.choices[0].delta.content or "" for c in chunks if c.choices)
+    assert len(text) == 9
+    assert chunks[-1].usage.completion_tokens == 9
+
+
+def test_embeddings_are_deterministic_and_similar_texts_are_close():
+    client = _client()
+    texts = ["三室两厅的户型图", "三室两厅户型", "法兰盘零件图纸"]
+    first = np.array([
+        d.embedding for d in client.embeddings.create(model="fake-emb", input=texts, dimensions=256, encoding_format="float").data
+    ])
+    # 未指定 encoding_format 时 openai SDK 请求 base64 编码
+    second = np.array([d.embedding for d in client.embeddings.create(model="fake-emb", input=texts, dimensions=256).data])
+    assert first.shape == (3, 256)
+    np.testing.assert_allclose(first, second, atol=1e-6)
+    assert first[0] @ first[1] > first[0] @ first[2]
+
+
+def test_error_injection():
+    client = _client(error_rate=1.0, error_status=429)
+    with pytest.raises(openai.RateLimitError):
+        client.embeddings.create(model="fake-emb", input=["x"])
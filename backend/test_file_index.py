@@ -0,0 +1,165 @@
+"""
+测试文件索引、缓存响应与 /download 断点续传（Range / If-Range / X-Accel-Redirect）
+
+使用示例：
+python -m pytest test_file_index.py -q
+"""
+import os
+
+os.environ.setdefault("LOG_DIR", "")
+os.environ.setdefault("LOG_CONSOLE", "false")
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+import main_service
+from file_index import FileIndex, RangeNotSatisfiable, cached_file_response, parse_range
+
+
+def make_request(headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+    })
+
+
+def test_variants_survive_reload_and_reset_when_content_changes(tmp_path):
+    index = FileIndex(str(tmp_path / "file_index.json"))
+    index.put_original("f1", "/data/f1.pdf", "hash-a", 10, "a.pdf")
+    index.put_variants("f1", {"card": {"path": "/p/f1_card.jpg", "mime": "image/jpeg", "etag": "t1"}})
+
+    reloaded = FileIndex(str(tmp_path / "file_index.json"))
+    assert reloaded.get("f1")["mime"] == "application/pdf"
+    assert reloaded.get("f1")["variants"]["card"]["etag"] == "t1"
+
+    reloaded.put_original("f1", "/data/f1.pdf", "hash-a", 10)
+    assert "card" in reloaded.get("f1")["variants"]
+    reloaded.put_original("f1", "/data/f1.pdf", "hash-b", 12)
+    assert reloaded.get("f1")["variants"] == {}
+
+
+def test_cached_response_returns_304_for_matching_etag(tmp_path):
+    path = tmp_path / "thumb.jpg"
+    path.write_bytes(b"jpeg")
+
+    full = cached_file_response(make_request({}), str(path), "image/jpeg", "abc", 60)
+    assert full.status_code == 200
+    assert full.headers["etag"] == '"abc"'
+    assert full.headers["cache-control"] == "public, max-age=60"
+
+    hit = cached_file_response(make_request({"If-None-Match": 'W/"x", "abc"'}), str(path), "image/jpeg", "abc", 60)
+    assert hit.status_code == 304
+    miss = cached_file_response(make_request({"If-None-Match": '"other"'}), str(path), "image/jpeg", "abc", 60)
+    assert miss.status_code == 200
+
+
+def test_parse_range_forms():
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=900-", 1000) == (900, 999)
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=990-5000", 1000) == (990, 999)
+    # 多段或语法错误时按完整文件返回
+    assert parse_range("bytes=0-1,5-6", 1000) is None
+    assert parse_range("items=0-1", 1000) is None
+    assert parse_range("bytes=50-10", 1000) is None
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=1000-", 1000)
+
+
+CONTENT = bytes(range(256)) * 40  # 10240 字节
+
+
+@pytest.fixture
+def download(tmp_path, monkeypatch):
+    """经 /download 接口（完整中间件链）下载一个已登记的文件"""
+    path = tmp_path / "f1.pdf"
+    path.write_bytes(CONTENT)
+    file_index = FileIndex(str(tmp_path / "file_index.json"))
+    file_index.put_original("f1", str(path), "hash-a", len(CONTENT), "户型图.pdf")
+
+    service = main_service.MultimodalRAGService.__new__(main_service.MultimodalRAGService)
+    service.file_index = file_index
+    service.upload_dir = tmp_path
+    service.download_accel_prefix = ""
+    monkeypatch.setattr(main_service, "service", service)
+    monkeypatch.setattr(main_service.startup_state, "status", "ready")
+    return service, TestClient(main_service.app)
+
+
+def test_download_range_returns_206_with_slice(download):
+    _, client = download
+    response = client.get("/download/f1", headers={"Range": "bytes=100-1099"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 100-1099/{len(CONTENT)}"
+    assert response.headers["content-length"] == "1000"
+    assert response.content == CONTENT[100:1100]
+
+    suffix = client.get("/download/f1", headers={"Range": "bytes=-10"})
+    assert suffix.status_code == 206
+    assert suffix.content == CONTENT[-10:]
+
+    full = client.get("/download/f1")
+    assert full.status_code == 200
+    assert full.headers["accept-ranges"] == "bytes"
+    assert "filename*=UTF-8''" in full.headers["content-disposition"]
+    assert full.content == CONTENT
+
+
+def test_download_range_beyond_end_returns_416(download):
+    _, client = download
+    response = client.get("/download/f1", headers={"Range": f"bytes={len(CONTENT)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+    assert response.content == b""
+
+
+def test_download_if_range_match_and_mismatch(download):
+    _, client = download
+    etag = client.head("/download/f1").headers["etag"]
+
+    resumed = client.get("/download/f1", headers={"Range": "bytes=5000-", "If-Range": etag})
+    assert resumed.status_code == 206
+    assert resumed.content == CONTENT[5000:]
+
+    # 文件已变化：忽略 Range，返回完整文件
+    changed = client.get("/download/f1", headers={"Range": "bytes=5000-", "If-Range": '"stale"'})
+    assert changed.status_code == 200
+    assert "content-range" not in changed.headers
+    assert changed.content == CONTENT
+
+
+def test_download_if_none_match_returns_304(download):
+    _, client = download
+    etag = client.get("/download/f1").headers["etag"]
+    response = client.get("/download/f1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_download_head_has_headers_but_no_body(download):
+    _, client = download
+    response = client.head("/download/f1")
+    assert response.status_code == 200
+    assert response.headers["content-length"] == str(len(CONTENT))
+    assert response.content == b""
+
+    ranged = client.head("/download/f1", headers={"Range": "bytes=0-9"})
+    assert ranged.status_code == 206
+    assert ranged.headers["content-length"] == "10"
+    assert ranged.content == b""
+
+
+def test_download_accel_redirect_hands_off_to_nginx(download):
+    service, client = download
+    service.download_accel_prefix = "/protected-uploads/"
+    response = client.get("/download/f1", headers={"Range": "bytes=0-9"})
+    assert response.status_code == 200
+    assert response.headers["x-accel-redirect"] == "/protected-uploads/f1.pdf"
+    assert response.headers["content-type"].startswith("application/pdf")
+    assert "filename*=UTF-8''" in response.headers["content-disposition"]
+    assert response.content == b""
+
+    assert client.get("/download/missing").status_code == 404
@@ -0,0 +1,116 @@
+"""
+测试异步入库任务队列
+
+使用示例：
+python -m pytest test_ingestion_jobs.py -q
+"""
+import asyncio
+
+from ingestion_jobs import IngestionJobManager, JobStore, JobStatus
+
+
+def make_planner(calls, fail_stage=None):
+    async def extract(job, state, progress):
+        calls.append("extract")
+        progress(0.5)
+        return {"text": "内容"}
+
+    async def index(job, state, progress):
+        calls.append("index")
+        if fail_stage == "index":
+            raise RuntimeError("向量库不可用")
+        return {"result": {"chunk_count": len(state["text"])}}
+
+    return lambda job: [("extract", extract), ("index", index)]
+
+
+def test_job_runs_all_stages_and_reports_progress(tmp_path):
+    calls = []
+
+    async def main():
+        manager = IngestionJobManager(make_planner(calls), JobStore(str(tmp_path)), workers=1)
+        await manager.start()
+        job = manager.submit("f1", "a.pdf", "/tmp/a.pdf", ".pdf")
+
+        events = [e async for e in manager.subscribe(job.job_id) if e]
+        await manager.stop()
+        return job, events
+
+    job, events = asyncio.run(main())
+
+    assert calls == ["extract", "index"]
+    assert job.status == JobStatus.COMPLETED
+    assert job.result == {"chunk_count": 2}
+    assert events[-1]["status"] == JobStatus.COMPLETED
+    assert all(s["durationMs"] is not None for s in events[-1]["stages"])
+
+
+def test_failed_job_resumes_from_last_completed_stage(tmp_path):
+    first_calls, second_calls = [], []
+
+    async def first_run():
+        manager = IngestionJobManager(make_planner(first_calls, fail_stage="index"), JobStore(str(tmp_path)), workers=1)
+        await manager.start()
+        job = manager.submit("f1", "a.pdf", "/tmp/a.pdf", ".pdf")
+        await manager.wait(job.job_id)
+        await manager.stop()
+        return job
+
+    job = asyncio.run(first_run())
+    assert job.status == JobStatus.FAILED
+
+    # 模拟服务在 index 阶段执行中重启
+    job.status = JobStatus.RUNNING
+    job.stages[1].status = JobStatus.RUNNING
+    JobStore(str(tmp_path)).save_job(job)
+
+    async def second_run():
+        manager = IngestionJobManager(make_planner(second_calls), JobStore(str(tmp_path)), workers=1)
+        await manager.start()
+        resumed = await manager.wait(job.job_id)
+        await manager.stop()
+        return resumed
+
+    resumed = asyncio.run(second_run())
+
+    assert second_calls == ["index"]
+    assert resumed.status == JobStatus.COMPLETED
+    assert resumed.result == {"chunk_count": 2}
+
+
+def test_finished_jobs_are_evicted_after_retention(tmp_path):
+    calls = []
+
+    async def main():
+        manager = IngestionJobManager(make_planner(calls), JobStore(str(tmp_path)), workers=1, retention=60)
+        await manager.start()
+        old = await manager.wait(manager.submit("f1", "a.pdf", "/tmp/a.pdf", ".pdf").job_id)
+        assert (tmp_path / f"{old.job_id}.state.json").exists()
+
+        # 结束时间早于保留期：下一次创建任务时清理
+        old.updated_at -= 120
+        recent = manager.submit("f2", "b.pdf", "/tmp/b.pdf", ".pdf")
+        await manager.wait(recent.job_id)
+        await manager.stop()
+        return manager, old, recent
+
+    manager, old, recent = asyncio.run(main())
+    assert manager.get(old.job_id) is None and old.job_id not in manager._done_events
+    assert not list(tmp_path.glob(f"{old.job_id}*"))
+    assert manager.get(recent.job_id).status == JobStatus.COMPLETED
+    assert (tmp_path / f"{recent.job_id}.json").exists()
+
+    # 重启时加载的过期任务同样被清理
+    store = JobStore(str(tmp_path))
+    expired = store.load_jobs()[0]
+    expired.updated_at -= 120
+    store.save_job(expired)
+
+    async def restart():
+        restarted = IngestionJobManager(make_planner(calls), store, workers=1, retention=60)
+        await restarted.start()
+        await restarted.stop()
+        return restarted
+
+    assert asyncio.run(restart())._jobs == {}
+    assert not list(tmp_path.glob("*.json"))
@@ -0,0 +1,123 @@
+"""
+测试 BM25 词法索引与 RRF 融合
+
+使用示例：
+python -m pytest test_lexical_index.py -q
+"""
+from lexical_index import LexicalIndex, tokenize, reciprocal_rank_fusion
+
+
+def test_tokenize_chinese_bigrams_and_part_numbers():
+    tokens = tokenize("主卧室图号GB-T1804")
+
+    assert "主卧" in tokens
+    assert "卧室" in tokens
+    assert "gb-t1804" in tokens
+    assert "t1804" in tokens
+
+
+def test_search_exact_part_number(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.jsonl"))
+    index.add_documents(
+        ["a_chunk_0", "b_chunk_0"],
+        ["法兰盘零件 图号 DWG-2024-017", "客厅与主卧的动线设计"],
+        [{"file_id": "a"}, {"file_id": "b"}]
+    )
+
+    results = index.search("DWG-2024-017", top_k=5)
+
+    assert results[0]["id"] == "a_chunk_0"
+    assert results[0]["metadata"]["file_id"] == "a"
+
+
+def test_index_is_persisted_and_overwrites_same_id(tmp_path):
+    path = str(tmp_path / "lexical.jsonl")
+    index = LexicalIndex(path)
+    index.add_documents(["a_chunk_0"], ["旧内容 卫生间"], [{}])
+    index.add_documents(["a_chunk_0"], ["新内容 厨房"], [{}])
+
+    reloaded = LexicalIndex(path)
+
+    assert len(reloaded) == 1
+    assert reloaded.search("厨房")[0]["content"] == "新内容 厨房"
+    assert reloaded.search("卫生间") == []
+
+
+def test_deleted_chunks_stay_deleted_after_reload(tmp_path):
+    path = str(tmp_path / "lexical.jsonl")
+    index = LexicalIndex(path)
+    index.add_documents(["a_chunk_0", "a_chunk_1"], ["厨房 朝南", "卫生间 朝北"], [{}, {}])
+    index.delete_documents(["a_chunk_1", "missing"])
+
+    reloaded = LexicalIndex(path)
+    assert len(index) == len(reloaded) == 1
+    assert reloaded.search("卫生间") == []
+
+
+def test_reciprocal_rank_fusion_prefers_items_in_both_lists():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]], k=60)
+
+    assert fused[0][0] == "c"
+    assert {doc_id for doc_id, _ in fused} == {"a", "b", "c", "d"}
+
+
+def test_group_key_returns_top_k_distinct_files(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.jsonl"))
+    # 长文档 a 的多个文本块都排在前面
+    index.add_documents(
+        ["a_chunk_0", "a_chunk_1", "a_chunk_2", "b_chunk_0", "c_chunk_0"],
+        ["卧室 卧室 卧室", "卧室 卧室", "卧室 卧室 客厅", "卧室 书房 阳台 厨房", "卧室 走廊 玄关 储藏 门厅"],
+        [{"file_id": "a"}, {"file_id": "a"}, {"file_id": "a"}, {"file_id": "b"}, {"file_id": "c"}]
+    )
+
+    chunks = index.search("卧室", top_k=2)
+    grouped = index.search("卧室", top_k=2, group_key="file_id")
+
+    assert {r["metadata"]["file_id"] for r in chunks} == {"a"}
+    assert [r["metadata"]["file_id"] for r in grouped] == ["a", "a", "a", "b"]
+
+
+def test_read_only_index_picks_up_appended_chunks(tmp_path):
+    path = str(tmp_path / "lexical.jsonl")
+    writer = LexicalIndex(path)
+    writer.add_documents(["a_chunk_0"], ["卧室 客厅"], [{"file_id": "a"}])
+    reader = LexicalIndex(path, read_only=True)
+    assert len(reader) == 1
+
+    writer.add_documents(["b_chunk_0", "a_chunk_0"], ["零件号 GB-T1804", "书房"], [{"file_id": "b"}, {"file_id": "a"}])
+    # 写入进程正在追加、尚未写完的行不会被读入
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"id": "c_chunk_0", "content": "零件')
+
+    assert [r["id"] for r in reader.search("GB-T1804")] == ["b_chunk_0"]
+    assert reader.search("客厅") == []
+    assert len(reader) == 2
+
+
+def test_compaction_drops_dead_records_and_readers_follow(tmp_path):
+    path = tmp_path / "lexical.jsonl"
+    writer = LexicalIndex(str(path), compact_ratio=1.0)
+    writer.min_compact_records = 4
+    ids = [f"a_chunk_{i}" for i in range(3)]
+    writer.add_documents(ids, ["卧室 客厅", "厨房 朝南", "阳台"], [{"file_id": "a"}] * 3)
+    reader = LexicalIndex(str(path), read_only=True)
+    assert reader.search("厨房")[0]["id"] == "a_chunk_1"
+
+    # 强制重新入库：覆盖 + 删除旧块，过期记录达到阈值时压缩
+    writer.delete_documents(ids[1:])
+    writer.add_documents(ids[:1], ["卧室 书房"], [{"file_id": "a"}])
+    writer.add_documents(["b_chunk_0"], ["零件号 GB-T1804"], [{"file_id": "b"}])
+    lines = path.read_text(encoding="utf-8").splitlines()
+    # 删除记录触发压缩，之后只追加了覆盖 a_chunk_0 和新增 b_chunk_0 的两行
+    assert len(lines) == 3 and writer.generation == 1
+    assert writer.offset == path.stat().st_size
+
+    for index in (reader, LexicalIndex(str(path))):
+        assert [r["id"] for r in index.search("书房")] == ["a_chunk_0"]
+        assert index.search("厨房") == []
+        assert len(index) == 2
+    assert reader.generation == 1
+
+    # 压缩后继续追加，只读端按新文件的偏移增量读入
+    writer.add_documents(["c_chunk_0"], ["车库"], [{"file_id": "c"}])
+    assert [r["id"] for r in reader.search("车库")] == ["c_chunk_0"]
@@ -0,0 +1,270 @@
+"""
+测试主服务的检索与问答流程（NumPy 向量库 + 固定向量，不调用模型）
+
+使用示例：
+python -m pytest test_main_service.py -q
+"""
+import os
+import asyncio
+
+os.environ.setdefault("LOG_DIR", "")
+os.environ.setdefault("LOG_CONSOLE", "false")
+
+import numpy as np
+import pytest
+
+import main_service
+from main_service import MultimodalRAGService, RetrievalStrategy, SearchRequest, VectorStoreManager
+from facts_store import FactsStore
+from file_index import FileIndex
+from ingestion_jobs import IngestionJobManager, JobStore, JobStatus
+from reranker import CrossEncoderReranker
+from upload_dedup import UploadHashIndex
+from upload_stream import StreamedUpload
+
+DIM = 8
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setenv("VECTOR_BACKEND", "numpy")
+    monkeypatch.setenv("EMBEDDING_TYPE", "qwen")
+    monkeypatch.setenv("DASHSCOPE_API_KEY", "test")
+    monkeypatch.setenv("EMBEDDING_DIMENSIONS", str(DIM))
+    monkeypatch.delenv("MODEL_SERVER_SOCKET", raising=False)
+    return VectorStoreManager(str(tmp_path / "db"))
+
+
+def add_file(manager, file_id, chunks, vectors):
+    ids = [f"{file_id}_chunk_{i}" for i in range(len(chunks))]
+    metadatas = [
+        {"file_id": file_id, "file_name": f"{file_id}.pdf", "chunk_id": i, "total_chunks": len(chunks)}
+        for i in range(len(chunks))
+    ]
+    manager._write_chunks(file_id, ids, chunks, [list(map(float, v)) for v in vectors], metadatas)
+
+
+def unit(*values):
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[:len(values)] = values
+    return vector / np.linalg.norm(vector)
+
+
+def make_service(manager, **attributes):
+    """只带检索组件的服务实例（不加载 VLM、PDF 解析等）"""
+    service = MultimodalRAGService.__new__(MultimodalRAGService)
+    service.vector_manager = manager
+    service.rerank_candidates = 50
+    service._reranker = None
+    for name, value in attributes.items():
+        setattr(service, name, value)
+    return service
+
+
+def test_two_stage_rerank_can_promote_file_below_top_k(manager):
+    # 向量相似度 f0 > f1 > f2 > f3，重排模型最看好 f3
+    for rank, file_id in enumerate(["f0", "f1", "f2", "f3"]):
+        add_file(manager, file_id, [f"{file_id} 文本{i}" for i in range(2)],
+                 [unit(1.0, 0.2 * rank, 0.01 * i) for i in range(2)])
+
+    def predictor(pairs):
+        return [10.0 if text.startswith("f3") else 1.0 for _, text in pairs]
+
+    service = make_service(manager, _reranker=CrossEncoderReranker(predictor=predictor, max_workers=1))
+    query = list(map(float, unit(1.0)))
+    manager.embeddings.embed_query = lambda text: query
+
+    request = SearchRequest(query="目标", strategy=RetrievalStrategy.TWO_STAGE, topK=2)
+    results, rerank_time = asyncio.run(service._retrieve_chunks(request))
+
+    files = list(dict.fromkeys(r["metadata"]["file_id"] for r in results))
+    assert files == ["f3", "f0"]
+    assert rerank_time is not None
+
+    # 批量检索：两阶段查询取未截断的候选池
+    pools = asyncio.run(manager.search_many([query], [50], [None], [2], [False]))
+    assert {r["metadata"]["file_id"] for r in pools[0]} == {"f0", "f1", "f2", "f3"}
+
+
+def test_reindex_with_fewer_chunks_removes_stale_chunks(manager, tmp_path):
+    add_file(manager, "f1", ["厨房 朝南", "卫生间 朝北", "阳台 朝东"], [unit(1.0, 0.1 * i) for i in range(3)])
+    add_file(manager, "f2", ["书房 朝西"], [unit(0.0, 1.0)])
+
+    # 强制重新入库：新的解析结果只有一个文本块
+    add_file(manager, "f1", ["厨房 朝南 重新解析"], [unit(1.0)])
+
+    reopened = VectorStoreManager(str(tmp_path / "db"))
+    for store in (manager, reopened):
+        assert store.vector_store.count() == 2
+        assert len(store.lexical_index) == 2
+        assert store.lexical_index.search("卫生间") == []
+        hits = asyncio.run(store.search("阳台", top_k=10, query_embedding=list(map(float, unit(1.0, 0.2)))))
+        assert sorted(h["id"] for h in hits) == ["f1_chunk_0", "f2_chunk_0"]
+
+
+def test_force_upload_is_rejected_while_previous_job_is_running(tmp_path):
+    release = asyncio.Event()
+
+    async def index(job, state, progress):
+        await release.wait()
+        return {"result": {"chunk_count": 1}}
+
+    def upload():
+        path = tmp_path / f"upload_{len(list(tmp_path.glob('upload_*')))}.tmp"
+        path.write_bytes(b"%PDF")
+        return StreamedUpload("a.pdf", "application/pdf", path, "hash-a", 4)
+
+    async def main():
+        service = make_service(
+            None,
+            upload_dir=tmp_path,
+            upload_hash_index=UploadHashIndex(str(tmp_path / "hash_index.json")),
+            file_index=FileIndex(str(tmp_path / "file_index.json")),
+            job_manager=IngestionJobManager(lambda job: [("index", index)], JobStore(str(tmp_path / "jobs")), workers=1)
+        )
+        await service.job_manager.start()
+        first = await service.handle_upload(upload())
+        rejected = await service.handle_upload(upload(), force=True)
+
+        release.set()
+        await service.job_manager.wait(first.jobId)
+        accepted = await service.handle_upload(upload(), force=True)
+        await service.job_manager.wait(accepted.jobId)
+        await service.job_manager.stop()
+        return first, rejected, accepted, service.job_manager.get(accepted.jobId)
+
+    first, rejected, accepted, job = asyncio.run(main())
+    assert first.success and not rejected.success
+    assert rejected.jobId == first.jobId and rejected.fileId == first.fileId
+    assert accepted.success and accepted.fileId == first.fileId and accepted.jobId != first.jobId
+    assert job.status == JobStatus.COMPLETED
+
+
+def test_failed_upload_is_reprocessed_after_its_job_is_evicted(tmp_path):
+    attempts = []
+
+    async def index(job, state, progress):
+        attempts.append(job.job_id)
+        if len(attempts) == 1:
+            raise RuntimeError("向量库不可用")
+        return {"result": {"chunk_count": 1}}
+
+    def upload():
+        path = tmp_path / f"upload_{len(list(tmp_path.glob('upload_*')))}.tmp"
+        path.write_bytes(b"%PDF")
+        return StreamedUpload("a.pdf", "application/pdf", path, "hash-a", 4)
+
+    async def main():
+        service = make_service(
+            None,
+            upload_dir=tmp_path,
+            upload_hash_index=UploadHashIndex(str(tmp_path / "hash_index.json")),
+            file_index=FileIndex(str(tmp_path / "file_index.json"))
+        )
+        service.job_manager = IngestionJobManager(
+            lambda job: [("index", index)], JobStore(str(tmp_path / "jobs")), workers=1,
+            retention=60, on_finished=service._on_ingestion_finished
+        )
+        await service.job_manager.start()
+        first = await service.handle_upload(upload(), wait=True)
+
+        # 失败任务过了保留期被清理
+        assert service.upload_hash_index.get("hash-a")["failed"]
+        service.job_manager.get(attempts[0]).updated_at -= 120
+        service.job_manager._evict_finished()
+        assert service.job_manager.get(attempts[0]) is None
+
+        retried = await service.handle_upload(upload(), wait=True)
+        await service.job_manager.stop()
+        return first, retried, service.upload_hash_index.get("hash-a")
+
+    first, retried, record = asyncio.run(main())
+    assert not first.success
+    assert retried.success and len(attempts) == 2
+    assert retried.jobId == attempts[1] and record["jobId"] == attempts[1] and not record.get("failed")
+
+
+def test_general_answer_cites_exactly_the_packed_chunks(manager):
+    for rank, file_id in enumerate(["f0", "f1", "f2", "f3", "f4"]):
+        add_file(manager, file_id, [f"{file_id} 的户型说明，客厅朝南。"], [unit(1.0, 0.3 * rank)])
+
+    prompts = []
+
+    class RecordingLLM:
+        async def ainvoke(self, prompt):
+            prompts.append(prompt)
+            return type("Message", (), {"content": "回答"})()
+
+    service = make_service(
+        manager, vlm_api_key="test", context_candidates=5,
+        context_packer=main_service.ContextPacker(token_budget=1000, lambda_mult=0.7, min_overlap=20)
+    )
+    service._create_llm = lambda streaming=False: RecordingLLM()
+
+    answer, sources, confidence = asyncio.run(service._handle_general_query(
+        "客厅朝向", top_k=2, query_embedding=list(map(float, unit(1.0)))
+    ))
+
+    names = [source["file_name"] for source in sources]
+    assert len(names) == 2 and names[0] == "f0.pdf"
+    # 提示词中的 [文档i] 与答案末尾的参考来源第 i 项一致
+    for i, name in enumerate(names, 1):
+        assert f"[文档{i}] {name}:" in prompts[0]
+        assert f"{i}. {name}" in answer
+    assert "[文档3]" not in prompts[0]
+
+
+def test_chinese_numerals_are_parsed_as_whole_numbers():
+    assert [main_service.chinese_numeral_to_int(n) for n in ("十", "十二", "二十", "二十三", "两", "一百零五")] == [10, 12, 20, 23, 2, 105]
+
+    service = make_service(None)
+    assert service._parse_filter_conditions("十二个房间的图纸")["room_count"] == 12
+    assert service._parse_filter_conditions("卧室超过二十三个")["bedroom_count_gt"] == 23
+    conditions = service._parse_filter_conditions("面积大于二十平米、小于一百二十平米的户型")
+    assert conditions["total_area_gt"] == 20.0 and conditions["total_area_lt"] == 120.0
+
+
+def test_thumbnail_locks_are_released_after_generation(tmp_path):
+    pdf_path = tmp_path / "f1.pdf"
+    pdf_path.write_bytes(b"%PDF")
+    file_index = FileIndex(str(tmp_path / "file_index.json"))
+    file_index.put_original("f1", str(pdf_path), "hash-a", 4, "a.pdf")
+    generated = []
+
+    async def generate(path, file_id):
+        generated.append(file_id)
+        await asyncio.sleep(0.01)
+        thumbnail = tmp_path / f"{file_id}_card.jpg"
+        thumbnail.write_bytes(b"jpeg")
+        variants = {"card": {"path": str(thumbnail), "mime": "image/jpeg", "etag": "t1"}}
+        file_index.put_variants(file_id, variants)
+        return variants
+
+    service = make_service(
+        None, upload_dir=tmp_path, file_index=file_index,
+        _thumbnail_locks={}, _thumbnail_waiters={}, _generate_thumbnails=generate
+    )
+
+    async def main():
+        return await asyncio.gather(*[service.get_thumbnail_variant("f1", "card") for _ in range(5)])
+
+    entries = asyncio.run(main())
+    assert generated == ["f1"]
+    assert all(entry["etag"] == "t1" for entry in entries)
+    assert service._thumbnail_locks == {} and service._thumbnail_waiters == {}
+
+
+def test_filter_query_with_fact_conditions_skips_vector_search(tmp_path):
+    facts = FactsStore(str(tmp_path / "facts.sqlite3"))
+    for file_id, bedrooms in (("a", 2), ("b", 4), ("c", 5)):
+        rooms = [{"name": f"卧室{i + 1}", "dimensions": {"area": 12}} for i in range(bedrooms)]
+        facts.upsert_document(file_id, f"{file_id}.png", "平面布置图", "floor_plan", {"rooms": rooms})
+
+    # 没有向量库：走向量检索会直接报错
+    service = make_service(None, facts_store=facts)
+    question = "找卧室大于3个的户型"
+    assert service._classify_question(question) == "filter_query"
+
+    answer, sources, confidence = asyncio.run(service._handle_filter_query(question, top_k=5))
+    assert sorted(source["file_id"] for source in sources) == ["b", "c"]
+    assert "共有 2 个符合条件的文件" in answer and confidence == 1.0
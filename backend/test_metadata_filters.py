@@ -0,0 +1,37 @@
+"""
+测试元数据过滤条件的下推拆分
+
+使用示例：
+python -m pytest test_metadata_filters.py -q
+"""
+from metadata_filters import build_where, match_conditions, match_filters
+
+
+def test_build_where_pushes_down_native_operators():
+    where, residual = build_where({
+        "bedroom_count": 3,
+        "total_area_gte": 100,
+        "total_area_lte": 200,
+        "image_type": ["floor_plan", "cad"],
+        "file_name_contains": "户型"
+    })
+
+    assert where == {"$and": [
+        {"bedroom_count": {"$eq": 3}},
+        {"total_area": {"$gte": 100}},
+        {"total_area": {"$lte": 200}},
+        {"image_type": {"$in": ["floor_plan", "cad"]}}
+    ]}
+    assert residual == [("file_name", "$contains", "户型")]
+    assert build_where({"file_id": "f1"}) == ({"file_id": {"$eq": "f1"}}, [])
+    assert build_where({}) == (None, [])
+
+
+def test_residual_conditions_match_like_chroma():
+    metadata = {"file_name": "三室户型.png", "total_area": 120.5}
+
+    assert match_filters(metadata, {"file_name_contains": "户型", "total_area_gte": 100})
+    assert not match_filters(metadata, {"total_area": {"$gt": 200}})
+    # 字段缺失：只有 $ne / $nin 视为满足
+    assert not match_conditions(metadata, [("bedroom_count", "$eq", 0)])
+    assert match_conditions(metadata, [("bedroom_count", "$ne", 2)])
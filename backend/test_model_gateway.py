@@ -0,0 +1,65 @@
+"""
+测试出站模型调用网关
+
+使用示例：
+python -m pytest test_model_gateway.py -q
+"""
+import asyncio
+
+from aiohttp import web
+
+from model_gateway import ModelGateway, _to_claude_messages
+
+
+def test_claude_messages_keep_order_and_split_system():
+    messages = [
+        {"role": "system", "content": "只返回JSON"},
+        {"role": "user", "content": [
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64,aW1n"}},
+            {"type": "text", "text": "描述图片"}
+        ]}
+    ]
+
+    system, converted = _to_claude_messages(messages)
+
+    assert system == "只返回JSON"
+    assert converted[0]["content"][0]["source"] == {"type": "base64", "media_type": "image/png", "data": "aW1n"}
+    assert converted[0]["content"][1] == {"type": "text", "text": "描述图片"}
+
+
+def test_http_calls_reuse_pooled_connection_and_record_stats():
+    peers = []
+
+    async def handler(request):
+        peers.append(request.transport.get_extra_info("peername"))
+        return web.json_response({
+            "choices": [{"message": {"content": "好"}}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4}
+        })
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        gateway = ModelGateway()
+        results = []
+        for _ in range(3):
+            results.append(await gateway.chat(
+                "qwen", f"http://127.0.0.1:{port}/v1", "k", "qwen-vl",
+                [{"role": "user", "content": "你好"}]
+            ))
+        await gateway.aclose()
+        await runner.cleanup()
+        return gateway, results
+
+    gateway, results = asyncio.run(main())
+
+    assert [r.content for r in results] == ["好", "好", "好"]
+    assert len(set(peers)) == 1
+    stats = gateway.stats()["qwen/qwen-vl"]
+    assert (stats["calls"], stats["errors"], stats["prompt_tokens"]) == (3, 0, 9)
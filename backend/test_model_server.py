@@ -0,0 +1,68 @@
+"""
+测试共享模型推理进程（Unix socket 协议、并发请求合并推理）
+
+使用示例：
+python -m pytest test_model_server.py -q
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from model_server import ModelServer, ModelServerClient, ModelServerError, RemoteEmbeddings
+
+
+class CountingEmbeddings:
+    """按文本长度生成向量，并记录每次推理的批大小"""
+
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(len(texts))
+        if "boom" in texts:
+            raise RuntimeError("推理失败")
+        return [[float(len(text)), 1.0, 0.0] for text in texts]
+
+
+@pytest.fixture
+def server(tmp_path):
+    embeddings = CountingEmbeddings()
+    server = ModelServer(str(tmp_path / "models.sock"), embeddings=embeddings, max_batch=256, batch_wait_ms=20)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    async def run():
+        await server.start()
+        started.set()
+
+    threading.Thread(target=lambda: (loop.run_until_complete(run()), loop.run_forever()), daemon=True).start()
+    started.wait(5)
+    yield server, embeddings
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def test_concurrent_requests_share_batches(server):
+    server, embeddings = server
+    client = ModelServerClient(server.socket_path, connect_timeout=1)
+    remote = RemoteEmbeddings(client)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda i: remote.embed_documents(["x" * i, "y"]), range(1, 33)))
+
+    assert [r[0][0] for r in results] == [float(i) for i in range(1, 33)]
+    assert remote.embed_query("abcd") == [4.0, 1.0, 0.0]
+    # 32 个并发请求合并成远少于 32 次推理
+    assert sum(embeddings.batches) == 65 and len(embeddings.batches) < 20
+
+
+def test_errors_are_returned_without_breaking_the_connection(server):
+    server, _ = server
+    client = ModelServerClient(server.socket_path, connect_timeout=1)
+
+    with pytest.raises(ModelServerError, match="推理失败"):
+        client.embed(["boom"])
+    assert client.embed(["ok"]).tolist() == [[2.0, 1.0, 0.0]]
+    assert client.ping()["requests"] == 3
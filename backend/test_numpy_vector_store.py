@@ -0,0 +1,103 @@
+"""
+测试内存映射 NumPy 向量索引
+
+使用示例：
+python -m pytest test_numpy_vector_store.py -q
+"""
+import numpy as np
+
+from numpy_vector_store import NumpyVectorStore
+
+
+def add_files(store, rng, n_files, chunks_per_file=5, dim=8):
+    vectors = {}
+    for f in range(n_files):
+        ids = [f"f{f}_chunk_{i}" for i in range(chunks_per_file)]
+        batch = rng.standard_normal((chunks_per_file, dim)).astype(np.float32)
+        metadatas = [{"file_id": f"f{f}", "chunk_id": i, "total_area": float(f)} for i in range(chunks_per_file)]
+        store.upsert(ids, batch.tolist(), [f"文本{f}-{i}" for i in range(chunks_per_file)], metadatas)
+        vectors.update(zip(ids, batch))
+    return vectors
+
+
+def test_exact_search_matches_brute_force_and_survives_reload(tmp_path):
+    rng = np.random.default_rng(0)
+    store = NumpyVectorStore(str(tmp_path), hnsw_min_rows=10 ** 9)
+    vectors = add_files(store, rng, 30)
+    # 覆盖写入：以最后一次为准
+    store.upsert(["f0_chunk_0"], [[0.0] * 8], ["零向量"], [{"file_id": "f0", "chunk_id": 0, "total_area": 0.0}])
+    vectors["f0_chunk_0"] = np.zeros(8, dtype=np.float32)
+
+    query = rng.standard_normal(8).astype(np.float32)
+    where = {"$and": [{"total_area": {"$gte": 10.0}}, {"total_area": {"$lt": 20.0}}]}
+    expected = sorted(
+        (float(((v - query) ** 2).sum()), chunk_id)
+        for chunk_id, v in vectors.items() if 10 <= int(chunk_id.split("_")[0][1:]) < 20
+    )[:5]
+
+    hits = store.query([query.tolist()], 5, where)[0]
+    assert [h[0] for h in hits] == [chunk_id for _, chunk_id in expected]
+    assert np.allclose([h[3] for h in hits], [d for d, _ in expected], atol=1e-4)
+    assert len(store._segments) <= 6
+
+    reloaded = NumpyVectorStore(str(tmp_path))
+    assert reloaded.count() == 150
+    assert reloaded.query([[0.0] * 8], 1)[0][0][:2] == ("f0_chunk_0", "零向量")
+    assert len(reloaded.get(where={"chunk_id": 0})["ids"]) == 30
+    fetched = reloaded.get_embeddings(["f3_chunk_2", "missing"])
+    assert list(fetched) == ["f3_chunk_2"] and np.allclose(fetched["f3_chunk_2"], vectors["f3_chunk_2"])
+
+
+def test_large_segments_use_hnsw_with_filters(tmp_path):
+    rng = np.random.default_rng(1)
+    store = NumpyVectorStore(str(tmp_path), hnsw_min_rows=50)
+    vectors = add_files(store, rng, 40)
+
+    assert any(segment.hnsw is not None for segment in store._segments)
+    target = vectors["f7_chunk_3"]
+    assert store.query([target.tolist()], 3)[0][0][0] == "f7_chunk_3"
+
+    hits = store.query([target.tolist()], 10, {"file_id": {"$in": ["f1", "f2"]}})[0]
+    assert len(hits) == 10
+    assert {h[2]["file_id"] for h in hits} == {"f1", "f2"}
+
+
+def test_read_only_store_follows_writer_across_merges(tmp_path):
+    rng = np.random.default_rng(2)
+    writer = NumpyVectorStore(str(tmp_path), hnsw_min_rows=10 ** 9)
+    add_files(writer, rng, 1)
+    reader = NumpyVectorStore(str(tmp_path), read_only=True)
+    assert reader.count() == 5
+
+    # 写入进程追加新段并合并、删除旧段后，读者重新加载仍得到完整结果
+    vectors = add_files(writer, rng, 6)
+    assert reader.count() == writer.count() == 30
+    query = vectors["f3_chunk_2"].tolist()
+    assert reader.query([query], 3) == writer.query([query], 3)
+
+    try:
+        reader.upsert(["x"], [[0.0] * 8], ["x"], [{}])
+    except PermissionError:
+        pass
+    else:
+        raise AssertionError("只读索引不应允许写入")
+
+
+def test_delete_survives_merges_and_reload(tmp_path):
+    rng = np.random.default_rng(3)
+    store = NumpyVectorStore(str(tmp_path), hnsw_min_rows=10 ** 9)
+    vectors = add_files(store, rng, 8)
+
+    deleted = store.delete({"file_id": "f2"}, ids=["f2_chunk_3", "f2_chunk_4", "f5_chunk_0"])
+    assert sorted(deleted) == ["f2_chunk_3", "f2_chunk_4"]
+    assert store.count() == 38
+    # 之后的写入触发合并：删除记录仍使更早段中的行失效
+    store.upsert(["new_chunk_0"], [[1.0] * 8], ["新"], [{"file_id": "new", "chunk_id": 0}])
+    for _ in range(3):
+        store.upsert(["f2_chunk_0"], [vectors["f2_chunk_0"].tolist()], ["文本2-0"], [{"file_id": "f2", "chunk_id": 0}])
+
+    reloaded = NumpyVectorStore(str(tmp_path))
+    assert reloaded.count() == 39
+    assert sorted(reloaded.get(where={"file_id": "f2"})["ids"]) == ["f2_chunk_0", "f2_chunk_1", "f2_chunk_2"]
+    hits = reloaded.query([vectors["f2_chunk_3"].tolist()], 40)[0]
+    assert "f2_chunk_3" not in [h[0] for h in hits] and len(hits) == 39
@@ -0,0 +1,41 @@
+"""
+测试通义千问 Embedding 的批量调用
+
+使用示例：
+python -m pytest test_qwen_embeddings.py -q
+"""
+from qwen_embeddings import QwenEmbeddings
+
+
+class RecordingGateway:
+    def __init__(self, fail_batches=False):
+        self.calls = []
+        self.fail_batches = fail_batches
+
+    def embed_sync(self, base_url, api_key, model, texts, **kwargs):
+        self.calls.append(list(texts))
+        if self.fail_batches and len(texts) > 1:
+            raise RuntimeError("batch rejected")
+        if "坏" in texts[0]:
+            raise RuntimeError("bad input")
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_embed_documents_batches_and_keeps_order():
+    embeddings = QwenEmbeddings(api_key="x", dimensions=2, batch_size=2)
+    embeddings.gateway = RecordingGateway()
+
+    vectors = embeddings.embed_documents(["a", "bb", "ccc", "dddd", "eeeee"])
+
+    assert [v[0] for v in vectors] == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert embeddings.gateway.calls == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+
+
+def test_failed_batch_falls_back_to_single_texts():
+    embeddings = QwenEmbeddings(api_key="x", dimensions=2, batch_size=10)
+    embeddings.gateway = RecordingGateway(fail_batches=True)
+
+    vectors = embeddings.embed_documents(["a", "坏", "ccc"])
+
+    assert vectors == [[1.0, 1.0], [0.0, 0.0], [3.0, 1.0]]
+    assert len(embeddings.gateway.calls) == 4
@@ -0,0 +1,67 @@
+"""
+测试交叉编码器重排器（使用随机初始化的小模型，离线运行）
+
+使用示例：
+python -m pytest test_reranker.py -q
+"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizer
+
+from reranker import CrossEncoderReranker
+
+
+@pytest.fixture(scope="module")
+def tiny_model_dir(tmp_path_factory):
+    model_dir = tmp_path_factory.mktemp("tiny_cross_encoder")
+
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list("卧室客厅面积图号零件") + list("abcdefg0123456789")
+    vocab_file = model_dir / "vocab.txt"
+    vocab_file.write_text("\n".join(vocab), encoding="utf-8")
+
+    config = BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=16,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=32,
+        max_position_embeddings=64,
+        num_labels=1
+    )
+    BertForSequenceClassification(config).save_pretrained(model_dir)
+    BertTokenizer(str(vocab_file)).save_pretrained(model_dir)
+    return str(model_dir)
+
+
+def test_rerank_sorts_by_score_and_keeps_vector_similarity(tiny_model_dir):
+    reranker = CrossEncoderReranker(model_name=tiny_model_dir, batch_size=2, max_workers=1, max_length=32)
+    results = [
+        {"id": f"f_chunk_{i}", "content": text, "metadata": {}, "similarity": 0.5}
+        for i, text in enumerate(["卧室面积", "客厅", "零件图号a1", "面积"])
+    ]
+
+    reranked = asyncio.run(reranker.rerank("卧室", results))
+
+    assert len(reranked) == 4
+    assert [r["similarity"] for r in reranked] == sorted((r["similarity"] for r in reranked), reverse=True)
+    assert all(r["vector_similarity"] == 0.5 for r in reranked)
+
+
+def test_scores_are_cached_per_query_and_chunk(tiny_model_dir):
+    reranker = CrossEncoderReranker(model_name=tiny_model_dir, cache_size=2, max_length=32)
+    candidates = [("a", "卧室"), ("b", "客厅")]
+
+    first = reranker.score("面积", candidates)
+    second = reranker.score("面积", candidates)
+
+    assert first == second
+    assert reranker.cache_misses == 2
+    assert reranker.cache_hits == 2
+
+    reranker.score("面积", [("c", "零件")])
+    assert len(reranker._cache) == 2
+    assert ("面积", "a") not in reranker._cache
@@ -30,7 +30,7 @@ def test_upload(file_path: str):
 
     with open(file_path, 'rb') as f:
         files = {'file': (Path(file_path).name, f, 'application/pdf')}
-        response = requests.post(f"{BASE_URL}/upload", files=files)
+        response = requests.post(f"{BASE_URL}/upload", files=files, params={'wait': 'true'})
 
     print(f"状态码: {response.status_code}")
     result = response.json()
@@ -0,0 +1,110 @@
+"""
+测试结构化日志管道与请求日志中间件
+
+使用示例：
+python -m pytest test_simple_logger.py -q
+"""
+import io
+import json
+import logging
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import simple_logger
+from simple_logger import LogPipeline, QueueLogHandler, RequestLogMiddleware, RotatingLogFile, log_request
+
+
+def _pipeline(tmp_path, **kwargs):
+    console = io.StringIO()
+    pipeline = LogPipeline(log_dir=str(tmp_path), console=console, **kwargs)
+    pipeline.start()
+    return pipeline, console
+
+
+def _records(tmp_path):
+    records = []
+    for path in sorted(tmp_path.glob("api_*.log")):
+        records += [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    return records
+
+
+def test_pipeline_writes_json_lines_and_console(tmp_path):
+    pipeline, console = _pipeline(tmp_path)
+    logger = logging.getLogger("test_simple_logger.pipeline")
+    logger.propagate = False
+    logger.addHandler(QueueLogHandler(pipeline))
+    logger.setLevel(logging.INFO)
+
+    logger.info("\n")  # 排版用的空行不写入
+    logger.info("处理完成", extra={"fields": {"chunks": 3}})
+    try:
+        raise ValueError("坏文件")
+    except ValueError:
+        logger.error("解析失败", exc_info=True)
+    pipeline.stop()
+
+    records = _records(tmp_path)
+    assert [r["msg"] for r in records] == ["处理完成", "解析失败"]
+    assert records[0]["chunks"] == 3 and records[0]["level"] == "INFO"
+    assert "ValueError: 坏文件" in records[1]["exc"]
+    assert "处理完成  chunks=3" in console.getvalue()
+    assert pipeline.stats()["written"] == 2
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    pipeline = LogPipeline(log_dir=str(tmp_path), console=None, queue_size=2)  # 不启动写入线程
+    assert [pipeline.emit({"msg": str(i)}) for i in range(4)] == [True, True, False, False]
+    assert pipeline.stats()["dropped"] == 2
+
+
+def test_rotation_keeps_backup_count(tmp_path):
+    log_file = RotatingLogFile(tmp_path, max_bytes=100, backup_count=2)
+    for i in range(5):
+        log_file.write(["x" * 120 + "\n"])
+    log_file.close()
+
+    names = sorted(p.name.split(".", 1)[1] for p in tmp_path.iterdir())
+    assert names == ["log", "log.1", "log.2"]
+
+
+def test_middleware_access_log_and_sampling(tmp_path, monkeypatch):
+    pipeline, _ = _pipeline(tmp_path)
+    monkeypatch.setattr(simple_logger, "_pipeline", pipeline)
+    service_logger = logging.getLogger("RAG_Service")
+    handler = QueueLogHandler(pipeline)
+    service_logger.addHandler(handler)
+    service_logger.setLevel(logging.INFO)
+
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        log_request("收到请求", item_id=item_id, message="ok")
+        service_logger.info("检索详情")
+        service_logger.warning("慢查询")
+        return {"id": item_id}
+
+    try:
+        unsampled = TestClient(RequestLogMiddleware(app, sample_rate=0.0))
+        response = unsampled.get("/items/1", headers={"X-Request-ID": "abc123"})
+        assert response.headers["x-request-id"] == "abc123"
+        assert float(response.headers["x-process-time"]) >= 0
+
+        sampled = TestClient(RequestLogMiddleware(app, sample_rate=1.0))
+        request_id = sampled.get("/items/2").headers["x-request-id"]
+    finally:
+        service_logger.removeHandler(handler)
+        pipeline.stop()
+
+    records = _records(tmp_path)
+    # 未采样的请求只有警告和访问日志；采样的请求详情与访问日志共用 request_id
+    assert [(r["msg"], r["request_id"]) for r in records] == [
+        ("慢查询", "abc123"),
+        ("GET /items/1 200", "abc123"),
+        ("收到请求", request_id),
+        ("检索详情", request_id),
+        ("慢查询", request_id),
+        ("GET /items/2 200", request_id),
+    ]
+    assert records[1]["route"] == "/items/{item_id}" and records[1]["status"] == 200
@@ -0,0 +1,47 @@
+"""
+测试分阶段耗时追踪与指标输出
+
+使用示例：
+python -m pytest test_tracing.py -q
+"""
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from tracing import Histogram, TracingMiddleware, REQUEST_SECONDS, render_metrics, span
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("demo_seconds", "示例", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, "search")
+
+    lines = histogram.render()
+    assert 'demo_seconds_bucket{stage="search",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{stage="search",le="1.0"} 3' in lines
+    assert 'demo_seconds_bucket{stage="search",le="+Inf"} 4' in lines
+    assert 'demo_seconds_count{stage="search"} 4' in lines
+
+
+def test_server_timing_header_and_route_label():
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        with span("query_embedding"):
+            await asyncio.sleep(0.01)
+        for _ in range(2):
+            with span("vector_search"):
+                await asyncio.sleep(0)
+        return {"id": item_id}
+
+    response = TestClient(app).get("/items/42")
+
+    timing = response.headers["server-timing"].split(", ")
+    assert [entry.split(";")[0] for entry in timing] == ["query_embedding", "vector_search", "total"]
+    assert float(timing[0].split("dur=")[1]) >= 10
+    # 按路由模板分组，而不是实际路径
+    assert ("GET", "/items/{item_id}", "200") in REQUEST_SECONDS.snapshot()
+    assert 'rag_stage_duration_seconds_count{stage="vector_search"}' in render_metrics()
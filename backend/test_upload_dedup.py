@@ -0,0 +1,18 @@
+"""
+测试上传内容去重
+
+使用示例：
+python -m pytest test_upload_dedup.py -q
+"""
+from upload_dedup import UploadHashIndex
+
+
+def test_hash_index_persists_records(tmp_path):
+    index_path = tmp_path / "hash_index.json"
+    index = UploadHashIndex(str(index_path))
+    index.put("abc", "file-1", "a.pdf", ".pdf", "job-1", 10)
+
+    reloaded = UploadHashIndex(str(index_path))
+    assert len(reloaded) == 1
+    assert reloaded.get("abc")["fileId"] == "file-1"
+    assert reloaded.get("missing") is None
@@ -0,0 +1,79 @@
+"""
+测试流式上传接收
+
+使用示例：
+python -m pytest test_upload_stream.py -q
+"""
+import asyncio
+import hashlib
+
+import pytest
+from starlette.requests import Request
+
+from upload_stream import receive_upload, UploadTooLarge, InvalidUpload
+
+BOUNDARY = "----rag-test-boundary"
+
+
+def make_request(body: bytes, piece_size: int = 1000, content_length: bool = True) -> Request:
+    """按 piece_size 分片发送请求体，模拟网络流"""
+    pieces = [body[i:i + piece_size] for i in range(0, len(body), piece_size)] or [b""]
+    messages = [
+        {"type": "http.request", "body": piece, "more_body": i < len(pieces) - 1}
+        for i, piece in enumerate(pieces)
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    return Request({"type": "http", "method": "POST", "path": "/upload", "headers": headers}, receive)
+
+
+def multipart_body(data: bytes, filename: str = "图纸.png") -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="note"\r\n\r\n'
+        f"备注\r\n"
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: image/png\r\n\r\n"
+    ).encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def test_streams_file_to_disk_with_hash_and_size(tmp_path):
+    data = bytes(range(256)) * 4000
+    temp_path = tmp_path / "upload.part"
+
+    upload = asyncio.run(receive_upload(
+        make_request(multipart_body(data)), temp_path, max_bytes=10 * 1024 * 1024, chunk_size=4096
+    ))
+
+    assert upload.filename == "图纸.png"
+    assert upload.content_type == "image/png"
+    assert upload.size == len(data)
+    assert upload.content_hash == hashlib.sha256(data).hexdigest()
+    assert upload.fields == {"note": "备注"}
+    assert temp_path.read_bytes() == data
+
+
+def test_overflow_aborts_and_removes_partial_file(tmp_path):
+    temp_path = tmp_path / "upload.part"
+    body = multipart_body(b"x" * 50000)
+
+    # 没有 Content-Length（分块传输）时在写入过程中中止
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(receive_upload(
+            make_request(body, content_length=False), temp_path, max_bytes=20000, chunk_size=4096
+        ))
+    assert not temp_path.exists()
+
+
+def test_rejects_request_without_file_field(tmp_path):
+    body = f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"note\"\r\n\r\n备注\r\n--{BOUNDARY}--\r\n".encode()
+
+    with pytest.raises(InvalidUpload):
+        asyncio.run(receive_upload(make_request(body), tmp_path / "upload.part", max_bytes=1024))
+    assert not (tmp_path / "upload.part").exists()
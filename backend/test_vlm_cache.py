@@ -0,0 +1,42 @@
+"""
+测试 VLM 响应缓存
+
+使用示例：
+python -m pytest test_vlm_cache.py -q
+"""
+from vlm_cache import VLMResponseCache
+
+
+def test_cache_round_trip_and_counters(tmp_path):
+    cache = VLMResponseCache(str(tmp_path / "vlm.sqlite3"))
+    key = cache.make_key("aW1n", "提示词", "cad", "gpt-4o", 2000)
+
+    assert cache.get(key) is None
+    cache.put(key, {"answer": "图纸", "extracted_info": {"零件": "轴"}, "token_usage": {"total_tokens": 10}})
+    assert cache.get(key)["extracted_info"] == {"零件": "轴"}
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+    # 键的任一组成部分变化都不应命中
+    assert key != cache.make_key("aW1n", "提示词", "cad", "gpt-4o", 1000)
+    assert key != cache.make_key("aW1n", "提示词", "floor_plan", "gpt-4o", 2000)
+
+    # 持久化：重新打开后仍可命中
+    cache.close()
+    assert VLMResponseCache(str(tmp_path / "vlm.sqlite3")).get(key)["answer"] == "图纸"
+
+
+def test_lru_eviction_by_size(tmp_path):
+    cache = VLMResponseCache(str(tmp_path / "vlm.sqlite3"), max_bytes=200)
+    value = {"answer": "x" * 80}
+
+    cache.put("a", value)
+    cache.put("b", value)
+    cache.get("a")  # a 变为最近访问
+    cache.put("c", value)
+
+    assert cache.stats()["bytes"] <= 200
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
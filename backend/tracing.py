@@ -0,0 +1,176 @@
+"""
+分阶段耗时追踪与 Prometheus 指标
+
+    span(name)           记录一个阶段（查询向量化、向量检索、聚合、LLM、VLM、PDF 解析、分块、入库……）的耗时：
+                         计入进程内直方图 rag_stage_duration_seconds{stage}，请求内的 span 同时记入当前请求的追踪
+    TracingMiddleware    纯 ASGI 中间件：为每个请求建立追踪，在响应头加 Server-Timing（各阶段耗时合计 + total），
+                         并把请求耗时计入 rag_http_request_duration_seconds{method, route, status}
+    render_metrics()     Prometheus 文本格式（/metrics）
+
+指标只在本进程内累计；多进程部署（serve_workers）时每个 worker 各自暴露。
+
+使用示例：
+    with span("vector_search"):
+        hits = await run_in_stage("search", ...)
+"""
+import math
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 阶段耗时分桶（秒）：覆盖毫秒级检索到分钟级的 VLM / PDF 解析
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """带标签的累计直方图（Prometheus histogram 语义：桶计数为 <= le 的累计值）"""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}  # 标签值 -> [各桶计数, 总和, 次数]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Tuple[List[int], float, int]]:
+        """各标签组合的 (累计桶计数, 总和, 次数)"""
+        with self._lock:
+            result = {}
+            for labels, (counts, total, count) in self._series.items():
+                cumulative, running = [], 0
+                for n in counts:
+                    running += n
+                    cumulative.append(running)
+                result[labels] = (cumulative, total, count)
+            return result
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (cumulative, total, count) in sorted(self.snapshot().items()):
+            base = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = base + "," if base else ""
+            for bound, n in zip(self.buckets, cumulative):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{_format_bound(bound)}"}} {n}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{base}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_bound(bound: float) -> str:
+    return repr(float(bound)) if not math.isinf(bound) else "+Inf"
+
+
+STAGE_SECONDS = Histogram("rag_stage_duration_seconds", "各处理阶段耗时（秒）", ["stage"])
+REQUEST_SECONDS = Histogram("rag_http_request_duration_seconds", "HTTP 请求耗时（秒）", ["method", "route", "status"])
+
+
+# ============ 请求追踪 ============
+
+class Trace:
+    """一个请求内记录的 span（响应结束后关闭，之后的后台任务不再记入）"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+        self.closed = False
+
+    def add(self, name: str, seconds: float):
+        if not self.closed:
+            self.spans.append((name, seconds))
+
+    def server_timing(self) -> str:
+        """Server-Timing 头：同名阶段合计耗时（毫秒），按首次出现顺序，最后为 total"""
+        totals: Dict[str, float] = {}
+        for name, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("rag_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str):
+    """记录一个阶段的耗时（异常时同样记录）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, seconds)
+
+
+class TracingMiddleware:
+    """
+    请求追踪中间件（纯 ASGI）
+
+    Server-Timing 在响应头发出时生成：普通响应包含全部阶段；流式响应（SSE）只包含响应开始前的阶段。
+    """
+
+    def __init__(self, app, skip_paths: Iterable[str] = ()):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        token = _current_trace.set(trace)
+        status = {"code": 500}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            trace.closed = True
+            _current_trace.reset(token)
+            if scope["path"] not in self.skip_paths:
+                # 按路由模板（/jobs/{job_id}）而不是实际路径分组，避免标签基数膨胀
+                route = getattr(scope.get("route"), "path", None) or "unmatched"
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - trace.start, scope["method"], route, str(status["code"])
+                )
+
+
+def render_metrics(extra_lines: Iterable[str] = ()) -> str:
+    """Prometheus 文本格式"""
+    lines = STAGE_SECONDS.render() + REQUEST_SECONDS.render() + list(extra_lines)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,83 @@
+"""
+上传内容去重
+按上传内容的 SHA-256（由 upload_stream 在写盘时计算）维护 hash -> fileId 索引，
+相同内容的重复上传直接复用已有 fileId，跳过解析、VLM 分析和索引
+"""
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("RAG_Service")
+
+
+class UploadHashIndex:
+    """
+    内容哈希 -> 文件记录
+
+    记录保存在一个 JSON 文件中：{sha256: {fileId, fileName, fileExtension, jobId, size, createdAt[, failed]}}
+    入库任务失败时记录标记 failed，重复上传时重新处理（任务记录过了保留期被清理后仍能识别）
+    """
+
+    def __init__(self, index_path: str = "./uploads/hash_index.json"):
+        self.index_path = Path(index_path)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _load(self):
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self._records = json.load(f)
+        except Exception as e:
+            logger.warning(f"  ⚠️ 无法加载上传哈希索引 {self.index_path}: {e}")
+
+    def _save(self):
+        # 先写临时文件再替换，避免进程中断留下半个文件
+        tmp_path = self.index_path.with_suffix(self.index_path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._records, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._records.get(content_hash)
+            return dict(record) if record else None
+
+    def put(
+        self,
+        content_hash: str,
+        file_id: str,
+        file_name: str,
+        file_extension: str,
+        job_id: Optional[str],
+        size: int
+    ):
+        with self._lock:
+            self._records[content_hash] = {
+                "fileId": file_id,
+                "fileName": file_name,
+                "fileExtension": file_extension,
+                "jobId": job_id,
+                "size": size,
+                "createdAt": time.time()
+            }
+            self._save()
+
+    def mark_failed(self, job_id: str):
+        """标记该入库任务对应的记录处理失败（记录已被新任务覆盖时不变）"""
+        with self._lock:
+            for record in self._records.values():
+                if record.get("jobId") == job_id:
+                    record["failed"] = True
+                    self._save()
+                    return
@@ -0,0 +1,194 @@
+"""
+流式上传接收
+直接解析请求体的 multipart 数据流，文件内容按固定大小分块写入磁盘，同时计算 SHA-256 和字节数。
+单个上传占用的内存只与分块大小有关，与文件大小无关；超过大小上限时立即中止并删除已写入的部分。
+"""
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+from executors import run_in_stage
+
+logger = logging.getLogger("RAG_Service")
+
+# 写盘分块大小
+WRITE_CHUNK_SIZE = 1024 * 1024
+# 非文件表单字段的大小上限
+MAX_FIELD_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """上传超过大小上限"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"文件超过大小上限 {max_bytes // (1024 * 1024)} MB")
+        self.max_bytes = max_bytes
+
+
+class InvalidUpload(Exception):
+    """请求不是合法的文件上传"""
+
+
+@dataclass
+class StreamedUpload:
+    """已写入磁盘的上传文件"""
+    filename: str
+    content_type: Optional[str]
+    temp_path: Path
+    content_hash: str
+    size: int
+    fields: Dict[str, str] = field(default_factory=dict)
+
+
+class _FileSink:
+    """边写盘边计算哈希（write 运行在 io 执行器中）"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self._file = open(path, "wb")
+
+    def write(self, data: bytes):
+        self.hasher.update(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        self._file.close()
+
+
+async def receive_upload(
+    request: Request,
+    temp_path: Path,
+    max_bytes: int,
+    file_field: str = "file",
+    chunk_size: int = WRITE_CHUNK_SIZE
+) -> StreamedUpload:
+    """
+    把 multipart 请求中的文件字段流式写入 temp_path
+
+    Args:
+        request: 请求
+        temp_path: 临时文件路径（失败时会被删除）
+        max_bytes: 文件大小上限
+        file_field: 文件字段名
+        chunk_size: 攒够多少字节写一次盘
+
+    Raises:
+        UploadTooLarge: 超过大小上限（Content-Length 超限时不读取请求体直接拒绝）
+        InvalidUpload: 请求不是 multipart 或缺少文件字段
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise InvalidUpload("请求必须是 multipart/form-data")
+
+    # Content-Length 包含 multipart 边界和表单头，只用来提前拒绝明显超限的请求
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + MAX_FIELD_SIZE:
+        raise UploadTooLarge(max_bytes)
+
+    # 解析器回调只在内存中收集数据，写盘统一在 io 执行器中进行
+    state = {"header_field": b"", "header_value": b"", "headers": {}, "name": None, "filename": None, "is_file": False}
+    fields: Dict[str, str] = {}
+    field_buffer = bytearray()
+    pending: List[bytes] = []
+    pending_size = 0
+    result: Dict[str, object] = {}
+    sink: Optional[_FileSink] = None
+
+    def on_part_begin():
+        state["headers"] = {}
+        state["name"] = None
+        state["filename"] = None
+        state["is_file"] = False
+        field_buffer.clear()
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"] = b""
+        state["header_value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        state["name"] = disposition.get(b"name", b"").decode("utf-8", "replace")
+        filename = disposition.get(b"filename")
+        state["filename"] = filename.decode("utf-8", "replace") if filename is not None else None
+        # 只接收第一个文件字段
+        if state["name"] == file_field and state["filename"] is not None and "filename" not in result:
+            state["is_file"] = True
+            result["filename"] = state["filename"]
+            part_type = state["headers"].get(b"content-type")
+            result["content_type"] = part_type.decode("latin-1") if part_type else None
+
+    def on_part_data(data, start, end):
+        nonlocal pending_size
+        if state["is_file"]:
+            pending.append(data[start:end])
+            pending_size += end - start
+        elif len(field_buffer) + end - start <= MAX_FIELD_SIZE:
+            field_buffer.extend(data[start:end])
+
+    def on_part_end():
+        if state["filename"] is None and state["name"]:
+            fields[state["name"]] = field_buffer.decode("utf-8", "replace")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    async def flush():
+        nonlocal pending_size
+        data = b"".join(pending)
+        pending.clear()
+        pending_size = 0
+        if data:
+            await run_in_stage("io", sink.write, data)
+
+    try:
+        sink = await run_in_stage("io", _FileSink, temp_path)
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if sink.size + pending_size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            if pending_size >= chunk_size:
+                await flush()
+        parser.finalize()
+        await flush()
+        await run_in_stage("io", sink.close)
+    except BaseException:
+        # 超限、客户端断开、解析错误：删除已写入的部分
+        if sink is not None:
+            sink.close()
+        temp_path.unlink(missing_ok=True)
+        raise
+
+    if "filename" not in result:
+        temp_path.unlink(missing_ok=True)
+        raise InvalidUpload(f"缺少文件字段: {file_field}")
+
+    return StreamedUpload(
+        filename=result["filename"],
+        content_type=result.get("content_type"),
+        temp_path=temp_path,
+        content_hash=sink.hasher.hexdigest(),
+        size=sink.size,
+        fields=fields
+    )
@@ -0,0 +1,161 @@
+"""
+向量库后端
+VectorStoreManager 只依赖这里的统一接口，由环境变量 VECTOR_BACKEND 选择：
+
+    chroma  LangChain Chroma（默认，SQLite + HNSW）
+    numpy   进程内内存映射 NumPy 索引（见 numpy_vector_store），小段精确检索、大段 HNSW
+
+统一接口：
+    count() -> int
+    upsert(ids, embeddings, documents, metadatas)
+    query(query_embeddings, n_results, where=None) -> 每个查询 [(id, 文本, 元数据, 距离)]，按距离升序
+    get(where=None, include_embeddings=False) -> {"ids", "documents", "metadatas"[, "embeddings"]}
+    get_embeddings(ids) -> {id: 向量}（不存在的 id 不返回）
+    delete(where=None, ids=None) -> 被删除的 id（两者同时给出时取交集）
+"""
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+from numpy_vector_store import NumpyVectorStore, SUPPORTED_DTYPES
+
+logger = logging.getLogger("RAG_Service")
+
+COLLECTION_NAME = "multimodal_rag"
+VECTOR_BACKENDS = ("chroma", "numpy")
+
+
+class ChromaBackend:
+    """LangChain Chroma 集合的统一接口封装"""
+
+    name = "chroma"
+
+    def __init__(self, persist_directory: str, embedding_function=None):
+        from langchain_community.vectorstores import Chroma
+
+        self.store = Chroma(
+            persist_directory=persist_directory,
+            embedding_function=embedding_function,
+            collection_name=COLLECTION_NAME
+        )
+        self.collection = self.store._collection
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]]
+    ):
+        self.collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+    def query(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[List[tuple]]:
+        if not query_embeddings:
+            return []
+        response = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=max(n_results, 1),
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+        return [
+            [(chunk_id, document, metadata or {}, distance)
+             for chunk_id, document, metadata, distance in zip(ids, documents, metadatas, distances)]
+            for ids, documents, metadatas, distances in zip(
+                response["ids"], response["documents"], response["metadatas"], response["distances"]
+            )
+        ]
+
+    def get(
+        self,
+        where: Optional[Dict[str, Any]] = None,
+        include_embeddings: bool = False
+    ) -> Dict[str, Any]:
+        include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+        return self.collection.get(where=where, include=include)
+
+    def delete(self, where: Optional[Dict[str, Any]] = None, ids: Optional[List[str]] = None) -> List[str]:
+        matched = self.collection.get(where=where, include=[])["ids"]
+        if ids is not None:
+            wanted = set(ids)
+            matched = [chunk_id for chunk_id in matched if chunk_id in wanted]
+        if matched:
+            self.collection.delete(ids=matched)
+        return matched
+
+    def get_embeddings(self, ids: List[str]) -> Dict[str, List[float]]:
+        if not ids:
+            return {}
+        response = self.collection.get(ids=list(ids), include=["embeddings"])
+        return dict(zip(response["ids"], response["embeddings"]))
+
+
+def _import_from_chroma(store: NumpyVectorStore, persist_directory: str, batch_size: int = 5000):
+    """NumPy 索引为空而 Chroma 目录已有数据时，一次性把向量、文本和元数据导入（不重新向量化）"""
+    if not os.path.exists(os.path.join(persist_directory, "chroma.sqlite3")):
+        return
+    try:
+        chroma = ChromaBackend(persist_directory)
+        existing = chroma.get(include_embeddings=True)
+    except Exception as e:
+        logger.warning(f"  ⚠️ 读取 Chroma 失败，跳过导入: {e}")
+        return
+
+    ids = existing.get("ids") or []
+    for start in range(0, len(ids), batch_size):
+        stop = start + batch_size
+        store.upsert(
+            ids[start:stop],
+            existing["embeddings"][start:stop],
+            existing["documents"][start:stop],
+            existing["metadatas"][start:stop]
+        )
+    if ids:
+        logger.info(f"  已从 Chroma 导入 {len(ids)} 个文本块到 NumPy 索引")
+
+
+def create_vector_backend(
+    persist_directory: str,
+    embedding_function=None,
+    kind: Optional[str] = None,
+    read_only: bool = False
+):
+    """
+    按 VECTOR_BACKEND 创建向量库后端
+
+    numpy 后端的数据放在 <persist_directory>/numpy_index，精度由 NUMPY_VECTOR_DTYPE 指定（float32 / float16，
+    只对新建的索引生效），行数达到 NUMPY_HNSW_MIN_ROWS 的段使用 HNSW（查询参数 NUMPY_HNSW_EF）；
+    首次启用时从同目录的 Chroma 集合导入已有数据。
+
+    read_only=True 时只读跟随写入进程发布的新段（多进程部署的检索 worker），仅 numpy 后端支持。
+    """
+    kind = (kind or os.getenv("VECTOR_BACKEND", "chroma")).lower()
+    if kind not in VECTOR_BACKENDS:
+        raise ValueError(f"不支持的向量库后端: {kind}（可选 {', '.join(VECTOR_BACKENDS)}）")
+    if read_only and kind != "numpy":
+        raise ValueError("只读跟随写入进程的向量库需要 VECTOR_BACKEND=numpy（Chroma 不支持多进程共享同一目录）")
+
+    if kind == "chroma":
+        return ChromaBackend(persist_directory, embedding_function)
+
+    dtype = os.getenv("NUMPY_VECTOR_DTYPE", "float32").lower()
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"不支持的 NUMPY_VECTOR_DTYPE: {dtype}（可选 {', '.join(SUPPORTED_DTYPES)}）")
+    store = NumpyVectorStore(
+        os.path.join(persist_directory, "numpy_index"),
+        dtype=dtype,
+        hnsw_min_rows=int(os.getenv("NUMPY_HNSW_MIN_ROWS", "10000")),
+        hnsw_ef=int(os.getenv("NUMPY_HNSW_EF", "100")),
+        read_only=read_only
+    )
+    if not read_only and store.count() == 0:
+        _import_from_chroma(store, persist_directory)
+    return store
@@ -0,0 +1,149 @@
+"""
+VLM 响应缓存
+以 (归一化图片哈希, 提示词 ID, 图像类型, 模型名, 压缩尺寸) 为键，把解析后的 VLM 结果持久化到 SQLite，
+重新入库（调整分块或更换 Embedding 后）时相同图片不再调用 VLM
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+def content_hash(text: str) -> str:
+    """文本的 SHA-256"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class VLMResponseCache:
+    """
+    基于 SQLite 的 VLM 响应缓存
+
+    - 按条目字节数统计总大小，超过 max_bytes 时按最近访问时间淘汰（LRU）
+    - 记录进程内的命中/未命中次数
+    """
+
+    def __init__(self, db_path: str = "./cache/vlm_cache.sqlite3", max_bytes: int = 512 * 1024 * 1024):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS vlm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_vlm_cache_last_access ON vlm_cache(last_access)")
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM vlm_cache").fetchone()
+        self._entries, self._total_bytes = row
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        image_base64: str,
+        prompt: str,
+        image_type: str,
+        model_name: str,
+        max_size: int
+    ) -> str:
+        """
+        生成缓存键
+
+        Args:
+            image_base64: 压缩编码后的图片（相同图片在相同 max_size 下编码结果一致，即归一化后的图片）
+            prompt: 完整提示词（取哈希作为提示词 ID，模板或问题变化都会产生新键）
+            image_type: 图像类型
+            model_name: VLM 模型名
+            max_size: 图片压缩尺寸
+        """
+        parts = [content_hash(image_base64), content_hash(prompt), image_type, model_name, str(max_size)]
+        return content_hash("|".join(parts))
+
+    @classmethod
+    def from_env(cls) -> Optional["VLMResponseCache"]:
+        """根据环境变量创建缓存，VLM_CACHE_ENABLED=false 时返回 None"""
+        if os.getenv("VLM_CACHE_ENABLED", "true").lower() != "true":
+            return None
+        return cls(
+            db_path=os.getenv("VLM_CACHE_PATH", "./cache/vlm_cache.sqlite3"),
+            max_bytes=int(float(os.getenv("VLM_CACHE_MAX_MB", "512")) * 1024 * 1024)
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存，命中时刷新访问时间"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM vlm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE vlm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """写入缓存，并按 LRU 淘汰超出容量的条目"""
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        now = time.time()
+
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM vlm_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vlm_cache (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, data, size, now, now)
+            )
+            if old:
+                self._total_bytes -= old[0]
+            else:
+                self._entries += 1
+            self._total_bytes += size
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """淘汰最久未访问的条目直到总大小不超过上限（调用方负责加锁）"""
+        while self._total_bytes > self.max_bytes and self._entries > 0:
+            rows = self._conn.execute(
+                "SELECT key, size FROM vlm_cache ORDER BY last_access ASC LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM vlm_cache WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self._entries -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": self._entries,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
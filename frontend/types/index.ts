@@ -143,4 +143,13 @@ export interface IntelligentQAResponse {
   sources: QASource[];
   confidence: number;
   query_type: QueryType;
+  cache?: AnswerCacheInfo | null;
+}
+
+// Semantic answer cache info returned by /ask
+export interface AnswerCacheInfo {
+  hit: boolean;
+  similarity: number | null;
+  hits: number;
+  misses: number;
 }